@@ -4,6 +4,8 @@ Utiliza Pydantic Settings para cargar variables de entorno de forma segura.
 """
 
 from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
 from pydantic_settings import BaseSettings
 from pydantic import Field
 
@@ -39,6 +41,346 @@ class Settings(BaseSettings):
         description="Margen en segundos antes de expiración para renovar token (5 min)"
     )
     
+    # Token Refresher (renovación proactiva en segundo plano)
+    token_refresher_enabled: bool = Field(
+        default=True,
+        description="Renovar tokens de tenants activos en segundo plano"
+    )
+    token_refresher_interval_seconds: int = Field(
+        default=60,
+        description="Intervalo entre revisiones del refresher"
+    )
+    token_refresher_jitter_seconds: int = Field(
+        default=30,
+        description="Anticipación aleatoria extra para no renovar todos los tenants a la vez"
+    )
+    
+    # Cache de configuración por tenant (credenciales desencriptadas)
+    tenant_settings_cache_ttl_seconds: float = Field(
+        default=300.0,
+        description="Segundos que se reutiliza la configuración desencriptada de un tenant"
+    )
+    tenant_settings_cache_max_entries: int = Field(
+        default=256,
+        description="Cantidad máxima de tenants en el cache de configuración"
+    )
+    
+    # Cache de catálogos DIAN (municipios, tributos, métodos de pago)
+    factus_catalog_ttl_seconds: float = Field(
+        default=86400.0,
+        description="Segundos que un catálogo se considera fresco"
+    )
+    factus_catalog_stale_seconds: float = Field(
+        default=604800.0,
+        description="Segundos adicionales en que se sirve el catálogo vencido mientras se refresca en segundo plano"
+    )
+    factus_catalog_cache_path: Optional[str] = Field(
+        default=None,
+        description="Archivo JSON para persistir los catálogos entre reinicios (None = solo memoria)"
+    )
+    factus_municipality_index_refresh_seconds: float = Field(
+        default=86400.0,
+        description="Cada cuánto se reconstruye el índice local de municipios desde Factus"
+    )
+    
+    # Rangos de numeración (espejo local en billing_resolutions)
+    numbering_ranges_max_age_seconds: float = Field(
+        default=3600.0,
+        description="Antigüedad máxima de la última sincronización antes de resincronizar en segundo plano"
+    )
+    numbering_block_size: int = Field(
+        default=1,
+        description="Consecutivos reservados por operación: 1 = contador exacto en la transacción de cada "
+                    "factura; N > 1 = cada proceso reserva bloques de N y los entrega desde memoria"
+    )
+    numbering_range_index_ttl_seconds: float = Field(
+        default=60.0,
+        description="Segundos que se reutiliza en memoria el rango activo de un tenant (entre procesos)"
+    )
+    numbering_range_warning_thresholds: List[float] = Field(
+        default_factory=lambda: [80.0, 90.0, 95.0],
+        description="Porcentajes de uso del rango activo a partir de los cuales se emite una advertencia"
+    )
+    numbering_range_failover_enabled: bool = Field(
+        default=True,
+        description="Activar automáticamente el siguiente rango vigente cuando el activo se agota o vence"
+    )
+    
+    # Cola asíncrona de facturas (modo 202 Accepted)
+    invoice_queue_enabled: bool = Field(
+        default=False,
+        description="Habilita los workers que envían a Factus las facturas en estado PENDING"
+    )
+    invoice_queue_workers: int = Field(
+        default=4,
+        description="Cantidad de workers de la cola (envíos simultáneos a Factus en el proceso)"
+    )
+    invoice_queue_tenant_concurrency: int = Field(
+        default=2,
+        description="Envíos simultáneos máximos por tenant"
+    )
+    invoice_queue_max_attempts: int = Field(
+        default=5,
+        description="Intentos máximos por factura ante errores transitorios antes de marcarla ERROR"
+    )
+    invoice_queue_retry_base_seconds: float = Field(
+        default=2.0,
+        description="Espera base (exponencial) antes de reencolar tras un error transitorio"
+    )
+    invoice_queue_stale_seconds: float = Field(
+        default=120.0,
+        description="Tiempo tras el cual una factura PENDING sin avance se considera abandonada"
+    )
+    invoice_submit_lease_seconds: float = Field(
+        default=60.0,
+        description="Lease de una factura SUBMITTING; quien la envía lo renueva cada tercio de este tiempo y solo se recupera al vencer"
+    )
+    invoice_queue_sweep_seconds: float = Field(
+        default=30.0,
+        description="Cada cuánto se buscan facturas abandonadas para reencolarlas"
+    )
+    
+    # Contingencia: outbox de facturas cuando Factus no está disponible
+    invoice_outbox_enabled: bool = Field(
+        default=True,
+        description="Emitir ticket provisional y guardar la factura en el outbox si Factus no responde"
+    )
+    invoice_outbox_poll_seconds: float = Field(
+        default=5.0,
+        description="Cada cuánto se revisa el outbox en busca de facturas por reenviar"
+    )
+    invoice_outbox_retry_seconds: float = Field(
+        default=15.0,
+        description="Pausa del reenvío de un tenant tras un error transitorio (si Factus no indica Retry-After)"
+    )
+    invoice_outbox_tenant_parallelism: int = Field(
+        default=4,
+        description="Tenants cuyo outbox se reenvía en paralelo (dentro de un tenant el orden es estricto)"
+    )
+    invoice_outbox_stale_seconds: float = Field(
+        default=120.0,
+        description="Tiempo tras el cual una entrada SENDING sin avance se considera abandonada"
+    )
+    
+    # Reconciliador de facturas (validación DIAN en segundo plano)
+    invoice_reconciler_enabled: bool = Field(
+        default=True,
+        description="Validar en segundo plano las facturas CREATED / ERROR_VALIDATING"
+    )
+    invoice_reconciler_interval_seconds: float = Field(
+        default=60.0,
+        description="Intervalo entre pasadas del reconciliador"
+    )
+    invoice_reconciler_min_age_seconds: float = Field(
+        default=60.0,
+        description="Antigüedad mínima de una factura antes de que el reconciliador la tome"
+    )
+    invoice_reconciler_page_size: int = Field(
+        default=100,
+        description="Facturas leídas por página (keyset) y actualizadas por transacción"
+    )
+    invoice_reconciler_concurrency: int = Field(
+        default=4,
+        description="Consultas simultáneas a Factus durante la reconciliación"
+    )
+    invoice_reconciler_max_attempts: int = Field(
+        default=8,
+        description="Intentos fallidos por factura antes de dejar de reconciliarla"
+    )
+    invoice_reconciler_backoff_base_seconds: float = Field(
+        default=60.0,
+        description="Espera base (exponencial) tras un intento fallido de una factura"
+    )
+    invoice_reconciler_backoff_max_seconds: float = Field(
+        default=21600.0,
+        description="Espera máxima entre intentos de una factura (6 h)"
+    )
+    
+    # Tirillas (GET /invoices/{number}/ticket-data)
+    ticket_cache_max_entries: int = Field(
+        default=2048,
+        description="Cantidad máxima de tirillas serializadas en el cache LRU"
+    )
+    ticket_cache_ttl_seconds: float = Field(
+        default=300.0,
+        description="Segundos que se sirve una tirilla cacheada (cota de desfase entre workers)"
+    )
+    ticket_printer_columns: int = Field(
+        default=48,
+        description="Caracteres por línea de la tirilla ESC/POS (48 = 80 mm fuente A, 32 = 58 mm)"
+    )
+    escpos_cache_max_entries: int = Field(
+        default=1024,
+        description="Cantidad máxima de tirillas ESC/POS renderizadas en cache"
+    )
+    
+    # Listado de facturas (GET /invoices)
+    invoice_list_count_cap: int = Field(
+        default=10000,
+        description="Filas que cuenta como máximo el total del listado (por encima se informa una estimación)"
+    )
+    
+    # Almacén local de PDF/XML de facturas (ver services/document_store.py)
+    document_store_enabled: bool = Field(
+        default=True,
+        description="Descargar en segundo plano el PDF y el XML de cada factura y servirlos desde disco"
+    )
+    document_store_path: str = Field(
+        default="./documents",
+        description="Directorio de los archivos (direccionados por SHA-256)"
+    )
+    document_store_max_bytes: int = Field(
+        default=512 * 1024 * 1024,
+        description="Tamaño máximo del almacén; al superarlo se eliminan los menos usados (LRU)"
+    )
+    document_store_workers: int = Field(
+        default=2,
+        description="Descargas simultáneas hacia Factus"
+    )
+    document_store_fetch_delay_seconds: float = Field(
+        default=5.0,
+        description="Espera antes de descargar los documentos de una factura recién creada/validada"
+    )
+    document_store_max_attempts: int = Field(
+        default=5,
+        description="Intentos de descarga de un documento antes de desistir"
+    )
+    document_store_retry_seconds: float = Field(
+        default=60.0,
+        description="Espera base entre intentos de descarga (crece con cada intento)"
+    )
+    
+    # Facturación en lote (POST /invoices/batch)
+    invoice_batch_max_orders: int = Field(
+        default=200,
+        description="Cantidad máxima de órdenes por lote"
+    )
+    invoice_batch_concurrency: int = Field(
+        default=8,
+        description="Envíos simultáneos a Factus dentro de un lote"
+    )
+    invoice_batch_chunk_size: int = Field(
+        default=25,
+        description="Facturas guardadas por transacción al procesar un lote"
+    )
+    
+    # Token Store (compartido entre workers)
+    factus_token_store: str = Field(
+        default="memory",
+        description="Backend de tokens: 'memory' (por proceso) o 'database' (compartido entre workers)"
+    )
+    factus_token_lease_seconds: int = Field(
+        default=30,
+        description="Duración del lease de renovación de token en BD"
+    )
+    factus_token_lease_wait_seconds: float = Field(
+        default=15.0,
+        description="Tiempo máximo esperando a que otro worker renueve el token"
+    )
+    
+    # HTTP Connection Pool (Factus)
+    factus_http_max_connections: int = Field(
+        default=50,
+        description="Máximo de conexiones simultáneas por cliente HTTP de Factus"
+    )
+    factus_http_max_keepalive_connections: int = Field(
+        default=20,
+        description="Máximo de conexiones keep-alive inactivas por cliente"
+    )
+    factus_http_keepalive_expiry: float = Field(
+        default=60.0,
+        description="Segundos que una conexión inactiva se mantiene abierta"
+    )
+    factus_http2: bool = Field(
+        default=False,
+        description="Usar HTTP/2 con Factus (requiere el paquete h2): multiplexa peticiones en una conexión"
+    )
+    
+    # Timeouts (Factus), en segundos
+    factus_timeouts: Dict[str, Dict[str, float]] = Field(
+        default_factory=dict,
+        description="Overrides por grupo de endpoint (auth, catalogs, bill_creation, bill_validation, default), "
+                    "ej: {\"bill_creation\": {\"read\": 90}}. Claves: connect, read, write, pool"
+    )
+
+    # Reintentos (Factus)
+    factus_retry_max_attempts: int = Field(
+        default=3,
+        description="Intentos máximos por petición (incluye el primero)"
+    )
+    factus_retry_base_delay_seconds: float = Field(
+        default=0.5,
+        description="Espera base del backoff exponencial"
+    )
+    factus_retry_max_delay_seconds: float = Field(
+        default=8.0,
+        description="Espera máxima entre reintentos"
+    )
+    factus_retry_budget_ratio: float = Field(
+        default=0.2,
+        description="Reintentos permitidos por cada petición original (presupuesto global)"
+    )
+    factus_retry_policies: Dict[str, Dict[str, Any]] = Field(
+        default_factory=dict,
+        description="Overrides por grupo de endpoint, ej: {\"bill_creation\": {\"max_attempts\": 4}}"
+    )
+    
+    # Circuit Breaker (Factus)
+    factus_circuit_failure_rate_threshold: float = Field(
+        default=0.5,
+        description="Tasa de errores (0-1) que abre el circuito"
+    )
+    factus_circuit_slow_call_seconds: float = Field(
+        default=10.0,
+        description="Duración a partir de la cual una llamada se considera lenta"
+    )
+    factus_circuit_slow_call_rate_threshold: float = Field(
+        default=0.8,
+        description="Tasa de llamadas lentas (0-1) que abre el circuito"
+    )
+    factus_circuit_window_size: int = Field(
+        default=20,
+        description="Cantidad de llamadas recientes evaluadas"
+    )
+    factus_circuit_minimum_calls: int = Field(
+        default=5,
+        description="Llamadas mínimas en la ventana antes de evaluar tasas"
+    )
+    factus_circuit_open_seconds: float = Field(
+        default=30.0,
+        description="Segundos que el circuito permanece abierto antes de probar"
+    )
+    
+    # Rate Limiter (tráfico saliente a Factus)
+    factus_rate_limit_enabled: bool = Field(
+        default=True,
+        description="Limitar la tasa de peticiones salientes a Factus (token bucket)"
+    )
+    factus_rate_limit_global_per_second: float = Field(
+        default=20.0,
+        description="Peticiones por segundo hacia Factus en todo el proceso"
+    )
+    factus_rate_limit_global_burst: int = Field(
+        default=40,
+        description="Ráfaga máxima global"
+    )
+    factus_rate_limit_account_per_second: float = Field(
+        default=5.0,
+        description="Peticiones por segundo por cuenta de Factus (tenant)"
+    )
+    factus_rate_limit_account_burst: int = Field(
+        default=10,
+        description="Ráfaga máxima por cuenta"
+    )
+    factus_rate_limit_account_overrides: Dict[str, Dict[str, float]] = Field(
+        default_factory=dict,
+        description="Límites por client_id de Factus, ej: {\"abc\": {\"per_second\": 10, \"burst\": 20}}"
+    )
+    factus_rate_limit_max_wait_seconds: float = Field(
+        default=10.0,
+        description="Tiempo máximo en cola antes de rechazar la petición"
+    )
+    
     # Supabase Auth
     supabase_jwt_secret: str = Field(
         ...,
@@ -102,6 +102,32 @@ class FactusConnectionError(FactusBaseException):
         super().__init__(message, 503, details)
 
 
+class FactusCircuitOpenError(FactusBaseException):
+    """Circuit breaker abierto: Factus está degradado y se falla de inmediato."""
+    
+    def __init__(
+        self, 
+        message: str = "Factus no disponible temporalmente",
+        retry_after: Optional[float] = None,
+        details: Optional[Any] = None
+    ):
+        self.retry_after = retry_after
+        super().__init__(message, 503, details)
+
+
+class FactusRateLimitError(FactusBaseException):
+    """La petición no obtuvo turno en el rate limiter antes del tiempo máximo de espera."""
+    
+    def __init__(
+        self, 
+        message: str = "Demasiadas peticiones a Factus, intente más tarde",
+        retry_after: Optional[float] = None,
+        details: Optional[Any] = None
+    ):
+        self.retry_after = retry_after
+        super().__init__(message, 503, details)
+
+
 class FactusInvoiceError(FactusBaseException):
     """Error específico al crear o validar una factura."""
     
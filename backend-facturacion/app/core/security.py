@@ -87,6 +87,11 @@ async def get_current_tenant(
     usaremos una consulta de seguridad:
     
     Si el usuario tiene rol 'admin' o 'owner' de un tenant.
+    
+    El Tenant queda en el identity map de la sesión de la petición (FastAPI
+    comparte la misma sesión entre dependencias): la factory y los servicios
+    lo reciben por parámetro o lo obtienen con session.get() sin volver a
+    consultar la BD.
     """
     # TODO: Implementar lógica robusta de relación User-Tenant.
     # Por ahora, para cumplir con el requerimiento de "Proteger", validamos el token.
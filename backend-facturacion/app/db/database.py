@@ -3,12 +3,20 @@ Configuración de la base de datos con SQLModel (async).
 Usa SQLite para desarrollo, puede cambiarse a PostgreSQL en producción.
 """
 
-from typing import AsyncGenerator
+from typing import AsyncGenerator, List, Tuple
+import ast
+import json
+import logging
 import os
 
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy import String, UniqueConstraint, inspect, text
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+logger = logging.getLogger(__name__)
 
 # URL de la base de datos (SQLite async para desarrollo)
 DATABASE_URL = os.getenv(
@@ -23,7 +31,7 @@ engine = create_async_engine(
     future=True
 )
 
-# Session factory async
+# Session factory async (AsyncSession de SQLModel: soporta .exec() y .execute())
 async_session_maker = sessionmaker(
     engine,
     class_=AsyncSession,
@@ -38,6 +46,171 @@ async def init_db() -> None:
     """
     async with engine.begin() as conn:
         await conn.run_sync(SQLModel.metadata.create_all)
+        added_columns = await conn.run_sync(_add_missing_columns)
+        if ("invoices", "customer_nit") in added_columns:
+            await conn.run_sync(_backfill_customer_nit)
+        await conn.run_sync(_convert_legacy_api_responses)
+        missing_indexes = await conn.run_sync(_missing_indexes)
+
+    # Cada índice en su propia transacción: si falla (duplicados previos en
+    # un índice único) se registra el error y la app arranca igual; hay que
+    # depurar y reiniciar
+    for name, ddl in missing_indexes:
+        try:
+            async with engine.begin() as conn:
+                await conn.exec_driver_sql(ddl)
+        except Exception as e:
+            logger.error(f"No se pudo crear el índice {name}: {e}")
+
+
+def _add_missing_columns(conn) -> List[Tuple[str, str]]:
+    """
+    Agrega a las tablas existentes las columnas nuevas de los modelos.
+
+    create_all no altera tablas que ya existen; sin esto una BD creada con
+    una versión anterior fallaría al consultar columnas nuevas. Solo agrega
+    columnas nullable o con default (nunca borra ni modifica).
+
+    Returns:
+        (tabla, columna) de las columnas agregadas
+    """
+    inspector = inspect(conn)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+
+    for table in SQLModel.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {col["name"] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            col_type = column.type.compile(dialect=conn.dialect)
+            ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'
+            default = getattr(column.default, "arg", None)
+            if isinstance(default, (bool, int, float, str)) and not callable(default):
+                literal = int(default) if isinstance(default, bool) else default
+                ddl += f" DEFAULT {literal!r}" if isinstance(literal, str) else f" DEFAULT {literal}"
+            conn.exec_driver_sql(ddl)
+            added.append((table.name, column.name))
+    return added
+
+
+# Identificación del cliente dentro de Invoice.payload (InvoiceCreateSchema en JSON)
+_PAYLOAD_CUSTOMER_NIT = {
+    "sqlite": "json_extract(payload, '$.customer.identification_number')",
+    "postgresql": "CAST(payload AS json) -> 'customer' ->> 'identification_number'",
+}
+
+
+def _backfill_customer_nit(conn) -> None:
+    """
+    Llena invoices.customer_nit desde el payload guardado al agregar la columna.
+
+    Se ejecuta una sola vez (cuando _add_missing_columns crea la columna);
+    las facturas sin payload quedan sin cliente y no aparecen al filtrar por NIT.
+    """
+    expression = _PAYLOAD_CUSTOMER_NIT.get(conn.dialect.name)
+    if expression is None:
+        logger.warning(f"customer_nit no se llenó: motor {conn.dialect.name} sin soporte")
+        return
+    result = conn.exec_driver_sql(
+        f"UPDATE invoices SET customer_nit = {expression} "
+        "WHERE customer_nit IS NULL AND payload IS NOT NULL"
+    )
+    logger.info(f"customer_nit llenado desde el payload en {result.rowcount} factura(s)")
+
+
+def _legacy_api_response_json(raw: str) -> str:
+    """JSON de un api_response guardado como texto (repr de dict o error)."""
+    try:
+        return json.dumps(json.loads(raw))
+    except ValueError:
+        pass
+    try:
+        value = ast.literal_eval(raw)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        value = None
+    if not isinstance(value, (dict, list)):
+        value = {"raw": raw}
+    return json.dumps(value, default=str)
+
+
+def _convert_legacy_api_responses(conn) -> None:
+    """
+    Convierte a JSON los api_response guardados como str(dict) de Python.
+
+    Antes la columna era texto libre; ahora es JSON y esas filas no se
+    podrían leer. Solo actúa si la columna sigue siendo de texto (BD creada
+    con la versión anterior); en una BD nueva ya es JSON y no hace nada.
+    En PostgreSQL, tras convertir las filas la columna pasa a json, así que
+    corre una sola vez. SQLite no permite cambiar el tipo: la consulta se
+    repite al iniciar, pero tras la primera conversión no encuentra nada.
+    """
+    inspector = inspect(conn)
+    if "invoices" not in inspector.get_table_names():
+        return
+    column = next((c for c in inspector.get_columns("invoices") if c["name"] == "api_response"), None)
+    if column is None or not isinstance(column["type"], String):
+        return
+
+    rows = conn.exec_driver_sql(
+        "SELECT id, api_response FROM invoices "
+        "WHERE api_response IS NOT NULL AND CAST(api_response AS TEXT) NOT LIKE '{\"%' "
+        "AND CAST(api_response AS TEXT) NOT IN ('{}', 'null')"
+    ).fetchall()
+    for invoice_id, raw in rows:
+        conn.execute(
+            text("UPDATE invoices SET api_response = :value WHERE id = :id"),
+            {"value": _legacy_api_response_json(raw), "id": invoice_id},
+        )
+    if rows:
+        logger.info(f"api_response convertido a JSON en {len(rows)} factura(s)")
+
+    if conn.dialect.name == "postgresql":
+        try:
+            with conn.begin_nested():
+                conn.exec_driver_sql(
+                    "ALTER TABLE invoices ALTER COLUMN api_response TYPE json "
+                    "USING api_response::json"
+                )
+            logger.info("invoices.api_response convertida a json")
+        except Exception as e:
+            logger.error(f"No se pudo cambiar invoices.api_response a json: {e}")
+
+
+def _missing_indexes(conn) -> List[Tuple[str, str]]:
+    """
+    DDL de los índices y restricciones únicas nuevas de tablas existentes.
+
+    Las restricciones únicas se crean como índice único (SQLite no permite
+    agregar restricciones con ALTER TABLE; el efecto es el mismo).
+    """
+    inspector = inspect(conn)
+    existing_tables = set(inspector.get_table_names())
+    missing = []
+
+    for table in SQLModel.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {c["name"] for c in inspector.get_unique_constraints(table.name)}
+        existing |= {i["name"] for i in inspector.get_indexes(table.name)}
+
+        for constraint in table.constraints:
+            if not isinstance(constraint, UniqueConstraint) or not constraint.name:
+                continue
+            if constraint.name in existing:
+                continue
+            columns = ", ".join(column.name for column in constraint.columns)
+            missing.append((
+                constraint.name,
+                f"CREATE UNIQUE INDEX {constraint.name} ON {table.name} ({columns})",
+            ))
+
+        for index in table.indexes:
+            if index.name and index.name not in existing:
+                missing.append((index.name, str(CreateIndex(index).compile(dialect=conn.dialect))))
+    return missing
 
 
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
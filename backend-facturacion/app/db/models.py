@@ -6,6 +6,7 @@ from datetime import date, datetime
 from typing import Optional, List
 from decimal import Decimal
 
+from sqlalchemy import JSON, Column, Index, UniqueConstraint
 from sqlmodel import SQLModel, Field, Relationship
 
 
@@ -141,6 +142,18 @@ class Invoice(SQLModel, table=True):
     Almacena el estado del proceso (Creada -> Validada).
     """
     __tablename__ = "invoices"
+    __table_args__ = (
+        # Idempotencia: una sola factura por orden y tipo de documento
+        UniqueConstraint("tenant_id", "order_reference", "document_type", name="uq_invoices_tenant_order"),
+        # Recorrido por keyset del reconciliador: WHERE status = ? ORDER BY created_at, id
+        Index("ix_invoices_status_created", "status", "created_at", "id"),
+        # Listado por tenant (GET /invoices): keyset sobre (created_at, id), sin
+        # filtro o con un filtro de igualdad por delante
+        Index("ix_invoices_tenant_created", "tenant_id", "created_at", "id"),
+        Index("ix_invoices_tenant_status_created", "tenant_id", "status", "created_at", "id"),
+        Index("ix_invoices_tenant_type_created", "tenant_id", "document_type", "created_at", "id"),
+        Index("ix_invoices_tenant_customer_created", "tenant_id", "customer_nit", "created_at", "id"),
+    )
     
     id: Optional[int] = Field(default=None, primary_key=True)
     
@@ -152,10 +165,15 @@ class Invoice(SQLModel, table=True):
     # Referencia interna (Orden)
     order_reference: str = Field(index=True, description="ID de la orden de restaurante")
     
+    # Cliente (identificación del adquiriente; filtro del listado)
+    customer_nit: Optional[str] = Field(default=None, max_length=20, description="NIT/cédula del cliente")
+    
     # Monto Total
     total: Decimal = Field(default=0, max_digits=20, decimal_places=2)
     
-    # Estado: CREATED, VALIDATED, ERROR, ANNULLED
+    # Estado: PENDING, SUBMITTING, CREATED, VALIDATED, ERROR, ANNULLED, CONTINGENCY
+    # (PENDING/SUBMITTING: orden reclamada, number queda vacío hasta que Factus responde)
+    # (CONTINGENCY: Factus no disponible, number es el provisional del outbox)
     status: str = Field(default="CREATED", index=True)
     
     # Tipo de documento: INVOICE, CREDIT_NOTE
@@ -170,16 +188,179 @@ class Invoice(SQLModel, table=True):
     qr_url: Optional[str] = Field(default=None, description="URL/Contenido del código QR")
     
     # Errores/Detalles
-    api_response: Optional[str] = Field(default=None, description="Respuesta JSON raw (pudiera ser larga)")
+    api_response: Optional[dict] = Field(
+        default=None,
+        sa_column=Column(JSON(none_as_null=True)),
+        description="Última respuesta de Factus (JSON)"
+    )
+    
+    # Envío asíncrono (cola de facturas)
+    payload: Optional[str] = Field(default=None, description="InvoiceCreateSchema en JSON, pendiente de enviar a Factus")
+    attempts: int = Field(default=0, description="Intentos de envío a Factus")
+    last_error: Optional[str] = Field(default=None)
+    lease_until: Optional[datetime] = Field(
+        default=None,
+        description="Fin del lease del envío en curso (SUBMITTING); quien envía lo renueva"
+    )
+    
+    # Tirilla materializada al crear/validar la factura (ver services/ticket_data.py)
+    ticket_data: Optional[dict] = Field(
+        default=None,
+        sa_column=Column(JSON(none_as_null=True)),
+        description="Datos de impresión de la tirilla (sin datos del restaurante)"
+    )
+    ticket_version: int = Field(default=0, description="Revisión de ticket_data (0 = sin materializar)")
+    
+    # Reconciliación en segundo plano (validación DIAN de CREATED / ERROR_VALIDATING)
+    reconcile_attempts: int = Field(default=0, description="Intentos fallidos del reconciliador")
+    next_reconcile_at: Optional[datetime] = Field(default=None, description="No revisar antes de esta fecha (backoff)")
     
     # Fechas
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: Optional[datetime] = Field(default=None)
     validated_at: Optional[datetime] = Field(default=None)
     
     # Relación con Tenant
     tenant_id: int = Field(foreign_key="tenants.id", index=True)
 
 
+# =============================================================================
+# MODELO: INVOICE ITEM (LÍNEAS DE FACTURA)
+# =============================================================================
+
+class InvoiceItem(SQLModel, table=True):
+    """
+    Línea de una factura con su desglose de impuestos.
+    Se escribe al reclamar la orden (junto con la fila Invoice); la tirilla,
+    los reportes y las notas crédito la leen por índice en lugar de volver a
+    interpretar el payload o la respuesta de Factus.
+    """
+    __tablename__ = "invoice_items"
+    __table_args__ = (
+        UniqueConstraint("invoice_id", "line", name="uq_invoice_items_line"),
+    )
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    
+    invoice_id: int = Field(foreign_key="invoices.id")
+    tenant_id: int = Field(foreign_key="tenants.id", index=True)
+    line: int = Field(description="Posición del ítem en la factura (desde 1)")
+    
+    # Producto
+    code: str = Field(max_length=50)
+    description: str = Field(max_length=500)
+    unit_measure_id: int = Field(default=70)
+    quantity: Decimal = Field(max_digits=20, decimal_places=4)
+    price: Decimal = Field(max_digits=20, decimal_places=2, description="Precio unitario sin impuestos")
+    discount: Decimal = Field(default=0, max_digits=20, decimal_places=2)
+    subtotal: Decimal = Field(default=0, max_digits=20, decimal_places=2, description="quantity * price - discount")
+    
+    # Impuesto principal (1=IVA, 22=Impoconsumo) y totales de impuestos del ítem
+    tax_id: Optional[int] = Field(default=None, index=True)
+    tax_percent: Decimal = Field(default=0, max_digits=6, decimal_places=2)
+    taxable_amount: Decimal = Field(default=0, max_digits=20, decimal_places=2)
+    tax_amount: Decimal = Field(default=0, max_digits=20, decimal_places=2)
+    taxes: Optional[List[dict]] = Field(
+        default=None,
+        sa_column=Column(JSON(none_as_null=True)),
+        description="Desglose por impuesto: [{tax_id, percent, taxable_amount, tax_amount}]"
+    )
+    withholding_amount: Decimal = Field(default=0, max_digits=20, decimal_places=2)
+    total: Decimal = Field(default=0, max_digits=20, decimal_places=2, description="subtotal + tax_amount")
+
+
+# =============================================================================
+# MODELO: INVOICE DOCUMENT (PDF/XML EN EL ALMACÉN LOCAL)
+# =============================================================================
+
+class InvoiceDocument(SQLModel, table=True):
+    """
+    PDF o XML de una factura descargado de Factus y guardado en disco.
+    El archivo se direcciona por su SHA-256 (ver services/document_store.py);
+    esta fila relaciona la factura con el contenido y el estado de la descarga.
+    """
+    __tablename__ = "invoice_documents"
+    __table_args__ = (
+        UniqueConstraint("invoice_id", "kind", name="uq_invoice_documents_kind"),
+    )
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    
+    invoice_id: int = Field(foreign_key="invoices.id")
+    tenant_id: int = Field(foreign_key="tenants.id", index=True)
+    kind: str = Field(max_length=10, description="pdf | xml")
+    
+    # Contenido (vacío hasta la primera descarga exitosa)
+    sha256: Optional[str] = Field(default=None, max_length=64, index=True)
+    size: int = Field(default=0, description="Bytes del archivo")
+    content_type: str = Field(default="application/octet-stream", max_length=100)
+    file_name: Optional[str] = Field(default=None, max_length=255, description="Nombre sugerido por Factus")
+    
+    # Estado: STORED, FAILED
+    status: str = Field(default="FAILED", index=True)
+    attempts: int = Field(default=0, description="Descargas fallidas consecutivas")
+    last_error: Optional[str] = Field(default=None)
+    
+    fetched_at: Optional[datetime] = Field(default=None)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+# =============================================================================
+# MODELO: INVOICE OUTBOX (CONTINGENCIA)
+# =============================================================================
+
+class InvoiceOutbox(SQLModel, table=True):
+    """
+    Factura pendiente de enviar a Factus tras una caída (contingencia).
+    El payload ya mapeado vive en Invoice.payload; el id de esta tabla fija
+    el orden de reenvío por tenant y el número provisional del ticket.
+    """
+    __tablename__ = "invoice_outbox"
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    
+    invoice_id: int = Field(foreign_key="invoices.id", unique=True)
+    tenant_id: int = Field(foreign_key="tenants.id", index=True)
+    reference_code: str = Field(max_length=255, description="reference_code enviado a Factus (order_id)")
+    provisional_number: str = Field(default="", max_length=50, index=True, description="Número del ticket provisional")
+    
+    # Estado: PENDING, SENDING, DELIVERED, FAILED
+    status: str = Field(default="PENDING", index=True)
+    attempts: int = Field(default=0, description="Reenvíos a Factus")
+    last_error: Optional[str] = Field(default=None)
+    
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: Optional[datetime] = Field(default=None)
+    delivered_at: Optional[datetime] = Field(default=None)
+
+
+# =============================================================================
+# MODELO: FACTUS TOKEN (TOKENS OAUTH2 COMPARTIDOS ENTRE WORKERS)
+# =============================================================================
+
+class FactusToken(SQLModel, table=True):
+    """
+    Token OAuth2 de Factus compartido entre procesos (workers de uvicorn).
+    Los tokens se guardan encriptados. El lease garantiza que solo un worker
+    renueve el token de una cuenta a la vez.
+    """
+    __tablename__ = "factus_tokens"
+    
+    # Hash de las credenciales de la cuenta (ver FactusTokenCache.key_for)
+    cache_key: str = Field(primary_key=True, max_length=64)
+    
+    # Tokens (encriptados)
+    access_token: Optional[str] = Field(default=None)
+    refresh_token: Optional[str] = Field(default=None)
+    expires_at: Optional[datetime] = Field(default=None)
+    
+    # Lease de renovación (single-flight entre workers)
+    lease_owner: Optional[str] = Field(default=None, max_length=255)
+    lease_expires_at: Optional[datetime] = Field(default=None)
+    
+    updated_at: Optional[datetime] = Field(default=None)
+
+
 # =============================================================================
 # MODELO: INGREDIENT (INSUMO)
 # =============================================================================
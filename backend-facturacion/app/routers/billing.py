@@ -3,24 +3,31 @@ Router de FastAPI para facturación electrónica.
 Expone los endpoints de Factus al frontend.
 """
 
+import asyncio
+import json
 import logging
-from typing import List, Optional
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Literal, Optional, Tuple, Union
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from fastapi import APIRouter, Depends, HTTPException, Query, status
-from pydantic import BaseModel
+from fastapi.responses import FileResponse, JSONResponse
+from pydantic import BaseModel, Field
 from sqlmodel import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.config import get_settings
 from app.core.exceptions import (
     FactusAPIError,
-    FactusAuthError,
+    FactusCircuitOpenError,
     FactusInvoiceError,
+    FactusRateLimitError,
     FactusValidationError,
 )
 from app.core.security import get_current_tenant
 from app.db.database import get_session
-from app.db.models import Invoice, BillingResolution, Tenant
+from app.db.models import Invoice, BillingResolution, InvoiceDocument, Tenant
 from app.schemas.factus import (
     InvoiceCreateSchema,
     InvoiceResponseSchema,
@@ -40,8 +47,42 @@ from app.schemas.factus import (
     # Ah, I see "from app.schemas.factus import".
     # I will be safe and just keep imports as is but change the service import.
 )
+from app.services.active_range_index import get_active_range_index
+from app.services.billing_ranges import BillingRangeService, schedule_ranges_resync
+from app.services.document_store import STORED, get_document_store
+from app.services.escpos import get_escpos_cache
+from app.services.factus.catalog_cache import get_catalog_cache
+from app.services.factus.circuit_breaker import get_circuit_breakers
 from app.services.factus.factory import FactusServiceFactory
+from app.services.factus.municipality_index import get_municipality_index
+from app.services.factus.rate_limiter import get_rate_limiter
+from app.services.factus.retry import get_retry_budget
 from app.services.factus.service import FactusService
+from app.services.factus.token_cache import get_token_cache
+from app.services.factus.token_refresher import get_token_refresher
+from app.services.invoice_items import factus_items, load_invoice_items
+from app.services.invoice_listing import InvoiceFilters, estimate_count, list_invoices, to_naive_utc
+from app.services.invoice_outbox import divert_to_outbox, get_outbox_replayer
+from app.services.invoice_queue import get_invoice_queue
+from app.services.invoice_reconciler import ERROR_VALIDATING, apply_validation_response, get_invoice_reconciler
+from app.services.invoice_submission import (
+    CONTINGENCY,
+    IN_PROGRESS_STATUSES,
+    PENDING,
+    SUBMITTING,
+    apply_invoice_response,
+    claim_invoice,
+    claim_invoices,
+    get_order_single_flight,
+    invoice_response_from_row,
+    is_completed,
+    is_transient_error,
+    mark_invoice_failed,
+    record_number_usage,
+    submit_claimed_invoice,
+)
+from app.services.number_allocator import get_number_allocator
+from app.services.ticket_data import build_ticket_document, get_ticket_cache, is_current, render_ticket
 
 logger = logging.getLogger(__name__)
 
@@ -57,7 +98,7 @@ class RestaurantOrderRequest(BaseModel):
     
     order_id: str
     payment_method: str  # efectivo, tarjeta, transferencia, nequi
-    numbering_range_id: int
+    numbering_range_id: Optional[int] = None  # None = rango activo del tenant
     
     # Cliente
     customer_nit: str
@@ -71,11 +112,97 @@ class RestaurantOrderRequest(BaseModel):
     observation: Optional[str] = None
 
 
+class BatchInvoiceRequest(BaseModel):
+    """Lote de órdenes a facturar."""
+    orders: List[RestaurantOrderRequest] = Field(..., min_length=1)
+
+
+class BatchInvoiceResult(BaseModel):
+    """Resultado de una orden del lote."""
+    order_id: str
+    status: str  # created, replayed, in_progress, contingency, error, rejected
+    invoice_id: Optional[int] = None
+    invoice: Optional[InvoiceResponseSchema] = None
+    error: Optional[str] = None
+    retry_after: Optional[float] = None
+
+
+class BatchInvoiceResponse(BaseModel):
+    """Respuesta de POST /invoices/batch."""
+    total: int
+    created: int
+    replayed: int = 0
+    in_progress: int = 0
+    contingency: int = 0
+    failed: int
+    rejected: int
+    results: List[BatchInvoiceResult]
+
+
+class InvoiceQueuedResponse(BaseModel):
+    """Respuesta 202 del modo asíncrono de facturación."""
+    invoice_id: int
+    status: str
+    order_reference: str
+    status_url: str
+
+
+class InvoiceStatusResponse(BaseModel):
+    """Estado de una factura (envío asíncrono)."""
+    invoice_id: int
+    status: str
+    order_reference: str
+    number: Optional[str] = None
+    cufe: Optional[str] = None
+    pdf_url: Optional[str] = None
+    attempts: int = 0
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+
+
+class OutboxProgressResponse(BaseModel):
+    """Progreso del outbox de contingencia del tenant."""
+    pending: int
+    delivered: int
+    failed: int
+    oldest_pending_at: Optional[datetime] = None
+    draining: bool = False
+    retry_in_seconds: Optional[float] = None
+    last_error: Optional[str] = None
+
+
+class InvoiceListItem(BaseModel):
+    """Factura del listado (GET /invoices)."""
+    id: int
+    number: Optional[str] = None
+    order_reference: str
+    status: str
+    document_type: str
+    total: float
+    cufe: Optional[str] = None
+    customer_nit: Optional[str] = None
+    related_invoice_id: Optional[int] = None
+    pdf_url: Optional[str] = None
+    created_at: datetime
+    validated_at: Optional[datetime] = None
+
+
+class InvoiceListResponse(BaseModel):
+    """Página del listado de facturas."""
+    items: List[InvoiceListItem]
+    limit: int
+    next_cursor: Optional[str] = None
+    estimated_total: Optional[int] = None
+    total_is_exact: Optional[bool] = None
+
+
 class HealthCheckResponse(BaseModel):
     """Respuesta de health check."""
     status: str
     message: str
     authenticated: bool = False
+    circuit_breakers: Dict[str, dict] = {}
 
 
 class ErrorResponse(BaseModel):
@@ -100,33 +227,124 @@ async def health_check(
 ):
     """
     Verifica que el servicio de facturación esté funcionando para el tenant autenticado.
+    Incluye el estado de los circuit breakers de Factus del tenant.
     """
+    account_key = None
     try:
         factory = FactusServiceFactory(db)
         # Usamos el context manager para asegurar cierre del cliente HTTP
-        async with await factory.create_service_for_tenant(current_tenant.id) as service:
-            # Intentar obtener información básica
-            await service.get_payment_methods()
+        async with await factory.create_service_for_tenant(current_tenant) as service:
+            account_key = service.account_key
+            # Intentar obtener información básica (directo a Factus, sin cache)
+            await service.check_connection()
             
         return HealthCheckResponse(
             status="ok",
             message=f"Conexión exitosa con Factus para tenant {current_tenant.name} ({current_tenant.id})",
-            authenticated=True
+            authenticated=True,
+            circuit_breakers=get_circuit_breakers().snapshot(account_key)
         )
     except HTTPException as e:
         return HealthCheckResponse(
             status="error",
             message=e.detail,
-            authenticated=True
+            authenticated=True,
+            circuit_breakers=get_circuit_breakers().snapshot(account_key)
+        )
+    except FactusCircuitOpenError as e:
+        return HealthCheckResponse(
+            status="degraded",
+            message=e.message,
+            authenticated=True,
+            circuit_breakers=get_circuit_breakers().snapshot(account_key)
         )
     except Exception as e:
         return HealthCheckResponse(
             status="error",
             message=f"Error: {str(e)}",
-            authenticated=True
+            authenticated=True,
+            circuit_breakers=get_circuit_breakers().snapshot(account_key)
         )
 
 
+async def factus_unavailable_handler(
+    request: Request, 
+    exc: Union[FactusCircuitOpenError, FactusRateLimitError]
+) -> JSONResponse:
+    """
+    Traduce FactusCircuitOpenError / FactusRateLimitError a 503 con Retry-After.
+    Registrado en la app (main.py) para cubrir todos los endpoints de facturación.
+    """
+    error_code = (
+        "factus_rate_limited" if isinstance(exc, FactusRateLimitError)
+        else "factus_unavailable"
+    )
+    headers = {}
+    if exc.retry_after is not None:
+        headers["Retry-After"] = str(int(exc.retry_after) + 1)
+    return JSONResponse(
+        status_code=503,
+        content={
+            "detail": {
+                "error": error_code,
+                "message": exc.message,
+                "retry_after": exc.retry_after
+            }
+        },
+        headers=headers
+    )
+
+
+# =============================================================================
+# MONITOREO
+# =============================================================================
+
+@router.get(
+    "/metrics",
+    summary="Métricas internas de la integración con Factus"
+)
+async def get_billing_metrics(
+    current_tenant: Tenant = Depends(get_current_tenant)
+):
+    """
+    Expone contadores internos para monitoreo (sin datos sensibles).
+    Son contadores de todo el proceso: requiere autenticación como el resto
+    de rutas de facturación.
+    """
+    token_cache = get_token_cache()
+    retry_budget = get_retry_budget()
+    return {
+        "tokens": {
+            "cached_accounts": token_cache.size,
+            **token_cache.stats,
+            "refresher_errors": len(get_token_refresher().last_errors),
+        },
+        "catalogs": get_catalog_cache().snapshot(),
+        "municipality_index": get_municipality_index().snapshot(),
+        "circuit_breakers": {
+            "open": get_circuit_breakers().open_count(),
+        },
+        "rate_limiter": get_rate_limiter().snapshot(),
+        "invoice_queue": get_invoice_queue().snapshot(),
+        "invoice_outbox": get_outbox_replayer().snapshot(),
+        "invoice_reconciler": get_invoice_reconciler().snapshot(),
+        "number_allocator": get_number_allocator().snapshot(),
+        "active_range_index": get_active_range_index().snapshot(),
+        "ticket_cache": get_ticket_cache().snapshot(),
+        "escpos_cache": get_escpos_cache().snapshot(),
+        "document_store": get_document_store().snapshot(),
+        "order_single_flight": {
+            "in_flight": get_order_single_flight().in_flight,
+            "joined": get_order_single_flight().joined,
+        },
+        "retries": {
+            "retries": retry_budget.retries,
+            "budget_exhausted": retry_budget.exhausted,
+            "budget_available": round(retry_budget.available, 2),
+        }
+    }
+
+
 # =============================================================================
 # CATÁLOGOS
 # =============================================================================
@@ -138,19 +356,43 @@ async def health_check(
 )
 async def get_numbering_ranges(
     current_tenant: Tenant = Depends(get_current_tenant),
+    refresh: bool = Query(False, description="Forzar sincronización en vivo con Factus"),
     db: AsyncSession = Depends(get_session)
 ):
     """
     Retorna los rangos de numeración autorizados por la DIAN para el tenant.
+    
+    Se leen del espejo local (billing_resolutions). Si la última
+    sincronización es más antigua que numbering_ranges_max_age_seconds se
+    resincroniza en segundo plano; con refresh=true (o sin rangos locales)
+    se sincroniza con Factus antes de responder.
     """
-    try:
-        factory = FactusServiceFactory(db)
-        async with await factory.create_service_for_tenant(current_tenant.id) as service:
-            return await service.get_numbering_ranges()
-    except FactusAuthError as e:
-        raise HTTPException(status_code=401, detail=str(e))
-    except FactusAPIError as e:
-        raise HTTPException(status_code=e.status_code or 500, detail=str(e))
+    range_service = BillingRangeService(db, get_settings())
+    
+    resolutions = [] if refresh else await range_service.get_tenant_resolutions(current_tenant.id)
+    
+    if not resolutions:
+        result = await range_service.sync_ranges_from_factus(current_tenant.id)
+        if not result.success:
+            raise HTTPException(status_code=502, detail=result.message)
+        resolutions = await range_service.get_tenant_resolutions(current_tenant.id)
+    elif range_service.is_stale(resolutions):
+        schedule_ranges_resync(current_tenant.id)
+    
+    return [
+        NumberingRangeSchema(
+            id=r.factus_id,
+            prefix=r.prefix,
+            from_number=r.number_from or 0,
+            to_number=r.number_to or 0,
+            current=r.current_number or 0,
+            resolution_number=r.resolution_number or "",
+            resolution_date=r.resolution_date,
+            technical_key=r.technical_key,
+            is_expired=r.is_expired,
+        )
+        for r in resolutions
+    ]
 
 
 @router.get(
@@ -159,6 +401,7 @@ async def get_numbering_ranges(
     summary="Obtener catálogo de municipios"
 )
 async def get_municipalities(
+    response: Response,
     current_tenant: Tenant = Depends(get_current_tenant),
     search: Optional[str] = Query(None, description="Término de búsqueda"),
     page: int = Query(1, ge=1),
@@ -167,13 +410,24 @@ async def get_municipalities(
 ):
     """
     Retorna el catálogo de municipios colombianos.
+    La búsqueda y paginación se resuelven en el índice local (sin llamar a
+    Factus); el total de coincidencias va en el header X-Total-Count.
     """
-    try:
-        factory = FactusServiceFactory(db)
-        async with await factory.create_service_for_tenant(current_tenant.id) as service:
-            return await service.get_municipalities(search, page, per_page)
-    except FactusAPIError as e:
-        raise HTTPException(status_code=e.status_code or 500, detail=str(e))
+    index = get_municipality_index()
+    
+    if index.needs_refresh:
+        try:
+            # Sin "async with": el refresco en segundo plano puede usar el
+            # servicio después de la petición (el cliente HTTP es compartido)
+            factory = FactusServiceFactory(db)
+            service = await factory.create_service_for_tenant(current_tenant)
+            await index.ensure_fresh(service.get_all_municipalities)
+        except FactusAPIError as e:
+            raise HTTPException(status_code=e.status_code or 500, detail=str(e))
+    
+    municipalities, total = index.search(search, page, per_page)
+    response.headers["X-Total-Count"] = str(total)
+    return municipalities
 
 
 @router.get(
@@ -190,7 +444,7 @@ async def get_tributes(
     """
     try:
         factory = FactusServiceFactory(db)
-        async with await factory.create_service_for_tenant(current_tenant.id) as service:
+        async with await factory.create_service_for_tenant(current_tenant) as service:
             return await service.get_tributes()
     except FactusAPIError as e:
         raise HTTPException(status_code=e.status_code or 500, detail=str(e))
@@ -209,7 +463,7 @@ async def get_payment_methods(
     """
     try:
         factory = FactusServiceFactory(db)
-        async with await factory.create_service_for_tenant(current_tenant.id) as service:
+        async with await factory.create_service_for_tenant(current_tenant) as service:
             return await service.get_payment_methods()
     except FactusAPIError as e:
         raise HTTPException(status_code=e.status_code or 500, detail=str(e))
@@ -226,49 +480,37 @@ async def get_payment_methods(
 )
 async def create_invoice(
     invoice_data: InvoiceCreateSchema,
+    http_response: Response,
     current_tenant: Tenant = Depends(get_current_tenant),
     db: AsyncSession = Depends(get_session)
 ):
     """
     Crea una factura electrónica completa.
-    Verifica que el rango de numeración pertenezca al tenant autenticado.
+    Si no se envía numbering_range_id se usa el rango activo del tenant; el
+    rango enviado debe pertenecer al tenant autenticado.
+    Idempotente por reference_code (ver /invoices/from-order).
     """
+    range_index = get_active_range_index()
+    range_id = None
     try:
-        # 1. Obtener Resolución desde el ID
-        stmt = select(BillingResolution).where(BillingResolution.factus_id == invoice_data.numbering_range_id)
-        result = await db.exec(stmt)
-        resolution = result.first()
-        
-        if not resolution:
-            raise HTTPException(status_code=400, detail="Rango de numeración no encontrado en sistema local")
-            
-        # 2. Validar que la resolución pertenezca al tenant autenticado
-        if resolution.tenant_id != current_tenant.id:
-            logger.warning(f"Tenant {current_tenant.id} intentó usar resolución de otro tenant ({resolution.tenant_id})")
-            raise HTTPException(status_code=403, detail="El rango de numeración no pertenece a este comercio")
+        # 1-2. Rango de numeración del tenant (el activo si no se envía o está agotado)
+        range_id = await range_index.resolve(db, current_tenant.id, invoice_data.numbering_range_id)
+        if range_id != invoice_data.numbering_range_id:
+            invoice_data = invoice_data.model_copy(update={"numbering_range_id": range_id})
         
         # 3. Instanciar servicio para ese tenant
         factory = FactusServiceFactory(db)
-        async with await factory.create_service_for_tenant(current_tenant.id) as service:
+        async with await factory.create_service_for_tenant(current_tenant) as service:
             
-            # 4. Crear en Factus
-            response = await service.create_invoice(invoice_data)
-            
-            # 5. Guardar en Base de Datos
-            new_invoice = Invoice(
-                number=response.number,
-                cufe=response.cufe,
-                factus_id=response.id,
-                order_reference=invoice_data.reference_code,
-                status=response.status.upper(), # CREATED
-                pdf_url=response.pdf_url,
-                xml_url=response.xml_url,
-                tenant_id=current_tenant.id,
-                api_response=str(response.model_dump())
+            # 4. Reclamar la referencia, crear en Factus y guardar
+            key = (current_tenant.id, invoice_data.reference_code)
+            (response, replayed), joined = await get_order_single_flight().run(
+                key,
+                lambda: _submit_order(db, service, current_tenant.id, invoice_data, async_mode=False)
             )
-            db.add(new_invoice)
-            await db.commit()
-            await db.refresh(new_invoice)
+            if replayed or joined:
+                http_response.headers["Idempotent-Replayed"] = "true"
+            _mark_contingency(http_response, response)
             
             return response
         
@@ -286,73 +528,77 @@ async def create_invoice(
         })
     except FactusAPIError as e:
         raise HTTPException(status_code=e.status_code or 500, detail=str(e))
+    finally:
+        if range_id is not None:
+            range_index.release(range_id)
 
 
 @router.post(
     "/invoices/from-order",
     response_model=InvoiceResponseSchema,
+    responses={202: {"model": InvoiceQueuedResponse}},
     summary="Facturar orden de restaurante"
 )
 async def create_invoice_from_order(
     order: RestaurantOrderRequest,
+    http_response: Response,
+    async_mode: bool = Query(False, description="Encolar el envío a Factus y responder 202 de inmediato"),
     current_tenant: Tenant = Depends(get_current_tenant),
     db: AsyncSession = Depends(get_session)
 ):
     """
     Endpoint simplificado para facturar una orden de restaurante.
+    
+    Con async_mode=true la factura se guarda como PENDING y se responde 202;
+    el estado se consulta en GET /invoices/{invoice_id}/status.
+    
+    Idempotente por order_id: si la orden ya se facturó se devuelve la misma
+    factura (header Idempotent-Replayed: true) sin llamar a Factus; si se está
+    facturando en otra petición se responde 409 (o 202 en modo asíncrono).
+    
+    Si Factus no está disponible la venta no falla: se responde 202 con un
+    ticket provisional (status "contingency", header Invoice-Contingency) y
+    la factura se envía a Factus desde el outbox cuando vuelva.
     """
+    queue = get_invoice_queue()
+    if async_mode and not queue.running:
+        raise HTTPException(
+            status_code=409,
+            detail="El modo asíncrono está deshabilitado (INVOICE_QUEUE_ENABLED)"
+        )
+    
+    range_index = get_active_range_index()
+    range_id = None
     try:
-        # 1. Validar tenant desde numbering_range_id
-        stmt = select(BillingResolution).where(BillingResolution.factus_id == order.numbering_range_id)
-        result = await db.exec(stmt)
-        resolution = result.first()
-        
-        if not resolution:
-            raise HTTPException(status_code=400, detail="Rango de numeración no válido")
-            
-        # Validar propiedad
-        if resolution.tenant_id != current_tenant.id:
-            raise HTTPException(status_code=403, detail="El rango de numeración no pertenece a este comercio")
+        # 1. Rango de numeración del tenant (el activo si no se envía o está agotado)
+        range_id = await range_index.resolve(db, current_tenant.id, order.numbering_range_id)
 
         # 2. Crear servicio
         factory = FactusServiceFactory(db)
-        async with await factory.create_service_for_tenant(current_tenant.id) as service:
+        async with await factory.create_service_for_tenant(current_tenant) as service:
             
-            # Convertir items a dicts para el servicio (que usa .get())
-            items_dicts = [item.model_dump() for item in order.items]
-
             # Mapear orden al formato de factura
-            invoice_data = service.map_restaurant_order_to_invoice(
-                order_id=order.order_id,
-                customer_nit=order.customer_nit,
-                customer_name=order.customer_name,
-                customer_email=order.customer_email,
-                items=items_dicts,
-                payment_method=order.payment_method,
-                numbering_range_id=order.numbering_range_id,
-                observation=order.observation
+            invoice_data = _map_order_to_invoice(service, order, range_id)
+            
+            # 3. Reclamar la orden y crear en Factus. Los duplicados
+            # concurrentes de este proceso esperan el resultado del primero
+            key = (current_tenant.id, invoice_data.reference_code)
+            (result, replayed), joined = await get_order_single_flight().run(
+                key,
+                lambda: _submit_order(db, service, current_tenant.id, invoice_data, async_mode)
             )
             
-            # 3. Crear en Factus
-            response = await service.create_invoice(invoice_data)
+            replay_headers = {"Idempotent-Replayed": "true"} if replayed or joined else {}
+            if isinstance(result, InvoiceQueuedResponse):
+                return JSONResponse(
+                    status_code=status.HTTP_202_ACCEPTED,
+                    headers={"Location": result.status_url, **replay_headers},
+                    content=result.model_dump()
+                )
             
-            # 4. Guardar en Base de Datos
-            new_invoice = Invoice(
-                number=response.number,
-                cufe=response.cufe,
-                factus_id=response.id,
-                order_reference=invoice_data.reference_code,
-                status=response.status.upper(),
-                pdf_url=response.pdf_url,
-                xml_url=response.xml_url,
-                tenant_id=current_tenant.id,
-                api_response=str(response.model_dump())
-            )
-            db.add(new_invoice)
-            await db.commit()
-            await db.refresh(new_invoice)
-
-            return response
+            http_response.headers.update(replay_headers)
+            _mark_contingency(http_response, result)
+            return result
         
     except FactusValidationError as e:
         raise HTTPException(status_code=422, detail={
@@ -368,6 +614,367 @@ async def create_invoice_from_order(
         })
     except FactusAPIError as e:
         raise HTTPException(status_code=e.status_code or 500, detail=str(e))
+    finally:
+        if range_id is not None:
+            range_index.release(range_id)
+
+
+def _map_order_to_invoice(
+    service: FactusService,
+    order: RestaurantOrderRequest,
+    numbering_range_id: int
+) -> InvoiceCreateSchema:
+    """Mapea una orden de restaurante al formato de factura de Factus."""
+    # Convertir items a dicts para el servicio (que usa .get())
+    items_dicts = [item.model_dump() for item in order.items]
+    
+    return service.map_restaurant_order_to_invoice(
+        order_id=order.order_id,
+        customer_nit=order.customer_nit,
+        customer_name=order.customer_name,
+        customer_email=order.customer_email,
+        items=items_dicts,
+        payment_method=order.payment_method,
+        numbering_range_id=numbering_range_id,
+        observation=order.observation
+    )
+
+
+def _mark_contingency(http_response: Response, result: BaseModel) -> None:
+    """Responde 202 si la factura quedó en contingencia (ticket provisional)."""
+    if getattr(result, "status", None) == CONTINGENCY.lower():
+        http_response.status_code = status.HTTP_202_ACCEPTED
+        http_response.headers["Invoice-Contingency"] = "true"
+
+
+def _queued_response(invoice: Invoice) -> InvoiceQueuedResponse:
+    """Respuesta 202 de una factura en cola."""
+    return InvoiceQueuedResponse(
+        invoice_id=invoice.id,
+        status=invoice.status,
+        order_reference=invoice.order_reference,
+        status_url=f"{router.prefix}/invoices/{invoice.id}/status"
+    )
+
+
+async def _submit_order(
+    db: AsyncSession,
+    service: FactusService,
+    tenant_id: int,
+    invoice_data: InvoiceCreateSchema,
+    async_mode: bool
+) -> Tuple[BaseModel, bool]:
+    """
+    Reclama la orden y la envía a Factus (o la encola en modo asíncrono).
+    
+    Returns:
+        (InvoiceResponseSchema o InvoiceQueuedResponse, True si es un replay)
+    """
+    invoice, claimed = await claim_invoice(
+        db, tenant_id, invoice_data, status=PENDING if async_mode else SUBMITTING
+    )
+    
+    if not claimed:
+        if is_completed(invoice):
+            return invoice_response_from_row(invoice), True
+        if async_mode:
+            return _queued_response(invoice), True
+        raise HTTPException(status_code=409, detail={
+            "error": "invoice_in_progress",
+            "message": f"La orden {invoice.order_reference} ya se está facturando",
+            "invoice_id": invoice.id,
+            "status_url": f"{router.prefix}/invoices/{invoice.id}/status"
+        })
+    
+    if async_mode:
+        get_invoice_queue().enqueue(invoice.id, tenant_id)
+        return _queued_response(invoice), False
+    
+    try:
+        response = await submit_claimed_invoice(service, invoice, invoice_data)
+    except Exception as e:
+        outbox = get_outbox_replayer()
+        if outbox.running and is_transient_error(e):
+            # Factus no disponible: ticket provisional, el outbox la enviará
+            await divert_to_outbox(db, invoice, e)
+            await db.commit()
+            outbox.notify()
+            return invoice_response_from_row(invoice), False
+        
+        # La orden queda en ERROR y puede volver a intentarse
+        mark_invoice_failed(invoice, e)
+        await db.commit()
+        raise
+    
+    apply_invoice_response(invoice, response, invoice_data)
+    await record_number_usage(db, invoice, invoice_data)
+    await db.commit()
+    return response, False
+
+
+@router.post(
+    "/invoices/batch",
+    response_model=BatchInvoiceResponse,
+    summary="Facturar varias órdenes de restaurante en lote"
+)
+async def create_invoices_batch(
+    batch: BatchInvoiceRequest,
+    current_tenant: Tenant = Depends(get_current_tenant),
+    db: AsyncSession = Depends(get_session)
+):
+    """
+    Factura muchas órdenes en una sola petición (cierre de turno, eventos).
+    
+    - Todas las órdenes se validan antes de enviar la primera a Factus
+      (rango de numeración del tenant, order_id repetido, datos de la factura)
+    - Un solo servicio (y token) del tenant; los envíos a Factus se hacen en
+      paralelo con un máximo de invoice_batch_concurrency
+    - Las facturas creadas se guardan en una transacción por cada
+      invoice_batch_chunk_size resultados
+    - Idempotente por order_id: las órdenes ya facturadas vuelven como
+      "replayed" y las que otra petición está facturando como "in_progress"
+    - Si Factus no está disponible las órdenes quedan en "contingency" con
+      ticket provisional y se envían desde el outbox
+    
+    Una orden que falla no afecta a las demás: el resultado es por orden.
+    """
+    settings = get_settings()
+    if len(batch.orders) > settings.invoice_batch_max_orders:
+        raise HTTPException(
+            status_code=413,
+            detail=f"El lote supera el máximo de {settings.invoice_batch_max_orders} órdenes"
+        )
+    
+    tenant_id = current_tenant.id
+    results: List[BatchInvoiceResult] = [
+        BatchInvoiceResult(order_id=order.order_id, status="pending")
+        for order in batch.orders
+    ]
+    
+    # 1. Rangos de numeración: cada rango distinto del lote se resuelve una vez
+    # y sus órdenes quedan en curso en el índice hasta terminar el lote
+    range_index = get_active_range_index()
+    requested_counts: Dict[Optional[int], int] = {}
+    for order in batch.orders:
+        requested_counts[order.numbering_range_id] = requested_counts.get(order.numbering_range_id, 0) + 1
+    resolved_ranges: Dict[Optional[int], Union[int, HTTPException]] = {}
+    try:
+        for requested, count in requested_counts.items():
+            try:
+                resolved_ranges[requested] = await range_index.resolve(db, tenant_id, requested, count)
+            except HTTPException as e:
+                resolved_ranges[requested] = e
+        order_ranges: Dict[int, int] = {}
+        
+        factory = FactusServiceFactory(db)
+        async with await factory.create_service_for_tenant(current_tenant) as service:
+            
+            # 2. Validación previa de todas las órdenes
+            pending: List[tuple] = []
+            seen_orders = set()
+            for index, order in enumerate(batch.orders):
+                result = results[index]
+                if order.order_id in seen_orders:
+                    result.status, result.error = "rejected", "order_id repetido en el lote"
+                    continue
+                seen_orders.add(order.order_id)
+                
+                range_id = resolved_ranges[order.numbering_range_id]
+                if isinstance(range_id, HTTPException):
+                    result.status, result.error = "rejected", range_id.detail
+                    continue
+                try:
+                    invoice_data = _map_order_to_invoice(service, order, range_id)
+                except Exception as e:
+                    result.status, result.error = "rejected", str(e)
+                    continue
+                order_ranges[index] = range_id
+                pending.append((index, invoice_data))
+            
+            # 3. Idempotencia: se reclaman todas las órdenes en una sentencia; las
+            # ya facturadas se devuelven desde la BD sin llamar a Factus
+            claims = await claim_invoices(db, tenant_id, [data for _, data in pending])
+            to_submit: List[tuple] = []
+            for index, invoice_data in pending:
+                invoice, claimed = claims[invoice_data.reference_code]
+                result = results[index]
+                result.invoice_id = invoice.id
+                if claimed:
+                    to_submit.append((index, invoice, invoice_data))
+                elif is_completed(invoice):
+                    result.status = "replayed"
+                    result.invoice = invoice_response_from_row(invoice)
+                else:
+                    result.status = "in_progress"
+            
+            # 4. Envío concurrente a Factus (acotado)
+            outbox = get_outbox_replayer()
+            semaphore = asyncio.Semaphore(max(1, settings.invoice_batch_concurrency))
+            
+            async def submit(index: int, invoice: Invoice, invoice_data: InvoiceCreateSchema):
+                async with semaphore:
+                    try:
+                        return index, invoice, invoice_data, await submit_claimed_invoice(service, invoice, invoice_data), None
+                    except Exception as e:
+                        return index, invoice, invoice_data, None, e
+            
+            tasks = [asyncio.create_task(submit(*item)) for item in to_submit]
+            chunk: List[int] = []
+            # Facturas creadas del bloque por rango (se descuentan en una sentencia por rango)
+            chunk_ranges: Dict[int, int] = {}
+            chunk_size = max(1, settings.invoice_batch_chunk_size)
+            
+            # 5. Guardar por bloques a medida que llegan las respuestas
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    index, invoice, invoice_data, response, error = await next_done
+                    result = results[index]
+                    
+                    if error is not None and outbox.running and is_transient_error(error):
+                        await divert_to_outbox(db, invoice, error)
+                        result.status = "contingency"
+                        result.invoice = invoice_response_from_row(invoice)
+                    elif error is not None:
+                        result.status = "error"
+                        result.error = str(error)
+                        if isinstance(error, (FactusCircuitOpenError, FactusRateLimitError)):
+                            result.retry_after = error.retry_after
+                        mark_invoice_failed(invoice, error)
+                    else:
+                        result.status = "created"
+                        result.invoice = response
+                        apply_invoice_response(invoice, response, invoice_data)
+                        range_id = order_ranges[index]
+                        chunk_ranges[range_id] = chunk_ranges.get(range_id, 0) + 1
+                    
+                    chunk.append(index)
+                    if len(chunk) >= chunk_size:
+                        await _save_batch_chunk(db, tenant_id, chunk, chunk_ranges, results)
+                        chunk, chunk_ranges = [], {}
+                
+                if chunk:
+                    await _save_batch_chunk(db, tenant_id, chunk, chunk_ranges, results)
+            finally:
+                for task in tasks:
+                    task.cancel()
+    finally:
+        for requested, range_id in resolved_ranges.items():
+            if not isinstance(range_id, HTTPException):
+                range_index.release(range_id, requested_counts[requested])
+    
+    counts = {state: 0 for state in ("created", "replayed", "in_progress", "contingency", "error", "rejected")}
+    for r in results:
+        counts[r.status] += 1
+    logger.info(
+        f"Lote de {len(results)} órdenes del tenant {tenant_id}: {counts['created']} creadas, "
+        f"{counts['replayed']} ya facturadas, {counts['contingency']} en contingencia, "
+        f"{counts['rejected']} rechazadas, {counts['error']} con error"
+    )
+    if counts["contingency"]:
+        outbox.notify()
+    return BatchInvoiceResponse(
+        total=len(results),
+        created=counts["created"],
+        replayed=counts["replayed"],
+        in_progress=counts["in_progress"],
+        contingency=counts["contingency"],
+        rejected=counts["rejected"],
+        failed=counts["error"],
+        results=results
+    )
+
+
+async def _save_batch_chunk(
+    db: AsyncSession,
+    tenant_id: int,
+    chunk: List[int],
+    chunk_ranges: Dict[int, int],
+    results: List[BatchInvoiceResult]
+) -> None:
+    """Guarda un bloque de resultados del lote (y el uso de sus rangos) en una sola transacción."""
+    try:
+        allocator = get_number_allocator()
+        for range_id, count in chunk_ranges.items():
+            await allocator.allocate(db, tenant_id, range_id, count)
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        # Las filas quedan en SUBMITTING: al reintentar se busca la factura en
+        # Factus por reference_code antes de reenviarla
+        logger.error(f"No se pudo guardar un bloque de {len(chunk)} facturas del lote: {e}")
+        for index in chunk:
+            if results[index].status == "created":
+                results[index].status = "error"
+                results[index].error = "Factura creada en Factus pero no se pudo guardar localmente"
+            elif results[index].status == "contingency":
+                results[index].status = "error"
+                results[index].invoice = None
+                results[index].error = "Factus no disponible y no se pudo guardar la contingencia"
+
+
+@router.get(
+    "/invoices/{invoice_id}/status",
+    response_model=InvoiceStatusResponse,
+    summary="Estado de una factura enviada en modo asíncrono"
+)
+async def get_invoice_status(
+    invoice_id: int,
+    wait: float = Query(0, ge=0, le=30, description="Segundos a esperar (long-polling) si aún está en proceso"),
+    current_tenant: Tenant = Depends(get_current_tenant),
+    db: AsyncSession = Depends(get_session)
+):
+    """
+    Retorna el estado de la factura. Con wait > 0 la respuesta se retiene
+    hasta que la factura salga de PENDING/SUBMITTING o se cumpla el tiempo.
+    """
+    queue = get_invoice_queue()
+    watcher = queue.watch(invoice_id) if wait else None
+    try:
+        invoice = await db.get(Invoice, invoice_id)
+        if not invoice or invoice.tenant_id != current_tenant.id:
+            raise HTTPException(status_code=404, detail="Factura no encontrada")
+        
+        if watcher is not None and invoice.status in IN_PROGRESS_STATUSES:
+            # Liberar la conexión de BD mientras se espera
+            await db.commit()
+            try:
+                await asyncio.wait_for(watcher.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+            await db.refresh(invoice)
+    finally:
+        if watcher is not None:
+            queue.unwatch(invoice_id, watcher)
+    
+    return InvoiceStatusResponse(
+        invoice_id=invoice.id,
+        status=invoice.status,
+        order_reference=invoice.order_reference,
+        number=invoice.number or None,
+        cufe=invoice.cufe,
+        pdf_url=invoice.pdf_url,
+        attempts=invoice.attempts,
+        error=invoice.last_error,
+        created_at=invoice.created_at,
+        updated_at=invoice.updated_at
+    )
+
+
+@router.get(
+    "/outbox",
+    response_model=OutboxProgressResponse,
+    summary="Progreso del envío de facturas en contingencia"
+)
+async def get_outbox_progress(
+    current_tenant: Tenant = Depends(get_current_tenant),
+    db: AsyncSession = Depends(get_session)
+):
+    """
+    Facturas del tenant emitidas con ticket provisional mientras Factus no
+    estaba disponible: pendientes de enviar, enviadas y rechazadas.
+    """
+    progress = await get_outbox_replayer().tenant_progress(db, current_tenant.id)
+    return OutboxProgressResponse(**progress)
 
 
 @router.post(
@@ -381,6 +988,9 @@ async def validate_invoice(
 ):
     """
     Realiza la validación final de la factura ante la DIAN/Factus.
+    
+    No es necesario llamarlo al facturar: el reconciliador valida en segundo
+    plano las facturas CREATED y reintenta las ERROR_VALIDATING.
     """
     try:
         # 1. Buscar factura para obtener tenant (y asegurar que pertenece al usuario)
@@ -396,36 +1006,16 @@ async def validate_invoice(
 
         # 2. Crear servicio
         factory = FactusServiceFactory(db)
-        async with await factory.create_service_for_tenant(current_tenant.id) as service:
+        async with await factory.create_service_for_tenant(current_tenant) as service:
             
             # 3. Llamar servicio de validación
             result = await service.validate_invoice(invoice_number)
             
-            # 4. Actualizar estado en BD
-            invoice.status = "VALIDATED"
-            invoice.validated_at = datetime.utcnow()
-            
-            # Parsear respuesta para extraer datos clave
-            data = result.get("data", {}).get("bill", {}) if isinstance(result, dict) else {}
-            
-            if data.get("cufe"):
-                invoice.cufe = data.get("cufe")
-            if data.get("qr"):
-                invoice.qr_url = data.get("qr")
-            
-            xml = data.get("xml_url") or result.get("xml_url")
-            if xml:
-                invoice.xml_url = xml
-                
-            pdf = data.get("public_url") or result.get("pdf_url")
-            if pdf:
-                invoice.pdf_url = pdf
-                
-            invoice.api_response = str(result)
+            # 4. Actualizar estado en BD (CUFE, QR, XML y PDF de la respuesta)
+            apply_validation_response(invoice, result)
             
             db.add(invoice)
             await db.commit()
-            await db.refresh(invoice)
                 
             return {
                 "status": "success", 
@@ -441,8 +1031,8 @@ async def validate_invoice(
     except FactusAPIError as e:
         # Registrar error en la factura si existe (ya cargada)
         if 'invoice' in locals() and invoice:
-            invoice.status = "ERROR_VALIDATING"
-            invoice.api_response = str(e)
+            invoice.status = ERROR_VALIDATING
+            invoice.last_error = str(e)
             db.add(invoice)
             await db.commit()
             
@@ -504,11 +1094,18 @@ async def create_credit_note(
 
         # 3. Crear servicio y procesar
         factory = FactusServiceFactory(db)
-        async with await factory.create_service_for_tenant(current_tenant.id) as service:
+        async with await factory.create_service_for_tenant(current_tenant) as service:
             
             # Obtener detalles completos de la factura desde Factus
             original_invoice_data = await service.get_invoice(data.invoice_number)
             
+            # Replicar los ítems tal como se enviaron (invoice_items); las
+            # retenciones no se guardan línea a línea, esas facturas usan los
+            # ítems que devuelve Factus
+            items = await load_invoice_items(db, invoice)
+            if items and not any(item.withholding_amount for item in items):
+                original_invoice_data = {**original_invoice_data, "items": factus_items(items)}
+            
             # Crear Nota Crédito
             response = await service.create_credit_note(
                 data=data,
@@ -529,11 +1126,12 @@ async def create_credit_note(
                 status="CREATED",
                 document_type="CREDIT_NOTE",
                 related_invoice_id=invoice.id,
+                customer_nit=invoice.customer_nit,
                 tenant_id=current_tenant.id,
                 pdf_url=response.pdf_url,
                 xml_url=response.xml_url,
                 qr_url=response.qr_code,
-                api_response=str(response.model_dump())
+                api_response=response.model_dump(mode="json")
             )
             
             if response.status == "validated":
@@ -542,7 +1140,6 @@ async def create_credit_note(
                 
             db.add(new_nc)
             await db.commit()
-            await db.refresh(new_nc)
             
             return response
 
@@ -562,6 +1159,56 @@ async def create_credit_note(
         raise HTTPException(status_code=e.status_code or 500, detail=str(e))
 
 
+@router.get(
+    "/invoices",
+    response_model=InvoiceListResponse,
+    summary="Listar y buscar facturas"
+)
+async def list_tenant_invoices(
+    status: Optional[str] = Query(default=None, description="Estado (ej: VALIDATED, CONTINGENCY)"),
+    document_type: Optional[str] = Query(default=None, description="INVOICE o CREDIT_NOTE"),
+    date_from: Optional[datetime] = Query(default=None, description="Creadas desde (inclusive; sin zona horaria se toma como UTC)"),
+    date_to: Optional[datetime] = Query(default=None, description="Creadas hasta (exclusive; sin zona horaria se toma como UTC)"),
+    customer_nit: Optional[str] = Query(default=None, max_length=20, description="NIT/cédula del cliente"),
+    cufe: Optional[str] = Query(default=None, description="CUFE exacto"),
+    number_prefix: Optional[str] = Query(default=None, min_length=1, max_length=30, description="Inicio del número (ej: SETP-99)"),
+    cursor: Optional[str] = Query(default=None, description="next_cursor de la página anterior"),
+    limit: int = Query(default=50, ge=1, le=200),
+    include_total: bool = Query(default=False, description="Incluir el total estimado"),
+    current_tenant: Tenant = Depends(get_current_tenant),
+    db: AsyncSession = Depends(get_session)
+):
+    """
+    Facturas del tenant, de la más reciente a la más antigua.
+    
+    Paginación por cursor (keyset): para la página siguiente enviar
+    next_cursor con los mismos filtros. Con include_total se agrega un total
+    estimado (exacto si hay pocas facturas; ver services/invoice_listing.py).
+    """
+    filters = InvoiceFilters(
+        status=status,
+        document_type=document_type,
+        date_from=to_naive_utc(date_from),
+        date_to=to_naive_utc(date_to),
+        customer_nit=customer_nit,
+        cufe=cufe,
+        number_prefix=number_prefix
+    )
+    try:
+        rows, next_cursor = await list_invoices(db, current_tenant.id, filters, cursor=cursor, limit=limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    
+    response = InvoiceListResponse(
+        items=[InvoiceListItem(**{**row._mapping, "number": row.number or None}) for row in rows],
+        limit=limit,
+        next_cursor=next_cursor
+    )
+    if include_total:
+        response.estimated_total, response.total_is_exact = await estimate_count(db, current_tenant.id, filters)
+    return response
+
+
 @router.get(
     "/invoices/{invoice_number}",
     summary="Consultar factura"
@@ -587,7 +1234,7 @@ async def get_invoice(
             raise HTTPException(status_code=404, detail="Factura no encontrada")
 
         factory = FactusServiceFactory(db)
-        async with await factory.create_service_for_tenant(current_tenant.id) as service:
+        async with await factory.create_service_for_tenant(current_tenant) as service:
             return await service.get_invoice(invoice_number)
             
     except FactusAPIError as e:
@@ -600,32 +1247,120 @@ async def get_invoice(
 )
 async def get_invoice_pdf(
     invoice_number: str,
+    request: Request,
     current_tenant: Tenant = Depends(get_current_tenant),
     db: AsyncSession = Depends(get_session)
 ):
     """
     Obtiene la URL para descargar el PDF de la factura.
+    
+    Responde desde la fila local, sin consultar Factus: pdf_url es el enlace
+    público de Factus y download_url el archivo del almacén local (None
+    mientras no se haya descargado; en ese caso se programa la descarga).
     """
-    try:
-        stmt = select(Invoice).where(
-            Invoice.number == invoice_number,
-            Invoice.tenant_id == current_tenant.id
-        )
-        result = await db.exec(stmt)
-        invoice = result.first()
-        
-        if not invoice:
-            raise HTTPException(status_code=404, detail="Factura no encontrada")
+    invoice, document = await _invoice_document(db, current_tenant.id, invoice_number, "pdf")
+    
+    store = get_document_store()
+    download_url = None
+    if document is not None and document.status == STORED and store.locate(document.sha256) is not None:
+        download_url = str(request.url_for("get_invoice_file", invoice_number=invoice_number, kind="pdf"))
+    else:
+        store.request(invoice, document)
+    
+    if not invoice.pdf_url and not download_url:
+        raise HTTPException(status_code=404, detail="PDF no disponible")
+    return {"pdf_url": invoice.pdf_url, "download_url": download_url}
 
-        factory = FactusServiceFactory(db)
-        async with await factory.create_service_for_tenant(current_tenant.id) as service:
-            pdf_url = await service.download_invoice_pdf(invoice_number)
-            if not pdf_url:
-                raise HTTPException(status_code=404, detail="PDF no disponible")
-            return {"pdf_url": pdf_url}
-            
-    except FactusAPIError as e:
-        raise HTTPException(status_code=e.status_code or 500, detail=str(e))
+
+@router.get(
+    "/invoices/{invoice_number}/files/{kind}",
+    summary="Descargar el PDF o XML de la factura"
+)
+async def get_invoice_file(
+    invoice_number: str,
+    kind: Literal["pdf", "xml"],
+    request: Request,
+    current_tenant: Tenant = Depends(get_current_tenant),
+    db: AsyncSession = Depends(get_session)
+):
+    """
+    Sirve el PDF o el XML de la factura desde el almacén local (sin Factus).
+    
+    Soporta Range (206), If-Range y GET condicional (If-None-Match con el
+    SHA-256 del contenido, If-Modified-Since -> 304). Si el archivo aún no
+    se ha descargado responde 202 con Retry-After y programa la descarga.
+    """
+    invoice, document = await _invoice_document(db, current_tenant.id, invoice_number, kind)
+    
+    store = get_document_store()
+    located = None
+    if document is not None and document.status == STORED:
+        located = store.locate(document.sha256)
+    
+    if located is None:
+        if store.request(invoice, document):
+            retry_after = max(1, int(get_settings().document_store_fetch_delay_seconds))
+            return JSONResponse(
+                status_code=202,
+                content={"detail": f"{kind.upper()} en descarga, reintente en unos segundos"},
+                headers={"Retry-After": str(retry_after)}
+            )
+        raise HTTPException(status_code=404, detail=f"{kind.upper()} no disponible")
+    
+    path, stat = located
+    etag = f'"{document.sha256}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    
+    if _not_modified(request, etag, stat.st_mtime):
+        store.not_modified += 1
+        return Response(status_code=304, headers=headers)
+    
+    store.served += 1
+    return FileResponse(
+        path,
+        media_type=document.content_type,
+        filename=f"{invoice_number}.{kind}",
+        content_disposition_type="inline" if kind == "pdf" else "attachment",
+        stat_result=stat,
+        headers=headers
+    )
+
+
+async def _invoice_document(
+    db: AsyncSession,
+    tenant_id: int,
+    invoice_number: str,
+    kind: str
+) -> Tuple[Invoice, Optional[InvoiceDocument]]:
+    """Factura del tenant y su documento del almacén local (una consulta)."""
+    stmt = select(Invoice, InvoiceDocument).outerjoin(
+        InvoiceDocument,
+        (InvoiceDocument.invoice_id == Invoice.id) & (InvoiceDocument.kind == kind)
+    ).where(
+        Invoice.number == invoice_number,
+        Invoice.tenant_id == tenant_id
+    )
+    result = await db.exec(stmt)
+    row = result.first()
+    
+    if not row:
+        raise HTTPException(status_code=404, detail="Factura no encontrada")
+    return row
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """True si el cliente ya tiene esta versión (If-None-Match o If-Modified-Since)."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return if_none_match.strip() == "*" or etag in if_none_match
+    
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
 
 
 # =============================================================================
@@ -642,39 +1377,98 @@ async def get_invoice_pdf(
 )
 async def get_invoice_ticket_data(
     invoice_number: str,
+    request: Request,
     current_tenant: Tenant = Depends(get_current_tenant),
     db: AsyncSession = Depends(get_session)
 ):
     """
     Retorna un JSON optimizado para imprimir en tirilla térmica (80mm).
     Incluye datos del restaurante, resolución, ítems simplificados y desglose de impuestos.
+    
+    La tirilla se materializa al crear/validar la factura y las reimpresiones
+    se sirven desde un cache en memoria. Responde con ETag; si el cliente
+    envía If-None-Match con la misma versión responde 304 sin cuerpo.
     """
-    # 1. Obtener Factura + Tenant (Restaurant -> Tenant)
-    stmt = (
-        select(Invoice, Tenant)
-        .join(Tenant, Invoice.tenant_id == Tenant.id)
-        .where(
-            Invoice.number == invoice_number,
-            Invoice.tenant_id == current_tenant.id
-        )
+    body, etag = await _ticket_body(db, current_tenant, invoice_number)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        get_ticket_cache().not_modified += 1
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@router.get(
+    "/invoices/{invoice_number}/ticket.escpos",
+    summary="Tirilla lista para impresora térmica (ESC/POS)"
+)
+async def get_invoice_ticket_escpos(
+    invoice_number: str,
+    request: Request,
+    columns: Optional[int] = Query(default=None, ge=32, le=64, description="Caracteres por línea (48 = 80 mm)"),
+    current_tenant: Tenant = Depends(get_current_tenant),
+    db: AsyncSession = Depends(get_session)
+):
+    """
+    Retorna los bytes ESC/POS de la tirilla (mismo contenido que ticket-data)
+    para enviarlos directo a la impresora, con el QR nativo de la factura.
+    
+    El renderizado se cachea por factura y versión de la tirilla; responde
+    con ETag y 304 igual que ticket-data.
+    """
+    columns = columns or get_settings().ticket_printer_columns
+    body, etag = await _ticket_body(db, current_tenant, invoice_number)
+    
+    escpos_etag = f'"{etag.strip(chr(34))}-{columns}"'
+    headers = {"ETag": escpos_etag, "Cache-Control": "private, no-cache"}
+    if escpos_etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    
+    rendered = get_escpos_cache().get_or_render(
+        current_tenant.id, invoice_number, etag, columns, lambda: json.loads(body)
     )
-    result = await db.exec(stmt)
-    record = result.first()
+    headers["Content-Disposition"] = f'inline; filename="{invoice_number}.escpos"'
+    return Response(content=rendered, media_type="application/octet-stream", headers=headers)
+
+
+async def _ticket_body(db: AsyncSession, tenant: Tenant, invoice_number: str) -> Tuple[bytes, str]:
+    """(JSON, ETag) de la tirilla: del cache o de la tirilla guardada en la factura."""
+    cache = get_ticket_cache()
+    cached = cache.get(tenant, invoice_number)
     
-    if not record:
-        raise HTTPException(status_code=404, detail="Factura no encontrada")
+    if cached is None:
+        # Obtener Factura (el Tenant ya viene de la autenticación, sin JOIN)
+        stmt = select(Invoice).where(
+            Invoice.number == invoice_number,
+            Invoice.tenant_id == tenant.id
+        )
+        result = await db.exec(stmt)
+        invoice = result.first()
         
-    invoice, tenant = record
-    
-    # 2. Obtener Resolución (asociada a la factura o activa del tenant)
-    # Intentamos buscar la resolución por el prefijo de la factura
-    prefix = ""
-    # Si la factura tiene prefijo (ej: SETT-123), extraerlo
-    if "-" in invoice.number:
-        prefix = invoice.number.split("-")[0]
+        if not invoice:
+            raise HTTPException(status_code=404, detail="Factura no encontrada")
         
+        # Facturas sin tirilla guardada (anteriores o creadas en otro
+        # proceso sin el rango en memoria): se calcula una vez y se guarda
+        if not is_current(invoice.ticket_data):
+            items = await load_invoice_items(db, invoice)
+            resolution = await _ticket_resolution(db, tenant.id, invoice.number)
+            invoice.ticket_data = build_ticket_document(invoice, items, resolution)
+            invoice.ticket_version = (invoice.ticket_version or 0) + 1
+            db.add(invoice)
+            await db.commit()
+        
+        body = render_ticket(tenant, invoice.ticket_data)
+        cached = body, cache.set(tenant, invoice_number, body)
+    return cached
+
+
+async def _ticket_resolution(db: AsyncSession, tenant_id: int, invoice_number: str) -> Optional[BillingResolution]:
+    """Resolución de la tirilla por el prefijo del número (la activa o la más reciente)."""
+    # Si la factura tiene prefijo (ej: SETT-123), extraerlo
+    prefix = invoice_number.split("-")[0] if "-" in invoice_number else ""
+    
     stmt_res = select(BillingResolution).where(
-        BillingResolution.tenant_id == tenant.id,
+        BillingResolution.tenant_id == tenant_id,
         BillingResolution.prefix == prefix,
         BillingResolution.is_active == True # Preferir la activa
     )
@@ -683,134 +1477,10 @@ async def get_invoice_ticket_data(
     
     # Si no se encuentra exacta (ej: histórica), buscar cualquiera que coincida con prefijo
     if not resolution and prefix:
-         stmt_res_hist = select(BillingResolution).where(
-            BillingResolution.tenant_id == tenant.id,
+        stmt_res_hist = select(BillingResolution).where(
+            BillingResolution.tenant_id == tenant_id,
             BillingResolution.prefix == prefix
-         ).order_by(BillingResolution.created_at.desc())
-         result_res_hist = await db.exec(stmt_res_hist)
-         resolution = result_res_hist.first()
-
-    # 3. Procesar respuesta de API guardada para extraer items e impuestos
-    # Esto evita tener que consultar a Factus de nuevo
-    import json
-    api_data = {}
-    if invoice.api_response:
-        try:
-            # Limpiar posible formato raro si se guardó como string de un dict stringificado
-            clean_resp = invoice.api_response.replace("'", "\"").replace("None", "null")
-            try:
-                raw_data = json.loads(invoice.api_response)
-            except:
-                # Fallback simple
-                raw_data = json.loads(clean_resp)
-                
-            # Factus estructura: data -> bill -> items
-            if isinstance(raw_data, dict):
-                if "data" in raw_data:
-                    api_data = raw_data["data"].get("bill", raw_data.get("data", {}))
-                elif "bill" in raw_data: # Directamente bill
-                    api_data = raw_data["bill"]
-                else:
-                    api_data = raw_data
-        except Exception as e:
-             logger.warning(f"No se pudo parsear api_response de factura {invoice_number}: {e}")
-
-    # Extraer items simplificados
-    items = []
-    total_iva = 0
-    total_ico = 0
-    subtotal = 0
-    total = 0
-    
-    raw_items = api_data.get("items", [])
-    
-    for item in raw_items:
-        # Calcular totales
-        price_val = item.get("price", 0)
-        qty_val = item.get("quantity", 0)
-        
-        try:
-            price = float(price_val)
-            qty = float(qty_val)
-        except:
-            price = 0.0
-            qty = 0.0
-            
-        line_total = price * qty
-        subtotal += line_total
-        
-        # Procesar impuestos del item
-        taxes = item.get("taxes", [])
-        for tax in taxes:
-             try:
-                 amount = float(tax.get("tax_amount", 0))
-             except:
-                 amount = 0.0
-                 
-             tax_name = tax.get("name", "")
-             tax_id = tax.get("tax_id")
-             
-             # Sumarizadores simples
-             if "IVA" in str(tax_name).upper() or tax_id == 1:
-                 total_iva += amount
-             elif "CONS" in str(tax_name).upper() or "ICO" in str(tax_name).upper() or tax_id == 22:
-                 total_ico += amount
-        
-        items.append({
-            "name": item.get("product", {}).get("name") if isinstance(item.get("product"), dict) else item.get("name", "Item"),
-            "qty": qty,
-            "price": price,
-            "total": line_total
-        })
-        
-    # Totales finales (usar los de la factura si están disponibles para precisión)
-    # Si api_data tiene totales, usarlos
-    if "payment" in api_data and isinstance(api_data.get("payment"), dict): 
-         try:
-            total = float(api_data.get("payment", {}).get("payable_amount", 0) or 0)
-         except:
-            total = subtotal + total_iva + total_ico
-    else:
-         total = subtotal + total_iva + total_ico
-
-    resolution_data = {}
-    if resolution:
-        resolution_data = {
-            "number": resolution.resolution_number,
-            "date": str(resolution.resolution_date),
-            "prefix": resolution.prefix,
-            "from": resolution.from_number,
-            "to": resolution.to_number
-        }
-    
-    # Dirección del restaurante (hardcoded por ahora si no está en modelo)
-    # Si el modelo Restaurant tuviera address, usarla.
-    # Por ahora "Dirección Principal"
-    
-    qr_code = invoice.qr_url
-    if not qr_code and "qr" in api_data:
-        qr_code = api_data["qr"]
-    
-    return {
-        "restaurant": {
-            "name": tenant.name,
-            "nit": tenant.nit,
-            "address": "Dirección registrada" 
-        },
-        "invoice": {
-            "number": invoice.number,
-            "date": str(invoice.created_at),
-            "cufe": invoice.cufe,
-            "qr_code": qr_code,
-            "payment_form": api_data.get("payment_form", {}).get("name", "Contado") if isinstance(api_data.get("payment_form"), dict) else "Contado"
-        },
-        "resolution": resolution_data,
-        "items": items,
-        "totals": {
-            "subtotal": subtotal,
-            "total_iva": total_iva,
-            "total_ico": total_ico,
-            "total": total
-        },
-        "footer_message": "Facturación Electrónica DIAN"
-    }
+        ).order_by(BillingResolution.created_at.desc())
+        result_res_hist = await db.exec(stmt_res_hist)
+        resolution = result_res_hist.first()
+    return resolution
@@ -345,10 +345,10 @@ class InvoiceCreateSchema(BaseModel):
     model_config = ConfigDict(str_strip_whitespace=True)
     
     # ID del rango de numeración autorizado por la DIAN
-    numbering_range_id: int = Field(
-        ...,
+    numbering_range_id: Optional[int] = Field(
+        default=None,
         gt=0,
-        description="ID del rango de numeración (resolución DIAN)"
+        description="ID del rango de numeración (resolución DIAN); si se omite se usa el rango activo del tenant"
     )
     
     # Código de referencia interno (ID de la orden)
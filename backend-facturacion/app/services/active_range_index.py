@@ -0,0 +1,358 @@
+"""
+Índice en memoria del rango de numeración activo por tenant.
+
+Las ventas ya no necesitan enviar numbering_range_id: el servidor usa el rango
+activo del tenant, leído una vez del espejo local (billing_resolutions) y
+mantenido en memoria con el uso que registra el asignador de consecutivos.
+
+- Cuenta las ventas en curso por rango: una ráfaga no envía a Factus más
+  facturas de las que le quedan al rango
+- Avisa (log y /metrics) cuando el uso del rango cruza los umbrales
+  configurados (ej: 80 %, 90 %, 95 %)
+- Si el rango activo se agota o vence, cambia al siguiente rango válido y
+  sincronizado en una sola transacción, antes de enviar la factura a Factus
+  (en vez de que Factus la rechace en plena hora pico)
+- Se invalida al sincronizar o activar rangos; entre procesos, por TTL
+
+Los rangos de notas crédito (prefijo NC) no participan.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import or_, select, update
+
+from app.core.config import Settings, get_settings
+from app.db.models import BillingResolution
+
+logger = logging.getLogger(__name__)
+
+
+# Prefijo de los rangos de notas crédito (ver POST /credit-notes)
+CREDIT_NOTE_PREFIX = "NC"
+
+
+def _is_invoice_range(resolution: BillingResolution) -> bool:
+    return not (resolution.prefix or "").upper().startswith(CREDIT_NOTE_PREFIX)
+
+
+def is_usable(resolution: BillingResolution, today: Optional[date] = None) -> bool:
+    """Rango con números disponibles y vigente (sin importar si está activo)."""
+    if resolution.is_expired:
+        return False
+    if resolution.expiration_date and resolution.expiration_date < (today or date.today()):
+        return False
+    return resolution.remaining_numbers > 0
+
+
+class _TenantRanges:
+    """Copia en memoria (desligada de la sesión) de los rangos de un tenant."""
+
+    def __init__(self, resolutions: List[BillingResolution], ttl_seconds: float):
+        self.ranges: Dict[int, BillingResolution] = {r.factus_id: r for r in resolutions}
+        self.expires_at = time.monotonic() + ttl_seconds
+
+    @property
+    def fresh(self) -> bool:
+        return time.monotonic() < self.expires_at
+
+    def active(self) -> Optional[BillingResolution]:
+        """Rango de facturas activo (aunque esté agotado o vencido)."""
+        for resolution in self.ranges.values():
+            if resolution.is_active and _is_invoice_range(resolution):
+                return resolution
+        return None
+
+    def next_usable(self, available: Callable[[BillingResolution], int], count: int) -> Optional[BillingResolution]:
+        """Siguiente rango sincronizado con `count` números disponibles: primero el que vence antes."""
+        candidates = [
+            r for r in self.ranges.values()
+            if _is_invoice_range(r) and r.last_synced_at and available(r) >= count
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda r: (r.expiration_date or date.max, r.number_from or 0, r.factus_id))
+
+
+class ActiveRangeIndex:
+    """
+    Resuelve el rango con el que se factura cada venta.
+
+    Un lock por tenant evita que dos ventas simultáneas del mismo proceso
+    hagan el cambio de rango a la vez; entre procesos el cambio es una
+    actualización condicional (solo gana quien desactiva el rango agotado).
+    """
+
+    def __init__(self, settings: Optional[Settings] = None):
+        self._settings = settings or get_settings()
+        self._tenants: Dict[int, _TenantRanges] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+
+        # Ventas en curso por rango (factus_id): resueltas y aún sin número
+        self._in_flight: Dict[int, int] = {}
+
+        # Mayor umbral de uso ya avisado por rango (factus_id)
+        self._warned: Dict[int, float] = {}
+
+        # Métricas
+        self.loads = 0
+        self.failovers = 0
+        self.threshold_warnings = 0
+
+    # =========================================================================
+    # RESOLUCIÓN
+    # =========================================================================
+
+    async def resolve(
+        self,
+        session,
+        tenant_id: int,
+        requested: Optional[int] = None,
+        count: int = 1
+    ) -> int:
+        """
+        Devuelve el factus_id del rango con el que se debe facturar.
+
+        Las `count` ventas quedan en curso en ese rango hasta que el llamador
+        invoque release() (siempre, en un finally).
+
+        Args:
+            session: Sesión de la petición. Solo lee el espejo local, salvo
+                en el cambio de rango, que se confirma con ella (antes de
+                reclamar la orden)
+            tenant_id: ID del tenant
+            requested: numbering_range_id enviado por el cliente (opcional).
+                Se respeta si es del tenant y está vigente; si está agotado o
+                vencido se usa el rango activo
+            count: Facturas que se enviarán con el rango (lotes)
+
+        Raises:
+            HTTPException: 400 rango desconocido, 403 rango de otro tenant,
+                409 el tenant no tiene ningún rango vigente
+        """
+        ranges = await self._get(session, tenant_id)
+
+        if requested is not None:
+            resolution = ranges.ranges.get(requested)
+            if resolution is None:
+                ranges = await self._check_requested(session, tenant_id, requested)
+                resolution = ranges.ranges[requested]
+            if self._available(resolution) >= count or not self._settings.numbering_range_failover_enabled:
+                return self._acquire(requested, count)
+            logger.warning(
+                f"Rango {requested} del tenant {tenant_id} agotado o vencido: se usa el rango activo"
+            )
+
+        active = ranges.active()
+        if active is None or self._available(active) < count:
+            if self._settings.numbering_range_failover_enabled:
+                active = await self._failover(session, tenant_id, active, count)
+            if active is None or self._available(active) < count:
+                raise HTTPException(
+                    status_code=409,
+                    detail="No hay un rango de numeración vigente. Sincronice los rangos y active uno."
+                )
+
+        self._check_thresholds(tenant_id, active)
+        return self._acquire(active.factus_id, count)
+
+    def release(self, factus_id: int, count: int = 1) -> None:
+        """Termina `count` ventas en curso del rango (con o sin factura)."""
+        remaining = self._in_flight.get(factus_id, 0) - count
+        if remaining > 0:
+            self._in_flight[factus_id] = remaining
+        else:
+            self._in_flight.pop(factus_id, None)
+
+    def _acquire(self, factus_id: int, count: int) -> int:
+        self._in_flight[factus_id] = self._in_flight.get(factus_id, 0) + count
+        return factus_id
+
+    def _available(self, resolution: BillingResolution) -> int:
+        """Números que le quedan al rango descontando las ventas en curso (0 si no es vigente)."""
+        if not is_usable(resolution):
+            return 0
+        return resolution.remaining_numbers - self._in_flight.get(resolution.factus_id, 0)
+
+    async def _check_requested(self, session, tenant_id: int, factus_id: int) -> _TenantRanges:
+        """Rango que no está en memoria: desconocido, ajeno o recién sincronizado."""
+        result = await session.execute(
+            select(BillingResolution.tenant_id).where(BillingResolution.factus_id == factus_id)
+        )
+        owner = result.scalar_one_or_none()
+        if owner is None:
+            raise HTTPException(status_code=400, detail="Rango de numeración no encontrado en sistema local")
+        if owner != tenant_id:
+            logger.warning(f"Tenant {tenant_id} intentó usar el rango {factus_id} de otro tenant ({owner})")
+            raise HTTPException(status_code=403, detail="El rango de numeración no pertenece a este comercio")
+        return await self._load(session, tenant_id)
+
+    async def _get(self, session, tenant_id: int) -> _TenantRanges:
+        ranges = self._tenants.get(tenant_id)
+        if ranges is not None and ranges.fresh:
+            return ranges
+        return await self._load(session, tenant_id)
+
+    async def _load(self, session, tenant_id: int) -> _TenantRanges:
+        result = await session.execute(
+            select(BillingResolution).where(BillingResolution.tenant_id == tenant_id)
+        )
+        # Copias desligadas: el índice las actualiza sin tocar la sesión
+        resolutions = [BillingResolution(**r.model_dump()) for r in result.scalars().all()]
+        ranges = _TenantRanges(resolutions, self._settings.numbering_range_index_ttl_seconds)
+        self._tenants[tenant_id] = ranges
+        self.loads += 1
+        return ranges
+
+    # =========================================================================
+    # CAMBIO DE RANGO
+    # =========================================================================
+
+    async def _failover(
+        self,
+        session,
+        tenant_id: int,
+        exhausted: Optional[BillingResolution],
+        count: int
+    ) -> Optional[BillingResolution]:
+        """
+        Activa el siguiente rango vigente en una sola transacción (la de la
+        sesión de la petición: no toma otra conexión del pool mientras las
+        ventas que esperan el lock retienen las suyas).
+
+        Returns:
+            El rango activo tras el cambio (None si no hay ninguno vigente)
+        """
+        lock = self._locks.setdefault(tenant_id, asyncio.Lock())
+        async with lock:
+            ranges = self._tenants.get(tenant_id)
+            active = ranges.active() if ranges else None
+            if active is not None and active is not exhausted and self._available(active) >= count:
+                # Otra venta de este proceso ya hizo el cambio
+                return active
+
+            candidate = ranges.next_usable(self._available, count) if ranges else None
+            if candidate is None:
+                return None
+
+            now = datetime.utcnow()
+            if exhausted is not None:
+                # Solo gana quien desactiva el rango agotado; si otro
+                # proceso ya cambió de rango, se relee el espejo local
+                result = await session.execute(
+                    update(BillingResolution)
+                    .where(BillingResolution.id == exhausted.id, BillingResolution.is_active == True)
+                    .values(is_active=False, updated_at=now)
+                    .execution_options(synchronize_session=False)
+                )
+                if result.rowcount != 1:
+                    await session.commit()
+                    return (await self._load(session, tenant_id)).active()
+
+            await session.execute(
+                update(BillingResolution)
+                .where(
+                    BillingResolution.tenant_id == tenant_id,
+                    or_(
+                        BillingResolution.prefix.is_(None),
+                        ~BillingResolution.prefix.like(f"{CREDIT_NOTE_PREFIX}%"),
+                    ),
+                    or_(BillingResolution.is_active == True, BillingResolution.id == candidate.id),
+                )
+                .values(is_active=(BillingResolution.id == candidate.id), updated_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+
+            for resolution in ranges.ranges.values():
+                if _is_invoice_range(resolution):
+                    resolution.is_active = resolution.id == candidate.id
+
+        self.failovers += 1
+        logger.warning(
+            f"Tenant {tenant_id}: rango {exhausted.factus_id if exhausted else '-'} agotado o vencido, "
+            f"se activó el rango {candidate.prefix or ''} ({candidate.factus_id}) "
+            f"con {candidate.remaining_numbers} números disponibles"
+        )
+        return candidate
+
+    # =========================================================================
+    # USO DEL RANGO
+    # =========================================================================
+
+    def cached_range(self, tenant_id: int, factus_id: int) -> Optional[BillingResolution]:
+        """Copia en memoria de un rango del tenant, sin consultar la BD (None si no está cargado)."""
+        ranges = self._tenants.get(tenant_id)
+        return ranges.ranges.get(factus_id) if ranges else None
+
+    def record_usage(self, tenant_id: int, factus_id: int, last_number: Optional[int]) -> None:
+        """
+        Registra el último consecutivo usado (lo llama el asignador).
+
+        Con last_number=None el rango se marca agotado: la siguiente venta
+        hace el cambio de rango antes de llamar a Factus.
+        """
+        ranges = self._tenants.get(tenant_id)
+        resolution = ranges.ranges.get(factus_id) if ranges else None
+        if resolution is None:
+            return
+
+        if last_number is None:
+            resolution.current_number = resolution.number_to
+        else:
+            resolution.current_number = max(resolution.current_number or 0, last_number)
+        self._check_thresholds(tenant_id, resolution)
+
+    def _check_thresholds(self, tenant_id: int, resolution: BillingResolution) -> None:
+        """Avisa una vez por cada umbral de uso que cruza el rango."""
+        usage = resolution.usage_percentage
+        crossed = [t for t in self._settings.numbering_range_warning_thresholds if usage >= t]
+        if not crossed or max(crossed) <= self._warned.get(resolution.factus_id, 0.0):
+            return
+
+        self._warned[resolution.factus_id] = max(crossed)
+        self.threshold_warnings += 1
+        logger.warning(
+            f"Rango {resolution.prefix or ''} ({resolution.factus_id}) del tenant {tenant_id} "
+            f"al {usage:.1f}% de uso: quedan {resolution.remaining_numbers} números"
+        )
+
+    def invalidate(self, tenant_id: int) -> None:
+        """Descarta los rangos en memoria de un tenant (al sincronizar o activar)."""
+        self._tenants.pop(tenant_id, None)
+
+    def snapshot(self) -> dict:
+        """Métricas del índice (para /metrics)."""
+        near_exhaustion = []
+        for tenant_id, ranges in self._tenants.items():
+            active = ranges.active()
+            if active is not None and active.factus_id in self._warned:
+                near_exhaustion.append({
+                    "tenant_id": tenant_id,
+                    "factus_id": active.factus_id,
+                    "usage_percentage": round(active.usage_percentage, 1),
+                    "remaining_numbers": active.remaining_numbers,
+                })
+        return {
+            "tenants": len(self._tenants),
+            "loads": self.loads,
+            "failovers": self.failovers,
+            "threshold_warnings": self.threshold_warnings,
+            "near_exhaustion": near_exhaustion,
+        }
+
+
+# Instancia global (singleton)
+_active_range_index: Optional[ActiveRangeIndex] = None
+
+
+def get_active_range_index() -> ActiveRangeIndex:
+    """Obtiene el índice global de rangos activos."""
+    global _active_range_index
+    if _active_range_index is None:
+        _active_range_index = ActiveRangeIndex()
+    return _active_range_index
@@ -3,17 +3,18 @@ Servicio de gestión de rangos de numeración DIAN.
 Implementa sincronización con Factus y consultas multi-tenant.
 """
 
+import asyncio
 import logging
-from datetime import datetime, date
-from typing import List, Optional
+from datetime import datetime, date, timedelta
+from typing import Dict, List, Optional
 
-import httpx
+from fastapi import HTTPException
 from sqlalchemy import select, and_
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import Settings, get_settings
-from app.core.encryption import decrypt_credential
 from app.core.exceptions import FactusAPIError, FactusAuthError
+from app.db.database import async_session_maker
 from app.db.models import Tenant, BillingResolution
 from app.schemas.billing_ranges import (
     BillingRangeFactusResponse,
@@ -21,8 +22,12 @@ from app.schemas.billing_ranges import (
     ActiveRangeResponse,
     SyncRangesResponse,
 )
+from app.services.active_range_index import get_active_range_index
 from app.services.factus.client import FactusClient
+from app.services.factus.factory import FactusServiceFactory
 from app.services.factus.auth import FactusAuthManager
+from app.services.factus.http_pool import get_http_client_registry
+from app.services.number_allocator import reserve_numbers
 
 logger = logging.getLogger(__name__)
 
@@ -125,6 +130,7 @@ class BillingRangeService:
                 created_count += 1
         
         await self._session.commit()
+        get_active_range_index().invalidate(tenant_id)
         
         logger.info(
             f"Sincronización completada: {created_count} creados, {updated_count} actualizados"
@@ -146,34 +152,22 @@ class BillingRangeService:
         """
         Obtiene los rangos desde la API de Factus usando credenciales del tenant.
         
-        IMPORTANTE: Las credenciales están encriptadas en la BD,
-        se desencriptan aquí antes de usarlas.
+        IMPORTANTE: Las credenciales están encriptadas en la BD; la
+        configuración desencriptada se obtiene del cache de la factory.
         """
-        # Desencriptar credenciales sensibles
-        logger.info(f"Desencriptando credenciales de tenant ID={tenant.id}")
         try:
-            decrypted_secret = decrypt_credential(tenant.factus_client_secret)
-            decrypted_password = decrypt_credential(tenant.factus_password)
-            logger.info(f"Credenciales desencriptadas OK: email={tenant.factus_email}")
-        except Exception as e:
-            logger.error(f"Error al desencriptar credenciales: {e}")
+            temp_settings = FactusServiceFactory.get_tenant_settings(tenant)
+        except HTTPException as e:
             raise FactusAPIError(
-                message=f"Error al desencriptar credenciales del tenant: {str(e)}",
+                message=f"Credenciales del tenant no utilizables: {e.detail}",
                 status_code=500
             )
         
-        # Crear settings temporales con credenciales desencriptadas
-        temp_settings = Settings(
-            factus_base_url=self._settings.factus_base_url,
-            factus_client_id=tenant.factus_client_id,
-            factus_client_secret=decrypted_secret,
-            factus_email=tenant.factus_email,
-            factus_password=decrypted_password,
+        http_client = get_http_client_registry().get_client(
+            tenant.id, temp_settings.factus_base_url
         )
-        
-        async with httpx.AsyncClient() as http_client:
-            client = FactusClient(http_client, temp_settings)
-            response = await client.get("/v1/numbering-ranges")
+        client = FactusClient(http_client, temp_settings)
+        response = await client.get("/v1/numbering-ranges")
         
         # Factus tiene una estructura anidada con paginación:
         # { "data": { "data": [...rangos...], "page": 1, ... } }
@@ -245,8 +239,8 @@ class BillingRangeService:
             factus_id=data.id,
             resolution_number=data.resolution_number,
             prefix=data.prefix,
-            from_number=data.from_number,
-            to_number=data.to_number,
+            number_from=data.from_number,
+            number_to=data.to_number,
             current_number=data.current,
             resolution_date=self._parse_date(data.resolution_date),
             expiration_date=self._parse_date(data.end_date),
@@ -269,8 +263,8 @@ class BillingRangeService:
         """Actualiza un rango existente con datos de Factus."""
         existing.resolution_number = data.resolution_number
         existing.prefix = data.prefix
-        existing.from_number = data.from_number
-        existing.to_number = data.to_number
+        existing.number_from = data.from_number
+        existing.number_to = data.to_number
         existing.current_number = data.current
         existing.resolution_date = self._parse_date(data.resolution_date)
         existing.expiration_date = self._parse_date(data.end_date)
@@ -348,6 +342,35 @@ class BillingRangeService:
         resolutions = result.scalars().all()
         return [self._to_internal_schema(r) for r in resolutions]
     
+    async def get_tenant_resolutions(
+        self, 
+        tenant_id: int
+    ) -> List[BillingResolution]:
+        """
+        Obtiene los rangos del tenant desde el espejo local (sin llamar a Factus).
+        
+        Args:
+            tenant_id: ID del tenant (SIEMPRE filtrar por tenant)
+        """
+        result = await self._session.execute(
+            select(BillingResolution).where(
+                BillingResolution.tenant_id == tenant_id
+            ).order_by(BillingResolution.factus_id)
+        )
+        return list(result.scalars().all())
+    
+    def is_stale(self, resolutions: List[BillingResolution]) -> bool:
+        """
+        Indica si el espejo local necesita resincronizarse.
+        Usa la sincronización más reciente: un rango que Factus ya no
+        devuelve no debe forzar resincronizaciones continuas.
+        """
+        synced = [r.last_synced_at for r in resolutions if r.last_synced_at]
+        if not synced:
+            return True
+        max_age = timedelta(seconds=self._settings.numbering_ranges_max_age_seconds)
+        return datetime.utcnow() - max(synced) > max_age
+    
     async def set_active_range(
         self, 
         tenant_id: int,
@@ -375,6 +398,7 @@ class BillingRangeService:
             resolution.updated_at = datetime.utcnow()
         
         await self._session.commit()
+        get_active_range_index().invalidate(tenant_id)
         logger.info(f"Rango {range_id} activado para tenant {tenant_id}")
         return True
     
@@ -386,30 +410,19 @@ class BillingRangeService:
         """
         Incrementa el número actual del rango después de facturar.
         
+        Atómico (UPDATE ... RETURNING): dos facturas concurrentes nunca leen
+        el mismo current_number.
+        
         Args:
             tenant_id: ID del tenant (seguridad)
             range_id: ID del rango
             
         Returns:
-            Nuevo número actual
+            Nuevo número actual (0 si el rango no existe o está agotado)
         """
-        result = await self._session.execute(
-            select(BillingResolution).where(
-                and_(
-                    BillingResolution.id == range_id,
-                    BillingResolution.tenant_id == tenant_id
-                )
-            )
-        )
-        
-        resolution = result.scalar_one_or_none()
-        if resolution:
-            resolution.current_number += 1
-            resolution.updated_at = datetime.utcnow()
-            await self._session.commit()
-            return resolution.current_number
-        
-        return 0
+        reserved = await reserve_numbers(self._session, tenant_id, range_id=range_id)
+        await self._session.commit()
+        return reserved[1] if reserved else 0
     
     # =========================================================================
     # HELPERS
@@ -419,11 +432,8 @@ class BillingRangeService:
         self, 
         tenant_id: int
     ) -> Optional[Tenant]:
-        """Obtiene un tenant por ID."""
-        result = await self._session.execute(
-            select(Tenant).where(Tenant.id == tenant_id)
-        )
-        return result.scalar_one_or_none()
+        """Obtiene un tenant por ID (usa el identity map de la sesión si ya está cargado)."""
+        return await self._session.get(Tenant, tenant_id)
     
     def _has_valid_credentials(self, tenant: Tenant) -> bool:
         """Verifica si el tenant tiene credenciales de Factus."""
@@ -453,8 +463,8 @@ class BillingRangeService:
             factus_id=resolution.factus_id,
             resolution_number=resolution.resolution_number,
             prefix=resolution.prefix,
-            from_number=resolution.from_number,
-            to_number=resolution.to_number,
+            from_number=resolution.number_from,
+            to_number=resolution.number_to,
             current_number=resolution.current_number,
             expiration_date=resolution.expiration_date,
             is_active=resolution.is_active,
@@ -464,6 +474,42 @@ class BillingRangeService:
         )
 
 
+# =============================================================================
+# RESINCRONIZACIÓN EN SEGUNDO PLANO
+# =============================================================================
+
+# Una tarea de resincronización por tenant como máximo
+_resync_tasks: Dict[int, asyncio.Task] = {}
+
+
+def schedule_ranges_resync(tenant_id: int) -> bool:
+    """
+    Resincroniza los rangos de un tenant en segundo plano, con su propia
+    sesión de BD (la de la petición se cierra al responder).
+    
+    Returns:
+        True si se programó una tarea nueva (False si ya había una en curso)
+    """
+    task = _resync_tasks.get(tenant_id)
+    if task is not None and not task.done():
+        return False
+    
+    async def resync() -> None:
+        try:
+            async with async_session_maker() as session:
+                service = BillingRangeService(session, get_settings())
+                result = await service.sync_ranges_from_factus(tenant_id)
+                if not result.success:
+                    logger.warning(f"Resincronización de rangos del tenant {tenant_id} falló: {result.message}")
+        except Exception as e:
+            logger.error(f"Error resincronizando rangos del tenant {tenant_id}: {e}")
+        finally:
+            _resync_tasks.pop(tenant_id, None)
+    
+    _resync_tasks[tenant_id] = asyncio.create_task(resync())
+    return True
+
+
 # =============================================================================
 # FACTORY / DEPENDENCY INJECTION
 # =============================================================================
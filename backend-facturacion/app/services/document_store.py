@@ -0,0 +1,459 @@
+"""
+Almacén local de PDF/XML de facturas.
+
+Antes cada GET /invoices/{number}/pdf consultaba la factura en Factus solo
+para devolver una URL. Ahora los documentos se descargan una vez, en segundo
+plano, y se sirven desde disco:
+- Al crear una factura (y al validarla, por si cambia el contenido) se
+  programa la descarga del PDF y el XML con un pool acotado de workers
+- Los archivos se guardan por SHA-256 ({sha[:2]}/{sha}); el mismo contenido
+  se guarda una sola vez y la fila InvoiceDocument lo relaciona con la factura
+- Tamaño acotado (document_store_max_bytes): al superarlo se eliminan los
+  archivos menos usados (LRU por atime). Un documento eliminado se vuelve a
+  descargar la próxima vez que se pida
+- Las descargas fallidas se reintentan con espera creciente hasta
+  document_store_max_attempts; las pendientes se reencolan al iniciar
+
+El índice LRU vive en memoria y se reconstruye recorriendo el directorio al
+iniciar. Con varios procesos cada uno lleva su propio índice: si un archivo
+desaparece (lo eliminó otro proceso) se trata como no descargado.
+
+Solo facturas (document_type INVOICE): las notas crédito usan otros
+endpoints de Factus.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+
+from app.core.config import Settings, get_settings
+from app.db.database import async_session_maker
+from app.db.models import Invoice, InvoiceDocument, Tenant
+from app.services.factus.factory import FactusServiceFactory
+
+logger = logging.getLogger(__name__)
+
+
+STORED = "STORED"
+FAILED = "FAILED"
+
+# Documentos de cada factura y su tipo de contenido
+DOCUMENT_KINDS = {"pdf": "application/pdf", "xml": "application/xml"}
+
+# Estados de factura sin documentos en Factus (rechazada o aún no enviada).
+# Las creadas guardan el estado que devuelve Factus (ej: "1"), por eso se
+# excluyen estos en lugar de listar los válidos
+NO_DOCUMENT_STATUSES = ("ERROR", "CONTINGENCY")
+
+# Envío en curso: la descarga espera a que Factus responda
+WAITING_STATUSES = ("PENDING", "SUBMITTING")
+
+INVOICE_DOCUMENT = "INVOICE"
+
+
+def is_fetchable(invoice: Invoice) -> bool:
+    """True si la factura tiene (o tendrá pronto) documentos en Factus."""
+    return (
+        invoice.document_type == INVOICE_DOCUMENT
+        and invoice.status not in NO_DOCUMENT_STATUSES
+        and (invoice.status in WAITING_STATUSES or bool(invoice.number))
+    )
+
+
+class DocumentStore:
+    """
+    Archivos de facturas en disco, direccionados por contenido, con descarga
+    en segundo plano y desalojo LRU por tamaño.
+
+    Los ids de factura viajan por una asyncio.Queue en memoria; la BD
+    (InvoiceDocument) es la fuente de verdad del estado de cada descarga.
+    """
+
+    def __init__(
+        self,
+        settings: Optional[Settings] = None,
+        session_maker=async_session_maker,
+    ):
+        self._settings = settings or get_settings()
+        self._session_maker = session_maker
+        self._root = os.path.abspath(self._settings.document_store_path)
+        self._max_bytes = self._settings.document_store_max_bytes
+
+        self._queue: "asyncio.Queue[int]" = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+        self._timers: Set[asyncio.Task] = set()
+
+        # Facturas programadas o en descarga, y las que deben reemplazar lo guardado
+        self._known: Set[int] = set()
+        self._replace: Set[int] = set()
+        self._waits: Dict[int, int] = {}
+
+        # Índice LRU: sha256 -> bytes (el más reciente al final)
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+
+        # Métricas
+        self.scheduled = 0
+        self.fetched = 0
+        self.failed = 0
+        self.deduplicated = 0
+        self.served = 0
+        self.not_modified = 0
+        self.evicted = 0
+
+    @property
+    def running(self) -> bool:
+        """True si los workers de descarga están activos."""
+        return bool(self._workers)
+
+    # =========================================================================
+    # CICLO DE VIDA
+    # =========================================================================
+
+    async def start(self) -> None:
+        """Carga el índice desde disco, reencola las descargas pendientes e inicia los workers."""
+        if self._workers:
+            return
+
+        await asyncio.to_thread(self._scan)
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"document-store-{i}")
+            for i in range(max(1, self._settings.document_store_workers))
+        ]
+        await self.recover()
+        logger.info(
+            f"Almacén de documentos iniciado: {len(self._index)} archivos, "
+            f"{self._total_bytes / 1_048_576:.1f} MB en {self._root}"
+        )
+
+    async def stop(self) -> None:
+        """Detiene workers y descargas programadas."""
+        tasks = list(self._workers) + list(self._timers)
+        if not tasks:
+            return
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        self._workers = []
+        self._timers.clear()
+        self._known.clear()
+        self._replace.clear()
+        logger.info("Almacén de documentos detenido")
+
+    async def recover(self) -> int:
+        """
+        Reencola las facturas con descargas fallidas que aún tienen intentos.
+
+        Returns:
+            Cantidad de facturas programadas
+        """
+        async with self._session_maker() as session:
+            result = await session.execute(
+                select(InvoiceDocument.invoice_id)
+                .where(
+                    InvoiceDocument.status == FAILED,
+                    InvoiceDocument.attempts < self._settings.document_store_max_attempts,
+                )
+                .distinct()
+            )
+            invoice_ids = result.scalars().all()
+
+        count = sum(1 for invoice_id in invoice_ids if self.schedule(invoice_id))
+        if count:
+            logger.info(f"Almacén de documentos: {count} descargas pendientes reencoladas")
+        return count
+
+    # =========================================================================
+    # ARCHIVOS
+    # =========================================================================
+
+    def path_for(self, sha256: str) -> str:
+        """Ruta del archivo con ese contenido."""
+        return os.path.join(self._root, sha256[:2], sha256)
+
+    def _scan(self) -> None:
+        """Reconstruye el índice LRU desde el directorio (orden por último acceso)."""
+        files: List[Tuple[float, str, int]] = []
+        os.makedirs(self._root, exist_ok=True)
+        for directory, _, names in os.walk(self._root):
+            for name in names:
+                path = os.path.join(directory, name)
+                if name.endswith(".tmp"):
+                    # Escritura interrumpida
+                    os.remove(path)
+                    continue
+                if len(name) != 64:
+                    continue
+                stat = os.stat(path)
+                files.append((stat.st_atime, name, stat.st_size))
+
+        self._index.clear()
+        for _, sha256, size in sorted(files):
+            self._index[sha256] = size
+        self._total_bytes = sum(self._index.values())
+        self._evict()
+
+    def _write(self, sha256: str, content: bytes) -> None:
+        # Escritura atómica: archivo temporal + rename
+        path = self.path_for(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    async def put(self, content: bytes) -> str:
+        """Guarda el contenido (si no estaba) y devuelve su SHA-256."""
+        sha256 = hashlib.sha256(content).hexdigest()
+        if self.locate(sha256) is not None:
+            self.deduplicated += 1
+            return sha256
+
+        await asyncio.to_thread(self._write, sha256, content)
+        self._total_bytes += len(content) - self._index.pop(sha256, 0)
+        self._index[sha256] = len(content)
+        self._evict(keep=sha256)
+        return sha256
+
+    def locate(self, sha256: Optional[str]) -> Optional[Tuple[str, os.stat_result]]:
+        """
+        (ruta, stat) del archivo, marcándolo como usado; None si no está en disco.
+        Actualiza solo el atime: Last-Modified (mtime) no cambia entre lecturas.
+        """
+        if not sha256:
+            return None
+        path = self.path_for(sha256)
+        try:
+            stat = os.stat(path)
+            os.utime(path, (time.time(), stat.st_mtime))
+        except FileNotFoundError:
+            if sha256 in self._index:
+                self._total_bytes -= self._index.pop(sha256)
+            return None
+
+        if sha256 not in self._index:
+            # Lo escribió otro proceso
+            self._index[sha256] = stat.st_size
+            self._total_bytes += stat.st_size
+        self._index.move_to_end(sha256)
+        return path, stat
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        """Elimina los archivos menos usados hasta quedar bajo document_store_max_bytes."""
+        while self._total_bytes > self._max_bytes and self._index:
+            sha256, size = next(iter(self._index.items()))
+            if sha256 == keep:
+                # El archivo recién guardado no se elimina aunque no quepa
+                if len(self._index) == 1:
+                    break
+                self._index.move_to_end(sha256)
+                continue
+
+            del self._index[sha256]
+            self._total_bytes -= size
+            try:
+                os.remove(self.path_for(sha256))
+            except FileNotFoundError:
+                pass
+            self.evicted += 1
+
+    # =========================================================================
+    # DESCARGAS
+    # =========================================================================
+
+    def schedule(self, invoice_id: int, replace: bool = False, delay: Optional[float] = None) -> bool:
+        """
+        Programa la descarga del PDF y el XML de una factura.
+
+        Args:
+            invoice_id: Id de la factura
+            replace: volver a descargar aunque ya estén guardados (ej: al validarla)
+            delay: segundos de espera (por defecto document_store_fetch_delay_seconds)
+
+        Returns:
+            False si el almacén no está activo o la factura ya estaba programada
+        """
+        if not self._workers:
+            return False
+        if replace:
+            self._replace.add(invoice_id)
+        if invoice_id in self._known:
+            return False
+
+        self._known.add(invoice_id)
+        self.scheduled += 1
+        if delay is None:
+            delay = self._settings.document_store_fetch_delay_seconds
+        if delay <= 0:
+            self._queue.put_nowait(invoice_id)
+            return True
+
+        async def enqueue_later() -> None:
+            await asyncio.sleep(delay)
+            self._queue.put_nowait(invoice_id)
+
+        task = asyncio.create_task(enqueue_later())
+        self._timers.add(task)
+        task.add_done_callback(self._timers.discard)
+        return True
+
+    def request(self, invoice: Invoice, document: Optional[InvoiceDocument]) -> bool:
+        """
+        Pide ya un documento que no está en disco (GET del archivo).
+
+        Returns:
+            True si habrá descarga; False si el almacén no está activo, la
+            factura no tiene documentos o se agotaron los intentos
+        """
+        if not self._workers or not is_fetchable(invoice):
+            return False
+        if document is not None and document.status == FAILED \
+                and document.attempts >= self._settings.document_store_max_attempts:
+            return False
+        self.schedule(invoice.id, delay=0)
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            invoice_id = await self._queue.get()
+            replace = invoice_id in self._replace
+            self._replace.discard(invoice_id)
+            retry_in: Optional[float] = None
+            try:
+                retry_in = await self._fetch(invoice_id, replace)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Almacén de documentos: error con la factura {invoice_id}: {e}")
+            finally:
+                self._known.discard(invoice_id)
+
+            if invoice_id in self._replace:
+                # Validada mientras se descargaba: se descarga otra vez
+                self.schedule(invoice_id, delay=0)
+            elif retry_in is not None:
+                self.schedule(invoice_id, replace=replace, delay=retry_in)
+
+    async def _fetch(self, invoice_id: int, replace: bool) -> Optional[float]:
+        """
+        Descarga los documentos que falten de una factura.
+
+        Returns:
+            Segundos hasta el siguiente intento, o None si no hay que reintentar
+        """
+        settings = self._settings
+        async with self._session_maker() as session:
+            result = await session.execute(
+                select(Invoice, Tenant)
+                .join(Tenant, Tenant.id == Invoice.tenant_id)
+                .where(Invoice.id == invoice_id)
+            )
+            row = result.first()
+            if row is None:
+                return None
+            invoice, tenant = row
+
+            if not is_fetchable(invoice):
+                return None
+            if invoice.status in WAITING_STATUSES:
+                # Aún no hay respuesta de Factus
+                waits = self._waits.get(invoice_id, 0) + 1
+                if waits >= settings.document_store_max_attempts:
+                    self._waits.pop(invoice_id, None)
+                    return None
+                self._waits[invoice_id] = waits
+                return settings.document_store_retry_seconds
+            self._waits.pop(invoice_id, None)
+
+            result = await session.execute(
+                select(InvoiceDocument).where(InvoiceDocument.invoice_id == invoice.id)
+            )
+            documents = {document.kind: document for document in result.scalars().all()}
+
+            pending = []
+            for kind in DOCUMENT_KINDS:
+                document = documents.get(kind)
+                if document is None:
+                    pending.append(InvoiceDocument(
+                        invoice_id=invoice.id,
+                        tenant_id=invoice.tenant_id,
+                        kind=kind,
+                        content_type=DOCUMENT_KINDS[kind],
+                    ))
+                elif replace or (document.status == STORED and not os.path.exists(self.path_for(document.sha256))):
+                    pending.append(document)
+                elif document.status == FAILED and document.attempts < settings.document_store_max_attempts:
+                    pending.append(document)
+            if not pending:
+                return None
+
+            attempts = 0
+            factory = FactusServiceFactory(session)
+            async with await factory.create_service_for_tenant(tenant) as service:
+                for document in pending:
+                    try:
+                        content, file_name = await service.fetch_invoice_document(invoice.number, document.kind)
+                        document.sha256 = await self.put(content)
+                        document.size = len(content)
+                        document.file_name = file_name
+                        document.status = STORED
+                        document.attempts = 0
+                        document.last_error = None
+                        document.fetched_at = datetime.utcnow()
+                        self.fetched += 1
+                    except Exception as e:
+                        # Un reemplazo fallido conserva el archivo anterior
+                        if document.status != STORED or not os.path.exists(self.path_for(document.sha256)):
+                            document.status = FAILED
+                        document.attempts += 1
+                        document.last_error = str(e)[:500]
+                        attempts = max(attempts, document.attempts)
+                        self.failed += 1
+                        logger.warning(
+                            f"Almacén de documentos: {document.kind.upper()} de {invoice.number} "
+                            f"no descargado (intento {document.attempts}): {e}"
+                        )
+                    session.add(document)
+            await session.commit()
+
+        if attempts and attempts < settings.document_store_max_attempts:
+            return settings.document_store_retry_seconds * attempts
+        return None
+
+    def snapshot(self) -> dict:
+        """Estado para /metrics."""
+        return {
+            "running": self.running,
+            "files": len(self._index),
+            "bytes": self._total_bytes,
+            "max_bytes": self._max_bytes,
+            "queued": self._queue.qsize(),
+            "scheduled": self.scheduled,
+            "fetched": self.fetched,
+            "failed": self.failed,
+            "deduplicated": self.deduplicated,
+            "served": self.served,
+            "not_modified": self.not_modified,
+            "evicted": self.evicted,
+        }
+
+
+# Instancia global (singleton)
+_document_store: Optional[DocumentStore] = None
+
+
+def get_document_store() -> DocumentStore:
+    """Obtiene la instancia global del almacén de documentos."""
+    global _document_store
+    if _document_store is None:
+        _document_store = DocumentStore()
+    return _document_store
@@ -0,0 +1,318 @@
+"""
+Renderizado ESC/POS de tirillas para impresoras térmicas de 80 mm.
+
+Convierte el JSON de ticket-data en los bytes que se envían tal cual a la
+impresora (sin depender del navegador del terminal de caja):
+- Texto en la página de códigos PC850 (tildes, ñ, ¡ ¿)
+- 48 columnas con la fuente A (576 puntos); configurable
+- QR nativo de la impresora (GS ( k) con qr_url o, si no hay, la URL de
+  consulta de la DIAN con el CUFE
+- Corte parcial al final
+
+Python puro y determinista: los mismos datos producen los mismos bytes
+(ver scripts/test_escpos.py y su fixture).
+"""
+
+import logging
+import unicodedata
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+# =============================================================================
+# COMANDOS ESC/POS
+# =============================================================================
+
+ESC = b"\x1b"
+GS = b"\x1d"
+LF = b"\n"
+
+INIT = ESC + b"@"
+CODEPAGE_PC850 = ESC + b"t\x02"
+ALIGN_LEFT = ESC + b"a\x00"
+ALIGN_CENTER = ESC + b"a\x01"
+BOLD_ON = ESC + b"E\x01"
+BOLD_OFF = ESC + b"E\x00"
+SIZE_NORMAL = GS + b"!\x00"
+SIZE_DOUBLE = GS + b"!\x11"         # doble alto y ancho
+SIZE_DOUBLE_HEIGHT = GS + b"!\x01"
+CUT = GS + b"V\x42\x03"             # avanza 3 líneas y corte parcial
+
+ENCODING = "cp850"
+
+# URL de consulta de documentos de la DIAN (QR cuando Factus no envía uno)
+DIAN_QR_URL = "https://catalogo-vpfe.dian.gov.co/document/searchqr?documentkey={cufe}"
+
+# Límite de datos del QR (modelo 2, corrección M)
+QR_MAX_BYTES = 2300
+
+
+def _encode(text: str) -> bytes:
+    """Texto en PC850; los caracteres sin equivalente pierden la tilde o quedan como '?'."""
+    try:
+        return text.encode(ENCODING)
+    except UnicodeEncodeError:
+        chars = []
+        for char in text:
+            try:
+                chars.append(char.encode(ENCODING))
+            except UnicodeEncodeError:
+                ascii_char = unicodedata.normalize("NFKD", char).encode("ascii", "ignore")
+                chars.append(ascii_char or b"?")
+        return b"".join(chars)
+
+
+def _qr_block(data: str, module_size: int = 6) -> bytes:
+    """QR nativo (GS ( k): modelo 2, tamaño de módulo, corrección M, guardar e imprimir."""
+    payload = data.encode("ascii", "ignore")[:QR_MAX_BYTES]
+    length = len(payload) + 3
+    return b"".join([
+        GS + b"(k\x04\x00\x31\x41\x32\x00",                     # modelo 2
+        GS + b"(k\x03\x00\x31\x43" + bytes([module_size]),      # tamaño del módulo
+        GS + b"(k\x03\x00\x31\x45\x31",                         # corrección M
+        GS + b"(k" + bytes([length % 256, length // 256]) + b"\x31\x50\x30" + payload,
+        GS + b"(k\x03\x00\x31\x51\x30",                         # imprimir
+    ])
+
+
+# =============================================================================
+# FORMATO
+# =============================================================================
+
+def format_money(value: Any) -> str:
+    """Pesos colombianos: $49.150 (centavos solo si los hay: $1.234,50)."""
+    amount = Decimal(str(value or 0)).quantize(Decimal("0.01"))
+    integer, cents = divmod(abs(amount), 1)
+    text = f"{int(integer):,}".replace(",", ".")
+    if cents:
+        text += f",{int(cents * 100):02d}"
+    return f"{'-' if amount < 0 else ''}${text}"
+
+
+def _format_qty(value: Any) -> str:
+    quantity = Decimal(str(value or 0)).normalize()
+    return f"{quantity:f}"
+
+
+def _wrap(text: str, width: int) -> List[str]:
+    """Parte el texto en líneas de `width` (por palabras; corta las palabras largas)."""
+    lines: List[str] = []
+    current = ""
+    for word in str(text or "").split():
+        while len(word) > width:
+            if current:
+                lines.append(current)
+                current = ""
+            lines.append(word[:width])
+            word = word[width:]
+        if not current:
+            current = word
+        elif len(current) + 1 + len(word) <= width:
+            current += " " + word
+        else:
+            lines.append(current)
+            current = word
+    if current:
+        lines.append(current)
+    return lines or [""]
+
+
+def _pair(left: str, right: str, width: int) -> str:
+    """Texto a la izquierda y valor a la derecha en la misma línea."""
+    space = width - len(right)
+    if space <= len(left):
+        left = left[:max(0, space - 1)]
+    return left.ljust(space) + right
+
+
+def qr_content(invoice: Dict[str, Any]) -> Optional[str]:
+    """Datos del QR: qr_code de la factura o la consulta DIAN por CUFE."""
+    qr = invoice.get("qr_code")
+    if qr and not str(qr).startswith("data:"):
+        return str(qr)
+    if invoice.get("cufe"):
+        return DIAN_QR_URL.format(cufe=invoice["cufe"])
+    return None
+
+
+# =============================================================================
+# RENDERIZADO
+# =============================================================================
+
+def render_escpos(ticket: Dict[str, Any], columns: int = 48) -> bytes:
+    """
+    Bytes ESC/POS de una tirilla (el JSON de GET /invoices/{number}/ticket-data).
+
+    Args:
+        ticket: datos de la tirilla (restaurant, invoice, resolution, items, totals, footer_message)
+        columns: caracteres por línea con la fuente A (48 en 80 mm, 32 en 58 mm)
+    """
+    restaurant = ticket.get("restaurant") or {}
+    invoice = ticket.get("invoice") or {}
+    resolution = ticket.get("resolution") or {}
+    totals = ticket.get("totals") or {}
+    rule = "-" * columns
+    out: List[bytes] = [INIT, CODEPAGE_PC850]
+
+    def line(text: str = "") -> None:
+        out.append(_encode(text) + LF)
+
+    def lines(text: str) -> None:
+        for part in _wrap(text, columns):
+            line(part)
+
+    # Encabezado
+    out += [ALIGN_CENTER, SIZE_DOUBLE, BOLD_ON]
+    for part in _wrap(restaurant.get("name") or "", columns // 2):
+        line(part)
+    out += [SIZE_NORMAL, BOLD_OFF]
+    if restaurant.get("nit"):
+        line(f"NIT: {restaurant['nit']}")
+    if restaurant.get("address"):
+        lines(restaurant["address"])
+    line()
+
+    # Factura y resolución
+    out.append(BOLD_ON)
+    line("FACTURA ELECTRÓNICA DE VENTA")
+    line(f"No. {invoice.get('number', '')}")
+    out.append(BOLD_OFF)
+    if resolution:
+        lines(f"Resolución DIAN No. {resolution.get('number') or ''} del {resolution.get('date') or ''}")
+        lines(
+            f"Prefijo {resolution.get('prefix') or ''} "
+            f"del {resolution.get('from') or ''} al {resolution.get('to') or ''}"
+        )
+    out.append(ALIGN_LEFT)
+    line(rule)
+    line(_pair("Fecha:", str(invoice.get("date") or "")[:19], columns))
+    line(_pair("Forma de pago:", str(invoice.get("payment_form") or ""), columns))
+    line(rule)
+
+    # Ítems: cantidad | descripción | total
+    qty_width, total_width = 5, 12
+    desc_width = columns - qty_width - total_width - 2
+    out.append(BOLD_ON)
+    line("Cant".ljust(qty_width) + " " + "Descripción".ljust(desc_width) + " " + "Total".rjust(total_width))
+    out.append(BOLD_OFF)
+    for item in ticket.get("items") or []:
+        description = _wrap(item.get("name") or "", desc_width)
+        line(
+            _format_qty(item.get("qty"))[:qty_width].ljust(qty_width) + " "
+            + description[0].ljust(desc_width) + " "
+            + format_money(item.get("total"))[-total_width:].rjust(total_width)
+        )
+        for extra in description[1:]:
+            line(" " * (qty_width + 1) + extra)
+        if Decimal(str(item.get("qty") or 0)) != 1:
+            line(" " * (qty_width + 1) + f"{_format_qty(item.get('qty'))} x {format_money(item.get('price'))}")
+    line(rule)
+
+    # Totales
+    line(_pair("Subtotal", format_money(totals.get("subtotal")), columns))
+    if totals.get("total_iva"):
+        line(_pair("IVA", format_money(totals.get("total_iva")), columns))
+    if totals.get("total_ico"):
+        line(_pair("Impoconsumo", format_money(totals.get("total_ico")), columns))
+    out += [BOLD_ON, SIZE_DOUBLE_HEIGHT]
+    line(_pair("TOTAL", format_money(totals.get("total")), columns))
+    out += [SIZE_NORMAL, BOLD_OFF]
+    line(rule)
+
+    # CUFE y QR
+    if invoice.get("cufe"):
+        line("CUFE:")
+        lines(invoice["cufe"])
+    qr = qr_content(invoice)
+    out.append(ALIGN_CENTER)
+    if qr:
+        out.append(LF)
+        out.append(_qr_block(qr))
+        out.append(LF)
+
+    # Pie
+    if ticket.get("footer_message"):
+        lines(ticket["footer_message"])
+    line("¡Gracias por su visita!")
+    out += [ALIGN_LEFT, CUT]
+    return b"".join(out)
+
+
+# =============================================================================
+# CACHE
+# =============================================================================
+
+class EscPosCache:
+    """
+    Cache LRU de tirillas renderizadas.
+
+    La clave incluye la versión del contenido (el ETag de ticket-data) y el
+    ancho: una factura revisada (ej: validada, con CUFE) se vuelve a
+    renderizar; las reimpresiones de la misma versión no.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[int, str, str, int], bytes]" = OrderedDict()
+
+        # Métricas
+        self.hits = 0
+        self.renders = 0
+
+    def get_or_render(
+        self,
+        tenant_id: int,
+        number: str,
+        version: str,
+        columns: int,
+        ticket: Any
+    ) -> bytes:
+        """
+        Bytes de la tirilla; renderiza solo si la versión no está en cache.
+        `ticket` puede ser una función que devuelve el dict (se llama solo al renderizar).
+        """
+        key = (tenant_id, number, version, columns)
+        cached = self._entries.get(key)
+        if cached is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return cached
+
+        data = ticket() if callable(ticket) else ticket
+        rendered = render_escpos(data, columns)
+        self.renders += 1
+        self._entries[key] = rendered
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+        return rendered
+
+    def clear(self) -> None:
+        """Elimina todas las entradas."""
+        self._entries.clear()
+
+    def snapshot(self) -> dict:
+        """Estado para /metrics."""
+        return {
+            "entries": len(self._entries),
+            "max_entries": self._max_entries,
+            "hits": self.hits,
+            "renders": self.renders,
+        }
+
+
+# Instancia global (singleton)
+_escpos_cache: Optional[EscPosCache] = None
+
+
+def get_escpos_cache() -> EscPosCache:
+    """Obtiene la instancia global del cache ESC/POS."""
+    global _escpos_cache
+    if _escpos_cache is None:
+        _escpos_cache = EscPosCache(max_entries=get_settings().escpos_cache_max_entries)
+    return _escpos_cache
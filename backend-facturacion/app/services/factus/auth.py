@@ -12,6 +12,11 @@ import httpx
 
 from app.core.config import Settings
 from app.core.exceptions import FactusAuthError, FactusTokenExpiredError
+from app.services.factus.endpoints import AUTH
+from app.services.factus.rate_limiter import get_rate_limiter
+from app.services.factus.token_cache import CachedToken, FactusTokenCache, get_token_cache
+from app.services.factus.timeouts import build_timeout
+from app.services.factus.token_store import DatabaseTokenStore, get_token_store
 
 logger = logging.getLogger(__name__)
 
@@ -24,38 +29,74 @@ class FactusAuthManager:
     - Obtención de token via password grant
     - Renovación automática usando refresh_token
     - Verificación de expiración con margen de seguridad (5 min)
-    - Thread-safe con asyncio.Lock
+    - Token compartido entre peticiones mediante un cache de proceso
+    - Opcional: token compartido entre workers vía BD con lease de renovación
+    - Thread-safe con asyncio.Lock (uno por cuenta de Factus)
     """
     
-    def __init__(self, client: httpx.AsyncClient, settings: Settings):
+    def __init__(
+        self, 
+        client: httpx.AsyncClient, 
+        settings: Settings,
+        token_cache: Optional[FactusTokenCache] = None,
+        token_store: Optional[DatabaseTokenStore] = None
+    ):
         """
         Inicializa el gestor de autenticación.
         
         Args:
             client: Cliente HTTP asíncrono para hacer las peticiones
             settings: Configuración con credenciales de Factus
+            token_cache: Cache de tokens compartido. Si no se proporciona,
+                         se usa el cache global del proceso.
+            token_store: Almacén persistente compartido entre workers.
+                         Si no se proporciona, se usa el configurado
+                         (None si FACTUS_TOKEN_STORE=memory).
         """
         self._client = client
         self._settings = settings
         
+        # Cache compartido entre instancias (clave por credenciales del tenant)
+        self._token_cache = token_cache or get_token_cache()
+        self._cache_key = self._token_cache.key_for(settings)
+        self._token_store = token_store or get_token_store()
+        
         # Estado del token
         self._access_token: Optional[str] = None
         self._refresh_token: Optional[str] = None
         self._expires_at: Optional[datetime] = None
+        self._load_from_cache()
         
         # Lock para thread-safety en operaciones de token
-        self._lock = asyncio.Lock()
+        # Compartido por todas las instancias de la misma cuenta
+        self._lock = self._token_cache.lock_for(self._cache_key)
     
     @property
     def _auth_url(self) -> str:
         """URL del endpoint de autenticación OAuth2."""
         return f"{self._settings.factus_base_url}/oauth/token"
     
-    def _is_token_valid(self) -> bool:
+    def _load_from_cache(self) -> None:
+        """Sincroniza el estado local con el token compartido del cache."""
+        cached = self._token_cache.get(self._cache_key)
+        if cached is None:
+            self._access_token = None
+            self._refresh_token = None
+            self._expires_at = None
+            return
+        
+        self._access_token = cached.access_token
+        self._refresh_token = cached.refresh_token
+        self._expires_at = cached.expires_at
+    
+    def _is_token_valid(self, lookahead_seconds: float = 0.0) -> bool:
         """
         Verifica si el token actual es válido.
         Considera un margen de seguridad antes de la expiración.
         
+        Args:
+            lookahead_seconds: Anticipación adicional al margen (refresher)
+        
         Returns:
             True si el token existe y no está por expirar, False en caso contrario
         """
@@ -63,7 +104,9 @@ class FactusAuthManager:
             return False
         
         # Verificar con margen de seguridad
-        margin = timedelta(seconds=self._settings.token_refresh_margin_seconds)
+        margin = timedelta(
+            seconds=self._settings.token_refresh_margin_seconds + lookahead_seconds
+        )
         return datetime.now() < (self._expires_at - margin)
     
     async def _login(self) -> None:
@@ -83,11 +126,14 @@ class FactusAuthManager:
             "password": self._settings.factus_password,
         }
         
+        await get_rate_limiter().acquire(self._cache_key, self._settings.factus_client_id)
+        
         try:
             response = await self._client.post(
                 self._auth_url,
                 data=payload,
-                headers={"Content-Type": "application/x-www-form-urlencoded"}
+                headers={"Content-Type": "application/x-www-form-urlencoded"},
+                timeout=build_timeout(AUTH, self._settings)
             )
             
             if response.status_code != 200:
@@ -108,7 +154,7 @@ class FactusAuthManager:
             raise FactusAuthError(
                 message="No se pudo conectar con Factus para autenticación",
                 details=str(e)
-            )
+            ) from e
     
     async def _refresh(self) -> None:
         """
@@ -132,11 +178,14 @@ class FactusAuthManager:
             "refresh_token": self._refresh_token,
         }
         
+        await get_rate_limiter().acquire(self._cache_key, self._settings.factus_client_id)
+        
         try:
             response = await self._client.post(
                 self._auth_url,
                 data=payload,
-                headers={"Content-Type": "application/x-www-form-urlencoded"}
+                headers={"Content-Type": "application/x-www-form-urlencoded"},
+                timeout=build_timeout(AUTH, self._settings)
             )
             
             if response.status_code != 200:
@@ -145,6 +194,7 @@ class FactusAuthManager:
                 self._access_token = None
                 self._refresh_token = None
                 self._expires_at = None
+                self._token_cache.invalidate(self._cache_key)
                 # Intentar login completo
                 await self._login()
                 return
@@ -158,11 +208,11 @@ class FactusAuthManager:
             raise FactusAuthError(
                 message="No se pudo renovar el token de Factus",
                 details=str(e)
-            )
+            ) from e
     
     def _store_token(self, data: dict) -> None:
         """
-        Almacena los datos del token en memoria.
+        Almacena los datos del token en memoria y en el cache compartido.
         
         Args:
             data: Respuesta del endpoint OAuth2 con access_token, refresh_token, expires_in
@@ -174,6 +224,15 @@ class FactusAuthManager:
         expires_in = data.get("expires_in", 3600)  # Default 1 hora
         self._expires_at = datetime.now() + timedelta(seconds=expires_in)
         
+        self._token_cache.set(
+            self._cache_key,
+            CachedToken(
+                access_token=self._access_token,
+                refresh_token=self._refresh_token,
+                expires_at=self._expires_at,
+            )
+        )
+        
         logger.debug(f"Token almacenado, expira en {expires_in} segundos")
     
     async def get_valid_token(self) -> str:
@@ -191,16 +250,15 @@ class FactusAuthManager:
             FactusTokenExpiredError: Si el token expiró y no se pudo renovar
         """
         async with self._lock:
+            # Otra petición pudo haber renovado el token mientras esperábamos
+            self._load_from_cache()
             if self._is_token_valid():
                 return self._access_token
             
-            # Token no válido o por expirar
-            if self._refresh_token:
-                logger.info("Token próximo a expirar, renovando...")
-                await self._refresh()
+            if self._token_store is not None:
+                await self._renew_token_shared()
             else:
-                logger.info("No hay token válido, realizando login...")
-                await self._login()
+                await self._renew_token()
             
             if not self._access_token:
                 raise FactusTokenExpiredError(
@@ -209,23 +267,163 @@ class FactusAuthManager:
             
             return self._access_token
     
-    async def invalidate(self) -> None:
+    async def refresh_ahead(self, lookahead_seconds: float) -> bool:
+        """
+        Renueva el token de forma proactiva si expira dentro de la ventana indicada.
+        
+        Pensado para el refresher en segundo plano: así ninguna petición de
+        usuario tiene que esperar la renovación OAuth.
+        
+        Args:
+            lookahead_seconds: Segundos de anticipación adicionales al margen
+                               de token_refresh_margin_seconds
+            
+        Returns:
+            True si este worker renovó el token (False si no hacía falta o si
+            otro worker ya había publicado uno que cubre la ventana)
+        """
+        async with self._lock:
+            self._load_from_cache()
+            if self._is_token_valid(lookahead_seconds):
+                return False
+            
+            if self._token_store is not None:
+                return await self._renew_token_shared(lookahead_seconds, proactive=True)
+            
+            await self._renew_token(proactive=True)
+            return True
+    
+    async def _renew_token(self, proactive: bool = False) -> None:
+        """Renueva el token (refresh si es posible, si no login completo)."""
+        self._token_cache.record_refresh(proactive)
+        if self._refresh_token:
+            logger.info("Token próximo a expirar, renovando...")
+            await self._refresh()
+        else:
+            logger.info("No hay token válido, realizando login...")
+            await self._login()
+    
+    async def _renew_token_shared(
+        self,
+        lookahead_seconds: float = 0.0,
+        proactive: bool = False
+    ) -> bool:
+        """
+        Obtiene un token válido coordinando con los demás workers vía BD.
+        
+        - Si otro worker ya guardó un token válido (que además cubre
+          lookahead_seconds, en la renovación proactiva), se reutiliza.
+        - Si no, se toma el lease y solo este worker renueva y publica el token.
+        - Si el lease está tomado, se espera a que el otro worker publique
+          el token (hasta factus_token_lease_wait_seconds); al agotarse la
+          espera se renueva localmente para no bloquear la venta.
+        
+        Returns:
+            True si este worker renovó el token, False si adoptó el guardado
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._settings.factus_token_lease_wait_seconds
+        poll_interval = 0.1
+        
+        while True:
+            if await self._adopt_stored_token(lookahead_seconds):
+                return False
+            
+            if await self._token_store.acquire_lease(self._cache_key):
+                try:
+                    # Revisar de nuevo: otro worker pudo publicar antes del lease
+                    if await self._adopt_stored_token(lookahead_seconds):
+                        return False
+                    await self._renew_token(proactive)
+                    await self._publish_token()
+                    return True
+                finally:
+                    await self._token_store.release_lease(self._cache_key)
+            
+            if loop.time() >= deadline:
+                logger.warning("Tiempo de espera del lease agotado, renovando token localmente")
+                await self._renew_token(proactive)
+                await self._publish_token()
+                return True
+            
+            await asyncio.sleep(poll_interval)
+            poll_interval = min(poll_interval * 2, 1.0)
+    
+    async def _adopt_stored_token(self, lookahead_seconds: float = 0.0) -> bool:
+        """
+        Carga el token guardado en BD si sigue siendo válido.
+        
+        Args:
+            lookahead_seconds: El token solo se da por bueno si además sigue
+                               vigente pasada esta ventana (refresher)
+        
+        Returns:
+            True si se adoptó un token válido
+        """
+        stored = await self._token_store.load(self._cache_key)
+        if stored is None:
+            return False
+        
+        self._token_cache.set(self._cache_key, stored)
+        self._load_from_cache()
+        return self._is_token_valid(lookahead_seconds)
+    
+    async def _publish_token(self) -> None:
+        """Guarda el token actual en BD para los demás workers."""
+        if not self._access_token:
+            return
+        await self._token_store.save(
+            self._cache_key,
+            CachedToken(
+                access_token=self._access_token,
+                refresh_token=self._refresh_token,
+                expires_at=self._expires_at,
+            )
+        )
+    
+    async def invalidate(self, rejected_token: Optional[str] = None) -> None:
         """
         Invalida el token actual, forzando re-autenticación en la próxima petición.
         Útil cuando se recibe un 401 de la API.
+        
+        Args:
+            rejected_token: Token que la API rechazó. Si el cache ya contiene
+                            un token distinto (otra petición lo renovó), no se
+                            invalida para evitar logins innecesarios.
         """
         async with self._lock:
+            cached = self._token_cache.get(self._cache_key)
+            if (
+                rejected_token 
+                and cached is not None 
+                and cached.access_token != rejected_token
+            ):
+                logger.debug("Token ya renovado por otra petición, no se invalida")
+                self._load_from_cache()
+                return
+            
             logger.info("Invalidando token de Factus")
             self._access_token = None
             self._refresh_token = None
             self._expires_at = None
+            self._token_cache.invalidate(self._cache_key)
+            
+            if self._token_store is not None:
+                await self._token_store.clear(self._cache_key, rejected_token)
+    
+    @property
+    def cache_key(self) -> str:
+        """Clave (hash) de la cuenta en el cache de tokens."""
+        return self._cache_key
     
     @property
     def is_authenticated(self) -> bool:
         """Indica si hay un token válido disponible."""
+        self._load_from_cache()
         return self._is_token_valid()
     
     @property
     def token_expires_at(self) -> Optional[datetime]:
         """Fecha y hora de expiración del token actual."""
+        self._load_from_cache()
         return self._expires_at
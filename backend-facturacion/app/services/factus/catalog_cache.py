@@ -0,0 +1,233 @@
+"""
+Cache compartido de catálogos DIAN obtenidos de Factus.
+Los catálogos (municipios, tributos, métodos de pago) cambian pocas veces al
+año y son iguales para todos los tenants: se sirven desde memoria y se
+refrescan en segundo plano (stale-while-revalidate).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CatalogEntry:
+    """Catálogo almacenado en el cache."""
+
+    data: Any
+    fetched_at: float  # time.time() (sobrevive a reinicios si se persiste)
+
+
+class FactusCatalogCache:
+    """
+    Cache en memoria de catálogos con TTL y stale-while-revalidate.
+
+    Características:
+    - Fresco (edad < ttl): se sirve desde memoria
+    - Vencido dentro de la ventana stale: se sirve y se refresca en segundo plano
+    - Sin entrada o fuera de la ventana: se consulta a Factus (una sola vez
+      aunque lleguen varias peticiones a la vez)
+    - Si Factus falla y hay una entrada (aunque vieja), se sirve esa
+    - Persistencia opcional en disco para arrancar con el cache caliente
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = 86400.0,
+        stale_seconds: float = 604800.0,
+        persist_path: Optional[str] = None,
+    ):
+        self._ttl_seconds = ttl_seconds
+        self._stale_seconds = stale_seconds
+        self._persist_path = persist_path
+        self._entries: Dict[str, CatalogEntry] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._refresh_tasks: Dict[str, asyncio.Task] = {}
+        self._loaded = False
+
+        # Métricas
+        self.stats: Dict[str, int] = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "refreshes": 0,
+            "refresh_errors": 0,
+        }
+
+    async def get_or_fetch(
+        self,
+        key: str,
+        fetcher: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """
+        Obtiene un catálogo del cache o lo consulta con `fetcher`.
+
+        Args:
+            key: Clave del catálogo (ej: "https://api...|tributes")
+            fetcher: Corrutina que consulta el catálogo en Factus. Debe poder
+                     ejecutarse después de terminada la petición (refresh en
+                     segundo plano).
+
+        Returns:
+            Datos del catálogo (JSON)
+        """
+        if not self._loaded:
+            await self._load()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.time() - entry.fetched_at
+            if age < self._ttl_seconds:
+                self.stats["hits"] += 1
+                return entry.data
+            if age < self._ttl_seconds + self._stale_seconds:
+                self.stats["stale_hits"] += 1
+                self._schedule_refresh(key, fetcher)
+                return entry.data
+
+        self.stats["misses"] += 1
+        return await self._fetch(key, fetcher)
+
+    async def _fetch(self, key: str, fetcher: Callable[[], Awaitable[Any]]) -> Any:
+        """Consulta el catálogo (single-flight por clave)."""
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        started_at = time.time()
+
+        async with lock:
+            # Otra petición pudo completar la consulta mientras esperábamos
+            entry = self._entries.get(key)
+            if entry is not None and entry.fetched_at >= started_at:
+                return entry.data
+
+            try:
+                data = await fetcher()
+            except Exception:
+                if entry is not None:
+                    logger.warning(f"Error consultando catálogo {key}, se sirve la copia en cache")
+                    return entry.data
+                raise
+
+            self._entries[key] = CatalogEntry(data=data, fetched_at=time.time())
+            await self._persist()
+            return data
+
+    def _schedule_refresh(self, key: str, fetcher: Callable[[], Awaitable[Any]]) -> None:
+        """Refresca el catálogo en segundo plano (una tarea por clave)."""
+        task = self._refresh_tasks.get(key)
+        if task is not None and not task.done():
+            return
+
+        async def refresh() -> None:
+            try:
+                lock = self._locks.setdefault(key, asyncio.Lock())
+                async with lock:
+                    data = await fetcher()
+                    self._entries[key] = CatalogEntry(data=data, fetched_at=time.time())
+                self.stats["refreshes"] += 1
+                await self._persist()
+                logger.info(f"Catálogo {key} refrescado en segundo plano")
+            except Exception as e:
+                self.stats["refresh_errors"] += 1
+                logger.warning(f"No se pudo refrescar el catálogo {key}: {e}")
+            finally:
+                self._refresh_tasks.pop(key, None)
+
+        self._refresh_tasks[key] = asyncio.create_task(refresh())
+
+    async def _load(self) -> None:
+        """Carga los catálogos persistidos en disco (si hay)."""
+        self._loaded = True
+        if not self._persist_path or not os.path.exists(self._persist_path):
+            return
+
+        try:
+            raw = await asyncio.to_thread(self._read_file)
+            for key, item in raw.items():
+                self._entries.setdefault(
+                    key, CatalogEntry(data=item["data"], fetched_at=item["fetched_at"])
+                )
+            logger.info(f"{len(raw)} catálogos cargados desde {self._persist_path}")
+        except Exception as e:
+            logger.warning(f"No se pudo cargar el cache de catálogos: {e}")
+
+    def _read_file(self) -> dict:
+        with open(self._persist_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    async def _persist(self) -> None:
+        """Guarda los catálogos en disco (si hay ruta configurada)."""
+        if not self._persist_path:
+            return
+
+        snapshot = {
+            key: {"data": entry.data, "fetched_at": entry.fetched_at}
+            for key, entry in self._entries.items()
+        }
+        try:
+            await asyncio.to_thread(self._write_file, snapshot)
+        except Exception as e:
+            logger.warning(f"No se pudo persistir el cache de catálogos: {e}")
+
+    def _write_file(self, snapshot: dict) -> None:
+        # Escritura atómica: archivo temporal + rename
+        tmp_path = f"{self._persist_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, self._persist_path)
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        """Elimina un catálogo (o todos si key es None)."""
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    async def aclose(self) -> None:
+        """Cancela los refrescos pendientes. Llamar en el shutdown."""
+        tasks = list(self._refresh_tasks.values())
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._refresh_tasks.clear()
+
+    def snapshot(self) -> dict:
+        """Métricas para monitoreo."""
+        lookups = self.stats["hits"] + self.stats["stale_hits"] + self.stats["misses"]
+        served = self.stats["hits"] + self.stats["stale_hits"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "hit_ratio": round(served / lookups, 3) if lookups else 0.0,
+        }
+
+
+# Instancia global (singleton)
+_catalog_cache: Optional[FactusCatalogCache] = None
+
+
+def get_catalog_cache() -> FactusCatalogCache:
+    """
+    Obtiene la instancia global del cache de catálogos.
+    Patrón singleton: los catálogos son iguales para todos los tenants.
+    """
+    global _catalog_cache
+    if _catalog_cache is None:
+        settings = get_settings()
+        _catalog_cache = FactusCatalogCache(
+            ttl_seconds=settings.factus_catalog_ttl_seconds,
+            stale_seconds=settings.factus_catalog_stale_seconds,
+            persist_path=settings.factus_catalog_cache_path,
+        )
+    return _catalog_cache
@@ -0,0 +1,247 @@
+"""
+Circuit breaker para las llamadas a Factus.
+Un breaker por cuenta (tenant) y grupo de endpoints: cuando la tasa de errores
+o de llamadas lentas supera el umbral, las peticiones fallan de inmediato en
+lugar de esperar el timeout completo, liberando capacidad del worker.
+"""
+
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from app.core.config import Settings, get_settings
+from app.core.exceptions import FactusCircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitState:
+    """Estados posibles del circuit breaker."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker de ventana deslizante por cantidad de llamadas.
+
+    - CLOSED: las llamadas pasan; se registran éxitos, fallos y lentitud
+    - OPEN: las llamadas fallan de inmediato hasta que pase open_seconds
+    - HALF_OPEN: se deja pasar una llamada de prueba; si funciona se cierra,
+      si falla se vuelve a abrir. Si la prueba no informa resultado en
+      open_seconds, se da por perdida y se deja pasar otra
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate_threshold: float = 0.5,
+        slow_call_seconds: float = 10.0,
+        slow_call_rate_threshold: float = 0.8,
+        window_size: int = 20,
+        minimum_calls: int = 5,
+        open_seconds: float = 30.0,
+    ):
+        self.name = name
+        self._failure_rate_threshold = failure_rate_threshold
+        self._slow_call_seconds = slow_call_seconds
+        self._slow_call_rate_threshold = slow_call_rate_threshold
+        self._minimum_calls = minimum_calls
+        self._open_seconds = open_seconds
+
+        # Ventana de (fallo, lenta) por llamada
+        self._calls: Deque[Tuple[bool, bool]] = deque(maxlen=window_size)
+
+        self._state = CircuitState.CLOSED
+        self._opened_at: Optional[float] = None
+        self._half_open_probe_in_flight = False
+        self._probe_started_at: Optional[float] = None
+
+        # Métricas
+        self.rejected_calls = 0
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        """Estado actual (pasa de OPEN a HALF_OPEN al cumplirse el tiempo)."""
+        if (
+            self._state == CircuitState.OPEN
+            and self._opened_at is not None
+            and time.monotonic() - self._opened_at >= self._open_seconds
+        ):
+            self._state = CircuitState.HALF_OPEN
+            self._half_open_probe_in_flight = False
+            self._probe_started_at = None
+        return self._state
+
+    def before_call(self) -> None:
+        """
+        Verifica si la llamada puede pasar.
+
+        Raises:
+            FactusCircuitOpenError: Si el circuito está abierto
+        """
+        state = self.state
+
+        if state == CircuitState.CLOSED:
+            return
+
+        if state == CircuitState.HALF_OPEN:
+            if self._half_open_probe_in_flight and self._probe_expired():
+                logger.warning(f"Llamada de prueba sin resultado para {self.name}, se permite otra")
+                self._half_open_probe_in_flight = False
+            if not self._half_open_probe_in_flight:
+                self._half_open_probe_in_flight = True
+                self._probe_started_at = time.monotonic()
+                return
+
+        self.rejected_calls += 1
+        raise FactusCircuitOpenError(
+            message=f"Factus no disponible temporalmente ({self.name})",
+            retry_after=self._retry_after(),
+        )
+
+    def record_success(self, duration: float) -> None:
+        """Registra una llamada exitosa (puede contar como lenta)."""
+        self._record(failed=False, duration=duration)
+
+    def record_failure(self, duration: float) -> None:
+        """Registra una llamada fallida (timeout, error de red, 5xx)."""
+        self._record(failed=True, duration=duration)
+
+    def release(self) -> None:
+        """Libera el turno de una llamada que no llegó a enviarse o se canceló."""
+        self._half_open_probe_in_flight = False
+
+    def _probe_expired(self) -> bool:
+        return (
+            self._probe_started_at is not None
+            and time.monotonic() - self._probe_started_at >= self._open_seconds
+        )
+
+    def _record(self, failed: bool, duration: float) -> None:
+        slow = duration >= self._slow_call_seconds
+
+        if self._state == CircuitState.HALF_OPEN:
+            self._half_open_probe_in_flight = False
+            if failed or slow:
+                self._open()
+            else:
+                self._close()
+            return
+
+        self._calls.append((failed, slow))
+
+        if self._state == CircuitState.CLOSED and len(self._calls) >= self._minimum_calls:
+            failure_rate, slow_rate = self._rates()
+            if (
+                failure_rate >= self._failure_rate_threshold
+                or slow_rate >= self._slow_call_rate_threshold
+            ):
+                self._open()
+
+    def _rates(self) -> Tuple[float, float]:
+        total = len(self._calls)
+        if not total:
+            return 0.0, 0.0
+        failures = sum(1 for failed, _ in self._calls if failed)
+        slow = sum(1 for _, is_slow in self._calls if is_slow)
+        return failures / total, slow / total
+
+    def _open(self) -> None:
+        self._state = CircuitState.OPEN
+        self._opened_at = time.monotonic()
+        self.times_opened += 1
+        logger.warning(f"Circuit breaker ABIERTO para {self.name} ({self._open_seconds}s)")
+
+    def _close(self) -> None:
+        self._state = CircuitState.CLOSED
+        self._opened_at = None
+        self._calls.clear()
+        logger.info(f"Circuit breaker cerrado para {self.name}")
+
+    def _retry_after(self) -> float:
+        if self._state == CircuitState.HALF_OPEN and self._probe_started_at is not None:
+            # Rechazada porque hay una prueba en curso: hasta que termine o expire
+            remaining = self._open_seconds - (time.monotonic() - self._probe_started_at)
+            return max(0.0, round(remaining, 1))
+        if self._opened_at is None:
+            return self._open_seconds
+        remaining = self._open_seconds - (time.monotonic() - self._opened_at)
+        return max(0.0, round(remaining, 1))
+
+    def snapshot(self) -> dict:
+        """Estado y métricas del breaker (para el health check)."""
+        failure_rate, slow_rate = self._rates()
+        state = self.state
+        return {
+            "state": state,
+            "failure_rate": round(failure_rate, 3),
+            "slow_call_rate": round(slow_rate, 3),
+            "calls_in_window": len(self._calls),
+            "rejected_calls": self.rejected_calls,
+            "times_opened": self.times_opened,
+            "retry_after": self._retry_after() if state == CircuitState.OPEN else None,
+        }
+
+
+class CircuitBreakerRegistry:
+    """Registro de breakers por (cuenta de Factus, grupo de endpoints)."""
+
+    def __init__(self, settings: Optional[Settings] = None):
+        self._settings = settings or get_settings()
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+
+    def get(self, account_key: str, group: str) -> CircuitBreaker:
+        """Obtiene (o crea) el breaker de una cuenta y grupo."""
+        key = (account_key, group)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            s = self._settings
+            breaker = CircuitBreaker(
+                name=f"{account_key[:8]}/{group}",
+                failure_rate_threshold=s.factus_circuit_failure_rate_threshold,
+                slow_call_seconds=s.factus_circuit_slow_call_seconds,
+                slow_call_rate_threshold=s.factus_circuit_slow_call_rate_threshold,
+                window_size=s.factus_circuit_window_size,
+                minimum_calls=s.factus_circuit_minimum_calls,
+                open_seconds=s.factus_circuit_open_seconds,
+            )
+            self._breakers[key] = breaker
+        return breaker
+
+    def snapshot(self, account_key: Optional[str] = None) -> Dict[str, dict]:
+        """
+        Estado de los breakers, por grupo.
+
+        Args:
+            account_key: Si se indica, solo los de esa cuenta
+        """
+        if account_key is None:
+            return {}
+        return {
+            group: breaker.snapshot()
+            for (key, group), breaker in self._breakers.items()
+            if key == account_key
+        }
+
+    def open_count(self) -> int:
+        """Cantidad de breakers abiertos en todo el proceso."""
+        return sum(
+            1 for b in self._breakers.values() if b.state == CircuitState.OPEN
+        )
+
+
+# Instancia global (singleton)
+_registry: Optional[CircuitBreakerRegistry] = None
+
+
+def get_circuit_breakers() -> CircuitBreakerRegistry:
+    """Obtiene el registro global de circuit breakers."""
+    global _registry
+    if _registry is None:
+        _registry = CircuitBreakerRegistry()
+    return _registry
@@ -3,7 +3,9 @@ Cliente HTTP de bajo nivel para la API de Factus.
 Maneja autenticación automática, logging y errores.
 """
 
+import asyncio
 import logging
+import time
 from typing import Any, Optional
 
 import httpx
@@ -16,6 +18,11 @@ from app.core.exceptions import (
     FactusValidationError,
 )
 from app.services.factus.auth import FactusAuthManager
+from app.services.factus.circuit_breaker import CircuitBreaker, get_circuit_breakers
+from app.services.factus.endpoints import IDEMPOTENT_METHODS, classify_endpoint
+from app.services.factus.rate_limiter import get_rate_limiter
+from app.services.factus.retry import RetryPolicy, build_retry_policy, get_retry_budget
+from app.services.factus.timeouts import build_timeout
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +36,9 @@ class FactusClient:
     - Manejo centralizado de errores HTTP
     - Logging de peticiones/respuestas
     - Reintentos en caso de token expirado
+    - Reintentos con backoff y jitter ante timeouts/5xx (idempotentes)
+    - Circuit breaker por cuenta y grupo de endpoints
+    - Rate limiting del tráfico saliente (global y por cuenta)
     """
     
     def __init__(self, client: httpx.AsyncClient, settings: Settings):
@@ -43,6 +53,11 @@ class FactusClient:
         self._settings = settings
         self._auth_manager = FactusAuthManager(client, settings)
     
+    @property
+    def account_key(self) -> str:
+        """Identificador (hash) de la cuenta de Factus de este cliente."""
+        return self._auth_manager.cache_key
+    
     @property
     def _base_url(self) -> str:
         """URL base de la API de Factus."""
@@ -125,23 +140,143 @@ class FactusClient:
                 endpoint=endpoint
             )
     
+    async def _send(
+        self,
+        method: str,
+        url: str,
+        data: Optional[dict],
+        params: Optional[dict],
+        retry_on_auth_error: bool,
+        timeout: httpx.Timeout
+    ) -> httpx.Response:
+        """
+        Envía una petición (un intento), renovando el token una vez si hay 401.
+        
+        Raises:
+            httpx.RequestError: Errores de red/timeout (los maneja _request)
+            FactusRateLimitError: Si no hubo turno en el rate limiter a tiempo
+        """
+        headers = await self._get_headers()
+        await get_rate_limiter().acquire(self.account_key, self._settings.factus_client_id)
+        
+        # No enviar Content-Type si no hay body (ej: GET)
+        if data is None and "Content-Type" in headers:
+            del headers["Content-Type"]
+        
+        response = await self._client.request(
+            method=method,
+            url=url,
+            json=data if data else None,
+            params=params,
+            headers=headers,
+            timeout=timeout
+        )
+        
+        # Manejo especial para 401: invalidar token (también en el cache
+        # compartido) y reintentar. Un 401 implica que Factus no procesó
+        # la petición, por lo que es seguro reenviarla.
+        if response.status_code == 401 and retry_on_auth_error:
+            logger.warning("Token rechazado, invalidando y reintentando...")
+            rejected_token = headers["Authorization"].removeprefix("Bearer ")
+            await self._auth_manager.invalidate(rejected_token)
+            return await self._send(
+                method, url, data, params,
+                retry_on_auth_error=False,
+                timeout=timeout
+            )
+        
+        return response
+    
+    def _can_retry(
+        self,
+        policy: RetryPolicy,
+        attempt: int,
+        safe_to_resend: bool,
+        error: Optional[httpx.RequestError] = None,
+        status_code: Optional[int] = None
+    ) -> bool:
+        """
+        Decide si un intento fallido puede reintentarse.
+        
+        - Errores de conexión (la petición nunca llegó): siempre reintentables
+        - Timeouts y 5xx/429: solo si la petición es segura de reenviar
+          (método idempotente o POST con clave de idempotencia)
+        """
+        if attempt >= policy.max_attempts:
+            return False
+        
+        if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout)):
+            retryable = True
+        elif isinstance(error, httpx.TimeoutException):
+            retryable = policy.retry_on_timeout and safe_to_resend
+        elif error is not None:
+            retryable = safe_to_resend
+        else:
+            retryable = status_code in policy.retry_on_status and safe_to_resend
+        
+        return retryable and get_retry_budget().try_acquire()
+    
+    async def find_bill_by_reference(self, reference_code: str) -> Optional[dict]:
+        """
+        Busca en Factus una factura ya creada con el reference_code dado.
+        
+        Se usa antes de reenviar un POST /v1/bills/validate para no crear
+        facturas duplicadas si el intento anterior sí llegó a Factus.
+        Son consultas internas: no cuentan como peticiones originales en el
+        presupuesto de reintentos (si no, cada reintento lo agrandaría).
+        
+        Returns:
+            Respuesta de /v1/bills/show/{number} (misma forma que la de
+            creación) o None si no existe
+            
+        Raises:
+            FactusAPIError, FactusConnectionError: Si no se pudo verificar
+        """
+        response = await self._request(
+            "GET", "/v1/bills",
+            params={"filter[reference_code]": reference_code},
+            count_in_budget=False
+        )
+        
+        data = response.get("data", {}) if isinstance(response, dict) else {}
+        bills = data.get("data", []) if isinstance(data, dict) else data
+        
+        for bill in bills or []:
+            if isinstance(bill, dict) and bill.get("reference_code") == reference_code:
+                logger.info(f"Factura con referencia {reference_code} ya existe en Factus: {bill.get('number')}")
+                return await self._request(
+                    "GET", f"/v1/bills/show/{bill.get('number')}", count_in_budget=False
+                )
+        
+        return None
+    
     async def _request(
         self,
         method: str,
         endpoint: str,
         data: Optional[dict] = None,
         params: Optional[dict] = None,
-        retry_on_auth_error: bool = True
+        retry_on_auth_error: bool = True,
+        idempotency_key: Optional[str] = None,
+        count_in_budget: bool = True
     ) -> Any:
         """
         Realiza una petición HTTP a la API de Factus.
         
+        Aplica la política de reintentos del grupo del endpoint (backoff
+        exponencial con jitter, sujeto al presupuesto global de reintentos).
+        
         Args:
             method: Método HTTP (GET, POST, PUT, DELETE)
             endpoint: Ruta del endpoint (sin base URL)
             data: Datos para el body (JSON)
             params: Parámetros de query string
             retry_on_auth_error: Si True, reintenta una vez si hay error 401
+            idempotency_key: reference_code de la factura. Permite reintentar
+                             un POST de creación: antes de reenviar se verifica
+                             que la factura no exista ya en Factus.
+            count_in_budget: Si False, la petición no aporta tokens al
+                             presupuesto de reintentos (consultas internas)
             
         Returns:
             Respuesta JSON de la API
@@ -149,38 +284,69 @@ class FactusClient:
         Raises:
             FactusAPIError: Si hay error en la petición
             FactusConnectionError: Si hay error de red
+            FactusCircuitOpenError: Si el circuito del grupo está abierto
+            FactusRateLimitError: Si se agotó la espera en el rate limiter
         """
         url = f"{self._base_url}{endpoint}"
+        group = classify_endpoint(method, endpoint)
+        policy = build_retry_policy(group, self._settings)
+        timeout = build_timeout(group, self._settings)
+        breaker = get_circuit_breakers().get(self.account_key, group)
+        safe_to_resend = method.upper() in IDEMPOTENT_METHODS or idempotency_key is not None
         
-        logger.debug(f"Factus API [{method}] {endpoint}")
+        if count_in_budget:
+            get_retry_budget().record_request()
+        attempt = 0
         
-        try:
-            headers = await self._get_headers()
+        while True:
+            attempt += 1
+            logger.debug(f"Factus API [{method}] {endpoint} (intento {attempt})")
             
-            # No enviar Content-Type si no hay body (ej: GET)
-            if data is None and "Content-Type" in headers:
-                del headers["Content-Type"]
+            if attempt > 1 and idempotency_key:
+                existing = await self.find_bill_by_reference(idempotency_key)
+                if existing is not None:
+                    return existing
             
-            response = await self._client.request(
-                method=method,
-                url=url,
-                json=data if data else None,
-                params=params,
-                headers=headers,
-                timeout=30.0
-            )
+            # Falla de inmediato si Factus está degradado (no se reintenta)
+            breaker.before_call()
+            started = time.monotonic()
             
-            # Manejo especial para 401: invalidar token y reintentar
-            if response.status_code == 401 and retry_on_auth_error:
-                logger.warning("Token rechazado, invalidando y reintentando...")
-                await self._auth_manager.invalidate()
-                return await self._request(
-                    method, endpoint, data, params, 
-                    retry_on_auth_error=False
+            try:
+                response = await self._send(method, url, data, params, retry_on_auth_error, timeout)
+                
+            except httpx.TimeoutException as e:
+                breaker.record_failure(time.monotonic() - started)
+                if self._can_retry(policy, attempt, safe_to_resend, error=e):
+                    await self._wait_before_retry(policy, attempt, endpoint, "timeout")
+                    continue
+                logger.error(f"Timeout en petición a Factus: {endpoint}")
+                raise FactusConnectionError(
+                    message=f"Timeout al conectar con Factus: {endpoint}"
                 )
+            except httpx.RequestError as e:
+                breaker.record_failure(time.monotonic() - started)
+                if self._can_retry(policy, attempt, safe_to_resend, error=e):
+                    await self._wait_before_retry(policy, attempt, endpoint, type(e).__name__)
+                    continue
+                logger.error(f"Error de conexión con Factus: {e}")
+                raise FactusConnectionError(
+                    message="No se pudo conectar con Factus",
+                    details=str(e)
+                )
+            except BaseException:
+                # Sin resultado de Factus (sin token, sin turno en el rate
+                # limiter, petición cancelada): no cuenta para el breaker, pero
+                # se libera el turno para no dejar la prueba HALF_OPEN tomada
+                breaker.release()
+                raise
+            
+            self._record_response(breaker, response, time.monotonic() - started)
             
             # Procesar errores
             if response.status_code >= 400:
+                if self._can_retry(policy, attempt, safe_to_resend, status_code=response.status_code):
+                    await self._wait_before_retry(policy, attempt, endpoint, f"HTTP {response.status_code}")
+                    continue
                 self._handle_error_response(response, endpoint)
             
             # Respuesta exitosa
@@ -190,18 +356,35 @@ class FactusClient:
             result = response.json()
             logger.debug(f"Factus API respuesta exitosa: {endpoint}")
             return result
-            
-        except httpx.TimeoutException:
-            logger.error(f"Timeout en petición a Factus: {endpoint}")
-            raise FactusConnectionError(
-                message=f"Timeout al conectar con Factus: {endpoint}"
-            )
-        except httpx.RequestError as e:
-            logger.error(f"Error de conexión con Factus: {e}")
-            raise FactusConnectionError(
-                message="No se pudo conectar con Factus",
-                details=str(e)
-            )
+    
+    @staticmethod
+    def _record_response(
+        breaker: CircuitBreaker, 
+        response: httpx.Response, 
+        duration: float
+    ) -> None:
+        """
+        Registra el resultado en el breaker.
+        Los 4xx (salvo 429) son errores del request, no de Factus: cuentan como éxito.
+        """
+        if response.status_code >= 500 or response.status_code == 429:
+            breaker.record_failure(duration)
+        else:
+            breaker.record_success(duration)
+    
+    async def _wait_before_retry(
+        self,
+        policy: RetryPolicy,
+        attempt: int,
+        endpoint: str,
+        reason: str
+    ) -> None:
+        """Espera el backoff correspondiente antes de reintentar."""
+        delay = policy.compute_delay(attempt)
+        logger.warning(
+            f"Factus {endpoint} falló ({reason}), reintento {attempt + 1}/{policy.max_attempts} en {delay:.2f}s"
+        )
+        await asyncio.sleep(delay)
     
     # =========================================================================
     # MÉTODOS PÚBLICOS DE CONVENIENCIA
@@ -218,10 +401,15 @@ class FactusClient:
     async def post(
         self, 
         endpoint: str, 
-        data: Optional[dict] = None
+        data: Optional[dict] = None,
+        idempotency_key: Optional[str] = None
     ) -> Any:
-        """Realiza una petición POST."""
-        return await self._request("POST", endpoint, data=data)
+        """
+        Realiza una petición POST.
+        
+        Solo se reintenta ante timeouts/5xx si se indica idempotency_key.
+        """
+        return await self._request("POST", endpoint, data=data, idempotency_key=idempotency_key)
     
     async def put(
         self, 
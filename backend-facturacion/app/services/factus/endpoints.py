@@ -0,0 +1,60 @@
+"""
+Clasificación de endpoints de la API de Factus.
+Agrupa las rutas por tipo de operación para aplicar políticas distintas
+(reintentos, timeouts, circuit breaker) según el grupo.
+"""
+
+# Grupos de endpoints
+AUTH = "auth"
+CATALOGS = "catalogs"
+BILL_CREATION = "bill_creation"
+BILL_VALIDATION = "bill_validation"
+BILLS = "bills"
+DEFAULT = "default"
+
+ENDPOINT_GROUPS = (AUTH, CATALOGS, BILL_CREATION, BILL_VALIDATION, BILLS, DEFAULT)
+
+# Catálogos DIAN (cambian muy poco y son iguales para todos los tenants)
+_CATALOG_PREFIXES = (
+    "/v1/municipalities",
+    "/v1/tributes",
+    "/v1/payment-methods",
+    "/v1/numbering-ranges",
+    "/v1/measurement-units",
+    "/v1/countries",
+)
+
+# Métodos HTTP idempotentes (seguros de reintentar)
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+
+def classify_endpoint(method: str, endpoint: str) -> str:
+    """
+    Determina el grupo de un endpoint de Factus.
+
+    Args:
+        method: Método HTTP
+        endpoint: Ruta del endpoint (sin base URL ni query string)
+
+    Returns:
+        Nombre del grupo (ver constantes del módulo)
+    """
+    method = method.upper()
+    path = endpoint.split("?", 1)[0].rstrip("/")
+
+    if path.startswith("/oauth"):
+        return AUTH
+
+    if path.startswith(_CATALOG_PREFIXES):
+        return CATALOGS
+
+    if path == "/v1/bills/validate" and method == "POST":
+        return BILL_CREATION
+
+    if path.startswith("/v1/bills/validate/") and method == "POST":
+        return BILL_VALIDATION
+
+    if path.startswith("/v1/bills"):
+        return BILLS
+
+    return DEFAULT
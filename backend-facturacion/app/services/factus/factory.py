@@ -5,16 +5,18 @@ y la seguridad de las credenciales.
 """
 
 import logging
-import httpx
+from typing import Union
+
 from fastapi import HTTPException
-from sqlmodel import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core.config import Settings
+from app.core.config import Settings, get_settings
 from app.core.encryption import decrypt_credential, get_encryptor
 from app.db.models import Tenant
 from app.services.factus.client import FactusClient
+from app.services.factus.http_pool import get_http_client_registry
 from app.services.factus.service import FactusService
+from app.services.factus.tenant_settings_cache import get_tenant_settings_cache
 
 logger = logging.getLogger(__name__)
 
@@ -28,12 +30,12 @@ class FactusServiceFactory:
     def __init__(self, session: AsyncSession):
         self.session = session
 
-    async def create_service_for_tenant(self, tenant_id: int) -> FactusService:
+    async def create_service_for_tenant(self, tenant: Union[Tenant, int]) -> FactusService:
         """
         Crea un servicio de Factus configurado con las credenciales del tenant (restaurante).
 
         Args:
-            tenant_id: ID del Tenant
+            tenant: Tenant ya cargado (ej: el de get_current_tenant) o su ID
 
         Returns:
             Instancia configurada de FactusService
@@ -41,10 +43,13 @@ class FactusServiceFactory:
         Raises:
             HTTPException: Si el tenant no existe o faltan credenciales
         """
-        # 1. Buscar tenant en BD
-        stmt = select(Tenant).where(Tenant.id == tenant_id)
-        result = await self.session.exec(stmt)
-        tenant = result.first()
+        # 1. Resolver tenant. Con un Tenant ya cargado no se consulta la BD;
+        # con un ID, session.get() usa primero el identity map de la sesión.
+        if isinstance(tenant, Tenant):
+            tenant_id = tenant.id
+        else:
+            tenant_id = tenant
+            tenant = await self.session.get(Tenant, tenant_id)
 
         if not tenant:
             logger.error(f"Tenant ID {tenant_id} no encontrado.")
@@ -54,6 +59,53 @@ class FactusServiceFactory:
             logger.warning(f"Intento de usar tenant inactivo: {tenant.name} ({tenant_id})")
             raise HTTPException(status_code=400, detail="El tenant está inactivo")
 
+        # 2-4. Validar, desencriptar y construir configuración del tenant
+        tenant_settings = self.get_tenant_settings(tenant)
+
+        # 5. Instanciar Cliente y Servicio
+        # El AsyncClient es compartido (pool keep-alive por tenant) y lo cierra
+        # el lifespan de la app, no el consumidor del servicio.
+        http_client = get_http_client_registry().get_client(
+            tenant_id, tenant_settings.factus_base_url
+        )
+        client = FactusClient(http_client, tenant_settings)
+        
+        return FactusService(client, tenant_settings, owns_http_client=False)
+
+    @classmethod
+    def get_tenant_settings(cls, tenant: Tenant) -> Settings:
+        """
+        Obtiene la configuración de Factus del tenant, usando el cache de
+        configuraciones desencriptadas cuando es posible.
+
+        Raises:
+            HTTPException: Si faltan credenciales o no se pueden desencriptar
+        """
+        cache = get_tenant_settings_cache()
+
+        tenant_settings = cache.get(tenant)
+        if tenant_settings is None:
+            tenant_settings = cls.build_tenant_settings(tenant)
+            cache.set(tenant, tenant_settings)
+
+        return tenant_settings
+
+    @staticmethod
+    def build_tenant_settings(tenant: Tenant) -> Settings:
+        """
+        Construye la configuración de Factus con las credenciales desencriptadas del tenant.
+
+        Args:
+            tenant: Tenant con credenciales (posiblemente encriptadas)
+
+        Returns:
+            Settings con las credenciales en claro (NUNCA loguear)
+
+        Raises:
+            HTTPException: Si faltan credenciales o no se pueden desencriptar
+        """
+        tenant_id = tenant.id
+
         # 2. Validar existencia de credenciales
         if not all([
             tenant.factus_client_id,
@@ -97,19 +149,12 @@ class FactusServiceFactory:
                 detail="Error de seguridad con las credenciales del facturador"
             )
 
-        # 4. Crear configuración efímera
-        # Hereda defaults del entorno pero sobreescribe auth con datos del tenant
-        tenant_settings = Settings(
-            factus_client_id=client_id,
-            factus_client_secret=client_secret,
-            factus_email=email,
-            factus_password=password
-        )
-
-        # 5. Instanciar Cliente y Servicio
-        # Importante: Creamos un nuevo AsyncClient que debe ser cerrado por el consumidor
-        # (Usando service.close() o async context manager)
-        http_client = httpx.AsyncClient()
-        client = FactusClient(http_client, tenant_settings)
-        
-        return FactusService(client, tenant_settings)
+        # 4. Crear configuración del tenant
+        # Copia la configuración global (sin volver a leer .env) y sobreescribe
+        # auth con los datos del tenant
+        return get_settings().model_copy(update={
+            "factus_client_id": client_id,
+            "factus_client_secret": client_secret,
+            "factus_email": email,
+            "factus_password": password,
+        })
@@ -0,0 +1,133 @@
+"""
+Registro de clientes HTTP compartidos para la API de Factus.
+Mantiene un httpx.AsyncClient con keep-alive por tenant/base URL durante
+toda la vida del proceso, evitando repetir DNS + TCP + TLS en cada factura.
+"""
+
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+from app.core.config import Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+
+class FactusHTTPClientRegistry:
+    """
+    Registro de clientes HTTP con pool de conexiones.
+
+    Características:
+    - Un cliente por (tenant, base URL), reutilizado entre peticiones
+    - Límites de pool y keep-alive configurables desde Settings
+    - HTTP/2 opcional (factus_http2): las peticiones concurrentes de un
+      tenant se multiplexan sobre una sola conexión
+    - Cierre ordenado de todos los clientes en el shutdown de la app
+    """
+
+    def __init__(self, settings: Optional[Settings] = None):
+        """
+        Inicializa el registro.
+
+        Args:
+            settings: Configuración con los límites del pool.
+                      Si no se proporciona, se usa la configuración global.
+        """
+        self._settings = settings or get_settings()
+        self._clients: Dict[Tuple[str, str], httpx.AsyncClient] = {}
+        self._lock = asyncio.Lock()
+        self._http2 = self._settings.factus_http2 and self._http2_available()
+
+    def _build_limits(self) -> httpx.Limits:
+        """Construye los límites del pool a partir de la configuración."""
+        return httpx.Limits(
+            max_connections=self._settings.factus_http_max_connections,
+            max_keepalive_connections=self._settings.factus_http_max_keepalive_connections,
+            keepalive_expiry=self._settings.factus_http_keepalive_expiry,
+        )
+
+    @staticmethod
+    def _http2_available() -> bool:
+        """Verifica que el paquete h2 esté instalado (dependencia opcional)."""
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("FACTUS_HTTP2 activo pero el paquete 'h2' no está instalado; se usará HTTP/1.1")
+            return False
+        return True
+
+    def get_client(self, key: str, base_url: str) -> httpx.AsyncClient:
+        """
+        Obtiene (o crea) el cliente HTTP compartido para un tenant y base URL.
+
+        El cliente NO debe ser cerrado por el consumidor: su ciclo de vida
+        lo controla el registro (ver aclose()).
+
+        Args:
+            key: Identificador del tenant/cuenta (ej: ID del tenant)
+            base_url: URL base de Factus para ese tenant
+
+        Returns:
+            Cliente HTTP asíncrono con pool de conexiones
+        """
+        registry_key = (str(key), base_url)
+        client = self._clients.get(registry_key)
+
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(limits=self._build_limits(), http2=self._http2)
+            self._clients[registry_key] = client
+            logger.info(f"Cliente HTTP de Factus creado para tenant {key} ({base_url})")
+
+        return client
+
+    async def discard(self, key: str, base_url: str) -> None:
+        """Cierra y elimina el cliente de un tenant (ej: al desactivarlo)."""
+        async with self._lock:
+            client = self._clients.pop((str(key), base_url), None)
+        if client is not None:
+            await client.aclose()
+
+    async def aclose(self) -> None:
+        """Cierra todos los clientes registrados. Llamar en el shutdown."""
+        async with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+
+        for client in clients:
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"Error cerrando cliente HTTP de Factus: {e}")
+
+        if clients:
+            logger.info(f"{len(clients)} clientes HTTP de Factus cerrados")
+
+    @property
+    def size(self) -> int:
+        """Cantidad de clientes abiertos en el registro."""
+        return len(self._clients)
+
+
+# Instancia global (singleton)
+_registry: Optional[FactusHTTPClientRegistry] = None
+
+
+def get_http_client_registry() -> FactusHTTPClientRegistry:
+    """
+    Obtiene la instancia global del registro de clientes HTTP.
+    Patrón singleton para compartir el pool en todo el proceso.
+    """
+    global _registry
+    if _registry is None:
+        _registry = FactusHTTPClientRegistry()
+    return _registry
+
+
+async def close_http_client_registry() -> None:
+    """Cierra el registro global. Usar desde el lifespan de la app."""
+    global _registry
+    if _registry is not None:
+        await _registry.aclose()
+        _registry = None
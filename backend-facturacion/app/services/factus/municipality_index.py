@@ -0,0 +1,274 @@
+"""
+Índice en memoria del catálogo de municipios para búsquedas locales.
+El formulario de clientes del POS busca en cada tecla: el catálogo completo
+se refleja localmente y la búsqueda se resuelve sin llamar a Factus.
+"""
+
+import asyncio
+import logging
+import re
+import time
+import unicodedata
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from app.core.config import get_settings
+from app.schemas.factus import MunicipalitySchema
+
+logger = logging.getLogger(__name__)
+
+# Longitud máxima de los prefijos indexados (tokens más largos se verifican aparte)
+MAX_PREFIX_LENGTH = 12
+
+# Similitud mínima (Dice sobre trigramas) para la búsqueda aproximada
+MIN_TRIGRAM_SIMILARITY = 0.3
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """Minúsculas, sin tildes ni signos: 'Bogotá, D.C.' -> 'bogota d c'."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(_NON_ALNUM.sub(" ", stripped.lower()).split())
+
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class MunicipalityIndex:
+    """
+    Índice de municipios con búsqueda por prefijo y aproximada.
+
+    Características:
+    - Normalización sin tildes ni mayúsculas
+    - Prefijos de cada palabra del nombre (y del departamento/código DANE)
+    - Búsqueda aproximada por trigramas si no hay coincidencias por prefijo
+    - Ranking: nombre exacto > nombre que empieza por la búsqueda >
+      palabras del nombre > departamento/código > aproximadas
+    - Paginación local
+    """
+
+    def __init__(self, refresh_seconds: float = 86400.0):
+        self._refresh_seconds = refresh_seconds
+
+        self._items: List[MunicipalitySchema] = []
+        self._names: List[str] = []
+        self._name_prefixes: Dict[str, Set[int]] = {}
+        self._other_prefixes: Dict[str, Set[int]] = {}
+        self._trigrams: Dict[str, Set[int]] = {}
+        self._trigram_counts: List[int] = []
+        self._alphabetical: List[int] = []
+
+        self.built_at: Optional[float] = None
+        self._build_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+        # Métricas
+        self.stats: Dict[str, int] = {
+            "queries": 0,
+            "fuzzy_queries": 0,
+            "builds": 0,
+            "build_errors": 0,
+        }
+
+    # =========================================================================
+    # CONSTRUCCIÓN
+    # =========================================================================
+
+    def build(self, municipalities: List[MunicipalitySchema]) -> None:
+        """Construye el índice y lo reemplaza de una sola vez."""
+        names: List[str] = []
+        name_prefixes: Dict[str, Set[int]] = {}
+        other_prefixes: Dict[str, Set[int]] = {}
+        trigrams: Dict[str, Set[int]] = {}
+        trigram_counts: List[int] = []
+
+        for position, municipality in enumerate(municipalities):
+            name = normalize_text(municipality.name)
+            names.append(name)
+
+            for token in name.split():
+                for length in range(1, min(len(token), MAX_PREFIX_LENGTH) + 1):
+                    name_prefixes.setdefault(token[:length], set()).add(position)
+
+            other = normalize_text(f"{municipality.department or ''} {municipality.code}")
+            for token in other.split():
+                for length in range(1, min(len(token), MAX_PREFIX_LENGTH) + 1):
+                    other_prefixes.setdefault(token[:length], set()).add(position)
+
+            name_trigrams = _trigrams(name)
+            trigram_counts.append(len(name_trigrams))
+            for trigram in name_trigrams:
+                trigrams.setdefault(trigram, set()).add(position)
+
+        self._items = list(municipalities)
+        self._names = names
+        self._name_prefixes = name_prefixes
+        self._other_prefixes = other_prefixes
+        self._trigrams = trigrams
+        self._trigram_counts = trigram_counts
+        self._alphabetical = sorted(range(len(names)), key=lambda i: names[i])
+        self.built_at = time.monotonic()
+        self.stats["builds"] += 1
+
+        logger.info(f"Índice de municipios construido ({len(self._items)} municipios)")
+
+    @property
+    def is_ready(self) -> bool:
+        """True si el índice ya tiene datos."""
+        return self.built_at is not None
+
+    @property
+    def needs_refresh(self) -> bool:
+        """True si el índice está vacío o vencido."""
+        return (
+            self.built_at is None
+            or time.monotonic() - self.built_at >= self._refresh_seconds
+        )
+
+    async def ensure_fresh(
+        self,
+        loader: Callable[[], Awaitable[List[MunicipalitySchema]]]
+    ) -> None:
+        """
+        Garantiza que el índice tenga datos.
+
+        - Vacío: construye esperando a `loader` (una sola vez)
+        - Vencido: sigue sirviendo el actual y reconstruye en segundo plano
+        """
+        if not self.is_ready:
+            async with self._build_lock:
+                if not self.is_ready:
+                    self.build(await loader())
+            return
+
+        if self.needs_refresh and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = asyncio.create_task(self._refresh(loader))
+
+    async def _refresh(self, loader: Callable[[], Awaitable[List[MunicipalitySchema]]]) -> None:
+        try:
+            async with self._build_lock:
+                self.build(await loader())
+        except Exception as e:
+            self.stats["build_errors"] += 1
+            logger.warning(f"No se pudo refrescar el índice de municipios: {e}")
+
+    # =========================================================================
+    # BÚSQUEDA
+    # =========================================================================
+
+    def search(
+        self,
+        query: Optional[str] = None,
+        page: int = 1,
+        per_page: int = 50
+    ) -> Tuple[List[MunicipalitySchema], int]:
+        """
+        Busca municipios en el índice.
+
+        Args:
+            query: Texto de búsqueda (nombre, departamento o código DANE)
+            page: Página (desde 1)
+            per_page: Resultados por página
+
+        Returns:
+            (municipios de la página, total de coincidencias)
+        """
+        self.stats["queries"] += 1
+        normalized = normalize_text(query)
+
+        if not normalized:
+            ranked = self._alphabetical
+        else:
+            ranked = self._prefix_search(normalized)
+            if not ranked:
+                self.stats["fuzzy_queries"] += 1
+                ranked = self._fuzzy_search(normalized)
+
+        start = (page - 1) * per_page
+        return [self._items[i] for i in ranked[start:start + per_page]], len(ranked)
+
+    def _lookup(self, prefixes: Dict[str, Set[int]], token: str) -> Set[int]:
+        candidates = prefixes.get(token[:MAX_PREFIX_LENGTH], set())
+        if len(token) <= MAX_PREFIX_LENGTH:
+            return candidates
+        # Token más largo que los prefijos indexados: verificar completo
+        return {
+            i for i in candidates
+            if any(word.startswith(token) for word in self._words_for(prefixes, i))
+        }
+
+    def _words_for(self, prefixes: Dict[str, Set[int]], position: int) -> List[str]:
+        if prefixes is self._name_prefixes:
+            return self._names[position].split()
+        item = self._items[position]
+        return normalize_text(f"{item.department or ''} {item.code}").split()
+
+    def _prefix_search(self, normalized: str) -> List[int]:
+        """Cada palabra de la búsqueda debe ser prefijo de alguna palabra."""
+        in_name: Optional[Set[int]] = None
+        anywhere: Optional[Set[int]] = None
+
+        for token in normalized.split():
+            name_matches = self._lookup(self._name_prefixes, token)
+            all_matches = name_matches | self._lookup(self._other_prefixes, token)
+            in_name = name_matches if in_name is None else in_name & name_matches
+            anywhere = all_matches if anywhere is None else anywhere & all_matches
+            if not anywhere:
+                return []
+
+        def rank(position: int) -> Tuple[int, int, str]:
+            name = self._names[position]
+            if name == normalized:
+                tier = 0
+            elif name.startswith(normalized):
+                tier = 1
+            elif position in in_name:
+                tier = 2
+            else:
+                tier = 3
+            return tier, len(name), name
+
+        return sorted(anywhere, key=rank)
+
+    def _fuzzy_search(self, normalized: str) -> List[int]:
+        """Coincidencias aproximadas (errores de digitación) por trigramas."""
+        query_trigrams = _trigrams(normalized)
+        shared: Counter = Counter()
+        for trigram in query_trigrams:
+            for position in self._trigrams.get(trigram, ()):
+                shared[position] += 1
+
+        scored = []
+        for position, count in shared.items():
+            similarity = 2 * count / (len(query_trigrams) + self._trigram_counts[position])
+            if similarity >= MIN_TRIGRAM_SIMILARITY:
+                scored.append((-similarity, self._names[position], position))
+
+        scored.sort()
+        return [position for _, _, position in scored]
+
+    def snapshot(self) -> dict:
+        """Métricas para monitoreo."""
+        return {
+            **self.stats,
+            "municipalities": len(self._items),
+            "age_seconds": round(time.monotonic() - self.built_at, 1) if self.built_at else None,
+        }
+
+
+# Instancia global (singleton)
+_municipality_index: Optional[MunicipalityIndex] = None
+
+
+def get_municipality_index() -> MunicipalityIndex:
+    """Obtiene la instancia global del índice de municipios."""
+    global _municipality_index
+    if _municipality_index is None:
+        _municipality_index = MunicipalityIndex(
+            refresh_seconds=get_settings().factus_municipality_index_refresh_seconds
+        )
+    return _municipality_index
@@ -0,0 +1,174 @@
+"""
+Rate limiter del tráfico saliente hacia Factus.
+Token bucket global (todo el proceso) y por cuenta de Factus: las peticiones
+esperan su turno de forma asíncrona en lugar de provocar 429 en Factus.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+from app.core.config import Settings, get_settings
+from app.core.exceptions import FactusRateLimitError
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Token bucket con reservas.
+
+    Cada petición reserva un token aunque el saldo quede negativo; el saldo
+    negativo indica cuánto debe esperar. Así las peticiones se atienden en
+    orden de llegada sin necesidad de un lock.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def reserve(self) -> float:
+        """
+        Reserva un token.
+
+        Returns:
+            Segundos que hay que esperar para usar el token reservado
+        """
+        self._refill()
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self.rate
+
+    def cancel(self) -> None:
+        """Devuelve un token reservado que no se usará."""
+        self._tokens = min(self.burst, self._tokens + 1)
+
+
+class FactusRateLimiter:
+    """
+    Limitador de peticiones hacia Factus.
+
+    Características:
+    - Bucket global y un bucket por cuenta (cache_key del auth manager)
+    - Límites por cuenta configurables por client_id
+    - Si la espera supera max_wait_seconds se rechaza con FactusRateLimitError
+    - Métricas de tiempo en cola
+    """
+
+    def __init__(self, settings: Optional[Settings] = None):
+        self._settings = settings or get_settings()
+        self._global = TokenBucket(
+            self._settings.factus_rate_limit_global_per_second,
+            self._settings.factus_rate_limit_global_burst,
+        )
+        self._accounts: Dict[str, TokenBucket] = {}
+
+        # Métricas
+        self.stats: Dict[str, float] = {
+            "acquired": 0,
+            "queued": 0,
+            "rejected": 0,
+            "cancelled": 0,
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+        }
+
+    def _bucket_for(self, account_key: str, client_id: Optional[str]) -> TokenBucket:
+        bucket = self._accounts.get(account_key)
+        if bucket is None:
+            override = self._settings.factus_rate_limit_account_overrides.get(client_id or "", {})
+            bucket = TokenBucket(
+                override.get("per_second", self._settings.factus_rate_limit_account_per_second),
+                override.get("burst", self._settings.factus_rate_limit_account_burst),
+            )
+            self._accounts[account_key] = bucket
+        return bucket
+
+    async def acquire(
+        self,
+        account_key: str,
+        client_id: Optional[str] = None,
+        max_wait: Optional[float] = None
+    ) -> float:
+        """
+        Espera turno para enviar una petición a Factus.
+
+        Args:
+            account_key: Identificador (hash) de la cuenta de Factus
+            client_id: client_id de Factus (para buscar límites propios)
+            max_wait: Espera máxima en segundos (por defecto la configurada)
+
+        Returns:
+            Segundos esperados en cola
+
+        Raises:
+            FactusRateLimitError: Si el turno llegaría después de max_wait
+        """
+        if not self._settings.factus_rate_limit_enabled:
+            return 0.0
+
+        if max_wait is None:
+            max_wait = self._settings.factus_rate_limit_max_wait_seconds
+
+        account_bucket = self._bucket_for(account_key, client_id)
+        wait = max(self._global.reserve(), account_bucket.reserve())
+
+        if wait > max_wait:
+            self._global.cancel()
+            account_bucket.cancel()
+            self.stats["rejected"] += 1
+            logger.warning(
+                f"Rate limit de Factus: espera de {wait:.2f}s supera el máximo ({max_wait}s)"
+            )
+            raise FactusRateLimitError(retry_after=round(wait, 1))
+
+        if wait > 0:
+            self.stats["queued"] += 1
+            try:
+                await asyncio.sleep(wait)
+            except (asyncio.CancelledError, TimeoutError):
+                # El que esperaba se fue (cliente desconectado, timeout externo):
+                # devolver la reserva para no perder capacidad
+                self._global.cancel()
+                account_bucket.cancel()
+                self.stats["cancelled"] += 1
+                raise
+
+        self.stats["acquired"] += 1
+        self.stats["total_wait_seconds"] += wait
+        self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], wait)
+        return wait
+
+    def snapshot(self) -> dict:
+        """Métricas para monitoreo."""
+        acquired = self.stats["acquired"]
+        return {
+            "acquired": int(acquired),
+            "queued": int(self.stats["queued"]),
+            "rejected": int(self.stats["rejected"]),
+            "cancelled": int(self.stats["cancelled"]),
+            "avg_wait_seconds": round(self.stats["total_wait_seconds"] / acquired, 3) if acquired else 0.0,
+            "max_wait_seconds": round(self.stats["max_wait_seconds"], 3),
+            "accounts": len(self._accounts),
+        }
+
+
+# Instancia global (singleton)
+_rate_limiter: Optional[FactusRateLimiter] = None
+
+
+def get_rate_limiter() -> FactusRateLimiter:
+    """Obtiene el rate limiter global de Factus."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = FactusRateLimiter()
+    return _rate_limiter
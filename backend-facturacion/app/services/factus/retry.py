@@ -0,0 +1,115 @@
+"""
+Políticas de reintento para las peticiones a Factus.
+Backoff exponencial con jitter y un presupuesto de reintentos global para no
+amplificar la carga cuando Factus está degradado.
+"""
+
+import random
+from dataclasses import dataclass, field, replace
+from typing import FrozenSet, Optional
+
+from app.core.config import Settings, get_settings
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Política de reintentos para un grupo de endpoints."""
+
+    max_attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 8.0
+    retry_on_status: FrozenSet[int] = field(
+        default_factory=lambda: frozenset({429, 502, 503, 504})
+    )
+    retry_on_timeout: bool = True
+
+    def compute_delay(self, attempt: int) -> float:
+        """
+        Calcula la espera antes del siguiente intento ("full jitter").
+
+        Args:
+            attempt: Número del intento que acaba de fallar (1 = primero)
+
+        Returns:
+            Segundos a esperar
+        """
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+
+class RetryBudget:
+    """
+    Presupuesto de reintentos (token bucket).
+
+    Cada petición original aporta `ratio` tokens y cada reintento consume uno.
+    Así, en una caída de Factus los reintentos nunca superan aprox. el
+    `ratio` del tráfico normal.
+    """
+
+    def __init__(self, ratio: float = 0.2, max_tokens: float = 20.0):
+        self._ratio = ratio
+        self._max_tokens = max_tokens
+        self._tokens = max_tokens
+
+        # Métricas
+        self.retries = 0
+        self.exhausted = 0
+
+    def record_request(self) -> None:
+        """Registra una petición original (no reintento)."""
+        self._tokens = min(self._max_tokens, self._tokens + self._ratio)
+
+    def try_acquire(self) -> bool:
+        """
+        Intenta consumir un token para reintentar.
+
+        Returns:
+            True si hay presupuesto para el reintento
+        """
+        if self._tokens >= 1:
+            self._tokens -= 1
+            self.retries += 1
+            return True
+        self.exhausted += 1
+        return False
+
+    @property
+    def available(self) -> float:
+        """Tokens disponibles para reintentos."""
+        return self._tokens
+
+
+def build_retry_policy(group: str, settings: Optional[Settings] = None) -> RetryPolicy:
+    """
+    Construye la política de un grupo de endpoints.
+
+    Parte de los valores globales (factus_retry_*) y aplica los overrides de
+    factus_retry_policies[group], ej: {"bill_creation": {"max_attempts": 4}}.
+    """
+    settings = settings or get_settings()
+
+    policy = RetryPolicy(
+        max_attempts=settings.factus_retry_max_attempts,
+        base_delay=settings.factus_retry_base_delay_seconds,
+        max_delay=settings.factus_retry_max_delay_seconds,
+    )
+
+    overrides = dict(settings.factus_retry_policies.get(group, {}))
+    if "retry_on_status" in overrides:
+        overrides["retry_on_status"] = frozenset(overrides["retry_on_status"])
+
+    return replace(policy, **overrides) if overrides else policy
+
+
+# Instancia global (singleton)
+_retry_budget: Optional[RetryBudget] = None
+
+
+def get_retry_budget() -> RetryBudget:
+    """
+    Obtiene el presupuesto global de reintentos del proceso.
+    """
+    global _retry_budget
+    if _retry_budget is None:
+        _retry_budget = RetryBudget(ratio=get_settings().factus_retry_budget_ratio)
+    return _retry_budget
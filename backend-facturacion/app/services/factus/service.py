@@ -3,14 +3,15 @@ Servicio de negocio para facturación electrónica con Factus.
 Contiene la lógica de alto nivel para crear facturas, consultar catálogos, etc.
 """
 
+import base64
 import logging
-from typing import List, Optional
+from typing import Any, List, Optional, Tuple
 from decimal import Decimal
 
 import httpx
 
 from app.core.config import Settings, get_settings
-from app.core.exceptions import FactusInvoiceError
+from app.core.exceptions import FactusAPIError, FactusCircuitOpenError, FactusInvoiceError, FactusRateLimitError
 from app.schemas.factus import (
     InvoiceCreateSchema,
     InvoiceResponseSchema,
@@ -23,6 +24,7 @@ from app.schemas.factus import (
     TributeSchema,
     CreditNoteCreate,
 )
+from app.services.factus.catalog_cache import get_catalog_cache
 from app.services.factus.client import FactusClient
 
 logger = logging.getLogger(__name__)
@@ -38,22 +40,35 @@ class FactusService:
     - Mapear órdenes de restaurante al formato de factura
     """
     
-    def __init__(self, client: FactusClient, settings: Settings):
+    def __init__(
+        self, 
+        client: FactusClient, 
+        settings: Settings,
+        owns_http_client: bool = True
+    ):
         """
         Inicializa el servicio de Factus.
         
         Args:
             client: Cliente HTTP de Factus configurado
             settings: Configuración de la aplicación
+            owns_http_client: Si False, el AsyncClient es compartido (pool)
+                              y close() no lo cierra
         """
         self._client = client
         self._settings = settings
+        self._owns_http_client = owns_http_client
 
     async def close(self):
-        """Cierra la conexión HTTP subyacente."""
-        if hasattr(self._client, "_client"):
+        """Cierra la conexión HTTP subyacente (solo si el servicio es su dueño)."""
+        if self._owns_http_client and hasattr(self._client, "_client"):
             await self._client._client.aclose()
 
+    @property
+    def account_key(self) -> str:
+        """Identificador (hash) de la cuenta de Factus del servicio."""
+        return self._client.account_key
+
     async def __aenter__(self):
         return self
 
@@ -64,6 +79,31 @@ class FactusService:
     # CATÁLOGOS
     # =========================================================================
     
+    async def check_connection(self) -> None:
+        """
+        Verifica autenticación y conectividad con Factus (sin pasar por el
+        cache de catálogos).
+        """
+        await self._client.get("/v1/payment-methods")
+    
+    async def _get_catalog(self, name: str, endpoint: str, params: Optional[dict] = None) -> list:
+        """
+        Obtiene un catálogo DIAN a través del cache compartido.
+        
+        Los catálogos son iguales para todos los tenants: la clave solo
+        depende de la URL de Factus, el endpoint y los parámetros.
+        """
+        key = f"{self._settings.factus_base_url}|{name}"
+        if params:
+            key += "|" + "&".join(f"{k}={v}" for k, v in sorted(params.items()))
+        
+        async def fetch() -> list:
+            logger.info(f"Consultando catálogo {name} en Factus")
+            response = await self._client.get(endpoint, params=params)
+            return response.get("data", []) if isinstance(response, dict) else response
+        
+        return await get_catalog_cache().get_or_fetch(key, fetch)
+    
     async def get_numbering_ranges(self) -> List[NumberingRangeSchema]:
         """
         Obtiene los rangos de numeración autorizados por la DIAN.
@@ -101,16 +141,37 @@ class FactusService:
         Returns:
             Lista de municipios
         """
-        logger.info("Consultando municipios de Factus")
         params = {"page": page, "per_page": per_page}
         if search:
             params["search"] = search
             
-        response = await self._client.get("/v1/municipalities", params=params)
-        data = response.get("data", []) if isinstance(response, dict) else response
+        data = await self._get_catalog("municipalities", "/v1/municipalities", params)
         
         return [MunicipalitySchema(**item) for item in data]
     
+    async def get_all_municipalities(self, per_page: int = 100, max_pages: int = 50) -> List[MunicipalitySchema]:
+        """
+        Obtiene el catálogo completo de municipios recorriendo las páginas.
+        
+        Se detiene cuando una página llega incompleta o no aporta municipios
+        nuevos (por si Factus ignora la paginación y devuelve todo).
+        
+        Returns:
+            Lista completa de municipios (sin duplicados)
+        """
+        municipalities = {}
+        
+        for page in range(1, max_pages + 1):
+            batch = await self.get_municipalities(page=page, per_page=per_page)
+            before = len(municipalities)
+            for municipality in batch:
+                municipalities[municipality.id] = municipality
+            
+            if len(batch) < per_page or len(municipalities) == before:
+                break
+        
+        return list(municipalities.values())
+    
     async def get_tributes(self) -> List[TributeSchema]:
         """
         Obtiene el catálogo de tributos (impuestos) disponibles.
@@ -122,9 +183,7 @@ class FactusService:
         Returns:
             Lista de tributos disponibles
         """
-        logger.info("Consultando tributos de Factus")
-        response = await self._client.get("/v1/tributes")
-        data = response.get("data", []) if isinstance(response, dict) else response
+        data = await self._get_catalog("tributes", "/v1/tributes")
         
         return [TributeSchema(**item) for item in data]
     
@@ -141,9 +200,7 @@ class FactusService:
         Returns:
             Lista de métodos de pago
         """
-        logger.info("Consultando métodos de pago de Factus")
-        response = await self._client.get("/v1/payment-methods")
-        return response.get("data", []) if isinstance(response, dict) else response
+        return await self._get_catalog("payment_methods", "/v1/payment-methods")
     
     # =========================================================================
     # FACTURACIÓN
@@ -171,33 +228,59 @@ class FactusService:
         payload = invoice_data.to_factus_payload()
         
         try:
-            response = await self._client.post("/v1/bills/validate", data=payload)
-            
-            # Extraer datos de respuesta
-            data = response.get("data", response) if isinstance(response, dict) else response
-            
-            bill_data = data.get("bill", {})
-            
-            return InvoiceResponseSchema(
-                id=bill_data.get("id"),
-                number=bill_data.get("number", ""),
-                prefix=data.get("numbering_range", {}).get("prefix"),
-                cufe=bill_data.get("cufe", ""),
-                status=str(bill_data.get("status", "created")),
-                pdf_url=bill_data.get("public_url"), # Factus returns public_url
-                xml_url=None, # Factus API v1 validate response might not return xml_url directly in bill?
-                qr_code=bill_data.get("qr"),
-                created_at=None, # Parse string? 
-                validated_at=None 
+            # reference_code como clave de idempotencia: permite reintentar sin
+            # duplicar la factura si Factus ya la recibió
+            response = await self._client.post(
+                "/v1/bills/validate", 
+                data=payload,
+                idempotency_key=invoice_data.reference_code
             )
             
+            return self._parse_bill_response(response)
+            
+        except (FactusCircuitOpenError, FactusRateLimitError):
+            raise
         except Exception as e:
             logger.error(f"Error al crear factura {invoice_data.reference_code}: {e}")
             raise FactusInvoiceError(
                 message=f"No se pudo crear la factura: {str(e)}",
                 invoice_reference=invoice_data.reference_code,
                 details=str(e)
-            )
+            ) from e
+    
+    async def find_invoice_by_reference(
+        self,
+        reference_code: str
+    ) -> Optional[InvoiceResponseSchema]:
+        """
+        Busca en Factus una factura ya creada con el reference_code dado.
+        
+        Returns:
+            La factura (mismo formato que create_invoice) o None si no existe
+        """
+        response = await self._client.find_bill_by_reference(reference_code)
+        return self._parse_bill_response(response) if response is not None else None
+    
+    @staticmethod
+    def _parse_bill_response(response: Any) -> InvoiceResponseSchema:
+        """Convierte la respuesta de creación/consulta de factura de Factus."""
+        # Extraer datos de respuesta
+        data = response.get("data", response) if isinstance(response, dict) else response
+        
+        bill_data = data.get("bill", {})
+        
+        return InvoiceResponseSchema(
+            id=bill_data.get("id"),
+            number=bill_data.get("number", ""),
+            prefix=data.get("numbering_range", {}).get("prefix"),
+            cufe=bill_data.get("cufe", ""),
+            status=str(bill_data.get("status", "created")),
+            pdf_url=bill_data.get("public_url"), # Factus returns public_url
+            xml_url=None, # Factus API v1 validate response might not return xml_url directly in bill?
+            qr_code=bill_data.get("qr"),
+            created_at=None, # Parse string? 
+            validated_at=None 
+        )
     
     async def get_invoice(self, invoice_number: str) -> dict:
         """
@@ -239,6 +322,26 @@ class FactusService:
         invoice = await self.get_invoice(invoice_number)
         return invoice.get("xml_url")
 
+    async def fetch_invoice_document(self, invoice_number: str, kind: str) -> Tuple[bytes, Optional[str]]:
+        """
+        Descarga el contenido del PDF o el XML de una factura.
+
+        Args:
+            invoice_number: Número de la factura
+            kind: "pdf" o "xml"
+
+        Returns:
+            (bytes del archivo, nombre sugerido por Factus)
+        """
+        logger.info(f"Descargando {kind.upper()} de la factura: {invoice_number}")
+        response = await self._client.get(f"/v1/bills/download-{kind}/{invoice_number}")
+        data = response.get("data", response) if isinstance(response, dict) else {}
+
+        encoded = data.get(f"{kind}_base_64_encoded") if isinstance(data, dict) else None
+        if not encoded:
+            raise FactusAPIError(message=f"Factus no devolvió el {kind.upper()} de la factura {invoice_number}")
+        return base64.b64decode(encoded), data.get("file_name")
+
     async def validate_invoice(self, invoice_number: str) -> dict:
         """
         Valida una factura creada previamente en Factus.
@@ -323,7 +426,11 @@ class FactusService:
         
         try:
             # Enviar a Factus (mismo endpoint de validación/creación)
-            response = await self._client.post("/v1/bills/validate", data=payload)
+            response = await self._client.post(
+                "/v1/bills/validate", 
+                data=payload,
+                idempotency_key=payload["reference_code"]
+            )
             
             data_resp = response.get("data", response) if isinstance(response, dict) else response
             bill_resp = data_resp.get("bill", {})
@@ -341,6 +448,8 @@ class FactusService:
                 validated_at=None
             )
             
+        except (FactusCircuitOpenError, FactusRateLimitError):
+            raise
         except Exception as e:
              logger.error(f"Error creando Nota Crédito: {e}")
              raise FactusInvoiceError(
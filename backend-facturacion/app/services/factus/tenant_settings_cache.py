@@ -0,0 +1,115 @@
+"""
+Cache de la configuración de Factus por tenant (credenciales ya desencriptadas).
+Evita repetir la desencriptación Fernet y la construcción de Settings en cada
+petición de facturación.
+"""
+
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from app.core.config import Settings, get_settings
+from app.db.models import Tenant
+
+logger = logging.getLogger(__name__)
+
+
+class TenantSettingsCache:
+    """
+    Cache LRU con TTL de Settings por tenant.
+
+    Características:
+    - Tamaño acotado (se descarta el tenant usado hace más tiempo)
+    - Expiración por TTL
+    - Huella de las credenciales guardadas (encriptadas): si otro worker
+      las cambia en la BD, la entrada deja de ser válida
+    - Nunca registra credenciales en los logs
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 300.0):
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[int, Tuple[Settings, float, str]]" = OrderedDict()
+
+        # Métricas
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def fingerprint(tenant: Tenant) -> str:
+        """Huella de las credenciales tal como están guardadas en la BD."""
+        raw = "|".join([
+            tenant.factus_client_id or "",
+            tenant.factus_client_secret or "",
+            tenant.factus_email or "",
+            tenant.factus_password or "",
+        ])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, tenant: Tenant) -> Optional[Settings]:
+        """Obtiene la configuración cacheada del tenant (o None)."""
+        entry = self._entries.get(tenant.id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        settings, expires_at, fingerprint = entry
+        if time.monotonic() >= expires_at or fingerprint != self.fingerprint(tenant):
+            del self._entries[tenant.id]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(tenant.id)
+        self.hits += 1
+        return settings
+
+    def set(self, tenant: Tenant, settings: Settings) -> None:
+        """Guarda la configuración del tenant."""
+        self._entries[tenant.id] = (
+            settings,
+            time.monotonic() + self._ttl_seconds,
+            self.fingerprint(tenant),
+        )
+        self._entries.move_to_end(tenant.id)
+
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, tenant_id: int) -> None:
+        """Elimina la configuración de un tenant (ej: al cambiar credenciales)."""
+        if self._entries.pop(tenant_id, None) is not None:
+            logger.info(f"Configuración de Factus del tenant {tenant_id} invalidada")
+
+    def clear(self) -> None:
+        """
+        Elimina todas las entradas. Llamar en el shutdown.
+        Los str de Python son inmutables: se sueltan las referencias para que
+        las credenciales en claro no sobrevivan en el cache.
+        """
+        count = len(self._entries)
+        self._entries.clear()
+        if count:
+            logger.info(f"Cache de configuración de tenants vaciado ({count} entradas)")
+
+    @property
+    def size(self) -> int:
+        """Cantidad de tenants con configuración cacheada."""
+        return len(self._entries)
+
+
+# Instancia global (singleton)
+_tenant_settings_cache: Optional[TenantSettingsCache] = None
+
+
+def get_tenant_settings_cache() -> TenantSettingsCache:
+    """Obtiene la instancia global del cache de configuración de tenants."""
+    global _tenant_settings_cache
+    if _tenant_settings_cache is None:
+        settings = get_settings()
+        _tenant_settings_cache = TenantSettingsCache(
+            max_entries=settings.tenant_settings_cache_max_entries,
+            ttl_seconds=settings.tenant_settings_cache_ttl_seconds,
+        )
+    return _tenant_settings_cache
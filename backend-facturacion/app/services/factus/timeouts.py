@@ -0,0 +1,41 @@
+"""
+Timeouts de las peticiones a Factus por grupo de endpoints.
+Los catálogos y la autenticación deben responder rápido; la creación y
+validación de facturas esperan la respuesta de la DIAN y toleran más lectura.
+"""
+
+from typing import Dict, Optional
+
+import httpx
+
+from app.core.config import Settings, get_settings
+from app.services.factus.endpoints import AUTH, BILL_CREATION, BILL_VALIDATION, CATALOGS, DEFAULT
+
+# Valores por defecto (segundos) para connect/read/write/pool
+DEFAULT_TIMEOUTS: Dict[str, Dict[str, float]] = {
+    AUTH: {"connect": 5.0, "read": 15.0, "write": 10.0, "pool": 5.0},
+    CATALOGS: {"connect": 5.0, "read": 15.0, "write": 10.0, "pool": 5.0},
+    BILL_CREATION: {"connect": 5.0, "read": 60.0, "write": 15.0, "pool": 10.0},
+    BILL_VALIDATION: {"connect": 5.0, "read": 60.0, "write": 15.0, "pool": 10.0},
+    DEFAULT: {"connect": 5.0, "read": 30.0, "write": 15.0, "pool": 10.0},
+}
+
+
+def build_timeout(group: str, settings: Optional[Settings] = None) -> httpx.Timeout:
+    """
+    Construye el timeout de un grupo de endpoints.
+
+    Parte de DEFAULT_TIMEOUTS (o del grupo "default" si el grupo no tiene
+    valores propios) y aplica los overrides de factus_timeouts[group].
+    """
+    settings = settings or get_settings()
+
+    values = dict(DEFAULT_TIMEOUTS.get(group, DEFAULT_TIMEOUTS[DEFAULT]))
+    values.update(settings.factus_timeouts.get(group, {}))
+
+    return httpx.Timeout(
+        connect=values["connect"],
+        read=values["read"],
+        write=values["write"],
+        pool=values["pool"],
+    )
@@ -0,0 +1,114 @@
+"""
+Cache de tokens OAuth2 de Factus compartido a nivel de proceso.
+Permite que las distintas instancias de FactusAuthManager (una por petición)
+reutilicen el mismo token mientras sea válido.
+"""
+
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional
+
+from app.core.config import Settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedToken:
+    """Token OAuth2 almacenado en el cache."""
+
+    access_token: Optional[str]
+    refresh_token: Optional[str]
+    expires_at: Optional[datetime]
+
+
+class FactusTokenCache:
+    """
+    Cache en memoria de tokens de Factus, indexado por credenciales del tenant.
+
+    Características:
+    - Una entrada por cuenta de Factus (base URL + client_id + usuario)
+    - Un asyncio.Lock por cuenta para que solo una petición haga login/refresh
+    - La clave incluye un hash de los secretos: si cambian, la entrada antigua
+      deja de usarse automáticamente
+    """
+
+    def __init__(self):
+        self._tokens: Dict[str, CachedToken] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        
+        # Contadores para monitoreo: renovaciones dentro de una petición
+        # (inline) vs. hechas en segundo plano (proactive)
+        self.stats: Dict[str, int] = {
+            "inline_refreshes": 0,
+            "proactive_refreshes": 0,
+        }
+
+    @staticmethod
+    def key_for(settings: Settings) -> str:
+        """
+        Calcula la clave de cache para unas credenciales.
+        Nunca contiene secretos en claro.
+        """
+        raw = "|".join([
+            settings.factus_base_url,
+            settings.factus_client_id,
+            settings.factus_client_secret,
+            settings.factus_email,
+            settings.factus_password,
+        ])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def lock_for(self, key: str) -> asyncio.Lock:
+        """Obtiene el lock compartido de una cuenta."""
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+    def get(self, key: str) -> Optional[CachedToken]:
+        """Obtiene el token cacheado de una cuenta (o None)."""
+        return self._tokens.get(key)
+
+    def set(self, key: str, token: CachedToken) -> None:
+        """Guarda el token de una cuenta."""
+        self._tokens[key] = token
+
+    def invalidate(self, key: str) -> None:
+        """Elimina el token de una cuenta (ej: tras un 401 de la API)."""
+        self._tokens.pop(key, None)
+
+    def record_refresh(self, proactive: bool) -> None:
+        """Registra una renovación de token para las métricas."""
+        if proactive:
+            self.stats["proactive_refreshes"] += 1
+        else:
+            self.stats["inline_refreshes"] += 1
+
+    def clear(self) -> None:
+        """Elimina todos los tokens cacheados."""
+        self._tokens.clear()
+
+    @property
+    def size(self) -> int:
+        """Cantidad de cuentas con token cacheado."""
+        return len(self._tokens)
+
+
+# Instancia global (singleton)
+_token_cache: Optional[FactusTokenCache] = None
+
+
+def get_token_cache() -> FactusTokenCache:
+    """
+    Obtiene la instancia global del cache de tokens.
+    Patrón singleton para compartir tokens entre peticiones.
+    """
+    global _token_cache
+    if _token_cache is None:
+        _token_cache = FactusTokenCache()
+    return _token_cache
@@ -0,0 +1,151 @@
+"""
+Renovación proactiva de tokens de Factus en segundo plano.
+Revisa periódicamente los tenants con facturación activa y renueva sus tokens
+antes de que entren en el margen de expiración, para que ninguna petición de
+usuario tenga que esperar el flujo OAuth.
+"""
+
+import asyncio
+import logging
+import random
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from app.core.config import Settings, get_settings
+from app.db.database import async_session_maker
+from app.db.models import Tenant
+from app.services.factus.auth import FactusAuthManager
+from app.services.factus.factory import FactusServiceFactory
+from app.services.factus.http_pool import get_http_client_registry
+
+logger = logging.getLogger(__name__)
+
+
+class FactusTokenRefresher:
+    """
+    Tarea en segundo plano que renueva tokens antes de que expiren.
+
+    Características:
+    - Recorre los tenants con billing_active en cada ciclo
+    - Anticipación con jitter para repartir las renovaciones en el tiempo
+    - Un error en un tenant no detiene el ciclo de los demás
+    """
+
+    def __init__(
+        self,
+        settings: Optional[Settings] = None,
+        session_maker=async_session_maker,
+    ):
+        self._settings = settings or get_settings()
+        self._session_maker = session_maker
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+        # Último error por tenant (para monitoreo)
+        self.last_errors: Dict[int, str] = {}
+
+    def start(self) -> None:
+        """Inicia la tarea en segundo plano."""
+        if self._task is not None:
+            return
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run(), name="factus-token-refresher")
+        logger.info("Refresher de tokens de Factus iniciado")
+
+    async def stop(self) -> None:
+        """Detiene la tarea y espera a que termine."""
+        if self._task is None:
+            return
+        self._stopping.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info("Refresher de tokens de Factus detenido")
+
+    async def _run(self) -> None:
+        """Ciclo principal: refrescar y dormir hasta el próximo intervalo."""
+        interval = self._settings.token_refresher_interval_seconds
+
+        while not self._stopping.is_set():
+            try:
+                await self.refresh_due_tokens()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error en ciclo del refresher de tokens: {e}")
+
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def refresh_due_tokens(self) -> int:
+        """
+        Renueva los tokens de los tenants activos que estén por expirar.
+
+        Returns:
+            Cantidad de tokens renovados en este ciclo
+        """
+        async with self._session_maker() as session:
+            result = await session.execute(
+                select(Tenant).where(
+                    Tenant.billing_active == True,
+                    Tenant.is_active == True,
+                )
+            )
+            tenants = result.scalars().all()
+
+        refreshed = 0
+        for tenant in tenants:
+            if await self._refresh_tenant(tenant):
+                refreshed += 1
+
+        if refreshed:
+            logger.info(f"Refresher: {refreshed} tokens renovados proactivamente")
+        return refreshed
+
+    async def _refresh_tenant(self, tenant: Tenant) -> bool:
+        """Renueva el token de un tenant si está dentro de la ventana."""
+        try:
+            tenant_settings = FactusServiceFactory.get_tenant_settings(tenant)
+        except HTTPException:
+            # Sin credenciales válidas: nada que renovar
+            return False
+
+        # La ventana cubre al menos un intervalo completo (para que el token
+        # no entre al margen antes del próximo ciclo) más un jitter aleatorio
+        lookahead = (
+            self._settings.token_refresher_interval_seconds
+            + random.uniform(0, self._settings.token_refresher_jitter_seconds)
+        )
+
+        http_client = get_http_client_registry().get_client(
+            tenant.id, tenant_settings.factus_base_url
+        )
+        auth_manager = FactusAuthManager(http_client, tenant_settings)
+
+        try:
+            refreshed = await auth_manager.refresh_ahead(lookahead)
+            self.last_errors.pop(tenant.id, None)
+            return refreshed
+        except Exception as e:
+            logger.warning(f"No se pudo renovar proactivamente el token del tenant {tenant.id}: {e}")
+            self.last_errors[tenant.id] = str(e)
+            return False
+
+
+# Instancia global (singleton)
+_refresher: Optional[FactusTokenRefresher] = None
+
+
+def get_token_refresher() -> FactusTokenRefresher:
+    """Obtiene la instancia global del refresher."""
+    global _refresher
+    if _refresher is None:
+        _refresher = FactusTokenRefresher()
+    return _refresher
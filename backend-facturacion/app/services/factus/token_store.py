@@ -0,0 +1,209 @@
+"""
+Almacén persistente de tokens de Factus compartido entre workers.
+Guarda los tokens encriptados en la BD (tabla factus_tokens) y usa un lease
+a nivel de fila para que solo un worker renueve el token de una cuenta a la vez.
+"""
+
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import get_settings
+from app.core.encryption import decrypt_credential, encrypt_credential
+from app.db.database import async_session_maker
+from app.db.models import FactusToken
+from app.services.factus.token_cache import CachedToken
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseTokenStore:
+    """
+    Backend de tokens en BD (SQLite/PostgreSQL vía app.db.database).
+
+    Características:
+    - Tokens encriptados con el mismo Fernet de las credenciales
+    - Lease con expiración: si un worker muere renovando, otro toma el relevo
+    - Operaciones atómicas con UPDATE condicional (compatible SQLite y Postgres)
+    """
+
+    def __init__(
+        self,
+        session_maker=async_session_maker,
+        lease_seconds: int = 30,
+    ):
+        """
+        Inicializa el almacén.
+
+        Args:
+            session_maker: Fábrica de sesiones async de SQLAlchemy
+            lease_seconds: Duración máxima del lease de renovación
+        """
+        self._session_maker = session_maker
+        self._lease_seconds = lease_seconds
+        # Identificador único de este worker
+        self._owner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    @property
+    def owner_id(self) -> str:
+        """Identificador del worker dueño de los leases."""
+        return self._owner_id
+
+    async def load(self, key: str) -> Optional[CachedToken]:
+        """
+        Lee el token guardado de una cuenta.
+
+        Returns:
+            Token desencriptado o None si no existe o no se puede leer
+        """
+        async with self._session_maker() as session:
+            row = await session.get(FactusToken, key)
+
+        if row is None or not row.access_token:
+            return None
+
+        try:
+            return CachedToken(
+                access_token=decrypt_credential(row.access_token),
+                refresh_token=decrypt_credential(row.refresh_token) if row.refresh_token else None,
+                expires_at=row.expires_at,
+            )
+        except ValueError:
+            logger.warning("Token almacenado en BD no se pudo desencriptar, se ignora")
+            return None
+
+    async def save(self, key: str, token: CachedToken) -> None:
+        """Guarda (upsert) el token encriptado de una cuenta."""
+        values = {
+            "access_token": encrypt_credential(token.access_token or ""),
+            "refresh_token": encrypt_credential(token.refresh_token or ""),
+            "expires_at": token.expires_at,
+            "updated_at": datetime.utcnow(),
+        }
+
+        async with self._session_maker() as session:
+            await self._ensure_row(session, key)
+            await session.execute(
+                update(FactusToken)
+                .where(FactusToken.cache_key == key)
+                .values(**values)
+            )
+            await session.commit()
+
+    async def clear(self, key: str, rejected_token: Optional[str] = None) -> None:
+        """
+        Borra el token guardado de una cuenta.
+
+        Args:
+            rejected_token: Si se indica, solo se borra cuando el token
+                            guardado coincide (otro worker pudo renovarlo ya).
+        """
+        if rejected_token:
+            stored = await self.load(key)
+            if stored is not None and stored.access_token != rejected_token:
+                return
+
+        async with self._session_maker() as session:
+            await session.execute(
+                update(FactusToken)
+                .where(FactusToken.cache_key == key)
+                .values(access_token=None, refresh_token=None, expires_at=None)
+            )
+            await session.commit()
+
+    async def acquire_lease(self, key: str) -> bool:
+        """
+        Intenta tomar el lease de renovación de una cuenta.
+
+        Returns:
+            True si este worker obtuvo el lease
+        """
+        now = datetime.utcnow()
+
+        async with self._session_maker() as session:
+            await self._ensure_row(session, key)
+            result = await session.execute(
+                update(FactusToken)
+                .where(
+                    FactusToken.cache_key == key,
+                    or_(
+                        FactusToken.lease_owner.is_(None),
+                        FactusToken.lease_expires_at < now,
+                        FactusToken.lease_owner == self._owner_id,
+                    )
+                )
+                .values(
+                    lease_owner=self._owner_id,
+                    lease_expires_at=now + timedelta(seconds=self._lease_seconds),
+                )
+            )
+            await session.commit()
+
+        acquired = result.rowcount == 1
+        if acquired:
+            logger.debug(f"Lease de token adquirido por {self._owner_id}")
+        return acquired
+
+    async def release_lease(self, key: str) -> None:
+        """Libera el lease de renovación (solo si es de este worker)."""
+        async with self._session_maker() as session:
+            await session.execute(
+                update(FactusToken)
+                .where(
+                    FactusToken.cache_key == key,
+                    FactusToken.lease_owner == self._owner_id,
+                )
+                .values(lease_owner=None, lease_expires_at=None)
+            )
+            await session.commit()
+
+    async def delete(self, key: str) -> None:
+        """Elimina por completo la fila de una cuenta."""
+        async with self._session_maker() as session:
+            await session.execute(delete(FactusToken).where(FactusToken.cache_key == key))
+            await session.commit()
+
+    async def _ensure_row(self, session: AsyncSession, key: str) -> None:
+        """Crea la fila de la cuenta si no existe (tolerante a carreras)."""
+        result = await session.execute(
+            select(FactusToken.cache_key).where(FactusToken.cache_key == key)
+        )
+        if result.first() is not None:
+            return
+
+        session.add(FactusToken(cache_key=key))
+        try:
+            await session.commit()
+        except IntegrityError:
+            # Otro worker la creó al mismo tiempo
+            await session.rollback()
+
+
+# Instancia global (singleton)
+_token_store: Optional[DatabaseTokenStore] = None
+
+
+def get_token_store() -> Optional[DatabaseTokenStore]:
+    """
+    Obtiene el almacén de tokens configurado.
+
+    Returns:
+        DatabaseTokenStore si FACTUS_TOKEN_STORE=database, None si los tokens
+        solo viven en memoria del proceso.
+    """
+    global _token_store
+    settings = get_settings()
+
+    if settings.factus_token_store != "database":
+        return None
+
+    if _token_store is None:
+        _token_store = DatabaseTokenStore(lease_seconds=settings.factus_token_lease_seconds)
+    return _token_store
@@ -0,0 +1,183 @@
+"""
+Líneas de factura normalizadas (tabla invoice_items).
+
+Los ítems y su desglose de impuestos se escriben una sola vez, al reclamar
+la orden, en la misma transacción que la fila Invoice. La tirilla y las
+notas crédito los leen con una consulta indexada por invoice_id en lugar de
+volver a interpretar Invoice.payload o la respuesta de Factus.
+"""
+
+import json
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+from sqlalchemy import delete, insert, select
+
+from app.db.models import Invoice, InvoiceItem
+from app.schemas.factus import InvoiceCreateSchema
+
+# Impuestos del resumen de la tirilla (tax_id de Factus)
+IVA_TAX_ID = 1
+ICO_TAX_ID = 22
+
+
+def invoice_item_rows(invoice_id: int, tenant_id: int, data: InvoiceCreateSchema) -> List[Dict[str, Any]]:
+    """
+    Filas de invoice_items de una factura.
+
+    El impuesto principal es el primero del ítem (el mismo que se envía a
+    Factus como tribute_id); tax_amount suma todos los impuestos del ítem y
+    taxes guarda el desglose de cada uno.
+    """
+    rows = []
+    for line, item in enumerate(data.items, start=1):
+        first_tax = item.taxes[0] if item.taxes else None
+        subtotal = item.subtotal
+        tax_amount = Decimal(item.total_taxes)
+        rows.append({
+            "invoice_id": invoice_id,
+            "tenant_id": tenant_id,
+            "line": line,
+            "code": item.code,
+            "description": item.description,
+            "unit_measure_id": item.unit_measure_id,
+            "quantity": item.quantity,
+            "price": item.price,
+            "discount": item.discount,
+            "subtotal": subtotal,
+            "tax_id": first_tax.tax_id if first_tax else None,
+            "tax_percent": first_tax.percent if first_tax else Decimal("0"),
+            "taxable_amount": sum((tax.taxable_amount for tax in item.taxes), Decimal("0")),
+            "tax_amount": tax_amount,
+            "taxes": [
+                {
+                    "tax_id": tax.tax_id,
+                    "percent": float(tax.percent),
+                    "taxable_amount": float(tax.taxable_amount),
+                    "tax_amount": float(tax.tax_amount),
+                }
+                for tax in item.taxes
+            ],
+            "withholding_amount": sum((wt.tax_amount for wt in item.withholding_taxes), Decimal("0")),
+            "total": subtotal + tax_amount,
+        })
+    return rows
+
+
+async def save_invoice_items(
+    session,
+    claimed: Sequence[Tuple[Invoice, InvoiceCreateSchema]],
+    replace: Iterable[int] = ()
+) -> None:
+    """
+    Escribe los ítems de las facturas reclamadas con un solo INSERT.
+
+    `replace` son facturas reclamadas de nuevo (venían de ERROR con otro
+    payload): sus ítems anteriores se borran primero. No hace commit.
+    """
+    replace = list(replace)
+    if replace:
+        await session.execute(delete(InvoiceItem).where(InvoiceItem.invoice_id.in_(replace)))
+
+    rows = [
+        row
+        for invoice, data in claimed
+        for row in invoice_item_rows(invoice.id, invoice.tenant_id, data)
+    ]
+    if rows:
+        await session.execute(insert(InvoiceItem), rows)
+
+
+async def load_invoice_items(session, invoice: Invoice) -> List[InvoiceItem]:
+    """
+    Ítems de una factura, en orden.
+
+    Las facturas anteriores a invoice_items no tienen filas: se calculan
+    (sin guardarlas) desde el payload enviado a Factus, si existe.
+    """
+    result = await session.execute(
+        select(InvoiceItem)
+        .where(InvoiceItem.invoice_id == invoice.id)
+        .order_by(InvoiceItem.line)
+    )
+    return list(result.scalars().all()) or payload_invoice_items(invoice)
+
+
+def payload_invoice_items(invoice: Invoice) -> List[InvoiceItem]:
+    """Ítems calculados desde Invoice.payload, sin guardarlos (filas previas a invoice_items)."""
+    if not invoice.payload:
+        return []
+    data = InvoiceCreateSchema.model_validate(json.loads(invoice.payload))
+    return [InvoiceItem(**row) for row in invoice_item_rows(invoice.id, invoice.tenant_id, data)]
+
+
+def item_taxes(item: InvoiceItem) -> List[Dict[str, Any]]:
+    """
+    Desglose de impuestos del ítem.
+
+    Las filas anteriores a la columna taxes solo tienen el impuesto
+    principal, con el total de impuestos del ítem.
+    """
+    if item.taxes is not None:
+        return item.taxes
+    if item.tax_id is None:
+        return []
+    return [{
+        "tax_id": item.tax_id,
+        "percent": float(item.tax_percent),
+        "taxable_amount": float(item.taxable_amount),
+        "tax_amount": float(item.tax_amount),
+    }]
+
+
+def ticket_totals(items: Sequence[InvoiceItem]) -> Dict[str, float]:
+    """Subtotal, IVA, Impoconsumo y total de la tirilla."""
+    by_tax: Dict[int, Decimal] = {}
+    for item in items:
+        for tax in item_taxes(item):
+            by_tax[tax["tax_id"]] = by_tax.get(tax["tax_id"], Decimal("0")) + Decimal(str(tax["tax_amount"]))
+    subtotal = sum((item.subtotal for item in items), Decimal("0"))
+    total_iva = by_tax.get(IVA_TAX_ID, Decimal("0"))
+    total_ico = by_tax.get(ICO_TAX_ID, Decimal("0"))
+    total = sum((item.total for item in items), Decimal("0"))
+    return {
+        "subtotal": float(subtotal),
+        "total_iva": float(total_iva),
+        "total_ico": float(total_ico),
+        "total": float(total),
+    }
+
+
+def factus_items(items: Sequence[InvoiceItem]) -> List[Dict[str, Any]]:
+    """
+    Ítems en el formato de Factus (ver InvoiceCreateSchema.to_factus_payload),
+    para replicar la factura en una nota crédito.
+    """
+    factus = []
+    for item in items:
+        price = float(item.price)
+        taxes = [
+            {
+                "tax_id": tax["tax_id"],
+                "tax_amount": tax["tax_amount"],
+                "taxable_amount": tax["taxable_amount"],
+                "percent": tax["percent"],
+            }
+            for tax in item_taxes(item)
+        ]
+        factus.append({
+            "code_reference": item.code,
+            "name": item.description,
+            "quantity": float(item.quantity),
+            "price": price,
+            "discount": float(item.discount),
+            "discount_rate": (float(item.discount) / price) * 100 if price > 0 else 0.0,
+            "unit_measure_id": item.unit_measure_id,
+            "standard_code_id": 1,
+            "is_excluded": 0,
+            "tribute_id": item.tax_id or IVA_TAX_ID,
+            "tax_rate": float(item.tax_percent),
+            "taxes": taxes,
+            "withholding_taxes": [],
+        })
+    return factus
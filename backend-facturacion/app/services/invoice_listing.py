@@ -0,0 +1,200 @@
+"""
+Listado y búsqueda de facturas (GET /invoices).
+
+- Paginación keyset sobre (tenant_id, created_at, id), de la más reciente a
+  la más antigua: cada página cuesta lo mismo sin importar la profundidad
+  (sin OFFSET). El cursor es opaco (base64 de la última fila devuelta)
+- Cada filtro de igualdad tiene su índice compuesto (tenant_id, filtro,
+  created_at, id) en Invoice; fechas, CUFE y prefijo del número se aplican
+  sobre el recorrido. created_at se guarda en UTC sin zona: las fechas con
+  zona horaria se convierten a UTC antes de comparar
+- Solo se leen las columnas del listado (sin api_response, payload ni
+  ticket_data)
+- El total es una estimación: en PostgreSQL las filas que estima el
+  planificador (EXPLAIN); si son pocas, o en otros motores, un COUNT acotado
+  a invoice_list_count_cap filas (al llegar al tope se informa el tope, es
+  decir "al menos N"). Nunca un COUNT(*) sobre todo el tenant
+"""
+
+import base64
+import json
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, List, Optional, Tuple
+
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from app.core.config import get_settings
+from app.db.models import Invoice
+
+logger = logging.getLogger(__name__)
+
+
+# Columnas del listado
+LIST_COLUMNS = (
+    Invoice.id,
+    Invoice.number,
+    Invoice.order_reference,
+    Invoice.status,
+    Invoice.document_type,
+    Invoice.total,
+    Invoice.cufe,
+    Invoice.customer_nit,
+    Invoice.related_invoice_id,
+    Invoice.pdf_url,
+    Invoice.created_at,
+    Invoice.validated_at,
+)
+
+
+@dataclass(frozen=True)
+class InvoiceFilters:
+    """Filtros del listado (None = sin filtrar)."""
+    status: Optional[str] = None
+    document_type: Optional[str] = None
+    date_from: Optional[datetime] = None     # created_at >= date_from
+    date_to: Optional[datetime] = None       # created_at < date_to
+    customer_nit: Optional[str] = None
+    cufe: Optional[str] = None
+    number_prefix: Optional[str] = None
+
+
+# =============================================================================
+# CURSOR
+# =============================================================================
+
+def encode_cursor(created_at: datetime, invoice_id: int) -> str:
+    """Cursor opaco de la última fila de una página."""
+    raw = json.dumps([created_at.isoformat(), invoice_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    (created_at, id) de un cursor.
+
+    Raises:
+        ValueError: si el cursor no es válido
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, invoice_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(invoice_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Cursor inválido") from e
+
+
+# =============================================================================
+# CONSULTA
+# =============================================================================
+
+def to_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Fecha en UTC sin zona, como created_at; las que no tienen zona ya son UTC."""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _prefix_upper_bound(prefix: str) -> str:
+    """Menor texto mayor que todos los que empiezan por `prefix`."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def filtered_invoices(tenant_id: int, filters: InvoiceFilters, columns: Any = LIST_COLUMNS):
+    """SELECT de las facturas del tenant con los filtros (sin orden ni límite)."""
+    stmt = select(*columns).where(Invoice.tenant_id == tenant_id)
+
+    if filters.status:
+        stmt = stmt.where(Invoice.status == filters.status)
+    if filters.document_type:
+        stmt = stmt.where(Invoice.document_type == filters.document_type)
+    if filters.customer_nit:
+        stmt = stmt.where(Invoice.customer_nit == filters.customer_nit)
+    if filters.cufe:
+        stmt = stmt.where(Invoice.cufe == filters.cufe)
+    if filters.date_from:
+        stmt = stmt.where(Invoice.created_at >= to_naive_utc(filters.date_from))
+    if filters.date_to:
+        stmt = stmt.where(Invoice.created_at < to_naive_utc(filters.date_to))
+    if filters.number_prefix:
+        # Rango en lugar de LIKE: usa el índice de number en cualquier motor
+        stmt = stmt.where(
+            Invoice.number >= filters.number_prefix,
+            Invoice.number < _prefix_upper_bound(filters.number_prefix),
+        )
+    return stmt
+
+
+async def list_invoices(
+    session,
+    tenant_id: int,
+    filters: InvoiceFilters,
+    cursor: Optional[str] = None,
+    limit: int = 50
+) -> Tuple[List[Any], Optional[str]]:
+    """
+    Una página del listado, de la factura más reciente a la más antigua.
+
+    Returns:
+        (filas, cursor de la página siguiente o None si es la última)
+
+    Raises:
+        ValueError: si el cursor no es válido
+    """
+    stmt = filtered_invoices(tenant_id, filters)
+    if cursor:
+        stmt = stmt.where(tuple_(Invoice.created_at, Invoice.id) < tuple_(*decode_cursor(cursor)))
+    stmt = stmt.order_by(Invoice.created_at.desc(), Invoice.id.desc()).limit(limit + 1)
+
+    rows = list((await session.execute(stmt)).all())
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
+
+
+# =============================================================================
+# TOTAL ESTIMADO
+# =============================================================================
+
+class _Explain(Executable, ClauseElement):
+    """EXPLAIN (FORMAT JSON) de una consulta (PostgreSQL)."""
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(_Explain, "postgresql")
+def _compile_explain(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
+async def estimate_count(session, tenant_id: int, filters: InvoiceFilters) -> Tuple[int, bool]:
+    """
+    Total aproximado de facturas que cumplen los filtros.
+
+    Returns:
+        (total, True si es exacto). Si no es exacto es la estimación de
+        PostgreSQL o, en otros motores, el tope (hay al menos ese número)
+    """
+    cap = get_settings().invoice_list_count_cap
+    stmt = filtered_invoices(tenant_id, filters, columns=(Invoice.id,))
+
+    if session.bind.dialect.name == "postgresql":
+        try:
+            plan = (await session.execute(_Explain(stmt))).scalar()
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            estimate = int(plan[0]["Plan"]["Plan Rows"])
+            if estimate > cap:
+                return estimate, False
+        except Exception as e:
+            logger.warning(f"No se pudo estimar el total de facturas: {e}")
+
+    # COUNT acotado: recorre como máximo `cap` entradas del índice
+    capped = select(func.count()).select_from(stmt.limit(cap).subquery())
+    count = (await session.execute(capped)).scalar_one()
+    return count, count < cap
@@ -0,0 +1,412 @@
+"""
+Contingencia: outbox de facturas cuando Factus no está disponible.
+
+Si al facturar una orden Factus no responde (red caída, timeout, 5xx,
+circuit breaker abierto o rate limit agotado), la venta no falla:
+- La factura queda en CONTINGENCY con su payload ya mapeado (Invoice.payload)
+- Se crea una entrada en invoice_outbox; su id da el número del ticket
+  provisional (CONT-000123) que se imprime de inmediato
+- Un proceso en segundo plano reenvía el outbox en orden de llegada por
+  tenant cuando Factus vuelve, pasando por el rate limiter del cliente y
+  buscando antes cada factura por reference_code (el intento que falló pudo
+  llegar a Factus)
+
+Dentro de un tenant el reenvío es secuencial (el orden de la numeración DIAN
+sigue al de las ventas); los tenants se reenvían en paralelo.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set
+
+from fastapi import HTTPException
+from sqlalchemy import func, select, update
+
+from app.core.config import Settings, get_settings
+from app.db.database import async_session_maker
+from app.db.models import Invoice, InvoiceOutbox, Tenant
+from app.schemas.factus import InvoiceCreateSchema
+from app.services.factus.factory import FactusServiceFactory
+from app.services.factus.service import FactusService
+from app.services.invoice_submission import (
+    CONTINGENCY,
+    apply_invoice_response,
+    is_transient_error,
+    mark_invoice_failed,
+    record_number_usage,
+    submit_claimed_invoice,
+)
+from app.services.ticket_data import get_ticket_cache
+
+logger = logging.getLogger(__name__)
+
+
+# Estados de una entrada del outbox
+OUTBOX_PENDING = "PENDING"
+OUTBOX_SENDING = "SENDING"
+OUTBOX_DELIVERED = "DELIVERED"
+OUTBOX_FAILED = "FAILED"
+
+PROVISIONAL_PREFIX = "CONT"
+
+# Entradas leídas por consulta al reenviar un tenant
+DRAIN_PAGE_SIZE = 50
+
+
+def provisional_number(outbox_id: int) -> str:
+    """Número del ticket provisional de una entrada del outbox."""
+    return f"{PROVISIONAL_PREFIX}-{outbox_id:06d}"
+
+
+async def divert_to_outbox(session, invoice: Invoice, error: BaseException) -> InvoiceOutbox:
+    """
+    Pasa una factura reclamada a contingencia.
+
+    Crea la entrada del outbox y asigna el número provisional a la factura.
+    No confirma la transacción (el llamador hace commit y luego notify()).
+    """
+    now = datetime.utcnow()
+    entry = InvoiceOutbox(
+        invoice_id=invoice.id,
+        tenant_id=invoice.tenant_id,
+        reference_code=invoice.order_reference,
+        last_error=str(error)[:500],
+        created_at=now,
+        updated_at=now,
+    )
+    session.add(entry)
+    await session.flush()
+    entry.provisional_number = provisional_number(entry.id)
+
+    invoice.status = CONTINGENCY
+    invoice.number = entry.provisional_number
+    invoice.last_error = entry.last_error
+    invoice.updated_at = now
+
+    get_outbox_replayer().diverted += 1
+    logger.warning(
+        f"Factus no disponible: orden {invoice.order_reference} en contingencia "
+        f"con ticket {entry.provisional_number}"
+    )
+    return entry
+
+
+class OutboxReplayer:
+    """
+    Reenvía a Factus las facturas en contingencia.
+
+    Revisa el outbox cada invoice_outbox_poll_seconds y de inmediato cuando
+    se agrega una entrada (notify). Un tenant cuyo reenvío falla por un
+    error transitorio se pausa (Retry-After del breaker/rate limiter o
+    invoice_outbox_retry_seconds) sin afectar a los demás.
+    """
+
+    def __init__(
+        self,
+        settings: Optional[Settings] = None,
+        session_maker=async_session_maker,
+    ):
+        self._settings = settings or get_settings()
+        self._session_maker = session_maker
+
+        self._task: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+
+        # Estado por tenant: reenvío en curso y pausa tras error transitorio
+        self._draining: Set[int] = set()
+        self._paused_until: Dict[int, float] = {}
+        self._last_error: Dict[int, str] = {}
+
+        # Métricas
+        self.diverted = 0
+        self.delivered = 0
+        self.failed = 0
+        self.deferred = 0
+
+    @property
+    def running(self) -> bool:
+        """True si el reenvío en segundo plano está activo."""
+        return self._task is not None and not self._task.done()
+
+    # =========================================================================
+    # CICLO DE VIDA
+    # =========================================================================
+
+    def start(self) -> None:
+        """Inicia el reenvío en segundo plano (revisa el outbox de inmediato)."""
+        if self.running:
+            return
+        self._wake.set()
+        self._task = asyncio.create_task(self._loop(), name="invoice-outbox")
+        logger.info("Outbox de contingencia iniciado")
+
+    async def stop(self) -> None:
+        """Detiene el reenvío (las entradas siguen en BD)."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        logger.info("Outbox de contingencia detenido")
+
+    def notify(self) -> None:
+        """Avisa que hay entradas nuevas (tras el commit que las guardó)."""
+        self._wake.set()
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self._next_wakeup())
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+            try:
+                await self.drain()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error reenviando el outbox de contingencia: {e}")
+
+    def _next_wakeup(self) -> float:
+        """Espera hasta la próxima revisión: el poll o el fin de la pausa más próxima."""
+        now = time.monotonic()
+        pauses = [until - now for until in self._paused_until.values() if until > now]
+        return min([self._settings.invoice_outbox_poll_seconds] + pauses)
+
+    # =========================================================================
+    # REENVÍO
+    # =========================================================================
+
+    async def drain(self) -> int:
+        """
+        Reenvía el outbox de los tenants que no están pausados.
+
+        Returns:
+            Facturas entregadas a Factus en esta pasada
+        """
+        async with self._session_maker() as session:
+            result = await session.execute(
+                select(InvoiceOutbox.tenant_id, InvoiceOutbox.status)
+                .where(InvoiceOutbox.status.in_((OUTBOX_PENDING, OUTBOX_SENDING)))
+                .distinct()
+            )
+            rows = result.all()
+
+        if any(status == OUTBOX_SENDING for _, status in rows):
+            await self._release_stale()
+        tenant_ids = {tenant_id for tenant_id, _ in rows}
+
+        now = time.monotonic()
+        ready = [
+            tenant_id for tenant_id in tenant_ids
+            if tenant_id not in self._draining and self._paused_until.get(tenant_id, 0) <= now
+        ]
+        if not ready:
+            return 0
+
+        semaphore = asyncio.Semaphore(max(1, self._settings.invoice_outbox_tenant_parallelism))
+
+        async def drain_bounded(tenant_id: int) -> int:
+            async with semaphore:
+                return await self._drain_tenant(tenant_id)
+
+        delivered = await asyncio.gather(
+            *(drain_bounded(tenant_id) for tenant_id in ready), return_exceptions=True
+        )
+        total = 0
+        for tenant_id, count in zip(ready, delivered):
+            if isinstance(count, Exception):
+                self._pause(tenant_id, count)
+                logger.error(f"Outbox del tenant {tenant_id}: {count}")
+            else:
+                total += count
+        return total
+
+    async def _release_stale(self) -> None:
+        """Devuelve a PENDING las entradas SENDING abandonadas (proceso caído)."""
+        cutoff = datetime.utcnow() - timedelta(seconds=self._settings.invoice_outbox_stale_seconds)
+        async with self._session_maker() as session:
+            await session.execute(
+                update(InvoiceOutbox)
+                .where(InvoiceOutbox.status == OUTBOX_SENDING, InvoiceOutbox.updated_at < cutoff)
+                .values(status=OUTBOX_PENDING, updated_at=datetime.utcnow())
+            )
+            await session.commit()
+
+    async def _drain_tenant(self, tenant_id: int) -> int:
+        """Reenvía en orden las entradas de un tenant hasta vaciarlo o fallar."""
+        self._draining.add(tenant_id)
+        delivered = 0
+        try:
+            async with self._session_maker() as session:
+                tenant = await session.get(Tenant, tenant_id)
+                factory = FactusServiceFactory(session)
+                async with await factory.create_service_for_tenant(tenant) as service:
+                    while True:
+                        result = await session.execute(
+                            select(InvoiceOutbox)
+                            .where(
+                                InvoiceOutbox.tenant_id == tenant_id,
+                                InvoiceOutbox.status == OUTBOX_PENDING,
+                            )
+                            .order_by(InvoiceOutbox.id)
+                            .limit(DRAIN_PAGE_SIZE)
+                        )
+                        entries = list(result.scalars().all())
+                        if not entries:
+                            break
+
+                        for entry in entries:
+                            outcome = await self._deliver(session, service, entry)
+                            if outcome is None:
+                                # Factus sigue sin responder u otro proceso
+                                # tomó la entrada: se conserva el orden
+                                return delivered
+                            delivered += outcome
+        finally:
+            self._draining.discard(tenant_id)
+
+        if delivered:
+            self._paused_until.pop(tenant_id, None)
+            self._last_error.pop(tenant_id, None)
+            logger.info(f"Outbox del tenant {tenant_id}: {delivered} facturas enviadas a Factus")
+        return delivered
+
+    async def _deliver(
+        self,
+        session,
+        service: FactusService,
+        entry: InvoiceOutbox
+    ) -> Optional[int]:
+        """
+        Envía a Factus la factura de una entrada.
+
+        Returns:
+            1 si se entregó, 0 si Factus la rechazó (FAILED), None si hay que
+            detener el reenvío del tenant
+        """
+        now = datetime.utcnow()
+        claimed = await session.execute(
+            update(InvoiceOutbox)
+            .where(InvoiceOutbox.id == entry.id, InvoiceOutbox.status == OUTBOX_PENDING)
+            .values(status=OUTBOX_SENDING, attempts=InvoiceOutbox.attempts + 1, updated_at=now)
+        )
+        if claimed.rowcount != 1:
+            await session.commit()
+            return None
+        # attempts > 1 hace que submit_claimed_invoice busque antes por reference_code
+        await session.execute(
+            update(Invoice)
+            .where(Invoice.id == entry.invoice_id)
+            .values(attempts=Invoice.attempts + 1, updated_at=now)
+        )
+        await session.commit()
+
+        await session.refresh(entry)
+        invoice = await session.get(Invoice, entry.invoice_id, populate_existing=True)
+
+        try:
+            invoice_data = InvoiceCreateSchema.model_validate_json(invoice.payload)
+            response = await submit_claimed_invoice(service, invoice, invoice_data)
+        except Exception as e:
+            message = e.detail if isinstance(e, HTTPException) else str(e)
+            entry.last_error = str(message)[:500]
+            entry.updated_at = datetime.utcnow()
+
+            if is_transient_error(e):
+                entry.status = OUTBOX_PENDING
+                await session.commit()
+                self._pause(entry.tenant_id, e)
+                return None
+
+            # Rechazo definitivo: la orden queda en ERROR y puede volver a facturarse
+            entry.status = OUTBOX_FAILED
+            mark_invoice_failed(invoice, message)
+            await session.commit()
+            self.failed += 1
+            self._last_error[entry.tenant_id] = entry.last_error
+            logger.error(
+                f"Outbox: Factus rechazó la factura {entry.provisional_number} "
+                f"(orden {entry.reference_code}): {message}"
+            )
+            return 0
+
+        # El ticket provisional deja de servirse: la tirilla pasa al número definitivo
+        get_ticket_cache().invalidate(invoice.tenant_id, invoice.number)
+        apply_invoice_response(invoice, response, invoice_data)
+        await record_number_usage(session, invoice, invoice_data)
+        entry.status = OUTBOX_DELIVERED
+        entry.last_error = None
+        entry.delivered_at = entry.updated_at = datetime.utcnow()
+        await session.commit()
+
+        self.delivered += 1
+        return 1
+
+    def _pause(self, tenant_id: int, error: BaseException) -> None:
+        """Pausa el reenvío de un tenant tras un error transitorio."""
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is None:
+            retry_after = self._settings.invoice_outbox_retry_seconds
+        self._paused_until[tenant_id] = time.monotonic() + retry_after
+        self._last_error[tenant_id] = str(error)[:500]
+        self.deferred += 1
+        logger.warning(f"Outbox del tenant {tenant_id}: Factus no disponible, reintento en {retry_after:.1f}s")
+
+    # =========================================================================
+    # PROGRESO
+    # =========================================================================
+
+    async def tenant_progress(self, session, tenant_id: int) -> dict:
+        """Progreso del outbox de un tenant (conteos en BD + estado del reenvío)."""
+        result = await session.execute(
+            select(InvoiceOutbox.status, func.count(), func.min(InvoiceOutbox.created_at))
+            .where(InvoiceOutbox.tenant_id == tenant_id)
+            .group_by(InvoiceOutbox.status)
+        )
+        counts = {OUTBOX_PENDING: 0, OUTBOX_SENDING: 0, OUTBOX_DELIVERED: 0, OUTBOX_FAILED: 0}
+        oldest_pending = None
+        for status, count, oldest in result.all():
+            counts[status] = count
+            if status in (OUTBOX_PENDING, OUTBOX_SENDING) and oldest is not None:
+                oldest_pending = min(oldest_pending or oldest, oldest)
+
+        paused_until = self._paused_until.get(tenant_id, 0)
+        retry_in = paused_until - time.monotonic()
+        return {
+            "pending": counts[OUTBOX_PENDING] + counts[OUTBOX_SENDING],
+            "delivered": counts[OUTBOX_DELIVERED],
+            "failed": counts[OUTBOX_FAILED],
+            "oldest_pending_at": oldest_pending,
+            "draining": tenant_id in self._draining,
+            "retry_in_seconds": round(retry_in, 1) if retry_in > 0 else None,
+            "last_error": self._last_error.get(tenant_id),
+        }
+
+    def snapshot(self) -> dict:
+        """Métricas del reenvío (para /metrics)."""
+        now = time.monotonic()
+        return {
+            "running": self.running,
+            "diverted": self.diverted,
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "deferred": self.deferred,
+            "draining_tenants": len(self._draining),
+            "paused_tenants": sum(1 for until in self._paused_until.values() if until > now),
+        }
+
+
+# Instancia global (singleton)
+_outbox_replayer: Optional[OutboxReplayer] = None
+
+
+def get_outbox_replayer() -> OutboxReplayer:
+    """Obtiene el reenviador global del outbox de contingencia."""
+    global _outbox_replayer
+    if _outbox_replayer is None:
+        _outbox_replayer = OutboxReplayer()
+    return _outbox_replayer
@@ -0,0 +1,400 @@
+"""
+Cola asíncrona de envío de facturas a Factus.
+
+En modo asíncrono el endpoint guarda la factura como PENDING (con el payload
+ya mapeado) y responde 202 de inmediato; un pool acotado de workers dentro de
+la app la envía a Factus y actualiza la fila. El cliente consulta
+GET /invoices/{id}/status (con long-polling opcional).
+
+- Concurrencia limitada por tenant: un tenant con muchas facturas no acapara
+  los workers (las que exceden su cupo esperan sin ocupar un worker)
+- Claim atómico PENDING -> SUBMITTING en BD: seguro con varios procesos
+- Filas SUBMITTING con el lease vencido (quien las enviaba se cayó) y
+  PENDING abandonadas se reencolan al iniciar y en un barrido periódico;
+  antes de reenviar se busca la factura en Factus por reference_code para no
+  duplicarla. Un envío en curso (de la cola o síncrono) renueva su lease y
+  no se toca
+- Si Factus sigue caído tras los reintentos, la factura pasa al outbox de
+  contingencia en lugar de quedar en ERROR
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import or_, select, update
+
+from app.core.config import Settings, get_settings
+from app.db.database import async_session_maker
+from app.db.models import Invoice, Tenant
+from app.schemas.factus import InvoiceCreateSchema
+from app.services.factus.factory import FactusServiceFactory
+from app.services.invoice_outbox import divert_to_outbox, get_outbox_replayer
+from app.services.invoice_submission import (
+    PENDING,
+    SUBMITTING,
+    apply_invoice_response,
+    is_transient_error,
+    lease_deadline,
+    lease_expired,
+    mark_invoice_failed,
+    record_number_usage,
+    submit_claimed_invoice,
+)
+
+logger = logging.getLogger(__name__)
+
+
+MAX_RETRY_DELAY_SECONDS = 300.0
+
+
+class InvoiceQueue:
+    """
+    Pool de workers que envía a Factus las facturas PENDING.
+
+    Los ids viajan por una asyncio.Queue en memoria; la BD es la fuente de
+    verdad, por lo que perder la cola (reinicio) solo retrasa el envío hasta
+    el siguiente barrido.
+    """
+
+    def __init__(
+        self,
+        settings: Optional[Settings] = None,
+        session_maker=async_session_maker,
+    ):
+        self._settings = settings or get_settings()
+        self._session_maker = session_maker
+
+        self._queue: "asyncio.Queue[Tuple[int, int]]" = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+        self._sweeper: Optional[asyncio.Task] = None
+        self._retry_tasks: Set[asyncio.Task] = set()
+
+        # Ids encolados, diferidos, en curso o esperando reintento en este proceso
+        self._known: Set[int] = set()
+        self._enqueued_at: Dict[int, float] = {}
+
+        # Cupo por tenant: envíos en curso y facturas esperando turno
+        self._in_flight: Dict[int, int] = {}
+        self._deferred: Dict[int, Deque[int]] = {}
+
+        # Long-polling de GET /invoices/{id}/status
+        self._watchers: Dict[int, Set[asyncio.Event]] = {}
+
+        # Métricas
+        self.enqueued = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+        self.recovered = 0
+        self._latencies: Deque[float] = deque(maxlen=500)
+
+    @property
+    def running(self) -> bool:
+        """True si los workers están activos."""
+        return bool(self._workers)
+
+    # =========================================================================
+    # CICLO DE VIDA
+    # =========================================================================
+
+    async def start(self) -> None:
+        """Reencola las facturas pendientes e inicia los workers y el barrido."""
+        if self._workers:
+            return
+
+        await self.recover(startup=True)
+
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"invoice-queue-{i}")
+            for i in range(max(1, self._settings.invoice_queue_workers))
+        ]
+        self._sweeper = asyncio.create_task(self._sweep_loop(), name="invoice-queue-sweeper")
+        logger.info(f"Cola de facturas iniciada ({len(self._workers)} workers)")
+
+    async def stop(self) -> None:
+        """Detiene workers, barrido y reintentos programados."""
+        tasks = list(self._workers) + list(self._retry_tasks)
+        if self._sweeper is not None:
+            tasks.append(self._sweeper)
+        if not tasks:
+            return
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        self._workers = []
+        self._sweeper = None
+        self._retry_tasks.clear()
+        logger.info("Cola de facturas detenida")
+
+    # =========================================================================
+    # ENCOLADO
+    # =========================================================================
+
+    def enqueue(self, invoice_id: int, tenant_id: int) -> bool:
+        """
+        Encola una factura PENDING para su envío.
+
+        Returns:
+            False si la factura ya estaba en la cola de este proceso
+        """
+        if invoice_id in self._known:
+            return False
+        self._known.add(invoice_id)
+        self._enqueued_at.setdefault(invoice_id, time.monotonic())
+        self._queue.put_nowait((invoice_id, tenant_id))
+        self.enqueued += 1
+        return True
+
+    async def recover(self, startup: bool = False) -> int:
+        """
+        Reencola facturas abandonadas.
+
+        Las SUBMITTING con el lease vencido vuelven a PENDING (su proceso se
+        cayó a mitad del envío; uno vivo renueva el lease). Al iniciar se encolan
+        todas las PENDING; en los barridos, solo las que llevan ese tiempo sin
+        avance (las recientes pertenecen a otro proceso vivo).
+
+        Returns:
+            Cantidad de facturas encoladas
+        """
+        now = datetime.utcnow()
+        cutoff = now - timedelta(seconds=self._settings.invoice_queue_stale_seconds)
+
+        async with self._session_maker() as session:
+            # Las recuperadas se encolan ya (su updated_at pasa a ser reciente)
+            rows = list((await session.execute(
+                update(Invoice)
+                .where(lease_expired(now))
+                .values(status=PENDING, lease_until=None, updated_at=now)
+                .returning(Invoice.id, Invoice.tenant_id)
+            )).all())
+
+            stmt = select(Invoice.id, Invoice.tenant_id).where(Invoice.status == PENDING)
+            if not startup:
+                stmt = stmt.where(or_(Invoice.updated_at == None, Invoice.updated_at < cutoff))
+            rows += (await session.execute(stmt.order_by(Invoice.id))).all()
+            await session.commit()
+
+        count = sum(1 for invoice_id, tenant_id in rows if self.enqueue(invoice_id, tenant_id))
+        if count:
+            self.recovered += count
+            logger.info(f"Cola de facturas: {count} facturas pendientes reencoladas")
+        return count
+
+    async def _sweep_loop(self) -> None:
+        """Barrido periódico de facturas abandonadas."""
+        while True:
+            await asyncio.sleep(self._settings.invoice_queue_sweep_seconds)
+            try:
+                await self.recover()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error en barrido de la cola de facturas: {e}")
+
+    # =========================================================================
+    # WORKERS
+    # =========================================================================
+
+    async def _worker(self) -> None:
+        """Toma facturas de la cola respetando el cupo de cada tenant."""
+        limit = max(1, self._settings.invoice_queue_tenant_concurrency)
+
+        while True:
+            invoice_id, tenant_id = await self._queue.get()
+            try:
+                if self._in_flight.get(tenant_id, 0) >= limit:
+                    # Tenant en su cupo: espera turno sin ocupar este worker
+                    self._deferred.setdefault(tenant_id, deque()).append(invoice_id)
+                    continue
+
+                self._in_flight[tenant_id] = self._in_flight.get(tenant_id, 0) + 1
+                try:
+                    await self._process(invoice_id)
+                finally:
+                    self._release_slot(tenant_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error procesando factura {invoice_id} de la cola: {e}")
+                self._finish(invoice_id)
+            finally:
+                self._queue.task_done()
+
+    def _release_slot(self, tenant_id: int) -> None:
+        """Libera el cupo del tenant y devuelve a la cola su siguiente factura diferida."""
+        remaining = self._in_flight.get(tenant_id, 1) - 1
+        if remaining > 0:
+            self._in_flight[tenant_id] = remaining
+        else:
+            self._in_flight.pop(tenant_id, None)
+
+        deferred = self._deferred.get(tenant_id)
+        if deferred:
+            self._queue.put_nowait((deferred.popleft(), tenant_id))
+            if not deferred:
+                self._deferred.pop(tenant_id, None)
+
+    async def _process(self, invoice_id: int) -> None:
+        """Envía una factura a Factus y guarda el resultado."""
+        async with self._session_maker() as session:
+            # Claim atómico: solo un worker (de cualquier proceso) la envía
+            result = await session.execute(
+                update(Invoice)
+                .where(Invoice.id == invoice_id, Invoice.status == PENDING)
+                .values(
+                    status=SUBMITTING,
+                    attempts=Invoice.attempts + 1,
+                    lease_until=lease_deadline(datetime.utcnow()),
+                    updated_at=datetime.utcnow(),
+                )
+            )
+            await session.commit()
+            if result.rowcount != 1:
+                self._finish(invoice_id)
+                return
+
+            invoice = await session.get(Invoice, invoice_id)
+            tenant = await session.get(Tenant, invoice.tenant_id)
+
+            try:
+                factory = FactusServiceFactory(session)
+                async with await factory.create_service_for_tenant(tenant) as service:
+                    invoice_data = InvoiceCreateSchema.model_validate_json(invoice.payload)
+                    response = await submit_claimed_invoice(service, invoice, invoice_data)
+            except Exception as e:
+                if is_transient_error(e) and invoice.attempts < self._settings.invoice_queue_max_attempts:
+                    await self._schedule_retry(session, invoice, e)
+                elif is_transient_error(e) and get_outbox_replayer().running:
+                    await self._divert(session, invoice, e)
+                else:
+                    await self._mark_failed(session, invoice, e)
+                return
+
+            apply_invoice_response(invoice, response, invoice_data)
+            await record_number_usage(session, invoice, invoice_data)
+            await session.commit()
+
+        self.succeeded += 1
+        logger.info(f"Factura {invoice_id} enviada a Factus: {invoice.number}")
+        self._finish(invoice_id)
+
+    async def _schedule_retry(self, session, invoice: Invoice, error: Exception) -> None:
+        """Devuelve la factura a PENDING y la reencola tras un backoff."""
+        invoice.status = PENDING
+        invoice.last_error = str(error)[:500]
+        invoice.updated_at = datetime.utcnow()
+        await session.commit()
+
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is None:
+            base = self._settings.invoice_queue_retry_base_seconds
+            retry_after = min(MAX_RETRY_DELAY_SECONDS, base * (2 ** (invoice.attempts - 1)))
+        delay = retry_after + random.uniform(0, 1)
+
+        self.retried += 1
+        logger.warning(
+            f"Factura {invoice.id}: error transitorio (intento {invoice.attempts}), "
+            f"reintento en {delay:.1f}s: {error}"
+        )
+
+        task = asyncio.create_task(self._requeue_later(invoice.id, invoice.tenant_id, delay))
+        self._retry_tasks.add(task)
+        task.add_done_callback(self._retry_tasks.discard)
+
+    async def _requeue_later(self, invoice_id: int, tenant_id: int, delay: float) -> None:
+        await asyncio.sleep(delay)
+        self._queue.put_nowait((invoice_id, tenant_id))
+
+    async def _divert(self, session, invoice: Invoice, error: Exception) -> None:
+        """Pasa la factura al outbox de contingencia (reintentos agotados)."""
+        await divert_to_outbox(session, invoice, error)
+        await session.commit()
+        get_outbox_replayer().notify()
+        self._finish(invoice.id)
+
+    async def _mark_failed(self, session, invoice: Invoice, error: Exception) -> None:
+        """Marca la factura como ERROR (definitivo)."""
+        message = error.detail if isinstance(error, HTTPException) else str(error)
+        mark_invoice_failed(invoice, message)
+        await session.commit()
+
+        self.failed += 1
+        logger.error(f"Factura {invoice.id} no se pudo enviar a Factus: {message}")
+        self._finish(invoice.id)
+
+    def _finish(self, invoice_id: int) -> None:
+        """Saca la factura de la cola y despierta a quienes esperan su estado."""
+        self._known.discard(invoice_id)
+        enqueued_at = self._enqueued_at.pop(invoice_id, None)
+        if enqueued_at is not None:
+            self._latencies.append(time.monotonic() - enqueued_at)
+
+        for event in self._watchers.pop(invoice_id, ()):
+            event.set()
+
+    # =========================================================================
+    # LONG-POLLING
+    # =========================================================================
+
+    def watch(self, invoice_id: int) -> asyncio.Event:
+        """
+        Registra un observador del estado de la factura.
+
+        Se registra antes de leer la fila para no perder una finalización que
+        ocurra entre la lectura y la espera.
+        """
+        event = asyncio.Event()
+        self._watchers.setdefault(invoice_id, set()).add(event)
+        return event
+
+    def unwatch(self, invoice_id: int, event: asyncio.Event) -> None:
+        """Elimina un observador registrado con watch()."""
+        watchers = self._watchers.get(invoice_id)
+        if watchers is not None:
+            watchers.discard(event)
+            if not watchers:
+                self._watchers.pop(invoice_id, None)
+
+    # =========================================================================
+    # MÉTRICAS
+    # =========================================================================
+
+    def snapshot(self) -> dict:
+        """Estado y métricas de la cola (para /metrics)."""
+        latencies = sorted(self._latencies)
+        return {
+            "running": self.running,
+            "workers": len(self._workers),
+            "queued": self._queue.qsize(),
+            "deferred": sum(len(d) for d in self._deferred.values()),
+            "in_flight": sum(self._in_flight.values()),
+            "waiting_retry": len(self._retry_tasks),
+            "enqueued": self.enqueued,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retried": self.retried,
+            "recovered": self.recovered,
+            "latency_p50_seconds": round(latencies[len(latencies) // 2], 3) if latencies else None,
+            "latency_max_seconds": round(latencies[-1], 3) if latencies else None,
+        }
+
+
+# Instancia global (singleton)
+_invoice_queue: Optional[InvoiceQueue] = None
+
+
+def get_invoice_queue() -> InvoiceQueue:
+    """Obtiene la cola global de facturas del proceso."""
+    global _invoice_queue
+    if _invoice_queue is None:
+        _invoice_queue = InvoiceQueue()
+    return _invoice_queue
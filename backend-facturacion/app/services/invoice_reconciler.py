@@ -0,0 +1,367 @@
+"""
+Reconciliador de facturas: validación DIAN en segundo plano.
+
+Las facturas CREATED esperaban una llamada manual a /validate y las que
+quedaban en ERROR_VALIDATING nunca se revisaban. El reconciliador:
+- Recorre Invoice por (status, created_at, id) con paginación keyset
+  (índice ix_invoices_status_created), sin OFFSET
+- Toma cada página con un lease (UPDATE ... RETURNING sobre
+  next_reconcile_at) para que dos procesos no validen la misma factura
+- Consulta el estado en Factus con concurrencia acotada; si la factura ya
+  está validada solo copia sus datos, si no la valida
+- Guarda CUFE/QR/PDF/XML de toda la página en un UPDATE masivo por clave
+- Backoff exponencial por factura (reconcile_attempts / next_reconcile_at);
+  los errores transitorios (Factus caído) no consumen intentos
+"""
+
+import asyncio
+import logging
+import random
+import time
+from contextlib import AsyncExitStack
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import or_, select, tuple_, update
+
+from app.core.config import Settings, get_settings
+from app.db.database import async_session_maker
+from app.db.models import Invoice, Tenant
+from app.services.document_store import get_document_store
+from app.services.factus.factory import FactusServiceFactory
+from app.services.factus.service import FactusService
+from app.services.invoice_submission import INVOICE_DOCUMENT, is_transient_error
+from app.services.ticket_data import revised_ticket
+
+logger = logging.getLogger(__name__)
+
+
+VALIDATED = "VALIDATED"
+ERROR_VALIDATING = "ERROR_VALIDATING"
+
+# Estados que el reconciliador revisa (en este orden)
+RECONCILE_STATUSES = ("CREATED", ERROR_VALIDATING)
+
+# Tiempo que una página queda reservada para el proceso que la revisa
+LEASE_SECONDS = 300
+
+
+# =============================================================================
+# RESPUESTA DE VALIDACIÓN -> COLUMNAS
+# =============================================================================
+
+def is_validated_bill(data: Any) -> bool:
+    """True si la factura consultada en Factus ya está validada ante la DIAN."""
+    bill = data.get("bill", data) if isinstance(data, dict) else {}
+    return str(bill.get("status")) == "1"
+
+
+def validation_values(invoice: Invoice, result: Any) -> Dict[str, Any]:
+    """
+    Columnas de la factura tras validarla en Factus.
+    Conserva los datos actuales que la respuesta no trae.
+    """
+    data = result.get("data", {}).get("bill", {}) if isinstance(result, dict) else {}
+    top = result if isinstance(result, dict) else {}
+    values = {
+        "status": VALIDATED,
+        "validated_at": datetime.utcnow(),
+        "cufe": data.get("cufe") or invoice.cufe,
+        "qr_url": data.get("qr") or invoice.qr_url,
+        "xml_url": data.get("xml_url") or top.get("xml_url") or invoice.xml_url,
+        "pdf_url": data.get("public_url") or top.get("pdf_url") or invoice.pdf_url,
+        "api_response": result if isinstance(result, dict) else {"raw": str(result)},
+    }
+    # Tirilla con el CUFE y el QR de la validación
+    values.update(revised_ticket(invoice, **values))
+    return values
+
+
+def apply_validation_response(invoice: Invoice, result: Any) -> None:
+    """Copia en la fila local el resultado de la validación (POST /validate)."""
+    for column, value in validation_values(invoice, result).items():
+        setattr(invoice, column, value)
+    # El PDF validado incluye CUFE y QR: reemplaza el descargado al crearla
+    get_document_store().schedule(invoice.id, replace=True)
+
+
+async def fetch_validation(service: FactusService, invoice_number: str) -> Any:
+    """
+    Estado de validación de una factura en Factus.
+    Si ya está validada devuelve la consulta; si no, la valida.
+    """
+    data = await service.get_invoice(invoice_number)
+    if is_validated_bill(data):
+        return {"data": data}
+    return await service.validate_invoice(invoice_number)
+
+
+# =============================================================================
+# RECONCILIADOR
+# =============================================================================
+
+class InvoiceReconciler:
+    """
+    Tarea en segundo plano que valida las facturas pendientes de validación.
+
+    Cada pasada recorre los estados de RECONCILE_STATUSES página por página;
+    un error en una página se registra y la pasada continúa con la siguiente.
+    """
+
+    def __init__(
+        self,
+        settings: Optional[Settings] = None,
+        session_maker=async_session_maker,
+    ):
+        self._settings = settings or get_settings()
+        self._session_maker = session_maker
+        self._task: Optional[asyncio.Task] = None
+
+        # Métricas
+        self.passes = 0
+        self.checked = 0
+        self.validated = 0
+        self.failed = 0
+        self.deferred = 0
+        self.last_run_at: Optional[datetime] = None
+        self.last_duration_seconds: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        """True si la tarea en segundo plano está activa."""
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """Inicia la tarea en segundo plano (primera pasada tras un intervalo)."""
+        if self.running:
+            return
+        self._task = asyncio.create_task(self._run(), name="invoice-reconciler")
+        logger.info("Reconciliador de facturas iniciado")
+
+    async def stop(self) -> None:
+        """Detiene la tarea y espera a que termine."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        logger.info("Reconciliador de facturas detenido")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._settings.invoice_reconciler_interval_seconds)
+            try:
+                await self.reconcile_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error en pasada del reconciliador de facturas: {e}")
+
+    # =========================================================================
+    # PASADA
+    # =========================================================================
+
+    async def reconcile_once(self) -> Dict[str, int]:
+        """
+        Revisa todas las facturas pendientes de validación que ya cumplieron
+        su backoff.
+
+        Returns:
+            Conteo de la pasada: checked, validated, failed, deferred
+        """
+        started = time.monotonic()
+        now = datetime.utcnow()
+        cutoff = now - timedelta(seconds=self._settings.invoice_reconciler_min_age_seconds)
+        page_size = max(1, self._settings.invoice_reconciler_page_size)
+        totals = {"checked": 0, "validated": 0, "failed": 0, "deferred": 0}
+
+        for status in RECONCILE_STATUSES:
+            cursor: Optional[Tuple[datetime, int]] = None
+            while True:
+                async with self._session_maker() as session:
+                    stmt = select(Invoice).where(
+                        Invoice.status == status,
+                        Invoice.created_at <= cutoff,
+                        Invoice.document_type == INVOICE_DOCUMENT,
+                        Invoice.reconcile_attempts < self._settings.invoice_reconciler_max_attempts,
+                        or_(Invoice.next_reconcile_at == None, Invoice.next_reconcile_at <= now),
+                    )
+                    if cursor is not None:
+                        stmt = stmt.where(tuple_(Invoice.created_at, Invoice.id) > tuple_(*cursor))
+                    stmt = stmt.order_by(Invoice.created_at, Invoice.id).limit(page_size)
+
+                    invoices = list((await session.execute(stmt)).scalars().all())
+                    if not invoices:
+                        break
+                    cursor = (invoices[-1].created_at, invoices[-1].id)
+
+                    try:
+                        counts = await self._reconcile_page(session, status, invoices, now)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        logger.error(f"Reconciliador: error en una página de {len(invoices)} facturas {status}: {e}")
+                        counts = {}
+
+                for key, value in counts.items():
+                    totals[key] += value
+                if len(invoices) < page_size:
+                    break
+
+        self.passes += 1
+        self.checked += totals["checked"]
+        self.validated += totals["validated"]
+        self.failed += totals["failed"]
+        self.deferred += totals["deferred"]
+        self.last_run_at = now
+        self.last_duration_seconds = round(time.monotonic() - started, 3)
+
+        if totals["checked"]:
+            logger.info(
+                f"Reconciliador: {totals['checked']} facturas revisadas, {totals['validated']} validadas, "
+                f"{totals['failed']} con error, {totals['deferred']} pospuestas (Factus no disponible)"
+            )
+        return totals
+
+    async def _reconcile_page(
+        self,
+        session,
+        status: str,
+        invoices: List[Invoice],
+        now: datetime
+    ) -> Dict[str, int]:
+        """Valida una página de facturas y guarda el resultado en bloque."""
+        # 1. Lease: solo se revisan las facturas que este proceso reservó
+        leased = await session.execute(
+            update(Invoice)
+            .where(
+                Invoice.id.in_([invoice.id for invoice in invoices]),
+                Invoice.status == status,
+                or_(Invoice.next_reconcile_at == None, Invoice.next_reconcile_at <= now),
+            )
+            .values(next_reconcile_at=now + timedelta(seconds=LEASE_SECONDS))
+            .returning(Invoice.id)
+            .execution_options(synchronize_session=False)
+        )
+        leased_ids = set(leased.scalars().all())
+        await session.commit()
+        invoices = [invoice for invoice in invoices if invoice.id in leased_ids]
+        if not invoices:
+            return {}
+
+        tenant_ids = {invoice.tenant_id for invoice in invoices}
+        result = await session.execute(select(Tenant).where(Tenant.id.in_(tenant_ids)))
+        tenants = {tenant.id: tenant for tenant in result.scalars().all()}
+
+        # 2. Consultas a Factus con concurrencia acotada (un servicio por tenant)
+        semaphore = asyncio.Semaphore(max(1, self._settings.invoice_reconciler_concurrency))
+        outcomes: List[Tuple[Invoice, Any, Optional[BaseException]]] = []
+
+        async with AsyncExitStack() as stack:
+            services: Dict[int, FactusService] = {}
+            factory = FactusServiceFactory(session)
+            for tenant_id in tenant_ids:
+                try:
+                    services[tenant_id] = await stack.enter_async_context(
+                        await factory.create_service_for_tenant(tenants[tenant_id])
+                    )
+                except Exception as e:
+                    outcomes.extend(
+                        (invoice, None, e) for invoice in invoices if invoice.tenant_id == tenant_id
+                    )
+
+            async def check(invoice: Invoice):
+                async with semaphore:
+                    try:
+                        return invoice, await fetch_validation(services[invoice.tenant_id], invoice.number), None
+                    except Exception as e:
+                        return invoice, None, e
+
+            outcomes.extend(await asyncio.gather(*(
+                check(invoice) for invoice in invoices if invoice.tenant_id in services
+            )))
+
+        # 3. Guardado en bloque (UPDATE por clave primaria, executemany)
+        finished_at = datetime.utcnow()
+        validated_rows: List[dict] = []
+        failed_rows: List[dict] = []
+        counts = {"checked": len(outcomes), "validated": 0, "failed": 0, "deferred": 0}
+
+        for invoice, response, error in outcomes:
+            if error is None:
+                validated_rows.append({
+                    "id": invoice.id,
+                    **validation_values(invoice, response),
+                    "reconcile_attempts": 0,
+                    "next_reconcile_at": None,
+                    "last_error": None,
+                    "updated_at": finished_at,
+                })
+                counts["validated"] += 1
+                continue
+
+            message = error.detail if isinstance(error, HTTPException) else str(error)
+            if is_transient_error(error):
+                # Factus no disponible: se pospone sin gastar un intento
+                new_status = invoice.status
+                attempts = invoice.reconcile_attempts
+                delay = getattr(error, "retry_after", None) or self._settings.invoice_reconciler_backoff_base_seconds
+                counts["deferred"] += 1
+            else:
+                new_status = ERROR_VALIDATING
+                attempts = invoice.reconcile_attempts + 1
+                delay = self._backoff(attempts)
+                counts["failed"] += 1
+                logger.warning(f"Reconciliador: factura {invoice.number} no validada (intento {attempts}): {message}")
+
+            failed_rows.append({
+                "id": invoice.id,
+                "status": new_status,
+                "reconcile_attempts": attempts,
+                "next_reconcile_at": finished_at + timedelta(seconds=delay),
+                "last_error": str(message)[:500],
+                "updated_at": finished_at,
+            })
+
+        if validated_rows:
+            await session.execute(update(Invoice), validated_rows)
+        if failed_rows:
+            await session.execute(update(Invoice), failed_rows)
+        await session.commit()
+
+        document_store = get_document_store()
+        for row in validated_rows:
+            document_store.schedule(row["id"], replace=True)
+        return counts
+
+    def _backoff(self, attempts: int) -> float:
+        """Espera exponencial (con jitter) tras el intento fallido número `attempts`."""
+        base = self._settings.invoice_reconciler_backoff_base_seconds
+        delay = min(self._settings.invoice_reconciler_backoff_max_seconds, base * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.8, 1.2)
+
+    def snapshot(self) -> dict:
+        """Métricas del reconciliador (para /metrics)."""
+        return {
+            "running": self.running,
+            "passes": self.passes,
+            "checked": self.checked,
+            "validated": self.validated,
+            "failed": self.failed,
+            "deferred": self.deferred,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_duration_seconds": self.last_duration_seconds,
+        }
+
+
+# Instancia global (singleton)
+_reconciler: Optional[InvoiceReconciler] = None
+
+
+def get_invoice_reconciler() -> InvoiceReconciler:
+    """Obtiene el reconciliador global de facturas."""
+    global _reconciler
+    if _reconciler is None:
+        _reconciler = InvoiceReconciler()
+    return _reconciler
@@ -0,0 +1,446 @@
+"""
+Envío idempotente de facturas de órdenes a Factus.
+
+Una orden se factura una sola vez por (tenant, order_reference, document_type):
+- Antes de llamar a Factus se "reclama" la fila Invoice (INSERT ... ON
+  CONFLICT DO NOTHING sobre la restricción única). Si ya existe, la factura
+  se devuelve desde sus columnas (replay) o se informa que está en proceso
+- Las peticiones duplicadas concurrentes del mismo proceso esperan el
+  resultado de la primera en lugar de llamar otra vez a Factus
+- Si la fila ya tuvo intentos previos, se busca la factura en Factus por
+  reference_code antes de reenviarla (el intento anterior pudo llegar)
+- Una fila SUBMITTING tiene un lease (lease_until) que quien la envía renueva
+  mientras espera a Factus; solo se recupera cuando el lease vence
+
+Lo usan /invoices/from-order (síncrono y asíncrono), /invoices/batch y la
+cola de facturas.
+"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import httpx
+from sqlalchemy import and_, or_, select, update
+
+from app.core.config import get_settings
+from app.core.exceptions import (
+    FactusAPIError,
+    FactusCircuitOpenError,
+    FactusConnectionError,
+    FactusRateLimitError,
+)
+from app.db.database import async_session_maker
+from app.db.models import Invoice
+from app.schemas.factus import InvoiceCreateSchema, InvoiceResponseSchema
+from app.services.document_store import get_document_store
+from app.services.factus.service import FactusService
+from app.services.invoice_items import save_invoice_items
+from app.services.number_allocator import get_number_allocator
+from app.services.ticket_data import materialize_ticket
+
+logger = logging.getLogger(__name__)
+
+
+# Estados propios del envío (ver Invoice.status)
+PENDING = "PENDING"
+SUBMITTING = "SUBMITTING"
+ERROR = "ERROR"
+CONTINGENCY = "CONTINGENCY"
+IN_PROGRESS_STATUSES = (PENDING, SUBMITTING)
+
+INVOICE_DOCUMENT = "INVOICE"
+
+# Una factura por orden (restricción única de Invoice)
+ORDER_KEY_COLUMNS = ("tenant_id", "order_reference", "document_type")
+
+# Errores tras los que vale la pena reintentar más tarde
+TRANSIENT_ERRORS = (FactusCircuitOpenError, FactusRateLimitError, FactusConnectionError)
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """
+    True si el error (o alguna de sus causas) es transitorio: red, 5xx,
+    breaker o rate limit. Incluye la red caída al pedir el token.
+    """
+    candidate: Optional[BaseException] = error
+    for _ in range(4):
+        if candidate is None:
+            break
+        if isinstance(candidate, TRANSIENT_ERRORS + (httpx.RequestError,)):
+            return True
+        if isinstance(candidate, FactusAPIError) and (candidate.status_code or 0) >= 500:
+            return True
+        candidate = candidate.__cause__
+    return False
+
+
+def is_completed(invoice: Invoice) -> bool:
+    """
+    True si la orden ya tiene factura: creada en Factus o, en contingencia,
+    con ticket provisional (el outbox la enviará a Factus).
+    """
+    return invoice.status not in IN_PROGRESS_STATUSES and invoice.status != ERROR
+
+
+# =============================================================================
+# FILA LOCAL <-> RESPUESTA DE FACTUS
+# =============================================================================
+
+def apply_invoice_response(
+    invoice: Invoice,
+    response: InvoiceResponseSchema,
+    invoice_data: Optional[InvoiceCreateSchema] = None
+) -> None:
+    """
+    Copia en la fila local los datos de la factura creada en Factus.
+    Con invoice_data también materializa la tirilla (ver ticket_data).
+    Programa la descarga del PDF/XML al almacén local (ver document_store).
+    """
+    invoice.number = response.number
+    invoice.cufe = response.cufe
+    invoice.factus_id = response.id
+    invoice.status = response.status.upper()
+    invoice.pdf_url = response.pdf_url
+    invoice.xml_url = response.xml_url
+    invoice.api_response = response.model_dump(mode="json")
+    invoice.last_error = None
+    invoice.updated_at = datetime.utcnow()
+    if invoice_data is not None:
+        materialize_ticket(invoice, invoice_data)
+    if invoice.id is not None:
+        get_document_store().schedule(invoice.id)
+
+
+async def record_number_usage(session, invoice: Invoice, invoice_data: InvoiceCreateSchema) -> None:
+    """
+    Descuenta del rango local el consecutivo de una factura creada en Factus.
+    
+    Llamar antes del commit que guarda la respuesta: en modo exacto la
+    reserva se confirma (o se revierte) junto con la factura.
+    """
+    await get_number_allocator().allocate(session, invoice.tenant_id, invoice_data.numbering_range_id)
+
+
+def invoice_response_from_row(invoice: Invoice) -> InvoiceResponseSchema:
+    """Reconstruye la respuesta de creación desde las columnas (replay)."""
+    prefix = invoice.number.split("-", 1)[0] if "-" in (invoice.number or "") else None
+    return InvoiceResponseSchema(
+        id=invoice.factus_id or 0,
+        number=invoice.number,
+        prefix=prefix,
+        cufe=invoice.cufe or "",
+        status=invoice.status.lower(),
+        created_at=invoice.created_at,
+        validated_at=invoice.validated_at,
+        pdf_url=invoice.pdf_url,
+        xml_url=invoice.xml_url,
+        qr_code=invoice.qr_url,
+    )
+
+
+# =============================================================================
+# LEASE DEL ENVÍO (SUBMITTING)
+# =============================================================================
+
+def lease_deadline(now: datetime) -> datetime:
+    """Fin del lease de una fila que pasa (o sigue) en SUBMITTING."""
+    return now + timedelta(seconds=get_settings().invoice_submit_lease_seconds)
+
+
+def lease_expired(now: datetime):
+    """
+    Condición SQL: fila SUBMITTING cuyo lease venció.
+
+    Las filas sin lease (anteriores a la columna) se juzgan por updated_at.
+    """
+    stale_cutoff = now - timedelta(seconds=get_settings().invoice_queue_stale_seconds)
+    return and_(
+        Invoice.status == SUBMITTING,
+        or_(
+            Invoice.lease_until < now,
+            and_(Invoice.lease_until == None, Invoice.updated_at < stale_cutoff),
+        ),
+    )
+
+
+async def _renew_lease(invoice_id: int) -> None:
+    """Renueva el lease de la fila mientras el envío sigue en curso."""
+    lease_seconds = get_settings().invoice_submit_lease_seconds
+    while True:
+        await asyncio.sleep(lease_seconds / 3)
+        try:
+            async with async_session_maker() as session:
+                await session.execute(
+                    update(Invoice)
+                    .where(Invoice.id == invoice_id, Invoice.status == SUBMITTING)
+                    .values(lease_until=lease_deadline(datetime.utcnow()))
+                )
+                await session.commit()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"No se pudo renovar el lease de la factura {invoice_id}: {e}")
+
+
+@asynccontextmanager
+async def hold_lease(invoice_id: Optional[int]):
+    """Mantiene vigente el lease de la fila durante el bloque."""
+    if invoice_id is None:
+        yield
+        return
+    task = asyncio.create_task(_renew_lease(invoice_id))
+    try:
+        yield
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+# =============================================================================
+# RECLAMO Y ENVÍO
+# =============================================================================
+
+def _insert_ignoring_conflicts(dialect_name: str, rows: List[dict]):
+    """INSERT ... ON CONFLICT DO NOTHING RETURNING sobre la restricción única."""
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    
+    return (
+        insert(Invoice)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=list(ORDER_KEY_COLUMNS))
+        .returning(Invoice)
+    )
+
+
+async def claim_invoices(
+    session,
+    tenant_id: int,
+    invoices_data: Sequence[InvoiceCreateSchema],
+    status: str = SUBMITTING
+) -> Dict[str, Tuple[Invoice, bool]]:
+    """
+    Reclama órdenes antes de enviarlas a Factus.
+    
+    Inserta las filas en `status` (SUBMITTING para envío inmediato, PENDING
+    para la cola) con un solo INSERT ... ON CONFLICT DO NOTHING. Las órdenes
+    que ya existían se devuelven sin reclamar, salvo las que quedaron en
+    ERROR (reintento de una orden fallida) y las SUBMITTING con el lease
+    vencido (la petición que las enviaba se cayó o se canceló), que se
+    vuelven a reclamar. Como ya tuvieron intentos, antes de reenviarlas se
+    busca la factura en Factus por reference_code.
+    Los ítems de las órdenes reclamadas se escriben en invoice_items en la
+    misma transacción.
+    
+    No usa rollback: la sesión de la petición conserva sus objetos cargados.
+    
+    Returns:
+        {reference_code: (fila, True si esta petición debe enviarla a Factus)}
+    """
+    if not invoices_data:
+        return {}
+    
+    now = datetime.utcnow()
+    first_attempt = 1 if status == SUBMITTING else 0
+    lease_until = lease_deadline(now) if status == SUBMITTING else None
+    by_reference = {data.reference_code: data for data in invoices_data}
+    
+    rows = [
+        {
+            "number": "",
+            "order_reference": reference,
+            "document_type": INVOICE_DOCUMENT,
+            "status": status,
+            "total": data.total,
+            "customer_nit": data.customer.identification_number,
+            "payload": data.model_dump_json(),
+            "attempts": first_attempt,
+            "lease_until": lease_until,
+            "tenant_id": tenant_id,
+            "created_at": now,
+            "updated_at": now,
+        }
+        for reference, data in by_reference.items()
+    ]
+    
+    claims: Dict[str, Tuple[Invoice, bool]] = {}
+    reclaimed_ids: List[int] = []
+    dialect_name = session.bind.dialect.name
+    if dialect_name in ("sqlite", "postgresql"):
+        result = await session.execute(_insert_ignoring_conflicts(dialect_name, rows))
+        for invoice in result.scalars().all():
+            claims[invoice.order_reference] = (invoice, True)
+    
+    missing = [reference for reference in by_reference if reference not in claims]
+    if missing:
+        result = await session.execute(
+            select(Invoice).where(
+                Invoice.tenant_id == tenant_id,
+                Invoice.order_reference.in_(missing),
+                Invoice.document_type == INVOICE_DOCUMENT,
+            )
+        )
+        existing = {invoice.order_reference: invoice for invoice in result.scalars().all()}
+        
+        for reference in missing:
+            invoice = existing.get(reference)
+            data = by_reference[reference]
+            
+            if invoice is None:
+                # Motor sin ON CONFLICT: inserción simple
+                invoice = Invoice(**next(r for r in rows if r["order_reference"] == reference))
+                session.add(invoice)
+                claims[reference] = (invoice, True)
+            elif invoice.status in (ERROR, SUBMITTING):
+                # Se reclama solo si sigue en ERROR o con el lease vencido
+                # (otra petición pudo ganarla, o el envío sigue vivo)
+                reclaimed = await session.execute(
+                    update(Invoice)
+                    .where(Invoice.id == invoice.id, or_(Invoice.status == ERROR, lease_expired(now)))
+                    .values(
+                        status=status,
+                        payload=data.model_dump_json(),
+                        total=data.total,
+                        customer_nit=data.customer.identification_number,
+                        attempts=Invoice.attempts + first_attempt,
+                        lease_until=lease_until,
+                        last_error=None,
+                        updated_at=now,
+                    )
+                )
+                await session.refresh(invoice)
+                claims[reference] = (invoice, reclaimed.rowcount == 1)
+                if reclaimed.rowcount == 1:
+                    reclaimed_ids.append(invoice.id)
+            else:
+                claims[reference] = (invoice, False)
+    
+    claimed = [(invoice, by_reference[reference]) for reference, (invoice, ok) in claims.items() if ok]
+    if any(invoice.id is None for invoice, _ in claimed):
+        await session.flush()
+    await save_invoice_items(session, claimed, replace=reclaimed_ids)
+    
+    await session.commit()
+    return claims
+
+
+async def claim_invoice(
+    session,
+    tenant_id: int,
+    invoice_data: InvoiceCreateSchema,
+    status: str = SUBMITTING
+) -> Tuple[Invoice, bool]:
+    """
+    Reclama una orden antes de enviarla a Factus (ver claim_invoices).
+    
+    Returns:
+        (fila, True si esta petición debe enviarla a Factus)
+    """
+    claims = await claim_invoices(session, tenant_id, [invoice_data], status)
+    return claims[invoice_data.reference_code]
+
+
+async def submit_claimed_invoice(
+    service: FactusService,
+    invoice: Invoice,
+    invoice_data: InvoiceCreateSchema
+) -> InvoiceResponseSchema:
+    """
+    Envía a Factus una factura reclamada.
+
+    Si no es el primer intento, primero la busca por reference_code para no
+    crearla dos veces. Mientras espera a Factus renueva el lease de la fila.
+    """
+    async with hold_lease(invoice.id):
+        if invoice.attempts > 1:
+            existing = await service.find_invoice_by_reference(invoice.order_reference)
+            if existing is not None:
+                return existing
+        return await service.create_invoice(invoice_data)
+
+
+def mark_invoice_failed(invoice: Invoice, error: Any) -> None:
+    """Marca la fila como ERROR (la orden puede volver a reclamarse)."""
+    invoice.status = ERROR
+    invoice.last_error = str(error)[:500]
+    invoice.updated_at = datetime.utcnow()
+
+
+# =============================================================================
+# DUPLICADOS CONCURRENTES (EN PROCESO)
+# =============================================================================
+
+class OrderSingleFlight:
+    """
+    Registro de órdenes en curso en este proceso.
+
+    La primera petición de una orden ejecuta el trabajo; las duplicadas que
+    llegan mientras tanto esperan su resultado (o su excepción).
+    """
+
+    def __init__(self):
+        self._futures: Dict[Hashable, asyncio.Future] = {}
+
+        # Métricas
+        self.joined = 0
+
+    async def run(
+        self,
+        key: Hashable,
+        work: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, bool]:
+        """
+        Ejecuta `work` una sola vez por clave.
+
+        Returns:
+            (resultado, True si se reutilizó el resultado de otra petición)
+        """
+        while key in self._futures:
+            future = self._futures[key]
+            self.joined += 1
+            try:
+                return await asyncio.shield(future), True
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # La petición original fue cancelada: esta toma el trabajo
+
+        future = asyncio.get_running_loop().create_future()
+        # Evita el aviso "exception was never retrieved" si nadie esperaba
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._futures[key] = future
+        try:
+            result = await work()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            self._futures.pop(key, None)
+
+    @property
+    def in_flight(self) -> int:
+        """Órdenes en curso."""
+        return len(self._futures)
+
+
+# Instancia global (singleton)
+_single_flight: Optional[OrderSingleFlight] = None
+
+
+def get_order_single_flight() -> OrderSingleFlight:
+    """Obtiene el registro global de órdenes en curso."""
+    global _single_flight
+    if _single_flight is None:
+        _single_flight = OrderSingleFlight()
+    return _single_flight
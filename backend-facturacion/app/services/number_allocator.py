@@ -0,0 +1,265 @@
+"""
+Reserva atómica de consecutivos de los rangos de numeración DIAN.
+
+Factus asigna el número de cada factura; BillingResolution.current_number es
+el contador local de uso del rango (último consecutivo usado), del que salen
+remaining_numbers y usage_percentage. Para que sea exacto con facturas
+concurrentes se reserva con una sola sentencia:
+
+    UPDATE billing_resolutions
+    SET current_number = max(current_number, number_from - 1) + :n
+    WHERE ... AND max(current_number, number_from - 1) + :n <= number_to
+    RETURNING current_number
+
+(en motores sin UPDATE ... RETURNING: SELECT ... FOR UPDATE y UPDATE).
+
+Modo por bloques (numbering_block_size > 1): cada proceso reserva N números
+de una vez y los entrega desde memoria; al cerrar devuelve los que no usó
+si nadie reservó después. Ahorra la sentencia por factura a cambio de que el
+contador vaya hasta N números por delante del uso real.
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import case, func, select, update
+
+from app.core.config import Settings, get_settings
+from app.db.database import async_session_maker
+from app.db.models import BillingResolution
+from app.services.active_range_index import get_active_range_index
+
+logger = logging.getLogger(__name__)
+
+
+def _last_used():
+    """Último consecutivo usado (current_number, o number_from - 1 si aún no se usa)."""
+    current = func.coalesce(BillingResolution.current_number, 0)
+    start = func.coalesce(BillingResolution.number_from, 0) - 1
+    return case((current < start, start), else_=current)
+
+
+async def reserve_numbers(
+    session,
+    tenant_id: int,
+    count: int = 1,
+    *,
+    factus_id: Optional[int] = None,
+    range_id: Optional[int] = None,
+) -> Optional[Tuple[int, int]]:
+    """
+    Reserva `count` consecutivos del rango en la transacción de `session`.
+
+    El rango se identifica por factus_id (el que envían las facturas) o por
+    su id interno. No hace commit: la reserva se confirma junto con lo demás
+    que guarde el llamador.
+
+    Returns:
+        (primero, último) reservados, o None si el rango no existe, no es del
+        tenant o no le quedan `count` números
+    """
+    if count < 1:
+        raise ValueError("count debe ser mayor que 0")
+
+    conditions = [BillingResolution.tenant_id == tenant_id]
+    if factus_id is not None:
+        conditions.append(BillingResolution.factus_id == factus_id)
+    elif range_id is not None:
+        conditions.append(BillingResolution.id == range_id)
+    else:
+        raise ValueError("Se requiere factus_id o range_id")
+
+    new_current = _last_used() + count
+    conditions.append(new_current <= func.coalesce(BillingResolution.number_to, 0))
+    now = datetime.utcnow()
+
+    if session.bind.dialect.update_returning:
+        result = await session.execute(
+            update(BillingResolution)
+            .where(*conditions)
+            .values(current_number=new_current, updated_at=now)
+            .returning(BillingResolution.current_number)
+            .execution_options(synchronize_session=False)
+        )
+        last = result.scalar_one_or_none()
+    else:
+        # Bloqueo de fila: otra transacción espera hasta el commit de esta
+        result = await session.execute(
+            select(BillingResolution.id, new_current).where(*conditions).with_for_update()
+        )
+        row = result.first()
+        last = None
+        if row is not None:
+            last = row[1]
+            await session.execute(
+                update(BillingResolution)
+                .where(BillingResolution.id == row[0])
+                .values(current_number=last, updated_at=now)
+                .execution_options(synchronize_session=False)
+            )
+
+    if last is None:
+        return None
+    return last - count + 1, last
+
+
+class NumberAllocator:
+    """
+    Reserva consecutivos para el flujo de facturación.
+
+    Con numbering_block_size = 1 cada factura reserva su número en la misma
+    transacción en que se guarda (contador exacto). Con bloques, un lock por
+    rango evita que dos corrutinas del proceso reserven a la vez.
+    """
+
+    def __init__(
+        self,
+        settings: Optional[Settings] = None,
+        session_maker=async_session_maker,
+    ):
+        self._settings = settings or get_settings()
+        self._session_maker = session_maker
+
+        # Bloques reservados por (tenant_id, factus_id): [siguiente, último]
+        self._blocks: Dict[Tuple[int, int], List[int]] = {}
+        self._locks: Dict[Tuple[int, int], asyncio.Lock] = {}
+
+        # Métricas
+        self.allocated = 0
+        self.blocks_leased = 0
+        self.exhausted = 0
+
+    @property
+    def block_size(self) -> int:
+        return max(1, self._settings.numbering_block_size)
+
+    async def allocate(
+        self,
+        session,
+        tenant_id: int,
+        factus_id: int,
+        count: int = 1
+    ) -> Optional[List[int]]:
+        """
+        Reserva `count` consecutivos del rango para facturas ya creadas.
+
+        En modo exacto usa la transacción de `session` (el llamador hace
+        commit). En modo por bloques los toma del bloque del proceso.
+
+        El uso se informa al índice de rangos activos: umbrales de aviso y
+        cambio de rango antes de la siguiente venta si este se agotó.
+
+        Returns:
+            Números reservados, o None si el rango no existe o está agotado
+            (se registra; la factura ya existe en Factus y no se revierte)
+        """
+        if self.block_size == 1:
+            reserved = await reserve_numbers(session, tenant_id, count, factus_id=factus_id)
+            numbers = list(range(reserved[0], reserved[1] + 1)) if reserved else None
+        else:
+            numbers = await self._take_from_block(tenant_id, factus_id, count)
+
+        get_active_range_index().record_usage(tenant_id, factus_id, numbers[-1] if numbers else None)
+
+        if numbers is None:
+            self.exhausted += 1
+            logger.warning(
+                f"Rango {factus_id} del tenant {tenant_id}: sin números locales para {count} "
+                f"factura(s); el contador se corregirá en la próxima sincronización"
+            )
+            return None
+
+        self.allocated += len(numbers)
+        return numbers
+
+    async def _take_from_block(self, tenant_id: int, factus_id: int, count: int) -> Optional[List[int]]:
+        key = (tenant_id, factus_id)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            numbers: List[int] = []
+            while len(numbers) < count:
+                block = self._blocks.get(key)
+                if block is None or block[0] > block[1]:
+                    block = await self._lease_block(tenant_id, factus_id, max(self.block_size, count - len(numbers)))
+                    if block is None:
+                        return None
+                    self._blocks[key] = block
+                take = min(count - len(numbers), block[1] - block[0] + 1)
+                numbers.extend(range(block[0], block[0] + take))
+                block[0] += take
+            return numbers
+
+    async def _lease_block(self, tenant_id: int, factus_id: int, size: int) -> Optional[List[int]]:
+        """Reserva un bloque en su propia transacción (queda del proceso aunque falle la factura)."""
+        async with self._session_maker() as session:
+            reserved = await reserve_numbers(session, tenant_id, size, factus_id=factus_id)
+            if reserved is None and size > 1:
+                # Final del rango: lo que quede, de a uno
+                reserved = await reserve_numbers(session, tenant_id, 1, factus_id=factus_id)
+            await session.commit()
+
+        if reserved is None:
+            return None
+        self.blocks_leased += 1
+        return [reserved[0], reserved[1]]
+
+    async def release_blocks(self) -> int:
+        """
+        Devuelve al rango los números reservados y no usados.
+
+        Solo si el contador sigue en el final del bloque (nadie reservó
+        después); si no, quedan como hueco hasta la próxima sincronización.
+
+        Returns:
+            Números devueltos
+        """
+        released = 0
+        blocks, self._blocks = self._blocks, {}
+        if not blocks:
+            return 0
+        async with self._session_maker() as session:
+            for (tenant_id, factus_id), (next_number, last) in blocks.items():
+                unused = last - next_number + 1
+                if unused <= 0:
+                    continue
+                result = await session.execute(
+                    update(BillingResolution)
+                    .where(
+                        BillingResolution.tenant_id == tenant_id,
+                        BillingResolution.factus_id == factus_id,
+                        BillingResolution.current_number == last,
+                    )
+                    .values(current_number=next_number - 1, updated_at=datetime.utcnow())
+                    .execution_options(synchronize_session=False)
+                )
+                if result.rowcount == 1:
+                    released += unused
+            await session.commit()
+
+        if released:
+            logger.info(f"Numeración: {released} números reservados sin usar devueltos a sus rangos")
+        return released
+
+    def snapshot(self) -> dict:
+        """Métricas del asignador (para /metrics)."""
+        return {
+            "block_size": self.block_size,
+            "allocated": self.allocated,
+            "blocks_leased": self.blocks_leased,
+            "exhausted": self.exhausted,
+            "leased_unused": sum(max(0, last - nxt + 1) for nxt, last in self._blocks.values()),
+        }
+
+
+# Instancia global (singleton)
+_number_allocator: Optional[NumberAllocator] = None
+
+
+def get_number_allocator() -> NumberAllocator:
+    """Obtiene el asignador global de consecutivos."""
+    global _number_allocator
+    if _number_allocator is None:
+        _number_allocator = NumberAllocator()
+    return _number_allocator
@@ -13,6 +13,8 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.config import Settings, get_settings
 from app.core.encryption import encrypt_credential, decrypt_credential
 from app.db.models import Tenant
+from app.services.factus.http_pool import get_http_client_registry
+from app.services.factus.tenant_settings_cache import get_tenant_settings_cache
 from app.schemas.restaurants import (
     RestaurantCreate,
     RestaurantUpdate,
@@ -140,6 +142,11 @@ class RestaurantService:
         await self._session.commit()
         await self._session.refresh(restaurant)
         
+        # Descartar la configuración de Factus cacheada (credenciales o estado)
+        get_tenant_settings_cache().invalidate(restaurant_id)
+        if not restaurant.is_active:
+            await self._discard_http_client(restaurant_id)
+        
         logger.info(f"Restaurante {restaurant_id} actualizado")
         return restaurant
     
@@ -153,9 +160,17 @@ class RestaurantService:
         restaurant.updated_at = datetime.utcnow()
         
         await self._session.commit()
+        get_tenant_settings_cache().invalidate(restaurant_id)
+        await self._discard_http_client(restaurant_id)
         logger.info(f"Restaurante {restaurant_id} desactivado")
         return True
     
+    async def _discard_http_client(self, restaurant_id: int) -> None:
+        """Cierra el pool de conexiones a Factus de un restaurante desactivado."""
+        await get_http_client_registry().discard(
+            restaurant_id, self._settings.factus_base_url
+        )
+    
     # =========================================================================
     # CREDENCIALES (DESENCRIPTADAS)
     # =========================================================================
@@ -0,0 +1,250 @@
+"""
+Tirillas materializadas (GET /invoices/{number}/ticket-data).
+
+Los datos de impresión se calculan una vez y se guardan en Invoice.ticket_data:
+- Al crear la factura (ítems del payload y resolución en memoria, sin
+  consultas extra)
+- Al validarla (se actualizan CUFE y QR de la cabecera)
+- Las facturas anteriores, o creadas sin el rango en memoria, se
+  materializan la primera vez que se imprimen
+
+Cada reimpresión sirve el JSON ya serializado desde un cache LRU por
+(tenant, número), con ETag: si el cliente envía If-None-Match responde 304.
+Los datos del restaurante no se guardan en la factura; se agregan al
+serializar y su cambio invalida la entrada del cache.
+"""
+
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from app.core.config import get_settings
+from app.db.models import BillingResolution, Invoice, InvoiceItem, Tenant
+from app.schemas.factus import InvoiceCreateSchema
+from app.services.active_range_index import get_active_range_index
+from app.services.invoice_items import invoice_item_rows, ticket_totals
+
+logger = logging.getLogger(__name__)
+
+
+# Formato de ticket_data; al cambiarlo las tirillas guardadas se recalculan
+TICKET_FORMAT = 1
+
+CONTINGENCY = "CONTINGENCY"
+
+
+# =============================================================================
+# DOCUMENTO
+# =============================================================================
+
+def _footer_message(status: str) -> str:
+    if status == CONTINGENCY:
+        return "Ticket provisional: factura electrónica en contingencia"
+    return "Facturación Electrónica DIAN"
+
+
+def _ticket_header(number: str, created_at: Any, cufe: Optional[str], qr_code: Optional[str]) -> Dict[str, Any]:
+    return {
+        "number": number,
+        "date": str(created_at),
+        "cufe": cufe,
+        "qr_code": qr_code,
+        "payment_form": "Contado"
+    }
+
+
+def build_ticket_document(
+    invoice: Invoice,
+    items: Sequence[InvoiceItem],
+    resolution: Optional[BillingResolution]
+) -> Dict[str, Any]:
+    """Datos de impresión de una factura (todo menos el restaurante)."""
+    resolution_data = {}
+    if resolution:
+        resolution_data = {
+            "number": resolution.resolution_number,
+            "date": str(resolution.resolution_date),
+            "prefix": resolution.prefix,
+            "from": resolution.number_from,
+            "to": resolution.number_to
+        }
+
+    return {
+        "format": TICKET_FORMAT,
+        "invoice": _ticket_header(invoice.number, invoice.created_at, invoice.cufe, invoice.qr_url),
+        "resolution": resolution_data,
+        "items": [
+            {
+                "name": item.description,
+                "qty": float(item.quantity),
+                "price": float(item.price),
+                "total": float(item.subtotal)
+            }
+            for item in items
+        ],
+        "totals": ticket_totals(items),
+        "footer_message": _footer_message(invoice.status)
+    }
+
+
+def is_current(document: Optional[dict]) -> bool:
+    """True si la tirilla guardada existe y tiene el formato vigente."""
+    return bool(document) and document.get("format") == TICKET_FORMAT
+
+
+def materialize_ticket(invoice: Invoice, invoice_data: InvoiceCreateSchema) -> None:
+    """
+    Guarda la tirilla de una factura recién creada (sin consultar la BD).
+
+    La resolución sale del índice de rangos en memoria; si el rango no está
+    cargado en este proceso la tirilla queda sin materializar y se calcula
+    en la primera impresión.
+    """
+    resolution = get_active_range_index().cached_range(invoice.tenant_id, invoice_data.numbering_range_id)
+    if resolution is None:
+        invoice.ticket_data = None
+        return
+
+    items = [InvoiceItem(**row) for row in invoice_item_rows(invoice.id, invoice.tenant_id, invoice_data)]
+    invoice.ticket_data = build_ticket_document(invoice, items, resolution)
+    invoice.ticket_version = (invoice.ticket_version or 0) + 1
+    get_ticket_cache().invalidate(invoice.tenant_id, invoice.number)
+
+
+def revised_ticket(invoice: Invoice, **columns: Any) -> Dict[str, Any]:
+    """
+    Columnas ticket_data / ticket_version tras cambiar `columns` de la
+    factura (ej: cufe y qr_url al validarla). Vacío si la tirilla no está
+    materializada: se calculará completa en la primera impresión.
+    """
+    if not is_current(invoice.ticket_data):
+        return {}
+
+    def value(column: str) -> Any:
+        return columns[column] if column in columns else getattr(invoice, column)
+
+    get_ticket_cache().invalidate(invoice.tenant_id, invoice.number)
+    return {
+        "ticket_data": {
+            **invoice.ticket_data,
+            "invoice": _ticket_header(value("number"), invoice.created_at, value("cufe"), value("qr_url")),
+            "footer_message": _footer_message(value("status")),
+        },
+        "ticket_version": (invoice.ticket_version or 0) + 1,
+    }
+
+
+def render_ticket(tenant: Tenant, document: Dict[str, Any]) -> bytes:
+    """JSON final de la tirilla (restaurante + documento guardado)."""
+    body = {
+        "restaurant": {
+            "name": tenant.name,
+            "nit": tenant.nit,
+            "address": "Dirección registrada"
+        },
+        **{key: value for key, value in document.items() if key != "format"},
+    }
+    return json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+# =============================================================================
+# CACHE LRU
+# =============================================================================
+
+class TicketDataCache:
+    """
+    Cache LRU con TTL de tirillas serializadas por (tenant, número).
+
+    - El ETag es el hash del contenido: igual en todos los workers
+    - La huella del restaurante (nombre, NIT) invalida la entrada si cambia
+    - Se invalida al materializar o revisar la tirilla en este proceso; en
+      otros workers la entrada vence por TTL
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 300.0):
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[int, str], Tuple[bytes, str, float, str]]" = OrderedDict()
+
+        # Métricas
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    @staticmethod
+    def fingerprint(tenant: Tenant) -> str:
+        """Huella de los datos del restaurante incluidos en la tirilla."""
+        return f"{tenant.name}|{tenant.nit or ''}"
+
+    @staticmethod
+    def etag_for(body: bytes) -> str:
+        return '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+
+    def get(self, tenant: Tenant, number: str) -> Optional[Tuple[bytes, str]]:
+        """(JSON, ETag) de la tirilla cacheada, o None."""
+        key = (tenant.id, number)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        body, etag, expires_at, fingerprint = entry
+        if time.monotonic() >= expires_at or fingerprint != self.fingerprint(tenant):
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return body, etag
+
+    def set(self, tenant: Tenant, number: str, body: bytes) -> str:
+        """Guarda la tirilla serializada y devuelve su ETag."""
+        etag = self.etag_for(body)
+        key = (tenant.id, number)
+        self._entries[key] = (body, etag, time.monotonic() + self._ttl_seconds, self.fingerprint(tenant))
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+        return etag
+
+    def invalidate(self, tenant_id: int, number: Optional[str]) -> None:
+        """Elimina la tirilla de una factura (ej: al validarla)."""
+        if number:
+            self._entries.pop((tenant_id, number), None)
+
+    def clear(self) -> None:
+        """Elimina todas las entradas."""
+        self._entries.clear()
+
+    def snapshot(self) -> dict:
+        """Estado para /metrics."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self._max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+# Instancia global (singleton)
+_ticket_cache: Optional[TicketDataCache] = None
+
+
+def get_ticket_cache() -> TicketDataCache:
+    """Obtiene la instancia global del cache de tirillas."""
+    global _ticket_cache
+    if _ticket_cache is None:
+        settings = get_settings()
+        _ticket_cache = TicketDataCache(
+            max_entries=settings.ticket_cache_max_entries,
+            ttl_seconds=settings.ticket_cache_ttl_seconds,
+        )
+    return _ticket_cache
@@ -16,6 +16,17 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.db.database import init_db
+from app.core.config import get_settings
+from app.core.exceptions import FactusCircuitOpenError, FactusRateLimitError
+from app.services.document_store import get_document_store
+from app.services.factus.catalog_cache import get_catalog_cache
+from app.services.factus.http_pool import close_http_client_registry
+from app.services.factus.tenant_settings_cache import get_tenant_settings_cache
+from app.services.factus.token_refresher import get_token_refresher
+from app.services.invoice_outbox import get_outbox_replayer
+from app.services.invoice_queue import get_invoice_queue
+from app.services.invoice_reconciler import get_invoice_reconciler
+from app.services.number_allocator import get_number_allocator
 from app.routers import billing
 from app.routers import ranges
 from app.routers import restaurants
@@ -38,9 +49,43 @@ async def lifespan(app: FastAPI):
     await init_db()
     logger.info("Base de datos inicializada")
     
+    # Renovación proactiva de tokens de Factus
+    if get_settings().token_refresher_enabled:
+        get_token_refresher().start()
+    
+    # Cola de envío asíncrono de facturas (reencola las pendientes)
+    if get_settings().invoice_queue_enabled:
+        await get_invoice_queue().start()
+    
+    # Outbox de contingencia (reenvía lo que quedó pendiente antes del reinicio)
+    if get_settings().invoice_outbox_enabled:
+        get_outbox_replayer().start()
+    
+    # Validación DIAN en segundo plano de facturas CREATED / ERROR_VALIDATING
+    if get_settings().invoice_reconciler_enabled:
+        get_invoice_reconciler().start()
+    
+    # Descarga en segundo plano de PDF/XML al almacén local
+    if get_settings().document_store_enabled:
+        await get_document_store().start()
+    
     yield
     
     logger.info("Cerrando módulo de facturación electrónica...")
+    
+    await get_invoice_queue().stop()
+    await get_outbox_replayer().stop()
+    await get_invoice_reconciler().stop()
+    await get_document_store().stop()
+    await get_number_allocator().release_blocks()
+    await get_token_refresher().stop()
+    await get_catalog_cache().aclose()
+    
+    # Cerrar pool de conexiones HTTP hacia Factus
+    await close_http_client_registry()
+    
+    # Soltar credenciales desencriptadas
+    get_tenant_settings_cache().clear()
 
 
 app = FastAPI(
@@ -70,6 +115,10 @@ app.include_router(billing.router)
 app.include_router(ranges.router)
 app.include_router(inventory.router)
 
+# Circuit breaker abierto / cola del rate limiter agotada -> 503 (fail fast)
+app.add_exception_handler(FactusCircuitOpenError, billing.factus_unavailable_handler)
+app.add_exception_handler(FactusRateLimitError, billing.factus_unavailable_handler)
+
 
 @app.get("/", tags=["Root"])
 async def root():
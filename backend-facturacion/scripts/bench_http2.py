@@ -0,0 +1,252 @@
+"""
+Benchmark de HTTP/1.1 vs HTTP/2 hacia un servidor local que simula Factus.
+
+Levanta un stub TLS (certificado autofirmado, ALPN h2/http1.1) con latencia
+fija por respuesta, y lanza N peticiones concurrentes de un mismo tenant a
+través de FactusClient y del registro de clientes HTTP, primero con HTTP/1.1 y
+luego con FACTUS_HTTP2. Reporta tiempo total, latencias y conexiones abiertas.
+
+Requiere el paquete h2 (pip install h2).
+
+Uso: python scripts/bench_http2.py [peticiones] [max_conexiones] [latencia_ms]
+"""
+import asyncio
+import datetime
+import ipaddress
+import json
+import os
+import ssl
+import statistics
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+# El benchmark mide el transporte, no el rate limiter
+os.environ.setdefault("FACTUS_RATE_LIMIT_ENABLED", "false")
+
+HOST = "127.0.0.1"
+
+stats = {"connections": 0, "h2_connections": 0}
+
+
+def generate_certificate(directory: str) -> tuple:
+    """Genera un certificado autofirmado para 127.0.0.1."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, HOST)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=1))
+        .not_valid_after(now + datetime.timedelta(hours=1))
+        .add_extension(
+            x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address(HOST))]),
+            critical=False,
+        )
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption(),
+        ))
+    return cert_path, key_path
+
+
+def response_body(path: str) -> bytes:
+    """Respuesta simulada de Factus según la ruta."""
+    if path.startswith("/oauth/token"):
+        data = {"access_token": "bench", "refresh_token": "bench", "expires_in": 3600}
+    else:
+        data = {"status": "OK", "data": []}
+    return json.dumps(data).encode()
+
+
+async def handle_http1(reader, writer, latency: float) -> None:
+    """Conexión HTTP/1.1 con keep-alive: una petición a la vez."""
+    while True:
+        head = await reader.readuntil(b"\r\n\r\n")
+        lines = head.decode().split("\r\n")
+        path = lines[0].split(" ")[1]
+        headers = dict(
+            line.split(": ", 1) for line in lines[1:] if ": " in line
+        )
+        length = int(headers.get("content-length", headers.get("Content-Length", 0)))
+        if length:
+            await reader.readexactly(length)
+
+        await asyncio.sleep(latency)
+        body = response_body(path)
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+            + f"Content-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+
+
+async def handle_http2(reader, writer, latency: float) -> None:
+    """Conexión HTTP/2: las peticiones se atienden en paralelo por stream."""
+    import h2.config
+    import h2.connection
+    import h2.events
+
+    conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False))
+    conn.initiate_connection()
+    writer.write(conn.data_to_send())
+
+    paths = {}
+
+    async def respond(stream_id: int, path: str) -> None:
+        await asyncio.sleep(latency)
+        body = response_body(path)
+        conn.send_headers(stream_id, [
+            (":status", "200"),
+            ("content-type", "application/json"),
+            ("content-length", str(len(body))),
+        ])
+        conn.send_data(stream_id, body, end_stream=True)
+        writer.write(conn.data_to_send())
+
+    while True:
+        data = await reader.read(65535)
+        if not data:
+            return
+        for event in conn.receive_data(data):
+            if isinstance(event, h2.events.RequestReceived):
+                paths[event.stream_id] = dict(event.headers)[b":path"].decode()
+            elif isinstance(event, h2.events.DataReceived):
+                conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            elif isinstance(event, h2.events.StreamEnded):
+                asyncio.create_task(respond(event.stream_id, paths.pop(event.stream_id)))
+        writer.write(conn.data_to_send())
+
+
+async def start_factus_stub(cert_path: str, key_path: str, latency: float):
+    """Servidor TLS que negocia h2 o http/1.1 por ALPN."""
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert_path, key_path)
+    context.set_alpn_protocols(["h2", "http/1.1"])
+
+    async def handle(reader, writer):
+        stats["connections"] += 1
+        protocol = writer.get_extra_info("ssl_object").selected_alpn_protocol()
+        try:
+            if protocol == "h2":
+                stats["h2_connections"] += 1
+                await handle_http2(reader, writer, latency)
+            else:
+                await handle_http1(reader, writer, latency)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, HOST, 0, ssl=context)
+
+
+async def run_round(port: int, http2: bool, requests: int, max_connections: int) -> dict:
+    """Lanza las peticiones concurrentes de un tenant con un modo de transporte."""
+    from app.core.config import Settings
+    from app.services.factus.client import FactusClient
+    from app.services.factus.http_pool import FactusHTTPClientRegistry
+
+    settings = Settings(
+        factus_base_url=f"https://{HOST}:{port}",
+        factus_client_id="bench",
+        factus_client_secret="bench",
+        factus_email="bench@example.com",
+        factus_password="bench",
+        factus_http2=http2,
+        factus_http_max_connections=max_connections,
+        factus_http_max_keepalive_connections=max_connections,
+    )
+    registry = FactusHTTPClientRegistry(settings)
+    client = FactusClient(registry.get_client("bench", settings.factus_base_url), settings)
+
+    # Calentamiento: login y primera conexión fuera de la medición
+    await client.get("/v1/tributes")
+    stats["connections"] = 0
+    stats["h2_connections"] = 0
+
+    async def timed_request() -> float:
+        started = time.perf_counter()
+        await client.get("/v1/tributes")
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*[timed_request() for _ in range(requests)])
+    elapsed = time.perf_counter() - started
+
+    await registry.aclose()
+
+    latencies.sort()
+    return {
+        "elapsed": elapsed,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "new_connections": stats["connections"],
+        "h2_connections": stats["h2_connections"],
+    }
+
+
+async def main() -> None:
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    max_connections = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    latency = (int(sys.argv[3]) if len(sys.argv) > 3 else 50) / 1000
+
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        print("❌ Este benchmark requiere el paquete h2: pip install h2")
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cert_path, key_path = generate_certificate(tmp)
+        # httpx confía en el certificado del stub vía SSL_CERT_FILE
+        os.environ["SSL_CERT_FILE"] = cert_path
+
+        server = await start_factus_stub(cert_path, key_path, latency)
+        port = server.sockets[0].getsockname()[1]
+
+        print("=" * 60)
+        print("BENCHMARK HTTP/1.1 vs HTTP/2 (Factus stub local)")
+        print("=" * 60)
+        print(f"{requests} peticiones concurrentes, pool de {max_connections} conexiones, "
+              f"latencia del stub {latency * 1000:.0f} ms\n")
+
+        results = {}
+        for label, http2 in (("HTTP/1.1", False), ("HTTP/2", True)):
+            results[label] = await run_round(port, http2, requests, max_connections)
+            r = results[label]
+            print(f"{label:9} total {r['elapsed']:.3f}s | p50 {r['p50'] * 1000:.0f} ms | "
+                  f"p95 {r['p95'] * 1000:.0f} ms | conexiones nuevas {r['new_connections']} "
+                  f"(h2: {r['h2_connections']})")
+
+        server.close()
+        await server.wait_closed()
+
+    speedup = results["HTTP/1.1"]["elapsed"] / results["HTTP/2"]["elapsed"]
+    print(f"\nHTTP/2 es {speedup:.1f}x más rápido para este tenant")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
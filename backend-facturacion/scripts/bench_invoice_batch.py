@@ -0,0 +1,166 @@
+"""
+Benchmark de facturación en lote vs órdenes una por una.
+
+Levanta un servidor local que simula Factus con latencia fija en la creación
+de facturas y una BD SQLite temporal con un tenant. Factura N órdenes primero
+con llamadas seriales a /invoices/from-order (como hace hoy el frontend) y
+luego con una sola llamada a /invoices/batch, y reporta tiempo total,
+throughput, envíos simultáneos que recibió Factus y sentencias SQL.
+
+Uso: python scripts/bench_invoice_batch.py [ordenes] [concurrencia] [latencia_ms]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+PORT = 8768
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_invoice_batch.db")
+
+ORDERS = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+CONCURRENCY = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+LATENCY = (int(sys.argv[3]) if len(sys.argv) > 3 else 300) / 1000
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ["FACTUS_BASE_URL"] = f"http://127.0.0.1:{PORT}"
+os.environ["TOKEN_REFRESHER_ENABLED"] = "false"
+# El benchmark mide la concurrencia del lote, no el rate limiter
+os.environ["FACTUS_RATE_LIMIT_ENABLED"] = "false"
+os.environ["INVOICE_BATCH_CONCURRENCY"] = str(CONCURRENCY)
+os.environ.setdefault("ENCRYPTION_KEY", "bench-invoice-batch-key")
+os.environ.setdefault("SUPABASE_JWT_SECRET", "bench-invoice-batch-secret-32-bytes!")
+for var in ("FACTUS_CLIENT_ID", "FACTUS_CLIENT_SECRET", "FACTUS_EMAIL", "FACTUS_PASSWORD"):
+    os.environ.setdefault(var, "bench")
+
+from support import build_order, created_bill, factus_stub, make_token, seed_tenant, start_factus_stub
+
+stub_stats = {"created": 0, "in_flight": 0, "max_in_flight": 0, "references": set()}
+
+
+def build_factus_stub():
+    """Factus simulado con latencia en /v1/bills/validate."""
+    from fastapi import Request
+
+    stub = factus_stub()
+
+    @stub.post("/v1/bills/validate")
+    async def create_bill(request: Request):
+        body = await request.json()
+        stub_stats["in_flight"] += 1
+        stub_stats["max_in_flight"] = max(stub_stats["max_in_flight"], stub_stats["in_flight"])
+        try:
+            await asyncio.sleep(LATENCY)
+        finally:
+            stub_stats["in_flight"] -= 1
+        stub_stats["created"] += 1
+        stub_stats["references"].add(body["reference_code"])
+        number = 990000000 + stub_stats["created"]
+        return created_bill(number, public_url=f"https://example.com/bill/{number}")
+
+    return stub
+
+
+async def run_serial(client, headers: dict) -> dict:
+    """Una llamada a /invoices/from-order por orden, en serie."""
+    stub_stats["max_in_flight"] = 0
+    started = time.perf_counter()
+    errors = 0
+    for index in range(ORDERS):
+        response = await client.post(
+            "/api/billing/invoices/from-order",
+            json=build_order(f"ORD-SERIAL-{index}", numbering_range_id=8),
+            headers=headers,
+        )
+        errors += response.status_code >= 400
+    elapsed = time.perf_counter() - started
+    return {"elapsed": elapsed, "created": ORDERS - errors, "errors": errors}
+
+
+async def run_batch(client, headers: dict) -> dict:
+    """Todas las órdenes en una sola llamada a /invoices/batch."""
+    stub_stats["max_in_flight"] = 0
+    orders = [build_order(f"ORD-BATCH-{index}", numbering_range_id=8) for index in range(ORDERS)]
+    # Una orden repetida y una con rango ajeno: se rechazan sin afectar al resto
+    orders.append(build_order("ORD-BATCH-0", numbering_range_id=8))
+    orders.append(build_order("ORD-BATCH-X-0", numbering_range_id=999))
+
+    started = time.perf_counter()
+    response = await client.post(
+        "/api/billing/invoices/batch",
+        json={"orders": orders},
+        headers=headers,
+    )
+    elapsed = time.perf_counter() - started
+    body = response.json()
+    return {
+        "elapsed": elapsed,
+        "created": body["created"],
+        "rejected": body["rejected"],
+        "errors": body["failed"],
+        "saved": sum(1 for r in body["results"] if r["invoice_id"]),
+    }
+
+
+async def main() -> None:
+    import httpx
+    from sqlalchemy import event
+
+    from app.db.database import engine
+    from main import app
+
+    start_factus_stub(build_factus_stub(), PORT)
+
+    await seed_tenant("Restaurante Lote", "900000001", "lote@example.com")
+    headers = {"Authorization": f"Bearer {make_token('bench-user', ttl_seconds=3600)}"}
+
+    statements = []
+    event.listen(
+        engine.sync_engine, "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement),
+    )
+
+    print("=" * 60)
+    print("BENCHMARK FACTURACIÓN EN LOTE vs SERIAL")
+    print("=" * 60)
+    print(f"{ORDERS} órdenes, concurrencia del lote {CONCURRENCY}, "
+          f"latencia de Factus {LATENCY * 1000:.0f} ms\n")
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+            statements.clear()
+            serial = await run_serial(client, headers)
+            serial["statements"] = len(statements)
+
+            statements.clear()
+            batch = await run_batch(client, headers)
+            batch["statements"] = len(statements)
+            batch["max_in_flight"] = stub_stats["max_in_flight"]
+
+    print(f"serial   {serial['elapsed']:6.2f}s ({ORDERS / serial['elapsed']:5.1f} fact/s) | "
+          f"creadas {serial['created']} | sentencias SQL {serial['statements']}")
+    print(f"lote     {batch['elapsed']:6.2f}s ({ORDERS / batch['elapsed']:5.1f} fact/s) | "
+          f"creadas {batch['created']} | rechazadas {batch['rejected']} | "
+          f"simultáneas en Factus {batch['max_in_flight']} | sentencias SQL {batch['statements']}")
+
+    speedup = serial["elapsed"] / batch["elapsed"]
+    print(f"\nEl lote es {speedup:.1f}x más rápido que las llamadas seriales")
+
+    ok = (
+        batch["created"] == ORDERS
+        and batch["saved"] == ORDERS
+        and batch["rejected"] == 2
+        and batch["max_in_flight"] <= CONCURRENCY
+        and stub_stats["created"] == len(stub_stats["references"])
+    )
+    print(f"{'✅' if ok else '❌'} Resultados por orden, concurrencia acotada y sin duplicados")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
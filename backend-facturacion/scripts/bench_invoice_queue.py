@@ -0,0 +1,247 @@
+"""
+Benchmark de facturación síncrona vs cola asíncrona (202 Accepted).
+
+Levanta un servidor local que simula Factus con latencia fija en la creación
+de facturas y una BD SQLite temporal con un tenant. Envía N órdenes en paralelo
+primero en modo síncrono y luego con async_mode=true, y reporta:
+- latencia de respuesta al cliente (p50/p95)
+- tiempo hasta que todas las facturas quedan creadas (throughput)
+- máximo de envíos simultáneos que recibió Factus
+
+Al final verifica la recuperación tras una caída: una factura SUBMITTING
+con el lease vencido se reencola al iniciar la cola y termina CREATED sin
+duplicarse, mientras que una cuyo envío sigue renovando el lease no se toca
+hasta que deja de renovarlo.
+
+Uso: python scripts/bench_invoice_queue.py [ordenes] [workers] [cupo_tenant] [latencia_ms]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+PORT = 8767
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_invoice_queue.db")
+
+ORDERS = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+WORKERS = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+TENANT_CONCURRENCY = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+LATENCY = (int(sys.argv[4]) if len(sys.argv) > 4 else 300) / 1000
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ["FACTUS_BASE_URL"] = f"http://127.0.0.1:{PORT}"
+os.environ["TOKEN_REFRESHER_ENABLED"] = "false"
+# El benchmark mide la cola, no el rate limiter
+os.environ["FACTUS_RATE_LIMIT_ENABLED"] = "false"
+os.environ["INVOICE_QUEUE_ENABLED"] = "true"
+os.environ["INVOICE_QUEUE_WORKERS"] = str(WORKERS)
+os.environ["INVOICE_QUEUE_TENANT_CONCURRENCY"] = str(TENANT_CONCURRENCY)
+os.environ["INVOICE_QUEUE_STALE_SECONDS"] = "1"
+os.environ["INVOICE_SUBMIT_LEASE_SECONDS"] = "1"
+os.environ.setdefault("ENCRYPTION_KEY", "bench-invoice-queue-key")
+os.environ.setdefault("SUPABASE_JWT_SECRET", "bench-invoice-queue-secret-32-bytes!")
+for var in ("FACTUS_CLIENT_ID", "FACTUS_CLIENT_SECRET", "FACTUS_EMAIL", "FACTUS_PASSWORD"):
+    os.environ.setdefault(var, "bench")
+
+from support import build_order, created_bill, factus_stub, make_token, seed_tenant, start_factus_stub
+
+stub_stats = {"created": 0, "in_flight": 0, "max_in_flight": 0, "references": set()}
+
+
+def build_factus_stub():
+    """Factus simulado con latencia en /v1/bills/validate."""
+    from fastapi import Request
+
+    stub = factus_stub()
+
+    @stub.post("/v1/bills/validate")
+    async def create_bill(request: Request):
+        body = await request.json()
+        stub_stats["in_flight"] += 1
+        stub_stats["max_in_flight"] = max(stub_stats["max_in_flight"], stub_stats["in_flight"])
+        try:
+            await asyncio.sleep(LATENCY)
+        finally:
+            stub_stats["in_flight"] -= 1
+        stub_stats["created"] += 1
+        stub_stats["references"].add(body["reference_code"])
+        number = 990000000 + stub_stats["created"]
+        return created_bill(number, public_url=f"https://example.com/bill/{number}")
+
+    return stub
+
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[max(0, int(len(values) * fraction) - 1)]
+
+
+async def run_round(client, headers: dict, label: str, async_mode: bool) -> dict:
+    """Envía ORDERS órdenes en paralelo y espera a que todas queden creadas."""
+    stub_stats["max_in_flight"] = 0
+    created_before = stub_stats["created"]
+
+    async def submit(index: int):
+        started = time.perf_counter()
+        response = await client.post(
+            "/api/billing/invoices/from-order",
+            params={"async_mode": "true"} if async_mode else None,
+            json=build_order(f"ORD-{label}-{index}", numbering_range_id=8),
+            headers=headers,
+        )
+        return response, time.perf_counter() - started
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*[submit(i) for i in range(ORDERS)])
+
+    errors = [r for r, _ in results if r.status_code >= 400]
+    if async_mode:
+        # Long-polling hasta que cada factura salga de PENDING/SUBMITTING
+        async def wait_done(response):
+            status_url = response.json()["status_url"]
+            while True:
+                state = (await client.get(status_url, params={"wait": 10}, headers=headers)).json()
+                if state["status"] not in ("PENDING", "SUBMITTING"):
+                    return state
+        states = await asyncio.gather(*[
+            wait_done(r) for r, _ in results if r.status_code == 202
+        ])
+        errors += [s for s in states if s["status"] == "ERROR"]
+
+    elapsed = time.perf_counter() - started
+    latencies = [latency for _, latency in results]
+    return {
+        "ack_p50": statistics.median(latencies),
+        "ack_p95": percentile(latencies, 0.95),
+        "elapsed": elapsed,
+        "throughput": ORDERS / elapsed,
+        "created": stub_stats["created"] - created_before,
+        "max_in_flight": stub_stats["max_in_flight"],
+        "errors": len(errors),
+    }
+
+
+async def check_crash_recovery(tenant_id: int) -> bool:
+    """
+    Una factura SUBMITTING con el lease vencido se reencola y se crea una sola
+    vez; una cuyo envío renueva el lease no se reencola hasta que deja de hacerlo.
+    """
+    from datetime import datetime, timedelta
+
+    from sqlmodel import select
+
+    from app.db.database import async_session_maker
+    from app.db.models import Invoice
+    from app.schemas.factus import InvoiceCreateSchema
+    from app.services.invoice_queue import InvoiceQueue
+    from app.services.invoice_submission import hold_lease
+
+    old = datetime.utcnow() - timedelta(minutes=5)
+    async with async_session_maker() as session:
+        # Reutiliza el payload de una factura del benchmark con otras referencias
+        template = (await session.exec(select(Invoice).where(Invoice.payload != None))).first()
+        invoice_data = InvoiceCreateSchema.model_validate_json(template.payload)
+
+        rows = []
+        for reference, lease_until in (("ORD-CRASH-1", old), ("ORD-LIVE-1", datetime.utcnow() + timedelta(seconds=1))):
+            data = invoice_data.model_copy(update={"reference_code": reference})
+            rows.append(Invoice(
+                number="",
+                order_reference=reference,
+                status="SUBMITTING",
+                payload=data.model_dump_json(),
+                attempts=1,
+                lease_until=lease_until,
+                tenant_id=tenant_id,
+                updated_at=old,
+            ))
+        session.add_all(rows)
+        await session.commit()
+        crashed_id, live_id = (row.id for row in rows)
+
+    async def load(invoice_id: int) -> Invoice:
+        async with async_session_maker() as session:
+            return await session.get(Invoice, invoice_id)
+
+    async def wait_done(invoice_id: int) -> Invoice:
+        for _ in range(50):
+            invoice = await load(invoice_id)
+            if invoice.status not in ("PENDING", "SUBMITTING"):
+                break
+            await asyncio.sleep(0.1)
+        return invoice
+
+    # Cola nueva = proceso reiniciado; el envío "vivo" sigue renovando su lease
+    queue = InvoiceQueue()
+    async with hold_lease(live_id):
+        await queue.start()
+        crashed = await wait_done(crashed_id)
+        await asyncio.sleep(1.5)
+        await queue.recover()
+        live = await load(live_id)
+    print(f"   Envío en curso tras el barrido: {live.status} (lease hasta {live.lease_until:%H:%M:%S.%f})")
+
+    # Dejó de renovar (proceso caído): el lease vence y el barrido la recupera
+    await asyncio.sleep(1.1)
+    await queue.recover()
+    recovered = await wait_done(live_id)
+    await queue.stop()
+
+    return (
+        crashed.status != "ERROR" and bool(crashed.number) and crashed.attempts == 2
+        and live.status == "SUBMITTING" and live.attempts == 1
+        and recovered.status != "ERROR" and bool(recovered.number) and recovered.attempts == 2
+    )
+
+
+async def main() -> None:
+    import httpx
+
+    from main import app
+
+    start_factus_stub(build_factus_stub(), PORT)
+
+    tenant_id = await seed_tenant("Restaurante Cola", "900000001", "cola@example.com")
+    headers = {"Authorization": f"Bearer {make_token('bench-user', ttl_seconds=3600)}"}
+
+    print("=" * 60)
+    print("BENCHMARK FACTURACIÓN SÍNCRONA vs COLA ASÍNCRONA")
+    print("=" * 60)
+    print(f"{ORDERS} órdenes en paralelo, {WORKERS} workers, cupo por tenant {TENANT_CONCURRENCY}, "
+          f"latencia de Factus {LATENCY * 1000:.0f} ms\n")
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            results = {}
+            for label, async_mode in (("síncrono", False), ("asíncrono", True)):
+                r = await run_round(client, headers, label[:4].upper(), async_mode)
+                results[label] = r
+                print(f"{label:10} respuesta p50 {r['ack_p50'] * 1000:6.0f} ms | p95 {r['ack_p95'] * 1000:6.0f} ms | "
+                      f"todas creadas en {r['elapsed']:.2f}s ({r['throughput']:.1f} fact/s) | "
+                      f"simultáneas en Factus {r['max_in_flight']} | errores {r['errors']}")
+
+            print()
+            failures = sum(r["errors"] for r in results.values())
+            if stub_stats["created"] != len(stub_stats["references"]):
+                print("❌ Factus recibió facturas duplicadas")
+                failures += 1
+
+            recovered = await check_crash_recovery(tenant_id)
+            print(f"{'✅' if recovered else '❌'} Recuperación tras caída: solo se reencolan las SUBMITTING con el lease vencido")
+            failures += 0 if recovered else 1
+
+    speedup = results["síncrono"]["ack_p50"] / results["asíncrono"]["ack_p50"]
+    print(f"\nEl modo asíncrono responde {speedup:.1f}x más rápido (p50) y limita a "
+          f"{min(WORKERS, TENANT_CONCURRENCY)} los envíos simultáneos del tenant a Factus")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
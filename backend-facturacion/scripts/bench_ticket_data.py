@@ -0,0 +1,199 @@
+"""
+Micro-benchmark de reimpresión de tirillas (GET /invoices/{number}/ticket-data).
+
+Crea N facturas contra un servidor local que simula Factus (BD SQLite
+temporal) y mide la latencia de reimprimir cada una en cuatro escenarios:
+- antes: réplica del cálculo anterior por petición (factura + ítems +
+  resolución, subtotales e impuestos recalculados)
+- guardada: tirilla materializada en la factura, cache en memoria frío
+- cache: tirilla servida desde el cache LRU (solo la autenticación toca la BD)
+- 304: cache + If-None-Match con el ETag (sin cuerpo)
+
+Verifica además que todas las variantes devuelven el mismo contenido.
+
+Uso: python scripts/bench_ticket_data.py [facturas] [rondas]
+"""
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+PORT = 8774
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_ticket_data.db")
+
+INVOICES = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+ROUNDS = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ["FACTUS_BASE_URL"] = f"http://127.0.0.1:{PORT}"
+os.environ["TOKEN_REFRESHER_ENABLED"] = "false"
+os.environ["FACTUS_RATE_LIMIT_ENABLED"] = "false"
+os.environ["INVOICE_OUTBOX_ENABLED"] = "false"
+os.environ["INVOICE_RECONCILER_ENABLED"] = "false"
+os.environ.setdefault("ENCRYPTION_KEY", "bench-ticket-key")
+os.environ.setdefault("SUPABASE_JWT_SECRET", "bench-ticket-secret-at-least-32-bytes")
+for var in ("FACTUS_CLIENT_ID", "FACTUS_CLIENT_SECRET", "FACTUS_EMAIL", "FACTUS_PASSWORD"):
+    os.environ.setdefault(var, "bench")
+
+from support import created_bill, factus_stub, make_token, seed_tenant, start_factus_stub
+
+RANGE_ID = 30
+
+
+def build_factus_stub():
+    """Factus simulado: numera las facturas desde 1."""
+    stub = factus_stub()
+    counter = {"bills": 0}
+
+    @stub.post("/v1/bills/validate")
+    async def create_bill():
+        counter["bills"] += 1
+        return created_bill(counter["bills"])
+
+    return stub
+
+
+def add_legacy_route(app) -> None:
+    """Réplica del endpoint anterior: calcula la tirilla en cada petición."""
+    from fastapi import Depends, HTTPException
+    from sqlmodel import select
+
+    from app.core.security import get_current_tenant
+    from app.db.database import get_session
+    from app.db.models import Invoice, InvoiceItem
+    from app.routers.billing import _ticket_resolution
+    from app.services.ticket_data import build_ticket_document
+
+    @app.get("/bench/legacy-ticket-data/{invoice_number}")
+    async def legacy_ticket_data(invoice_number: str, tenant=Depends(get_current_tenant), db=Depends(get_session)):
+        rows = (await db.exec(
+            select(Invoice, InvoiceItem)
+            .outerjoin(InvoiceItem, InvoiceItem.invoice_id == Invoice.id)
+            .where(Invoice.number == invoice_number, Invoice.tenant_id == tenant.id)
+            .order_by(InvoiceItem.line)
+        )).all()
+        if not rows:
+            raise HTTPException(status_code=404, detail="Factura no encontrada")
+        invoice = rows[0][0]
+        resolution = await _ticket_resolution(db, tenant.id, invoice.number)
+        document = build_ticket_document(invoice, [item for _, item in rows if item is not None], resolution)
+        document.pop("format")
+        return {
+            "restaurant": {"name": tenant.name, "nit": tenant.nit, "address": "Dirección registrada"},
+            **document,
+        }
+
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[max(0, int(len(values) * fraction) - 1)]
+
+
+async def measure(client, headers: dict, numbers: list, url: str, before_each=None, etags=None) -> dict:
+    """Reimprime todas las facturas ROUNDS veces y devuelve latencias y cuerpos."""
+    latencies, bodies, statuses = [], {}, set()
+    for _ in range(ROUNDS):
+        for number in numbers:
+            if before_each:
+                before_each()
+            request_headers = dict(headers)
+            if etags:
+                request_headers["If-None-Match"] = etags[number]
+            started = time.perf_counter()
+            response = await client.get(url.format(number=number), headers=request_headers)
+            latencies.append(time.perf_counter() - started)
+            statuses.add(response.status_code)
+            if response.status_code == 200:
+                bodies[number] = (response.json(), response.headers.get("etag"))
+    return {
+        "p50": statistics.median(latencies),
+        "p95": percentile(latencies, 0.95),
+        "statuses": statuses,
+        "bodies": bodies,
+    }
+
+
+async def main() -> None:
+    import httpx
+
+    from app.services.ticket_data import get_ticket_cache
+    from main import app
+
+    start_factus_stub(build_factus_stub(), PORT)
+    await seed_tenant(
+        "Restaurante Tirillas", "900000030", "tirillas@example.com",
+        range_id=RANGE_ID, number_from=1, number_to=100000, resolution_number="18760000001",
+    )
+    add_legacy_route(app)
+
+    headers = {"Authorization": f"Bearer {make_token('bench-ticket')}"}
+    items = [
+        {"id": "P1", "name": "Bandeja paisa", "price": 32000, "quantity": 1},
+        {"id": "P2", "name": "Limonada", "price": 7000, "quantity": 2, "tax_type": "IVA"},
+        {"id": "P3", "name": "Postre", "price": 9000, "quantity": 1, "is_taxed": False},
+    ]
+    checks = []
+
+    def check(label: str, ok: bool) -> None:
+        checks.append(ok)
+        print(f"{'✅' if ok else '❌'} {label}")
+
+    print("=" * 60)
+    print(f"REIMPRESIÓN DE TIRILLAS ({INVOICES} facturas x {ROUNDS} rondas)")
+    print("=" * 60)
+
+    transport = httpx.ASGITransport(app=app)
+    cache = get_ticket_cache()
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+            numbers = []
+            for index in range(INVOICES):
+                response = await client.post(
+                    "/api/billing/invoices/from-order",
+                    json={
+                        "order_id": f"ORD-T{index}",
+                        "payment_method": "efectivo",
+                        "customer_nit": "222222222222",
+                        "customer_name": "Consumidor Final",
+                        "customer_email": "cliente@example.com",
+                        "items": items,
+                    },
+                    headers=headers,
+                )
+                numbers.append(response.json()["number"])
+
+            url = "/api/billing/invoices/{number}/ticket-data"
+            results = {
+                "antes": await measure(client, headers, numbers, "/bench/legacy-ticket-data/{number}"),
+                "guardada": await measure(client, headers, numbers, url, before_each=cache.clear),
+            }
+            results["cache"] = await measure(client, headers, numbers, url)
+            etags = {number: etag for number, (_, etag) in results["cache"]["bodies"].items()}
+            results["304"] = await measure(client, headers, numbers, url, etags=etags)
+
+    for label, r in results.items():
+        print(f"{label:9} p50 {r['p50'] * 1000:6.2f} ms | p95 {r['p95'] * 1000:6.2f} ms | HTTP {sorted(r['statuses'])}")
+    print()
+
+    legacy = {number: body for number, (body, _) in results["antes"]["bodies"].items()}
+    cached = {number: body for number, (body, _) in results["cache"]["bodies"].items()}
+    check("Mismo contenido que el cálculo por petición", legacy == cached and len(cached) == INVOICES)
+    check("If-None-Match responde 304", results["304"]["statuses"] == {304})
+    check("Cache caliente más rápido que el cálculo por petición", results["cache"]["p50"] < results["antes"]["p50"])
+    print(json.dumps(cache.snapshot()))
+
+    speedup = results["antes"]["p50"] / results["cache"]["p50"]
+    print(f"\nLa reimpresión desde el cache es {speedup:.1f}x más rápida (p50)")
+    if not all(checks):
+        print(f"❌ {checks.count(False)} verificación(es) fallida(s)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,167 @@
+"""
+Prueba de estrés del asignador de consecutivos de rangos de numeración.
+
+Usa una BD SQLite temporal con un rango de numeración. Verifica:
+- Cientos de reservas simultáneas (cada una en su propia sesión) obtienen
+  números únicos y contiguos, y el contador final es exacto
+- El patrón anterior (leer current_number y escribir +1) pierde
+  actualizaciones con la misma carga
+- Modo por bloques con varios asignadores (workers): números únicos y, tras
+  devolver los bloques, el contador queda en lo realmente usado
+- Con el rango agotado la reserva devuelve None sin pasarse de number_to
+
+Uso: python scripts/stress_number_allocator.py [reservas]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "allocator.db")
+NUMBER_FROM = 990000000
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ.setdefault("ENCRYPTION_KEY", "allocator-key")
+os.environ.setdefault("SUPABASE_JWT_SECRET", "allocator-secret-at-least-32-bytes")
+for var in ("FACTUS_CLIENT_ID", "FACTUS_CLIENT_SECRET", "FACTUS_EMAIL", "FACTUS_PASSWORD"):
+    os.environ.setdefault(var, "allocator")
+
+from support import seed_tenant
+
+
+async def set_range(current_number: int, number_to: int = NUMBER_FROM + 100000) -> None:
+    from sqlalchemy import update
+
+    from app.db.database import async_session_maker
+    from app.db.models import BillingResolution
+
+    async with async_session_maker() as session:
+        await session.execute(
+            update(BillingResolution).values(current_number=current_number, number_to=number_to)
+        )
+        await session.commit()
+
+
+async def current_number() -> int:
+    from sqlmodel import select
+
+    from app.db.database import async_session_maker
+    from app.db.models import BillingResolution
+
+    async with async_session_maker() as session:
+        return (await session.exec(select(BillingResolution.current_number))).one()
+
+
+async def main(total: int) -> None:
+    from sqlmodel import select
+
+    from app.core.config import get_settings
+    from app.db.database import async_session_maker
+    from app.db.models import BillingResolution
+    from app.services.number_allocator import NumberAllocator, reserve_numbers
+
+    tenant_id = await seed_tenant(
+        "Restaurante Consecutivos",
+        "900000004",
+        "consecutivos@example.com",
+        number_from=NUMBER_FROM,
+        number_to=NUMBER_FROM + 100000,
+    )
+    checks = []
+
+    def check(label: str, ok: bool) -> None:
+        checks.append(ok)
+        print(f"{'✅' if ok else '❌'} {label}")
+
+    print("=" * 60)
+    print(f"ASIGNADOR DE CONSECUTIVOS ({total} reservas simultáneas)")
+    print("=" * 60)
+
+    # 1. Reserva atómica: una sesión (transacción) por reserva
+    async def reserve_one() -> int:
+        async with async_session_maker() as session:
+            reserved = await reserve_numbers(session, tenant_id, factus_id=8)
+            await session.commit()
+            return reserved[0]
+
+    started = time.perf_counter()
+    numbers = await asyncio.gather(*(reserve_one() for _ in range(total)))
+    elapsed = time.perf_counter() - started
+    print(f"   Atómico: {elapsed:.2f}s ({total / elapsed:.0f} reservas/s)")
+    check(
+        "Reservas simultáneas: números únicos y contiguos",
+        sorted(numbers) == list(range(NUMBER_FROM, NUMBER_FROM + total)),
+    )
+    check("Contador final exacto", await current_number() == NUMBER_FROM + total - 1)
+
+    # 2. Patrón anterior: leer y escribir +1 a través del ORM
+    await set_range(NUMBER_FROM - 1)
+
+    async def read_modify_write() -> None:
+        async with async_session_maker() as session:
+            resolution = (await session.exec(select(BillingResolution))).one()
+            await asyncio.sleep(0)
+            resolution.current_number += 1
+            await session.commit()
+
+    outcomes = await asyncio.gather(*(read_modify_write() for _ in range(total)), return_exceptions=True)
+    errors = sum(isinstance(o, Exception) for o in outcomes)
+    lost = total - errors - (await current_number() - (NUMBER_FROM - 1))
+    print(f"   Leer y escribir +1: {lost} actualizaciones perdidas, {errors} errores")
+    check("El patrón anterior pierde actualizaciones (referencia)", lost > 0 or errors > 0)
+
+    # 3. Bloques: varios asignadores (uno por worker) compartiendo el rango
+    await set_range(NUMBER_FROM - 1)
+    settings = get_settings().model_copy(update={"numbering_block_size": 20})
+    workers = [NumberAllocator(settings) for _ in range(4)]
+
+    async def allocate(index: int) -> int:
+        async with async_session_maker() as session:
+            allocated = await workers[index % len(workers)].allocate(session, tenant_id, 8)
+            return allocated[0]
+
+    started = time.perf_counter()
+    numbers = await asyncio.gather(*(allocate(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+    leases = sum(w.blocks_leased for w in workers)
+    print(f"   Bloques de 20: {elapsed:.2f}s ({total / elapsed:.0f} reservas/s), {leases} reservas de bloque")
+    check("Bloques: números únicos entre workers", len(set(numbers)) == total)
+    check("Bloques: una sentencia por bloque, no por factura", leases <= -(-total // 20) + len(workers))
+
+    # Solo se recupera el sobrante del bloque que quedó al final del rango
+    for worker in workers:
+        await worker.release_blocks()
+    used_to = max(numbers)
+    final = await current_number()
+    check(
+        f"Bloques devueltos: contador {final - used_to} por encima del último número usado",
+        used_to <= final <= used_to + 20 * len(workers),
+    )
+
+    # 4. Rango agotado
+    await set_range(NUMBER_FROM + 9, number_to=NUMBER_FROM + 10)
+    async with async_session_maker() as session:
+        last = await reserve_numbers(session, tenant_id, factus_id=8)
+        exhausted = await reserve_numbers(session, tenant_id, factus_id=8)
+        too_many = await reserve_numbers(session, tenant_id, 5, range_id=1)
+        await session.commit()
+    check(
+        "Rango agotado: None sin pasarse de number_to",
+        last == (NUMBER_FROM + 10, NUMBER_FROM + 10) and exhausted is None and too_many is None
+        and await current_number() == NUMBER_FROM + 10,
+    )
+
+    print()
+    if not all(checks):
+        print(f"❌ {checks.count(False)} verificación(es) fallida(s)")
+        sys.exit(1)
+    print("✅ Asignador de consecutivos verificado")
+
+
+if __name__ == "__main__":
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    asyncio.run(main(total))
@@ -0,0 +1,174 @@
+"""
+Utilidades compartidas por los scripts de prueba y benchmark.
+
+- Servidor local que simula Factus: OAuth y la búsqueda de facturas por
+  reference_code (vacía) ya incluidas; cada script agrega las rutas de su
+  prueba y lo levanta con start_factus_stub()
+- JWT de Supabase para autenticarse contra la app
+- Tenant de prueba con credenciales de Factus cifradas y su rango activo
+- Orden del POS para /invoices/from-order y /invoices/batch
+
+No es un script: los demás lo importan después de fijar sus variables de
+entorno (la configuración de la app se lee al llamar estas funciones).
+"""
+import os
+import socket
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+import uvicorn
+from fastapi import FastAPI
+
+CONSUMER_NIT = "222222222222"
+LUNCH = {"id": "P1", "name": "Almuerzo", "price": 20000, "quantity": 1}
+
+
+# =============================================================================
+# FACTUS SIMULADO
+# =============================================================================
+
+def factus_stub(oauth: bool = True, bill_lookup: bool = True) -> FastAPI:
+    """
+    App que simula Factus.
+
+    Args:
+        oauth: Incluir /oauth/token (siempre entrega un token válido)
+        bill_lookup: Incluir GET /v1/bills sin resultados (ninguna factura
+            previa con ese reference_code)
+    """
+    stub = FastAPI()
+
+    if oauth:
+        @stub.post("/oauth/token")
+        async def token():
+            return {"access_token": "access", "refresh_token": "refresh", "expires_in": 3600}
+
+    if bill_lookup:
+        @stub.get("/v1/bills")
+        async def list_bills():
+            return {"data": {"data": []}}
+
+    return stub
+
+
+def start_factus_stub(stub: FastAPI, port: int) -> None:
+    """Levanta el stub en un hilo y espera a que acepte conexiones."""
+    threading.Thread(
+        target=uvicorn.run,
+        args=(stub,),
+        kwargs={"host": "127.0.0.1", "port": port, "log_level": "warning"},
+        daemon=True,
+    ).start()
+
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def created_bill(number: int, prefix: str = "SETP", **bill: object) -> dict:
+    """Respuesta de Factus al crear una factura (POST /v1/bills/validate)."""
+    return {
+        "data": {
+            "bill": {
+                "id": number,
+                "number": f"{prefix}-{number}",
+                "cufe": f"cufe-{number}",
+                "status": 1,
+                **bill,
+            },
+            "numbering_range": {"prefix": prefix},
+        }
+    }
+
+
+# =============================================================================
+# AUTENTICACIÓN Y DATOS
+# =============================================================================
+
+def make_token(user_id: str = "scripts-user", ttl_seconds: int = 600) -> str:
+    """JWT de Supabase válido para las pruebas."""
+    import jwt
+
+    return jwt.encode(
+        {"sub": user_id, "aud": "authenticated", "exp": int(time.time()) + ttl_seconds},
+        os.environ["SUPABASE_JWT_SECRET"],
+        algorithm="HS256",
+    )
+
+
+async def add_tenant(session, name: str, nit: str, email: str):
+    """Tenant con facturación activa y credenciales de Factus cifradas."""
+    from app.core.encryption import encrypt_credential
+    from app.db.models import Tenant
+
+    tenant = Tenant(
+        name=name,
+        nit=nit,
+        factus_client_id="client",
+        factus_client_secret=encrypt_credential("secret"),
+        factus_email=email,
+        factus_password=encrypt_credential("password"),
+        billing_active=True,
+    )
+    session.add(tenant)
+    await session.commit()
+    await session.refresh(tenant)
+    return tenant
+
+
+async def seed_tenant(
+    name: str,
+    nit: str,
+    email: str,
+    range_id: int = 8,
+    number_from: int = 990000000,
+    number_to: int = 995000000,
+    **resolution: object
+) -> int:
+    """
+    Crea las tablas, un tenant y su rango de facturación activo (sincronizado
+    y vigente un año). Retorna el id del tenant.
+    """
+    from app.db.database import async_session_maker, init_db
+    from app.db.models import BillingResolution
+
+    await init_db()
+    async with async_session_maker() as session:
+        tenant = await add_tenant(session, name, nit, email)
+        session.add(BillingResolution(
+            factus_id=range_id,
+            prefix="SETP",
+            number_from=number_from,
+            number_to=number_to,
+            current_number=0,
+            is_active=True,
+            expiration_date=date.today() + timedelta(days=365),
+            last_synced_at=datetime.utcnow(),
+            tenant_id=tenant.id,
+            **resolution,
+        ))
+        await session.commit()
+        return tenant.id
+
+
+def build_order(order_id: str, items: Optional[list] = None, numbering_range_id: Optional[int] = None) -> dict:
+    """Orden del POS a consumidor final (por defecto, un almuerzo)."""
+    order = {
+        "order_id": order_id,
+        "payment_method": "efectivo",
+        "customer_nit": CONSUMER_NIT,
+        "customer_name": "Consumidor Final",
+        "customer_email": "cliente@example.com",
+        "items": items if items is not None else [LUNCH],
+    }
+    if numbering_range_id is not None:
+        order["numbering_range_id"] = numbering_range_id
+    return order
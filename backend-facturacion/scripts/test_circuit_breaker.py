@@ -0,0 +1,175 @@
+"""
+Script para verificar que el circuit breaker no se queda tomado en HALF_OPEN.
+
+Levanta un servidor local que simula Factus (OAuth + /v1/bills/show) y abre el
+breaker con 503. Verifica:
+- Con el circuito abierto las llamadas fallan de inmediato
+- Una llamada de prueba que falla al obtener el token (login caído durante la
+  misma caída) libera el turno: la siguiente llamada vuelve a probar
+- Una llamada de prueba cancelada (cliente desconectado) también lo libera y
+  la siguiente cierra el circuito
+- Una prueba que nunca informa resultado expira a los open_seconds
+
+Uso: python scripts/test_circuit_breaker.py
+"""
+import asyncio
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+PORT = 8776
+OPEN_SECONDS = 1.0
+
+os.environ["FACTUS_BASE_URL"] = f"http://127.0.0.1:{PORT}"
+os.environ["TOKEN_REFRESHER_ENABLED"] = "false"
+os.environ["FACTUS_RATE_LIMIT_ENABLED"] = "false"
+os.environ["FACTUS_RETRY_MAX_ATTEMPTS"] = "1"
+os.environ["FACTUS_CIRCUIT_MINIMUM_CALLS"] = "2"
+os.environ["FACTUS_CIRCUIT_OPEN_SECONDS"] = str(OPEN_SECONDS)
+os.environ.setdefault("ENCRYPTION_KEY", "circuit-breaker-key")
+os.environ.setdefault("SUPABASE_JWT_SECRET", "circuit-breaker-secret-at-least-32-bytes")
+for var in ("FACTUS_CLIENT_ID", "FACTUS_CLIENT_SECRET", "FACTUS_EMAIL", "FACTUS_PASSWORD"):
+    os.environ.setdefault(var, "breaker")
+
+from support import factus_stub, start_factus_stub
+
+# Comportamiento del stub (se cambia durante la prueba)
+stub_state = {"auth_ok": True, "status": 503, "delay": 0.0}
+
+
+def build_factus_stub():
+    """Factus simulado con login y /v1/bills/show configurables."""
+    from fastapi.responses import JSONResponse
+
+    stub = factus_stub(oauth=False, bill_lookup=False)
+
+    @stub.post("/oauth/token")
+    async def token():
+        if not stub_state["auth_ok"]:
+            return JSONResponse(status_code=500, content={"message": "login caído"})
+        return {"access_token": "tok", "refresh_token": "ref", "expires_in": 3600}
+
+    @stub.get("/v1/bills/show/{number}")
+    async def show_bill(number: str):
+        await asyncio.sleep(stub_state["delay"])
+        if stub_state["status"] != 200:
+            return JSONResponse(status_code=stub_state["status"], content={"message": "caído"})
+        return {"status": "OK", "data": {"bill": {"number": number}}}
+
+    return stub
+
+
+async def main() -> None:
+    import httpx
+
+    from app.core.config import get_settings
+    from app.core.exceptions import FactusAPIError, FactusAuthError, FactusCircuitOpenError
+    from app.services.factus.circuit_breaker import (
+        CircuitBreaker,
+        CircuitState,
+        get_circuit_breakers,
+    )
+    from app.services.factus.client import FactusClient
+    from app.services.factus.endpoints import classify_endpoint
+
+    start_factus_stub(build_factus_stub(), PORT)
+
+    checks = []
+
+    def check(label: str, ok: bool) -> None:
+        checks.append(ok)
+        print(f"{'✅' if ok else '❌'} {label}")
+
+    async def outcome(coro) -> str:
+        """Nombre de la excepción que lanzó la llamada (u "ok")."""
+        try:
+            await coro
+            return "ok"
+        except Exception as e:
+            return type(e).__name__
+
+    print("=" * 60)
+    print("CIRCUIT BREAKER: LLAMADA DE PRUEBA EN HALF_OPEN")
+    print("=" * 60)
+
+    async with httpx.AsyncClient() as http_client:
+        client = FactusClient(http_client, get_settings())
+        endpoint = "/v1/bills/show/SETP1"
+
+        # Abrir el circuito con 503
+        for _ in range(2):
+            await outcome(client.get(endpoint))
+        breaker = get_circuit_breakers().get(client.account_key, classify_endpoint("GET", endpoint))
+        check("Dos 503 abren el circuito", breaker.state == CircuitState.OPEN)
+        check(
+            "Con el circuito abierto falla de inmediato",
+            await outcome(client.get(endpoint)) == FactusCircuitOpenError.__name__,
+        )
+
+        # La prueba falla al obtener el token: no debe quedar tomada
+        await client.auth_manager.invalidate()
+        stub_state["auth_ok"] = False
+        await asyncio.sleep(OPEN_SECONDS + 0.1)
+        first = await outcome(client.get(endpoint))
+        second = await outcome(client.get(endpoint))
+        print(f"   Prueba sin login: {first}; siguiente llamada: {second}")
+        check(
+            "Prueba que falla en el login libera el turno (la siguiente vuelve a probar)",
+            first == second == FactusAuthError.__name__
+            and breaker.state == CircuitState.HALF_OPEN,
+        )
+
+        # La prueba se cancela (cliente desconectado)
+        stub_state.update(auth_ok=True, status=200, delay=2.0)
+        probe = asyncio.create_task(client.get(endpoint))
+        await asyncio.sleep(0.5)
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+        stub_state["delay"] = 0.0
+        after_cancel = await outcome(client.get(endpoint))
+        print(f"   Llamada tras cancelar la prueba: {after_cancel}")
+        check(
+            "Prueba cancelada libera el turno y la siguiente cierra el circuito",
+            after_cancel == "ok" and breaker.state == CircuitState.CLOSED,
+        )
+
+        stub_state["status"] = 503
+        check(
+            "Un 503 de Factus sigue siendo FactusAPIError",
+            await outcome(client.get(endpoint)) == FactusAPIError.__name__,
+        )
+
+    # Una prueba que nunca informa resultado expira
+    breaker = CircuitBreaker("expira", minimum_calls=1, open_seconds=0.3)
+    breaker.record_failure(0.01)
+    await asyncio.sleep(0.35)
+    breaker.before_call()  # prueba que se pierde sin record_* ni release
+    try:
+        breaker.before_call()
+        retry_after = None
+    except FactusCircuitOpenError as e:
+        retry_after = e.retry_after
+    await asyncio.sleep(0.35)
+    try:
+        breaker.before_call()
+        expired = "ok"
+    except FactusCircuitOpenError as e:
+        expired = type(e).__name__
+    print(f"   Rechazo con prueba en curso: retry_after={retry_after}; tras expirar: {expired}")
+    check(
+        "Prueba perdida: se rechaza con retry_after > 0 y expira a los open_seconds",
+        retry_after is not None and retry_after > 0 and expired == "ok",
+    )
+
+    print()
+    if all(checks):
+        print("✅ Circuit breaker verificado")
+    else:
+        print("❌ Hay verificaciones fallidas")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
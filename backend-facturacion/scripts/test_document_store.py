@@ -0,0 +1,248 @@
+"""
+Script para verificar el almacén local de PDF/XML de facturas.
+
+Usa una BD SQLite temporal, un directorio temporal y un servidor local que
+simula Factus (cuenta las descargas). Verifica:
+- Al crear la factura el PDF y el XML se descargan en segundo plano y se
+  sirven desde disco con el mismo contenido
+- /invoices/{number}/pdf y las descargas repetidas no consultan Factus
+- Range (206), If-None-Match e If-Modified-Since (304)
+- Una descarga fallida se reintenta
+- Con el tamaño máximo superado se eliminan los archivos menos usados; un
+  archivo eliminado responde 202 y se vuelve a descargar
+- El índice se reconstruye desde disco al reiniciar
+
+Uso: python scripts/test_document_store.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+PORT = 8775
+TMP_DIR = tempfile.mkdtemp()
+DB_PATH = os.path.join(TMP_DIR, "document_store.db")
+STORE_PATH = os.path.join(TMP_DIR, "documents")
+
+PDF_SIZE = 10_000
+XML_SIZE = 2_000
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ["FACTUS_BASE_URL"] = f"http://127.0.0.1:{PORT}"
+os.environ["TOKEN_REFRESHER_ENABLED"] = "false"
+os.environ["FACTUS_RATE_LIMIT_ENABLED"] = "false"
+os.environ["INVOICE_OUTBOX_ENABLED"] = "false"
+os.environ["INVOICE_RECONCILER_ENABLED"] = "false"
+os.environ["DOCUMENT_STORE_PATH"] = STORE_PATH
+os.environ["DOCUMENT_STORE_FETCH_DELAY_SECONDS"] = "0"
+os.environ["DOCUMENT_STORE_RETRY_SECONDS"] = "0.3"
+# Caben dos facturas (PDF + XML); la tercera desaloja la más antigua
+os.environ["DOCUMENT_STORE_MAX_BYTES"] = str(2 * (PDF_SIZE + XML_SIZE) + 1_000)
+os.environ.setdefault("ENCRYPTION_KEY", "document-store-key")
+os.environ.setdefault("SUPABASE_JWT_SECRET", "document-store-secret-at-least-32-bytes")
+for var in ("FACTUS_CLIENT_ID", "FACTUS_CLIENT_SECRET", "FACTUS_EMAIL", "FACTUS_PASSWORD"):
+    os.environ.setdefault(var, "documents")
+
+from support import build_order, created_bill, factus_stub, make_token, seed_tenant, start_factus_stub
+
+RANGE_ID = 40
+
+# Peticiones recibidas por el stub: "pdf", "xml", "show", "bills"
+calls = {"pdf": 0, "xml": 0, "show": 0, "bills": 0}
+
+# Números cuyo XML falla una vez
+fail_xml_once = {"SETP-2"}
+
+
+def document_bytes(number: str, kind: str) -> bytes:
+    """Contenido determinista de cada documento."""
+    size = PDF_SIZE if kind == "pdf" else XML_SIZE
+    seed = f"{kind}:{number}:".encode()
+    return (seed * (size // len(seed) + 1))[:size]
+
+
+def build_factus_stub():
+    """Factus simulado con la descarga de PDF/XML."""
+    import base64
+
+    from fastapi.responses import JSONResponse
+
+    stub = factus_stub()
+
+    @stub.post("/v1/bills/validate")
+    async def create_bill():
+        calls["bills"] += 1
+        number = calls["bills"]
+        return created_bill(number, public_url=f"https://factus.example/public/SETP-{number}")
+
+    @stub.get("/v1/bills/show/{number}")
+    async def show_bill(number: str):
+        calls["show"] += 1
+        return {"data": {"number": number, "pdf_url": f"https://factus.example/public/{number}"}}
+
+    @stub.get("/v1/bills/download-{kind}/{number}")
+    async def download(kind: str, number: str):
+        calls[kind] += 1
+        if kind == "xml" and number in fail_xml_once:
+            fail_xml_once.discard(number)
+            return JSONResponse(status_code=404, content={"message": "Documento aún no generado"})
+        encoded = base64.b64encode(document_bytes(number, kind)).decode()
+        return {"data": {"file_name": f"{number}.{kind}", f"{kind}_base_64_encoded": encoded}}
+
+    return stub
+
+
+async def wait_for_file(client, headers: dict, number: str, kind: str, timeout: float = 10.0):
+    """GET del archivo hasta que deje de responder 202."""
+    deadline = time.monotonic() + timeout
+    statuses = []
+    while True:
+        response = await client.get(f"/api/billing/invoices/{number}/files/{kind}", headers=headers)
+        statuses.append(response.status_code)
+        if response.status_code != 202 or time.monotonic() > deadline:
+            return response, statuses
+        await asyncio.sleep(0.1)
+
+
+async def main() -> None:
+    import httpx
+    from sqlmodel import select
+
+    from app.db.database import async_session_maker
+    from app.db.models import InvoiceDocument
+    from app.services.document_store import DocumentStore, get_document_store
+    from main import app
+
+    start_factus_stub(build_factus_stub(), PORT)
+    await seed_tenant(
+        "Restaurante Documentos", "900000040", "documentos@example.com",
+        range_id=RANGE_ID, number_from=1, number_to=1000,
+    )
+
+    headers = {"Authorization": f"Bearer {make_token('documents-user')}"}
+    checks = []
+
+    def check(label: str, ok: bool) -> None:
+        checks.append(ok)
+        print(f"{'✅' if ok else '❌'} {label}")
+
+    print("=" * 60)
+    print("ALMACÉN LOCAL DE PDF/XML")
+    print("=" * 60)
+
+    store = get_document_store()
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+            # 1. Descarga en segundo plano al crear la factura
+            created = await client.post("/api/billing/invoices/from-order", json=build_order("ORD-1"), headers=headers)
+            number = created.json()["number"]
+            pdf, _ = await wait_for_file(client, headers, number, "pdf")
+            xml, _ = await wait_for_file(client, headers, number, "xml")
+            check(
+                "PDF y XML descargados en segundo plano con el mismo contenido",
+                pdf.status_code == 200 and pdf.content == document_bytes(number, "pdf")
+                and xml.status_code == 200 and xml.content == document_bytes(number, "xml"),
+            )
+            check(
+                "Tipos de contenido y nombre de archivo",
+                pdf.headers["content-type"] == "application/pdf"
+                and xml.headers["content-type"].startswith("application/xml")
+                and f'{number}.pdf' in pdf.headers.get("content-disposition", ""),
+            )
+            check("Una sola descarga por documento", calls["pdf"] == 1 and calls["xml"] == 1)
+
+            # 2. Reimpresiones y reenvíos sin Factus
+            before = dict(calls)
+            urls = (await client.get(f"/api/billing/invoices/{number}/pdf", headers=headers)).json()
+            for _ in range(5):
+                await client.get(f"/api/billing/invoices/{number}/files/pdf", headers=headers)
+            check(
+                "/pdf responde desde la fila local con download_url",
+                urls.get("pdf_url") == f"https://factus.example/public/{number}"
+                and str(urls.get("download_url", "")).endswith(f"/api/billing/invoices/{number}/files/pdf"),
+            )
+            check("Descargas repetidas sin peticiones a Factus", calls == before)
+
+            # 3. Range y GET condicional
+            partial = await client.get(
+                f"/api/billing/invoices/{number}/files/pdf", headers={**headers, "Range": "bytes=100-199"}
+            )
+            check(
+                "Range: 206 con el fragmento pedido",
+                partial.status_code == 206 and partial.content == document_bytes(number, "pdf")[100:200]
+                and partial.headers.get("content-range") == f"bytes 100-199/{PDF_SIZE}",
+            )
+            etag = pdf.headers.get("etag")
+            by_etag = await client.get(
+                f"/api/billing/invoices/{number}/files/pdf", headers={**headers, "If-None-Match": etag}
+            )
+            by_date = await client.get(
+                f"/api/billing/invoices/{number}/files/pdf",
+                headers={**headers, "If-Modified-Since": pdf.headers.get("last-modified")},
+            )
+            check(
+                "If-None-Match / If-Modified-Since: 304 sin cuerpo",
+                by_etag.status_code == 304 and by_date.status_code == 304 and not by_etag.content,
+            )
+            check("ETag es el SHA-256 del contenido", etag is not None and len(etag.strip('"')) == 64)
+
+            # 4. Reintento de una descarga fallida
+            created = await client.post("/api/billing/invoices/from-order", json=build_order("ORD-2"), headers=headers)
+            second = created.json()["number"]
+            xml, _ = await wait_for_file(client, headers, second, "xml")
+            async with async_session_maker() as session:
+                document = (await session.exec(
+                    select(InvoiceDocument).where(InvoiceDocument.kind == "xml", InvoiceDocument.sha256 != None)
+                    .order_by(InvoiceDocument.invoice_id.desc())
+                )).first()
+            check(
+                "XML fallido se reintenta y queda guardado",
+                xml.status_code == 200 and xml.content == document_bytes(second, "xml")
+                and document.status == "STORED" and document.attempts == 0 and store.failed == 1,
+            )
+
+            # 5. Desalojo LRU por tamaño y nueva descarga
+            await client.get(f"/api/billing/invoices/{number}/files/pdf", headers=headers)
+            await client.get(f"/api/billing/invoices/{number}/files/xml", headers=headers)
+            created = await client.post("/api/billing/invoices/from-order", json=build_order("ORD-3"), headers=headers)
+            third = created.json()["number"]
+            await wait_for_file(client, headers, third, "pdf")
+            await wait_for_file(client, headers, third, "xml")
+            snapshot = store.snapshot()
+            check(
+                "Al superar el tamaño máximo se elimina la factura menos usada",
+                snapshot["evicted"] == 2 and snapshot["bytes"] <= snapshot["max_bytes"]
+                and not os.path.exists(store.path_for(document.sha256)),
+            )
+            before_pdf = calls["pdf"]
+            refetched, statuses = await wait_for_file(client, headers, second, "pdf")
+            check(
+                "Archivo eliminado: 202 y nueva descarga",
+                statuses[0] == 202 and refetched.status_code == 200
+                and refetched.content == document_bytes(second, "pdf") and calls["pdf"] == before_pdf + 1,
+            )
+
+    # 6. Índice reconstruido desde disco
+    restarted = DocumentStore()
+    await asyncio.to_thread(restarted._scan)
+    check(
+        "Al reiniciar el índice se reconstruye desde el directorio",
+        restarted.snapshot()["files"] == store.snapshot()["files"]
+        and restarted.snapshot()["bytes"] == store.snapshot()["bytes"],
+    )
+    print(f"   {store.snapshot()}")
+
+    print()
+    if not all(checks):
+        print(f"❌ {checks.count(False)} verificación(es) fallida(s)")
+        sys.exit(1)
+    print("✅ Almacén de documentos verificado")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
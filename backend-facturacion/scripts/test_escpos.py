@@ -0,0 +1,135 @@
+"""
+Script para verificar el renderizado ESC/POS de tirillas (sin BD ni red).
+
+Renderiza una tirilla fija y compara los bytes con los fixtures de
+scripts/fixtures (80 mm / 48 columnas y 58 mm / 32 columnas). Verifica además:
+- Inicio (ESC @ + PC850) y corte al final
+- Ninguna línea de texto supera el ancho configurado
+- Bloque QR nativo con qr_code; sin QR se usa la consulta DIAN por CUFE
+- Tildes y ñ en PC850
+- El cache renderiza una sola vez por factura y versión
+
+Uso: python scripts/test_escpos.py [--update] [--preview]
+  --update   reescribe los fixtures con la salida actual (revisar el diff)
+  --preview  imprime el texto de la tirilla de 80 mm sin comandos
+"""
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+FIXTURES_DIR = os.path.join(BASE_DIR, "scripts", "fixtures")
+FIXTURES = {48: "ticket_80mm.escpos", 32: "ticket_58mm.escpos"}
+
+TICKET = {
+    "restaurant": {"name": "Restaurante La Montaña", "nit": "900123456", "address": "Calle 10 # 5-23, Cali"},
+    "invoice": {
+        "number": "SETP-990000123",
+        "date": "2026-03-14 12:30:05.123456",
+        "cufe": "2f1e7c0a9b8d6e5f4a3b2c1d0e9f8a7b6c5d4e3f2a1b0c9d8e7f6a5b4c3d2e1f0a9b8c7d6e5f4a3b2c1d0e9f8a7b6",
+        "qr_code": "https://catalogo-vpfe-hab.dian.gov.co/document/searchqr?documentkey=2f1e7c0a9b8d",
+        "payment_form": "Contado",
+    },
+    "resolution": {"number": "18760000001", "date": "2025-01-15", "prefix": "SETP", "from": 990000000, "to": 995000000},
+    "items": [
+        {"name": "Bandeja paisa con chicharrón y aguacate extra", "qty": 1.0, "price": 32000.0, "total": 32000.0},
+        {"name": "Limonada de coco", "qty": 2.0, "price": 7000.0, "total": 14000.0},
+        {"name": "Ñame al vapor", "qty": 1.5, "price": 3000.5, "total": 4500.75},
+    ],
+    "totals": {"subtotal": 50500.75, "total_iva": 2660.0, "total_ico": 2560.0, "total": 55720.75},
+    "footer_message": "Facturación Electrónica DIAN",
+}
+
+
+def strip_commands(data: bytes) -> list:
+    """Líneas de texto (PC850) de la salida, sin comandos ESC/POS ni el bloque QR."""
+    text = bytearray()
+    i = 0
+    while i < len(data):
+        byte = data[i]
+        if byte == 0x1b:                      # ESC @ | ESC t/a/E n
+            i += 2 if data[i + 1:i + 2] == b"@" else 3
+        elif byte == 0x1d:
+            command = data[i + 1:i + 2]
+            if command == b"(":               # GS ( k pL pH datos
+                length = data[i + 3] + data[i + 4] * 256
+                i += 5 + length
+            elif command == b"V":             # GS V m n
+                i += 4
+            else:                             # GS ! n
+                i += 3
+        else:
+            text.append(byte)
+            i += 1
+    return text.decode("cp850").split("\n")
+
+
+def main() -> None:
+    from app.services.escpos import CUT, DIAN_QR_URL, INIT, CODEPAGE_PC850, EscPosCache, render_escpos
+
+    update = "--update" in sys.argv
+    checks = []
+
+    def check(label: str, ok: bool) -> None:
+        checks.append(ok)
+        print(f"{'✅' if ok else '❌'} {label}")
+
+    print("=" * 60)
+    print("TIRILLA ESC/POS")
+    print("=" * 60)
+
+    for columns, name in FIXTURES.items():
+        rendered = render_escpos(TICKET, columns)
+        path = os.path.join(FIXTURES_DIR, name)
+        if update:
+            os.makedirs(FIXTURES_DIR, exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(rendered)
+            print(f"   Fixture actualizado: {name} ({len(rendered)} bytes)")
+
+        with open(path, "rb") as f:
+            expected = f.read()
+        if rendered != expected:
+            offset = next((i for i, (a, b) in enumerate(zip(rendered, expected)) if a != b), min(len(rendered), len(expected)))
+            print(f"   Primera diferencia en el byte {offset}: {rendered[offset:offset + 16]!r} vs {expected[offset:offset + 16]!r}")
+        check(f"{columns} columnas: bytes idénticos al fixture {name}", rendered == expected)
+
+        text_lines = strip_commands(rendered)
+        widest = max(len(line) for line in text_lines)
+        check(f"{columns} columnas: ninguna línea supera el ancho (máx {widest})", widest <= columns)
+
+    rendered = render_escpos(TICKET)
+    text = "\n".join(strip_commands(rendered))
+    check("Inicia con ESC @ y página PC850, termina con corte", rendered.startswith(INIT + CODEPAGE_PC850) and rendered.endswith(CUT))
+    check("QR nativo con qr_code", b"\x1d(k" in rendered and TICKET["invoice"]["qr_code"].encode() in rendered)
+    check("Tildes y ñ en PC850", "Montaña" in text and "Ñame" in text and "ELECTRÓNICA" in text)
+    check("Totales en pesos", "$55.720,75" in text and "$2.560" in text)
+
+    without_qr = {**TICKET, "invoice": {**TICKET["invoice"], "qr_code": None}}
+    rendered = render_escpos(without_qr)
+    check(
+        "Sin qr_code: QR con la consulta DIAN del CUFE",
+        DIAN_QR_URL.format(cufe=TICKET["invoice"]["cufe"]).encode() in rendered,
+    )
+    provisional = {**TICKET, "invoice": {**TICKET["invoice"], "qr_code": None, "cufe": None}}
+    check("Ticket provisional (sin CUFE): sin bloque QR", b"\x1d(k" not in render_escpos(provisional))
+
+    cache = EscPosCache(max_entries=2)
+    for version in ('"v1"', '"v1"', '"v2"'):
+        cache.get_or_render(1, "SETP-990000123", version, 48, lambda: TICKET)
+    check("Cache: un renderizado por versión", cache.renders == 2 and cache.hits == 1)
+
+    if "--preview" in sys.argv:
+        print()
+        print("\n".join(strip_commands(render_escpos(TICKET))))
+
+    print()
+    if not all(checks):
+        print(f"❌ {checks.count(False)} verificación(es) fallida(s)")
+        sys.exit(1)
+    print("✅ Tirilla ESC/POS verificada")
+
+
+if __name__ == "__main__":
+    main()
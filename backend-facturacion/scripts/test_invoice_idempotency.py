@@ -0,0 +1,232 @@
+"""
+Script para verificar la facturación idempotente por order_id.
+
+Usa una BD SQLite temporal y un servidor local que simula Factus (contando
+las facturas que recibe). Verifica:
+- Reintento de una orden ya facturada: misma factura, sin llamar a Factus
+- Doble clic (peticiones concurrentes): una sola llamada a Factus
+- Orden que falló: queda en ERROR y el reintento la factura en la misma fila
+- Lote con órdenes ya facturadas: se devuelven como "replayed"
+- Orden SUBMITTING de una petición caída: con el lease vigente responde 409;
+  al vencer el lease se vuelve a reclamar y se recupera la factura que ya
+  estaba en Factus (búsqueda por reference_code, sin reenviarla)
+
+Uso: python scripts/test_invoice_idempotency.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+PORT = 8769
+DB_PATH = os.path.join(tempfile.mkdtemp(), "idempotency.db")
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ["FACTUS_BASE_URL"] = f"http://127.0.0.1:{PORT}"
+os.environ["TOKEN_REFRESHER_ENABLED"] = "false"
+os.environ.setdefault("ENCRYPTION_KEY", "idempotency-key")
+os.environ.setdefault("SUPABASE_JWT_SECRET", "idempotency-secret-at-least-32-bytes")
+for var in ("FACTUS_CLIENT_ID", "FACTUS_CLIENT_SECRET", "FACTUS_EMAIL", "FACTUS_PASSWORD"):
+    os.environ.setdefault(var, "idempotency")
+
+from support import build_order, created_bill, factus_stub, make_token, seed_tenant, start_factus_stub
+
+# Llamadas a /v1/bills/validate por reference_code
+bill_calls = {}
+# Órdenes que el stub rechaza la primera vez
+fail_once = {"ORD-FAIL"}
+# Facturas que ya están en Factus aunque la fila local quedó en SUBMITTING
+lost_bills = {"ORD-LOST": 990009999}
+
+
+def build_factus_stub():
+    """Factus simulado con 200 ms de latencia al crear facturas."""
+    from fastapi import Request
+    from fastapi.responses import JSONResponse
+
+    stub = factus_stub(bill_lookup=False)
+
+    def bill(number: int) -> dict:
+        return created_bill(number, public_url=f"https://example.com/bill/{number}")
+
+    @stub.get("/v1/bills")
+    async def list_bills(request: Request):
+        reference = request.query_params.get("filter[reference_code]")
+        if reference in lost_bills:
+            return {"data": {"data": [{"reference_code": reference, "number": f"SETP-{lost_bills[reference]}"}]}}
+        return {"data": {"data": []}}
+
+    @stub.get("/v1/bills/show/{number}")
+    async def show_bill(number: str):
+        return bill(int(number.split("-")[1]))
+
+    @stub.post("/v1/bills/validate")
+    async def create_bill(request: Request):
+        reference = (await request.json())["reference_code"]
+        bill_calls[reference] = bill_calls.get(reference, 0) + 1
+        await asyncio.sleep(0.2)
+
+        if reference in fail_once:
+            fail_once.discard(reference)
+            return JSONResponse(status_code=422, content={"message": "Datos inválidos"})
+
+        return bill(990000000 + sum(bill_calls.values()))
+
+    return stub
+
+
+async def count_invoice_rows(order_id: str) -> int:
+    from sqlalchemy import func
+    from sqlmodel import select
+
+    from app.db.database import async_session_maker
+    from app.db.models import Invoice
+
+    async with async_session_maker() as session:
+        result = await session.exec(
+            select(func.count()).select_from(Invoice).where(Invoice.order_reference == order_id)
+        )
+        return result.one()
+
+
+async def set_lease(order_id: str, seconds: float) -> None:
+    """Deja la orden en SUBMITTING con el lease a `seconds` de ahora (petición caída)."""
+    from datetime import datetime, timedelta
+
+    from app.db.database import async_session_maker
+    from app.db.models import Invoice
+    from app.services.invoice_submission import SUBMITTING
+
+    async with async_session_maker() as session:
+        invoice = Invoice(
+            number="",
+            order_reference=order_id,
+            status=SUBMITTING,
+            attempts=1,
+            lease_until=datetime.utcnow() + timedelta(seconds=seconds),
+            tenant_id=1,
+            updated_at=datetime.utcnow(),
+        )
+        session.add(invoice)
+        await session.commit()
+
+
+async def expire_lease(order_id: str) -> None:
+    from datetime import datetime, timedelta
+
+    from sqlalchemy import update
+
+    from app.db.database import async_session_maker
+    from app.db.models import Invoice
+
+    async with async_session_maker() as session:
+        await session.execute(
+            update(Invoice)
+            .where(Invoice.order_reference == order_id)
+            .values(lease_until=datetime.utcnow() - timedelta(seconds=1))
+        )
+        await session.commit()
+
+
+async def main() -> None:
+    import httpx
+
+    from main import app
+
+    start_factus_stub(build_factus_stub(), PORT)
+    await seed_tenant("Restaurante Idempotente", "900000001", "idempotencia@example.com")
+
+    headers = {"Authorization": f"Bearer {make_token('idempotency-user')}"}
+    url = "/api/billing/invoices/from-order"
+    checks = []
+
+    def check(label: str, ok: bool) -> None:
+        checks.append(ok)
+        print(f"{'✅' if ok else '❌'} {label}")
+
+    print("=" * 60)
+    print("FACTURACIÓN IDEMPOTENTE POR ORDER_ID")
+    print("=" * 60)
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+            # 1. Reintento secuencial
+            first = await client.post(url, json=build_order("ORD-1", numbering_range_id=8), headers=headers)
+            retry = await client.post(url, json=build_order("ORD-1", numbering_range_id=8), headers=headers)
+            check(
+                "Reintento devuelve la misma factura sin llamar a Factus",
+                first.status_code == retry.status_code == 200
+                and first.json()["number"] == retry.json()["number"]
+                and retry.headers.get("Idempotent-Replayed") == "true"
+                and bill_calls.get("ORD-1") == 1
+                and await count_invoice_rows("ORD-1") == 1,
+            )
+
+            # 2. Doble clic: 5 peticiones concurrentes de la misma orden
+            responses = await asyncio.gather(*[
+                client.post(url, json=build_order("ORD-2", numbering_range_id=8), headers=headers) for _ in range(5)
+            ])
+            numbers = {r.json().get("number") for r in responses}
+            check(
+                "Peticiones concurrentes: una sola llamada a Factus y una sola fila",
+                all(r.status_code == 200 for r in responses)
+                and len(numbers) == 1
+                and bill_calls.get("ORD-2") == 1
+                and await count_invoice_rows("ORD-2") == 1,
+            )
+
+            # 3. Orden que falla y luego se reintenta
+            failed = await client.post(url, json=build_order("ORD-FAIL", numbering_range_id=8), headers=headers)
+            retried = await client.post(url, json=build_order("ORD-FAIL", numbering_range_id=8), headers=headers)
+            check(
+                "Orden fallida queda en ERROR y el reintento la factura en la misma fila",
+                failed.status_code >= 400
+                and retried.status_code == 200
+                and retried.headers.get("Idempotent-Replayed") is None
+                and bill_calls.get("ORD-FAIL") == 2
+                and await count_invoice_rows("ORD-FAIL") == 1,
+            )
+
+            # 4. Lote con órdenes ya facturadas
+            batch = await client.post(
+                "/api/billing/invoices/batch",
+                json={"orders": [build_order(f"ORD-{i}", numbering_range_id=8) for i in (1, 2, 3)]},
+                headers=headers,
+            )
+            body = batch.json()
+            check(
+                "Lote: órdenes ya facturadas vuelven como replayed",
+                batch.status_code == 200
+                and body["replayed"] == 2
+                and body["created"] == 1
+                and bill_calls.get("ORD-1") == 1
+                and bill_calls.get("ORD-3") == 1,
+            )
+
+            # 5. Petición caída a mitad del envío (la factura sí llegó a Factus)
+            await set_lease("ORD-LOST", 60)
+            live = await client.post(url, json=build_order("ORD-LOST", numbering_range_id=8), headers=headers)
+            await expire_lease("ORD-LOST")
+            recovered = await client.post(url, json=build_order("ORD-LOST", numbering_range_id=8), headers=headers)
+            check(
+                "SUBMITTING con lease vigente: 409; al vencer se reclama y se recupera sin reenviar",
+                live.status_code == 409
+                and recovered.status_code == 200
+                and recovered.json()["number"] == f"SETP-{lost_bills['ORD-LOST']}"
+                and "ORD-LOST" not in bill_calls
+                and await count_invoice_rows("ORD-LOST") == 1,
+            )
+
+    print()
+    if not all(checks):
+        print(f"❌ {checks.count(False)} verificación(es) fallida(s)")
+        sys.exit(1)
+    print("✅ Facturación idempotente verificada")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,240 @@
+"""
+Script para verificar las líneas de factura normalizadas y api_response en JSON.
+
+Usa una BD SQLite temporal y un servidor local que simula Factus. Verifica:
+- /invoices/from-order y /invoices/batch escriben invoice_items (ítems,
+  impuesto principal, IVA/Impoconsumo) en la misma transacción del reclamo
+- Una orden que quedó en ERROR y se reintenta con otros ítems los reemplaza
+- api_response se guarda como JSON (dict) y no como repr de Python
+- La tirilla lee ítems y totales de invoice_items
+- Un ítem con varios impuestos (IVA + Impoconsumo) guarda el desglose: la
+  tirilla suma cada impuesto en su total y la nota crédito los replica todos
+- init_db convierte a JSON los api_response antiguos (str(dict) o texto)
+
+Uso: python scripts/test_invoice_items.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+PORT = 8773
+DB_PATH = os.path.join(tempfile.mkdtemp(), "invoice_items.db")
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ["FACTUS_BASE_URL"] = f"http://127.0.0.1:{PORT}"
+os.environ["TOKEN_REFRESHER_ENABLED"] = "false"
+os.environ["FACTUS_RATE_LIMIT_ENABLED"] = "false"
+os.environ["INVOICE_OUTBOX_ENABLED"] = "false"
+os.environ["INVOICE_RECONCILER_ENABLED"] = "false"
+os.environ.setdefault("ENCRYPTION_KEY", "invoice-items-key")
+os.environ.setdefault("SUPABASE_JWT_SECRET", "invoice-items-secret-at-least-32-bytes")
+for var in ("FACTUS_CLIENT_ID", "FACTUS_CLIENT_SECRET", "FACTUS_EMAIL", "FACTUS_PASSWORD"):
+    os.environ.setdefault(var, "items")
+
+from support import build_order, created_bill, factus_stub, make_token, seed_tenant, start_factus_stub
+
+RANGE_ID = 20
+
+# reference_code que el stub rechaza una vez (422)
+reject_once = {"ORD-RETRY"}
+
+
+def build_factus_stub():
+    """Factus simulado: numera las facturas desde 1 y rechaza reject_once."""
+    from fastapi import Request
+    from fastapi.responses import JSONResponse
+
+    stub = factus_stub()
+    counter = {"bills": 0}
+
+    @stub.post("/v1/bills/validate")
+    async def create_bill(request: Request):
+        reference = (await request.json())["reference_code"]
+        if reference in reject_once:
+            reject_once.discard(reference)
+            return JSONResponse(status_code=422, content={"message": "Datos inválidos", "data": {}})
+        counter["bills"] += 1
+        return created_bill(counter["bills"])
+
+    return stub
+
+
+LUNCH = {"id": "P1", "name": "Almuerzo", "price": 20000, "quantity": 2}           # ICO 8 %
+SODA = {"id": "P2", "name": "Gaseosa", "price": 5000, "quantity": 1, "tax_type": "IVA"}  # IVA 19 %
+
+
+async def load_rows(reference: str):
+    """(factura, ítems) de una orden."""
+    from sqlmodel import select
+
+    from app.db.database import async_session_maker
+    from app.db.models import Invoice, InvoiceItem
+
+    async with async_session_maker() as session:
+        invoice = (await session.exec(select(Invoice).where(Invoice.order_reference == reference))).first()
+        items = (await session.exec(
+            select(InvoiceItem).where(InvoiceItem.invoice_id == invoice.id).order_by(InvoiceItem.line)
+        )).all()
+        return invoice, items
+
+
+def multi_tax_totals(invoice) -> tuple:
+    """
+    Totales de la tirilla e impuestos de la nota crédito con un segundo
+    impuesto (Impoconsumo 8 %) en la gaseosa, y totales de las filas
+    originales sin desglose (como las anteriores a la columna taxes).
+    """
+    from app.db.models import InvoiceItem
+    from app.schemas.factus import InvoiceCreateSchema, TaxSchema
+    from app.services.invoice_items import factus_items, invoice_item_rows, ticket_totals
+
+    data = InvoiceCreateSchema.model_validate_json(invoice.payload)
+    legacy = [InvoiceItem(**{**row, "taxes": None}) for row in invoice_item_rows(invoice.id, invoice.tenant_id, data)]
+
+    data.items[1].taxes.append(TaxSchema(tax_id=22, tax_amount=400, taxable_amount=5000, percent=8))
+    items = [InvoiceItem(**row) for row in invoice_item_rows(invoice.id, invoice.tenant_id, data)]
+    factus_taxes = [(tax["tax_id"], tax["tax_amount"]) for tax in factus_items(items)[1]["taxes"]]
+    return ticket_totals(items), factus_taxes, ticket_totals(legacy)
+
+
+async def convert_legacy_rows() -> dict:
+    """Escribe api_response con el formato antiguo, reinicia init_db y lee el resultado."""
+    from sqlalchemy import text
+    from sqlmodel import select
+
+    from app.db.database import async_session_maker, engine, init_db
+    from app.db.models import Invoice
+
+    legacy = {
+        "LEGACY-REPR": "{'id': 7, 'number': 'SETP-7', 'status': 'created', 'pdf_url': None}",
+        "LEGACY-ERROR": "Error de Factus: timeout",
+    }
+    async with engine.begin() as conn:
+        # Columna de texto como en una BD creada con la versión anterior
+        await conn.execute(text("ALTER TABLE invoices DROP COLUMN api_response"))
+        await conn.execute(text("ALTER TABLE invoices ADD COLUMN api_response VARCHAR"))
+        for reference, raw in legacy.items():
+            await conn.execute(
+                text(
+                    "INSERT INTO invoices (number, order_reference, total, status, document_type, "
+                    "api_response, attempts, reconcile_attempts, ticket_version, tenant_id, created_at) "
+                    "VALUES (:number, :reference, 0, 'CREATED', 'INVOICE', :raw, 1, 0, 0, 1, CURRENT_TIMESTAMP)"
+                ),
+                {"number": reference, "reference": reference, "raw": raw},
+            )
+    await init_db()
+    async with async_session_maker() as session:
+        rows = (await session.exec(select(Invoice).where(Invoice.order_reference.in_(list(legacy))))).all()
+        return {row.order_reference: row.api_response for row in rows}
+
+
+async def main() -> None:
+    import httpx
+
+    from main import app
+
+    start_factus_stub(build_factus_stub(), PORT)
+    await seed_tenant(
+        "Restaurante Ítems", "900000020", "items@example.com",
+        range_id=RANGE_ID, number_from=1, number_to=1000,
+    )
+
+    headers = {"Authorization": f"Bearer {make_token('items-user')}"}
+    checks = []
+
+    def check(label: str, ok: bool) -> None:
+        checks.append(ok)
+        print(f"{'✅' if ok else '❌'} {label}")
+
+    print("=" * 60)
+    print("LÍNEAS DE FACTURA (invoice_items) Y api_response EN JSON")
+    print("=" * 60)
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+            # 1. Factura síncrona
+            created = await client.post(
+                "/api/billing/invoices/from-order", json=build_order("ORD-1", [LUNCH, SODA]), headers=headers
+            )
+            invoice, items = await load_rows("ORD-1")
+            check("from-order crea la factura", created.status_code == 200 and invoice.number == "SETP-1")
+            check(
+                "Ítems en invoice_items con impuesto principal",
+                [(i.line, i.code, i.tax_id) for i in items] == [(1, "P1", 22), (2, "P2", 1)]
+                and float(items[0].subtotal) == 40000 and float(items[0].tax_amount) == 3200
+                and float(items[1].tax_amount) == 950 and float(items[1].total) == 5950,
+            )
+            check("Invoice.total con impuestos", float(invoice.total) == 49150)
+            check(
+                "api_response guardado como JSON",
+                isinstance(invoice.api_response, dict) and invoice.api_response.get("number") == invoice.number,
+            )
+
+            check(
+                "Desglose de impuestos por ítem",
+                items[1].taxes == [{"tax_id": 1, "percent": 19.0, "taxable_amount": 5000.0, "tax_amount": 950.0}],
+            )
+            multi_tax = multi_tax_totals(invoice)
+
+            # 2. Tirilla
+            ticket = (await client.get(f"/api/billing/invoices/{invoice.number}/ticket-data", headers=headers)).json()
+            check(
+                "Tirilla con ítems y totales de invoice_items",
+                [i["name"] for i in ticket["items"]] == ["Almuerzo", "Gaseosa"]
+                and ticket["totals"] == {"subtotal": 45000.0, "total_iva": 950.0, "total_ico": 3200.0, "total": 49150.0},
+            )
+
+            # 3. Reintento de una orden en ERROR con otros ítems
+            failed = await client.post(
+                "/api/billing/invoices/from-order", json=build_order("ORD-RETRY", [LUNCH, SODA]), headers=headers
+            )
+            retried = await client.post(
+                "/api/billing/invoices/from-order", json=build_order("ORD-RETRY", [SODA]), headers=headers
+            )
+            invoice, items = await load_rows("ORD-RETRY")
+            check(
+                "Reintento tras ERROR reemplaza los ítems",
+                failed.status_code >= 400 and retried.status_code == 200
+                and [i.code for i in items] == ["P2"] and float(invoice.total) == 5950,
+            )
+
+            # 4. Lote
+            orders = [build_order(f"ORD-B{i}", [LUNCH] * (i + 1)) for i in range(5)]
+            batch = await client.post("/api/billing/invoices/batch", json={"orders": orders}, headers=headers)
+            counts = [len((await load_rows(f"ORD-B{i}"))[1]) for i in range(5)]
+            check("/invoices/batch escribe los ítems de cada orden", batch.status_code == 200 and counts == [1, 2, 3, 4, 5])
+
+    # 5. Ítem con IVA e Impoconsumo
+    totals, factus_taxes, legacy_totals = multi_tax
+    check(
+        "Varios impuestos por ítem: cada uno suma en su total y la nota crédito los replica",
+        totals == {"subtotal": 45000.0, "total_iva": 950.0, "total_ico": 3600.0, "total": 49550.0}
+        and factus_taxes == [(1, 950.0), (22, 400.0)],
+    )
+    check(
+        "Filas sin desglose (anteriores) usan el impuesto principal",
+        legacy_totals == {"subtotal": 45000.0, "total_iva": 950.0, "total_ico": 3200.0, "total": 49150.0},
+    )
+
+    # 6. Conversión de api_response antiguos
+    converted = await convert_legacy_rows()
+    check(
+        "init_db convierte str(dict) y texto libre a JSON",
+        converted.get("LEGACY-REPR") == {"id": 7, "number": "SETP-7", "status": "created", "pdf_url": None}
+        and converted.get("LEGACY-ERROR") == {"raw": "Error de Factus: timeout"},
+    )
+
+    print()
+    if not all(checks):
+        print(f"❌ {checks.count(False)} verificación(es) fallida(s)")
+        sys.exit(1)
+    print("✅ Líneas de factura y api_response verificados")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,198 @@
+"""
+Script para verificar el outbox de contingencia (Factus caído).
+
+Usa una BD SQLite temporal y un servidor local que simula Factus; el servidor
+se detiene a mitad de la prueba (conexión rechazada) y se vuelve a iniciar.
+Verifica:
+- Con Factus caído las ventas responden 202 con ticket provisional
+- El ticket provisional se puede imprimir (ticket-data con los ítems)
+- Al volver Factus el outbox se vacía en el orden de las ventas, sin duplicar
+  facturas, y GET /outbox reporta el progreso
+
+Uso: python scripts/test_invoice_outbox.py [ventas]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+PORT = 8770
+DB_PATH = os.path.join(tempfile.mkdtemp(), "outbox.db")
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ["FACTUS_BASE_URL"] = f"http://127.0.0.1:{PORT}"
+os.environ["TOKEN_REFRESHER_ENABLED"] = "false"
+os.environ["INVOICE_OUTBOX_ENABLED"] = "true"
+os.environ["INVOICE_OUTBOX_POLL_SECONDS"] = "1"
+os.environ["FACTUS_CIRCUIT_OPEN_SECONDS"] = "2"
+os.environ.setdefault("ENCRYPTION_KEY", "outbox-key")
+os.environ.setdefault("SUPABASE_JWT_SECRET", "outbox-secret-at-least-32-bytes-long")
+for var in ("FACTUS_CLIENT_ID", "FACTUS_CLIENT_SECRET", "FACTUS_EMAIL", "FACTUS_PASSWORD"):
+    os.environ.setdefault(var, "outbox")
+
+from support import build_order, created_bill, factus_stub, make_token, seed_tenant
+
+# reference_code de cada factura creada, en orden de llegada
+created_references = []
+
+
+def build_stub():
+    """App local que simula Factus con 100 ms de latencia al crear facturas."""
+    from fastapi import Request
+
+    stub = factus_stub()
+
+    @stub.post("/v1/bills/validate")
+    async def create_bill(request: Request):
+        reference = (await request.json())["reference_code"]
+        await asyncio.sleep(0.1)
+        created_references.append(reference)
+        number = 990000000 + len(created_references)
+        return created_bill(number, public_url=f"https://example.com/bill/{number}")
+
+    return stub
+
+
+class StubServer:
+    """Servidor del stub que se puede detener y reiniciar en el mismo puerto."""
+
+    def __init__(self):
+        self._server = None
+        self._thread = None
+
+    def start(self) -> None:
+        import uvicorn
+
+        config = uvicorn.Config(build_stub(), host="127.0.0.1", port=PORT, log_level="warning")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.05)
+
+    def stop(self) -> None:
+        self._server.should_exit = True
+        self._thread.join()
+
+
+async def load_invoices(references) -> dict:
+    from sqlmodel import select
+
+    from app.db.database import async_session_maker
+    from app.db.models import Invoice
+
+    async with async_session_maker() as session:
+        result = await session.exec(select(Invoice).where(Invoice.order_reference.in_(references)))
+        return {invoice.order_reference: invoice for invoice in result.all()}
+
+
+async def main(sales: int) -> None:
+    import httpx
+
+    from main import app
+
+    stub = StubServer()
+    stub.start()
+    await seed_tenant("Restaurante Contingencia", "900000002", "contingencia@example.com")
+
+    headers = {"Authorization": f"Bearer {make_token('outbox-user')}"}
+    url = "/api/billing/invoices/from-order"
+    checks = []
+
+    def check(label: str, ok: bool) -> None:
+        checks.append(ok)
+        print(f"{'✅' if ok else '❌'} {label}")
+
+    print("=" * 60)
+    print(f"OUTBOX DE CONTINGENCIA ({sales} ventas con Factus caído)")
+    print("=" * 60)
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+            # Venta normal: deja el token de Factus en cache
+            warmup = await client.post(url, json=build_order("ORD-WARMUP", numbering_range_id=8), headers=headers)
+            check("Venta con Factus disponible", warmup.status_code == 200)
+
+            # 1. Factus caído: las ventas no fallan
+            stub.stop()
+            references = [f"ORD-{i:03d}" for i in range(sales)]
+            latencies = []
+            responses = []
+            for reference in references:
+                started = time.perf_counter()
+                responses.append(await client.post(url, json=build_order(reference, numbering_range_id=8), headers=headers))
+                latencies.append(time.perf_counter() - started)
+
+            numbers = [r.json().get("number", "") for r in responses]
+            check(
+                "Ventas con Factus caído responden 202 con ticket provisional",
+                all(r.status_code == 202 and r.headers.get("Invoice-Contingency") == "true" for r in responses)
+                and all(n.startswith("CONT-") for n in numbers)
+                and len(set(numbers)) == sales,
+            )
+            ordered = sorted(latencies)
+            print(
+                f"   Latencia por venta: p50 {ordered[len(ordered) // 2] * 1000:.0f} ms, "
+                f"máx {ordered[-1] * 1000:.0f} ms (las primeras esperan reintentos hasta abrir el breaker)"
+            )
+
+            ticket = await client.get(f"/api/billing/invoices/{numbers[0]}/ticket-data", headers=headers)
+            check(
+                "Ticket provisional imprimible con los ítems de la venta",
+                ticket.status_code == 200 and len(ticket.json()["items"]) == 1,
+            )
+
+            retry = await client.post(url, json=build_order(references[0], numbering_range_id=8), headers=headers)
+            check(
+                "Reintento de una venta en contingencia devuelve el mismo ticket",
+                retry.status_code == 202 and retry.json()["number"] == numbers[0],
+            )
+
+            progress = (await client.get("/api/billing/outbox", headers=headers)).json()
+            check(f"GET /outbox reporta {sales} pendientes", progress["pending"] == sales)
+
+            # 2. Factus vuelve: el outbox se vacía en orden
+            stub.start()
+            started = time.perf_counter()
+            deadline = started + 60
+            while time.perf_counter() < deadline:
+                progress = (await client.get("/api/billing/outbox", headers=headers)).json()
+                if progress["pending"] == 0:
+                    break
+                await asyncio.sleep(0.2)
+            drain_seconds = time.perf_counter() - started
+            print(
+                f"   Outbox vaciado en {drain_seconds:.1f}s ({sales / drain_seconds:.1f} facturas/s; "
+                f"cada reenvío busca por reference_code y crea, al ritmo del rate limiter)"
+            )
+
+            check(
+                "Outbox vaciado al volver Factus",
+                progress["pending"] == 0 and progress["delivered"] == sales and progress["failed"] == 0,
+            )
+            replayed = [r for r in created_references if r in references]
+            check("Facturas enviadas en el orden de las ventas", replayed == references)
+            check("Sin facturas duplicadas en Factus", len(set(replayed)) == len(replayed))
+
+            invoices = await load_invoices(references)
+            check(
+                "Facturas locales con el número definitivo de Factus",
+                all(inv.status != "CONTINGENCY" and inv.number.startswith("SETP-") for inv in invoices.values()),
+            )
+
+    print()
+    if not all(checks):
+        print(f"❌ {checks.count(False)} verificación(es) fallida(s)")
+        sys.exit(1)
+    print("✅ Outbox de contingencia verificado")
+
+
+if __name__ == "__main__":
+    sales = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    asyncio.run(main(sales))
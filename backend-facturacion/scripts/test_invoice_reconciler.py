@@ -0,0 +1,221 @@
+"""
+Script para verificar el reconciliador de facturas (validación DIAN).
+
+Usa una BD SQLite temporal con facturas CREATED / ERROR_VALIDATING y un
+servidor local que simula Factus (show + validate). Verifica:
+- Una pasada valida todas las pendientes (varias páginas keyset) y guarda
+  CUFE/QR/PDF con pocas sentencias SQL
+- Las que Factus ya tenía validadas solo se consultan (sin POST /validate)
+- Concurrencia hacia Factus acotada por INVOICE_RECONCILER_CONCURRENCY
+- Las rechazadas quedan en ERROR_VALIDATING con backoff y la siguiente pasada
+  no las vuelve a consultar
+
+Uso: python scripts/test_invoice_reconciler.py [facturas]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+PORT = 8771
+DB_PATH = os.path.join(tempfile.mkdtemp(), "reconciler.db")
+CONCURRENCY = 4
+PAGE_SIZE = 100
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ["FACTUS_BASE_URL"] = f"http://127.0.0.1:{PORT}"
+os.environ["TOKEN_REFRESHER_ENABLED"] = "false"
+os.environ["FACTUS_RATE_LIMIT_ENABLED"] = "false"
+os.environ["INVOICE_RECONCILER_CONCURRENCY"] = str(CONCURRENCY)
+os.environ["INVOICE_RECONCILER_PAGE_SIZE"] = str(PAGE_SIZE)
+os.environ.setdefault("ENCRYPTION_KEY", "reconciler-key")
+os.environ.setdefault("SUPABASE_JWT_SECRET", "reconciler-secret-at-least-32-bytes")
+for var in ("FACTUS_CLIENT_ID", "FACTUS_CLIENT_SECRET", "FACTUS_EMAIL", "FACTUS_PASSWORD"):
+    os.environ.setdefault(var, "reconciler")
+
+from support import add_tenant, factus_stub, start_factus_stub
+
+# Facturas que Factus ya validó / rechaza al validar
+already_validated = set()
+rejected = set()
+
+calls = {"show": 0, "validate": 0, "in_flight": 0, "max_in_flight": 0}
+
+
+def build_factus_stub():
+    """Factus simulado con 50 ms de latencia por consulta."""
+    from fastapi.responses import JSONResponse
+
+    stub = factus_stub()
+
+    def bill(number: str, status: int) -> dict:
+        return {
+            "number": number,
+            "status": status,
+            "cufe": f"cufe-{number}",
+            "qr": f"https://catalogo-vpfe.dian.gov.co/document/searchqr?documentkey=cufe-{number}",
+            "public_url": f"https://example.com/bill/{number}",
+        }
+
+    async def tracked(kind: str) -> None:
+        calls[kind] += 1
+        calls["in_flight"] += 1
+        calls["max_in_flight"] = max(calls["max_in_flight"], calls["in_flight"])
+        await asyncio.sleep(0.05)
+        calls["in_flight"] -= 1
+
+    @stub.get("/v1/bills/show/{number}")
+    async def show_bill(number: str):
+        await tracked("show")
+        return {"data": {"bill": bill(number, 1 if number in already_validated else 0)}}
+
+    @stub.post("/v1/bills/validate/{number}")
+    async def validate_bill(number: str):
+        await tracked("validate")
+        if number in rejected:
+            return JSONResponse(status_code=409, content={"message": "Documento con errores"})
+        return {"data": {"bill": bill(number, 1)}}
+
+    return stub
+
+
+async def seed_database(total: int) -> int:
+    """Crea el tenant y `total` facturas pendientes de validación."""
+    from datetime import datetime, timedelta
+
+    from app.db.database import async_session_maker, init_db
+    from app.db.models import Invoice
+
+    await init_db()
+    async with async_session_maker() as session:
+        tenant = await add_tenant(
+            session, "Restaurante Reconciliación", "900000003", "reconciliacion@example.com"
+        )
+
+        created_at = datetime.utcnow() - timedelta(hours=1)
+        for i in range(total):
+            number = f"SETP-{990000000 + i}"
+            status = "ERROR_VALIDATING" if i % 10 == 0 else "CREATED"
+            if i % 7 == 0:
+                already_validated.add(number)
+            elif i % 25 == 3:
+                rejected.add(number)
+            session.add(Invoice(
+                number=number,
+                order_reference=f"ORD-{i}",
+                status=status,
+                # Varias facturas con el mismo created_at: el keyset desempata por id
+                created_at=created_at + timedelta(seconds=i // 3),
+                tenant_id=tenant.id,
+            ))
+        session.add(Invoice(
+            number="SETP-1", order_reference="ORD-DONE", status="VALIDATED",
+            created_at=created_at, tenant_id=tenant.id,
+        ))
+        await session.commit()
+        return tenant.id
+
+
+async def load_invoices() -> list:
+    from sqlmodel import select
+
+    from app.db.database import async_session_maker
+    from app.db.models import Invoice
+
+    async with async_session_maker() as session:
+        return list((await session.exec(select(Invoice))).all())
+
+
+async def main(total: int) -> None:
+    from datetime import datetime
+
+    from sqlalchemy import event
+
+    from app.db.database import engine
+    from app.services.invoice_reconciler import InvoiceReconciler
+
+    start_factus_stub(build_factus_stub(), PORT)
+    await seed_database(total)
+
+    statements = []
+    event.listen(
+        engine.sync_engine, "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement)
+    )
+
+    checks = []
+
+    def check(label: str, ok: bool) -> None:
+        checks.append(ok)
+        print(f"{'✅' if ok else '❌'} {label}")
+
+    print("=" * 60)
+    print(f"RECONCILIADOR DE FACTURAS ({total} pendientes, páginas de {PAGE_SIZE})")
+    print("=" * 60)
+
+    reconciler = InvoiceReconciler()
+    started = time.perf_counter()
+    first = await reconciler.reconcile_once()
+    elapsed = time.perf_counter() - started
+    pages = -(-total // PAGE_SIZE)
+    print(
+        f"   Pasada: {elapsed:.2f}s, {first['checked'] / elapsed:.0f} facturas/s, "
+        f"{len(statements)} sentencias SQL para {pages} páginas"
+    )
+
+    invoices = {inv.number: inv for inv in await load_invoices()}
+    expected_ok = total - len(rejected)
+    validated = [
+        inv for inv in invoices.values()
+        if inv.status == "VALIDATED" and inv.cufe and inv.qr_url and inv.pdf_url
+    ]
+    check(
+        "Una pasada valida todas las pendientes con CUFE/QR/PDF",
+        first["checked"] == total and first["validated"] == expected_ok
+        and len(validated) == expected_ok,
+    )
+    check(
+        "Facturas ya validadas en Factus: solo consulta, sin POST /validate",
+        calls["show"] == total and calls["validate"] == total - len(already_validated),
+    )
+    check(
+        f"Concurrencia hacia Factus acotada (máx {calls['max_in_flight']} de {CONCURRENCY})",
+        calls["max_in_flight"] <= CONCURRENCY,
+    )
+    check(
+        "Sentencias SQL por página constantes (lectura, lease y UPDATE masivo)",
+        len(statements) <= pages * 8 + 4,
+    )
+
+    now = datetime.utcnow()
+    failed = [invoices[number] for number in rejected]
+    check(
+        "Rechazadas en ERROR_VALIDATING con backoff",
+        all(
+            inv.status == "ERROR_VALIDATING" and inv.reconcile_attempts == 1
+            and inv.next_reconcile_at and inv.next_reconcile_at > now
+            for inv in failed
+        ),
+    )
+
+    calls_before = calls["show"] + calls["validate"]
+    second = await reconciler.reconcile_once()
+    check(
+        "La siguiente pasada respeta el backoff (sin consultas a Factus)",
+        second["checked"] == 0 and calls["show"] + calls["validate"] == calls_before,
+    )
+
+    print()
+    if not all(checks):
+        print(f"❌ {checks.count(False)} verificación(es) fallida(s)")
+        sys.exit(1)
+    print("✅ Reconciliador de facturas verificado")
+
+
+if __name__ == "__main__":
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 250
+    asyncio.run(main(total))
@@ -0,0 +1,123 @@
+"""
+Script para contar las sentencias SQL que ejecuta cada endpoint de facturación.
+
+Usa una BD SQLite temporal, un servidor local que simula Factus y un JWT
+firmado con SUPABASE_JWT_SECRET. Cuenta las sentencias con el evento
+before_cursor_execute del engine y falla si algún endpoint supera el máximo
+esperado (el Tenant autenticado no debe volver a consultarse).
+
+Uso: python scripts/test_query_count.py
+"""
+import os
+import sys
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+PORT = 8766
+DB_PATH = os.path.join(tempfile.mkdtemp(), "query_count.db")
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ["FACTUS_BASE_URL"] = f"http://127.0.0.1:{PORT}"
+os.environ["TOKEN_REFRESHER_ENABLED"] = "false"
+os.environ["INVOICE_OUTBOX_ENABLED"] = "false"
+os.environ["INVOICE_RECONCILER_ENABLED"] = "false"
+os.environ["DOCUMENT_STORE_ENABLED"] = "false"
+os.environ.setdefault("ENCRYPTION_KEY", "query-count-key")
+os.environ.setdefault("SUPABASE_JWT_SECRET", "query-count-secret-at-least-32-bytes")
+for var in ("FACTUS_CLIENT_ID", "FACTUS_CLIENT_SECRET", "FACTUS_EMAIL", "FACTUS_PASSWORD"):
+    os.environ.setdefault(var, "query-count")
+
+from support import build_order, created_bill, factus_stub, make_token, seed_tenant, start_factus_stub
+
+# Máximo de sentencias SQL por endpoint
+MAX_STATEMENTS = {
+    "GET /api/billing/health": 1,          # tenant
+    "POST /api/billing/invoices/from-order": 6,  # tenant + resolución + reclamo (insert) + ítems + resultado (update) + consecutivo
+    "GET /api/billing/invoices/{n}/ticket-data": 2,  # tenant + factura (tirilla materializada al crearla)
+    "GET /api/billing/invoices/{n}/ticket-data (reimpresión)": 1,  # tenant (tirilla en cache)
+    "GET /api/billing/invoices/{n}/ticket.escpos": 1,  # tenant (tirilla en cache)
+    "GET /api/billing/invoices/{n}/pdf": 2,  # tenant + factura con su documento (sin Factus)
+    "GET /api/billing/invoices": 2,  # tenant + página (keyset)
+    "GET /api/billing/invoices?include_total": 3,  # tenant + página + COUNT acotado
+}
+
+
+def build_factus_stub():
+    """Factus simulado con los endpoints que usan las rutas medidas."""
+    stub = factus_stub()
+
+    @stub.get("/v1/payment-methods")
+    async def payment_methods():
+        return {"data": [{"code": "10", "name": "Efectivo"}]}
+
+    @stub.post("/v1/bills/validate")
+    async def create_bill():
+        return created_bill(990000001, public_url="https://example.com/bill")
+
+    return stub
+
+
+def main() -> None:
+    import asyncio
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+
+    from app.db.database import engine
+    from main import app
+
+    start_factus_stub(build_factus_stub(), PORT)
+
+    asyncio.run(seed_tenant("Restaurante Conteo", "900000001", "conteo@example.com"))
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", count_statement)
+
+    headers = {"Authorization": f"Bearer {make_token('query-count-user')}"}
+    order = build_order("ORD-QC-1", numbering_range_id=8)
+
+    requests = [
+        ("GET /api/billing/health", "GET", "/api/billing/health", None),
+        ("POST /api/billing/invoices/from-order", "POST", "/api/billing/invoices/from-order", order),
+        ("GET /api/billing/invoices/{n}/ticket-data", "GET", "/api/billing/invoices/SETP-990000001/ticket-data", None),
+        ("GET /api/billing/invoices/{n}/ticket-data (reimpresión)", "GET", "/api/billing/invoices/SETP-990000001/ticket-data", None),
+        ("GET /api/billing/invoices/{n}/ticket.escpos", "GET", "/api/billing/invoices/SETP-990000001/ticket.escpos", None),
+        ("GET /api/billing/invoices/{n}/pdf", "GET", "/api/billing/invoices/SETP-990000001/pdf", None),
+        ("GET /api/billing/invoices", "GET", "/api/billing/invoices?status=1&limit=20", None),
+        ("GET /api/billing/invoices?include_total", "GET", "/api/billing/invoices?include_total=true", None),
+    ]
+
+    print("=" * 60)
+    print("SENTENCIAS SQL POR ENDPOINT")
+    print("=" * 60)
+
+    failures = 0
+    with TestClient(app) as client:
+        for label, method, url, body in requests:
+            statements.clear()
+            response = client.request(method, url, json=body, headers=headers)
+            count = len(statements)
+            expected = MAX_STATEMENTS[label]
+            ok = response.status_code < 400 and count <= expected
+            failures += 0 if ok else 1
+
+            print(f"{'✅' if ok else '❌'} {label}: {count} sentencias (máx {expected}) [HTTP {response.status_code}]")
+            if not ok:
+                for statement in statements:
+                    print(f"     {' '.join(statement.split())[:100]}")
+
+    print()
+    if failures:
+        print(f"❌ {failures} endpoint(s) fuera del presupuesto de consultas")
+        sys.exit(1)
+    print("✅ Todos los endpoints dentro del presupuesto de consultas")
+
+
+if __name__ == "__main__":
+    main()
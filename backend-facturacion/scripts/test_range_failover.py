@@ -0,0 +1,205 @@
+"""
+Script para verificar el rango activo por tenant y el cambio automático de rango.
+
+Usa una BD SQLite temporal con varios rangos (activo casi agotado, siguiente
+vigente, vencido, sin sincronizar y de notas crédito) y un servidor local que
+simula Factus y registra el numbering_range_id de cada factura. Verifica:
+- Las ventas sin numbering_range_id usan el rango activo del tenant
+- Aviso al cruzar los umbrales de uso configurados
+- En una ráfaga, el rango agotado recibe solo los números que le quedan y el
+  resto pasa al siguiente rango vigente y sincronizado (un solo cambio)
+- El cambio es atómico en la BD: un rango de facturas activo, la NC intacta
+- Un rango enviado agotado o vencido se reemplaza por el activo; uno
+  desconocido o de otro tenant se rechaza (400 / 403)
+
+Uso: python scripts/test_range_failover.py [ventas_en_rafaga]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+PORT = 8772
+DB_PATH = os.path.join(tempfile.mkdtemp(), "failover.db")
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ["FACTUS_BASE_URL"] = f"http://127.0.0.1:{PORT}"
+os.environ["TOKEN_REFRESHER_ENABLED"] = "false"
+os.environ["FACTUS_RATE_LIMIT_ENABLED"] = "false"
+os.environ["INVOICE_OUTBOX_ENABLED"] = "false"
+os.environ["INVOICE_RECONCILER_ENABLED"] = "false"
+os.environ["NUMBERING_RANGE_WARNING_THRESHOLDS"] = "[80, 90]"
+os.environ.setdefault("ENCRYPTION_KEY", "failover-key")
+os.environ.setdefault("SUPABASE_JWT_SECRET", "failover-secret-at-least-32-bytes-long")
+for var in ("FACTUS_CLIENT_ID", "FACTUS_CLIENT_SECRET", "FACTUS_EMAIL", "FACTUS_PASSWORD"):
+    os.environ.setdefault(var, "failover")
+
+from support import add_tenant, build_order, created_bill, factus_stub, make_token, start_factus_stub
+
+# Rangos (factus_id)
+ACTIVE, NEXT, EXPIRED, UNSYNCED, CREDIT_NOTES, FOREIGN = 10, 11, 12, 13, 14, 15
+
+# numbering_range_id de cada factura recibida por el stub, en orden
+received_ranges = []
+
+
+def build_factus_stub():
+    """Factus simulado con 50 ms de latencia al crear facturas."""
+    from fastapi import Request
+
+    stub = factus_stub()
+
+    @stub.post("/v1/bills/validate")
+    async def create_bill(request: Request):
+        range_id = (await request.json())["numbering_range_id"]
+        await asyncio.sleep(0.05)
+        received_ranges.append(range_id)
+        return created_bill(len(received_ranges), prefix=f"R{range_id}")
+
+    return stub
+
+
+async def seed_database() -> None:
+    """Crea dos tenants y sus rangos."""
+    from datetime import date, datetime, timedelta
+
+    from app.db.database import async_session_maker, init_db
+    from app.db.models import BillingResolution
+
+    await init_db()
+    async with async_session_maker() as session:
+        tenants = [
+            await add_tenant(session, "Restaurante Rangos", "900000005", "rangos0@example.com"),
+            await add_tenant(session, "Otro Restaurante", "900000006", "rangos1@example.com"),
+        ]
+
+        synced = datetime.utcnow()
+        next_year = date.today() + timedelta(days=365)
+        ranges = [
+            # Activo: 6 números restantes (uso ~74 %; 80 % tras 3 ventas, 90 % tras 5)
+            (ACTIVE, "SETP", 1, 20, 14, True, False, next_year, synced, tenants[0]),
+            (NEXT, "SETT", 1, 1000, 0, False, False, next_year, synced, tenants[0]),
+            (EXPIRED, "SETX", 1, 1000, 0, False, True, None, synced, tenants[0]),
+            # Vence antes que NEXT pero nunca se sincronizó: no es candidato
+            (UNSYNCED, "SETU", 1, 1000, 0, False, False, date.today() + timedelta(days=30), None, tenants[0]),
+            (CREDIT_NOTES, "NC", 1, 1000, 0, True, False, next_year, synced, tenants[0]),
+            (FOREIGN, "SETO", 1, 1000, 0, True, False, next_year, synced, tenants[1]),
+        ]
+        for factus_id, prefix, first, last, current, active, expired, expires, synced_at, tenant in ranges:
+            session.add(BillingResolution(
+                factus_id=factus_id,
+                prefix=prefix,
+                number_from=first,
+                number_to=last,
+                current_number=current,
+                is_active=active,
+                is_expired=expired,
+                expiration_date=expires,
+                last_synced_at=synced_at,
+                tenant_id=tenant.id,
+            ))
+        await session.commit()
+
+
+async def load_ranges() -> dict:
+    from sqlmodel import select
+
+    from app.db.database import async_session_maker
+    from app.db.models import BillingResolution
+
+    async with async_session_maker() as session:
+        return {r.factus_id: r for r in (await session.exec(select(BillingResolution))).all()}
+
+
+async def main(burst: int) -> None:
+    import httpx
+
+    from main import app
+
+    start_factus_stub(build_factus_stub(), PORT)
+    await seed_database()
+
+    headers = {"Authorization": f"Bearer {make_token('failover-user')}"}
+    url = "/api/billing/invoices/from-order"
+    checks = []
+
+    def check(label: str, ok: bool) -> None:
+        checks.append(ok)
+        print(f"{'✅' if ok else '❌'} {label}")
+
+    print("=" * 60)
+    print(f"RANGO ACTIVO Y CAMBIO AUTOMÁTICO ({burst} ventas en ráfaga)")
+    print("=" * 60)
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+            # 1. Ventas sin numbering_range_id: rango activo
+            sequential = [await client.post(url, json=build_order(f"ORD-S{i}"), headers=headers) for i in range(4)]
+            check(
+                "Ventas sin numbering_range_id usan el rango activo",
+                all(r.status_code == 200 for r in sequential) and received_ranges == [ACTIVE] * 4,
+            )
+            metrics = (await client.get("/api/billing/metrics", headers=headers)).json()["active_range_index"]
+            check(
+                "Aviso al cruzar el 80 % de uso (una sola vez)",
+                metrics["threshold_warnings"] == 1 and metrics["near_exhaustion"][0]["remaining_numbers"] == 2,
+            )
+
+            # 2. Ráfaga: quedan 2 números en el rango activo
+            received_ranges.clear()
+            started = time.perf_counter()
+            responses = await asyncio.gather(*(
+                client.post(url, json=build_order(f"ORD-B{i}"), headers=headers) for i in range(burst)
+            ))
+            elapsed = time.perf_counter() - started
+            print(f"   Ráfaga: {elapsed:.2f}s, rangos usados {sorted(set(received_ranges))}")
+            metrics = (await client.get("/api/billing/metrics", headers=headers)).json()["active_range_index"]
+            check(
+                "Ráfaga sin errores: 2 ventas con el rango agotado y el resto con el siguiente",
+                all(r.status_code == 200 for r in responses)
+                and received_ranges.count(ACTIVE) == 2 and received_ranges.count(NEXT) == burst - 2,
+            )
+            check("Un solo cambio de rango", metrics["failovers"] == 1)
+            check("Aviso al cruzar el 90 % antes de agotarse", metrics["threshold_warnings"] == 2)
+
+            ranges = await load_ranges()
+            check(
+                "Cambio atómico: NEXT activo, el agotado inactivo, NC intacta, sin sincronizar descartado",
+                ranges[NEXT].is_active and not ranges[ACTIVE].is_active
+                and ranges[CREDIT_NOTES].is_active and not ranges[UNSYNCED].is_active,
+            )
+            check(
+                "Contadores locales exactos",
+                ranges[ACTIVE].current_number == 20 and ranges[NEXT].current_number == burst - 2,
+            )
+
+            # 3. Rango enviado por el cliente
+            received_ranges.clear()
+            exhausted = await client.post(url, json=build_order("ORD-X1", numbering_range_id=ACTIVE), headers=headers)
+            expired = await client.post(url, json=build_order("ORD-X2", numbering_range_id=EXPIRED), headers=headers)
+            check(
+                "Rango enviado agotado o vencido se reemplaza por el activo",
+                exhausted.status_code == 200 and expired.status_code == 200 and received_ranges == [NEXT, NEXT],
+            )
+            unknown = await client.post(url, json=build_order("ORD-X3", numbering_range_id=999), headers=headers)
+            foreign = await client.post(url, json=build_order("ORD-X4", numbering_range_id=FOREIGN), headers=headers)
+            check(
+                "Rango desconocido 400, de otro tenant 403",
+                unknown.status_code == 400 and foreign.status_code == 403,
+            )
+
+    print()
+    if not all(checks):
+        print(f"❌ {checks.count(False)} verificación(es) fallida(s)")
+        sys.exit(1)
+    print("✅ Rango activo y cambio automático verificados")
+
+
+if __name__ == "__main__":
+    burst = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    asyncio.run(main(burst))
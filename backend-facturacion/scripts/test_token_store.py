@@ -0,0 +1,189 @@
+"""
+Script para probar el almacén de tokens compartido entre workers.
+
+Levanta un servidor local que simula el endpoint OAuth2 de Factus, lanza varios
+procesos worker que piden token al mismo tiempo y cuenta cuántas veces se
+llamó a /oauth/token. Con FACTUS_TOKEN_STORE=database debe ser 1 por ronda.
+
+También verifica que la renovación proactiva (refresh_ahead) no adopte un
+token guardado que vence dentro de la ventana: debe enviar un refresh_token.
+
+Uso: python scripts/test_token_store.py [workers] [peticiones_por_worker]
+"""
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qs
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from support import factus_stub, start_factus_stub
+
+PORT = 8765
+TOKEN_TTL_SECONDS = 3
+
+token_requests = {"password": 0, "refresh_token": 0}
+
+
+def build_factus_stub():
+    """Factus simulado: solo el endpoint OAuth2, que cuenta los grants."""
+    from fastapi import Request
+
+    stub = factus_stub(oauth=False, bill_lookup=False)
+
+    @stub.post("/oauth/token")
+    async def token(request: Request):
+        form = parse_qs((await request.body()).decode())
+        grant_type = form.get("grant_type", [""])[0]
+        token_requests[grant_type] = token_requests.get(grant_type, 0) + 1
+        # Simular latencia del proveedor para provocar la estampida
+        await asyncio.sleep(0.3)
+        count = sum(token_requests.values())
+        return {
+            "access_token": f"access-{count}",
+            "refresh_token": f"refresh-{count}",
+            "expires_in": TOKEN_TTL_SECONDS,
+        }
+
+    return stub
+
+
+def worker(requests_per_worker: int, results) -> None:
+    """Proceso worker: pide token varias veces de forma concurrente."""
+    import httpx
+
+    from app.core.config import Settings
+    from app.services.factus.auth import FactusAuthManager
+
+    settings = Settings(
+        factus_base_url=f"http://127.0.0.1:{PORT}",
+        factus_client_id="client-demo",
+        factus_client_secret="secret-demo",
+        factus_email="demo@factus.com.co",
+        factus_password="password-demo",
+    )
+
+    async def run():
+        async with httpx.AsyncClient() as client:
+            managers = [FactusAuthManager(client, settings) for _ in range(requests_per_worker)]
+            return await asyncio.gather(*[m.get_valid_token() for m in managers])
+
+    results.extend(asyncio.run(run()))
+
+
+def refresh_ahead_round(lookahead_seconds: float) -> tuple:
+    """Renovación proactiva desde este proceso; devuelve (renovó, token guardado)."""
+    import httpx
+
+    from app.core.config import Settings
+    from app.services.factus.auth import FactusAuthManager
+    from app.services.factus.token_store import get_token_store
+
+    settings = Settings(
+        factus_base_url=f"http://127.0.0.1:{PORT}",
+        factus_client_id="client-demo",
+        factus_client_secret="secret-demo",
+        factus_email="demo@factus.com.co",
+        factus_password="password-demo",
+    )
+
+    async def run():
+        async with httpx.AsyncClient() as client:
+            manager = FactusAuthManager(client, settings)
+            refreshed = await manager.refresh_ahead(lookahead_seconds)
+            stored = await get_token_store().load(manager.cache_key)
+            return refreshed, stored.access_token if stored else None
+
+    return asyncio.run(run())
+
+
+def run_round(workers: int, requests_per_worker: int) -> list:
+    """Lanza una ronda de workers en paralelo y devuelve los tokens obtenidos."""
+    ctx = multiprocessing.get_context("spawn")
+    manager = ctx.Manager()
+    results = manager.list()
+
+    processes = [
+        ctx.Process(target=worker, args=(requests_per_worker, results))
+        for _ in range(workers)
+    ]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+
+    return list(results)
+
+
+async def init_database() -> None:
+    import app.db.models  # noqa: F401 - registrar tablas en el metadata
+    from app.db.database import init_db
+    await init_db()
+
+
+def main() -> None:
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    requests_per_worker = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    db_path = os.path.join(tempfile.mkdtemp(), "tokens.db")
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{db_path}"
+    os.environ["FACTUS_TOKEN_STORE"] = "database"
+    os.environ["TOKEN_REFRESH_MARGIN_SECONDS"] = "1"
+    os.environ.setdefault("ENCRYPTION_KEY", "token-store-test-key")
+    os.environ.setdefault("SUPABASE_JWT_SECRET", "test")
+    for var in ("FACTUS_CLIENT_ID", "FACTUS_CLIENT_SECRET", "FACTUS_EMAIL", "FACTUS_PASSWORD"):
+        os.environ.setdefault(var, "test")
+
+    asyncio.run(init_database())
+
+    start_factus_stub(build_factus_stub(), PORT)
+
+    print(f"=== Ronda 1: {workers} workers x {requests_per_worker} peticiones (sin token) ===")
+    tokens = run_round(workers, requests_per_worker)
+    print(f"Tokens distintos: {set(tokens)}")
+    print(f"Llamadas a /oauth/token: {token_requests}")
+    first_round_ok = token_requests["password"] == 1 and len(set(tokens)) == 1
+
+    # Esperar a que el token entre en la ventana de renovación
+    time.sleep(TOKEN_TTL_SECONDS)
+
+    print(f"\n=== Ronda 2: token expirado ===")
+    before = dict(token_requests)
+    tokens = run_round(workers, requests_per_worker)
+    renewals = sum(token_requests.values()) - sum(before.values())
+    print(f"Tokens distintos: {set(tokens)}")
+    print(f"Llamadas a /oauth/token: {token_requests} (+{renewals})")
+    second_round_ok = renewals == 1 and len(set(tokens)) == 1
+
+    # El token recién publicado es válido con el margen normal pero vence
+    # dentro de la ventana del refresher: refresh_ahead debe renovarlo
+    print(f"\n=== Ronda 3: refresh_ahead con token guardado dentro de la ventana ===")
+    before = dict(token_requests)
+    refreshed, stored = refresh_ahead_round(lookahead_seconds=TOKEN_TTL_SECONDS * 10)
+    refresh_grants = token_requests["refresh_token"] - before["refresh_token"]
+    print(f"Renovó: {refreshed}, token guardado: {stored}, refresh grants: +{refresh_grants}")
+    third_round_ok = refreshed and refresh_grants == 1 and stored == f"access-{sum(token_requests.values())}"
+
+    # Fuera de la ventana no hay nada que renovar
+    before = dict(token_requests)
+    refreshed, _ = refresh_ahead_round(lookahead_seconds=0)
+    print(f"Sin ventana -> renovó: {refreshed}, llamadas: +{sum(token_requests.values()) - sum(before.values())}")
+    third_round_ok = third_round_ok and not refreshed and token_requests == before
+
+    if not third_round_ok:
+        print("\nFALLO: refresh_ahead no renovó el token que vence dentro de la ventana")
+        sys.exit(1)
+
+    if first_round_ok and second_round_ok:
+        print("\nOK: un solo worker renovó el token en cada ronda")
+    else:
+        print("\nFALLO: varios workers renovaron el token")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()